@@ -0,0 +1,185 @@
+'''
+Netlink codec benchmark
+
+Decode and encode synthetic RTNL dumps: links, routes, addresses and
+neighbours.
+No root permissions are required, the dumps are generated in memory::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    python benchmark/codec.py [count]
+'''
+import sys
+import time
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pr2modules.netlink.rtnl.ndmsg import ndmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+
+
+def ip4addr(index):
+    return '10.%i.%i.%i' % (index >> 16, index >> 8 & 0xFF, index & 0xFF)
+
+
+def make_link(index):
+    return {
+        'family': 0,
+        'index': index,
+        'flags': 0x1043,
+        'ifi_type': 1,
+        'header': {'type': 16, 'flags': 2, 'sequence_number': 1},
+        'attrs': [
+            ['IFLA_IFNAME', 'eth%i' % index],
+            ['IFLA_MTU', 1500],
+            ['IFLA_TXQLEN', 1000],
+            ['IFLA_OPERSTATE', 'UP'],
+            ['IFLA_ADDRESS', '52:54:00:00:%02x:%02x' % divmod(index, 256)],
+            ['IFLA_BROADCAST', 'ff:ff:ff:ff:ff:ff'],
+            [
+                'IFLA_LINKINFO',
+                {
+                    'attrs': [
+                        ['IFLA_INFO_KIND', 'vlan'],
+                        [
+                            'IFLA_INFO_DATA',
+                            {'attrs': [['IFLA_VLAN_ID', index % 4094 + 1]]},
+                        ],
+                    ]
+                },
+            ],
+            ['IFLA_STATS64', {'rx_packets': index, 'tx_packets': index}],
+        ],
+    }
+
+
+def make_route(index):
+    return {
+        'family': 2,
+        'dst_len': 32,
+        'table': 254,
+        'proto': 4,
+        'type': 1,
+        'header': {'type': 24, 'flags': 2, 'sequence_number': 1},
+        'attrs': [
+            ['RTA_TABLE', 254],
+            ['RTA_DST', ip4addr(index)],
+            ['RTA_GATEWAY', '192.168.0.1'],
+            ['RTA_OIF', 2],
+            ['RTA_PRIORITY', 100],
+        ],
+    }
+
+
+def make_address(index):
+    addr = ip4addr(index)
+    return {
+        'family': 2,
+        'prefixlen': 24,
+        'flags': 128,
+        'index': 2,
+        'header': {'type': 20, 'flags': 2, 'sequence_number': 1},
+        'attrs': [
+            ['IFA_ADDRESS', addr],
+            ['IFA_LOCAL', addr],
+            ['IFA_LABEL', 'eth0'],
+            ['IFA_FLAGS', 128],
+            [
+                'IFA_CACHEINFO',
+                {
+                    'ifa_preferred': 0xFFFFFFFF,
+                    'ifa_valid': 0xFFFFFFFF,
+                    'cstamp': 1,
+                    'tstamp': 1,
+                },
+            ],
+        ],
+    }
+
+
+def make_neighbour(index):
+    return {
+        'family': 2,
+        'ifindex': 2,
+        'state': 2,
+        'flags': 0,
+        'ndm_type': 1,
+        'header': {'type': 28, 'flags': 2, 'sequence_number': 1},
+        'attrs': [
+            ['NDA_DST', ip4addr(index)],
+            [
+                'NDA_LLADDR',
+                '52:54:00:%02x:%02x:%02x'
+                % (index >> 16, index >> 8 & 0xFF, index & 0xFF),
+            ],
+            [
+                'NDA_CACHEINFO',
+                {
+                    'ndm_confirmed': 100,
+                    'ndm_used': 100,
+                    'ndm_updated': 100,
+                    'ndm_refcnt': 0,
+                },
+            ],
+            ['NDA_PROBES', 1],
+        ],
+    }
+
+
+samples = (
+    ('ifinfmsg', ifinfmsg, make_link),
+    ('rtmsg', rtmsg, make_route),
+    ('ifaddrmsg', ifaddrmsg, make_address),
+    ('ndmsg', ndmsg, make_neighbour),
+)
+
+
+def encode(msg_class, factory, count):
+    data = bytearray()
+    for index in range(count):
+        msg = msg_class()
+        msg.setvalue(factory(index))
+        msg.data = data
+        msg.offset = len(data)
+        msg.encode()
+    return data
+
+
+def decode(data, lazy_decode=False):
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = lazy_decode
+    for msg in marshal.parse(data):
+        # access some NLA to force decoding
+        msg.get_attr('IFLA_IFNAME')
+        msg.get_attr('RTA_DST')
+        msg.get_attr('IFA_ADDRESS')
+        msg.get_attr('NDA_DST')
+
+
+def best(func, *argv, rounds=3):
+    ret = None
+    timing = []
+    for _ in range(rounds):
+        start = time.time()
+        ret = func(*argv)
+        timing.append(time.time() - start)
+    return ret, min(timing)
+
+
+def main(count):
+    for name, msg_class, factory in samples:
+        data, encode_time = best(encode, msg_class, factory, count)
+        _, decode_time = best(decode, data)
+        _, lazy_time = best(decode, data, True)
+        print(
+            '%-10s encode: %8i msg/s   decode: %8i msg/s   lazy: %8i msg/s'
+            % (
+                name,
+                count / encode_time,
+                count / decode_time,
+                count / lazy_time,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,103 @@
+'''
+conntrack dump benchmark
+
+Create N conntrack entries and read them back:
+
+* dump_entries -- `Conntrack.dump_entries()`, message objects
+* stream_entries -- `Conntrack.stream_entries()`, compact records
+* aggregate -- `Conntrack.aggregate()`, counters only
+
+For every mode print the rate and the peak Python memory use while
+iterating the entries, the entries are not stored. Linux only,
+requires root and nf_conntrack::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/conntrack.py [count]
+'''
+import socket
+import sys
+import time
+import tracemalloc
+from pr2modules.conntrack import Conntrack
+from pr2modules.netlink.nfnetlink.nfctsocket import NFCTAttrTuple
+
+# a separate zone not to mix the benchmark with the real traffic
+ZONE = 0xBE
+
+
+def tuples(count):
+    for index in range(count):
+        yield NFCTAttrTuple(
+            saddr='10.%i.%i.1' % (index >> 16 & 0xFF, index >> 8 & 0xFF),
+            daddr='10.255.255.1',
+            proto=socket.IPPROTO_TCP,
+            sport=1024 + (index & 0xFF),
+            dport=443,
+        )
+
+
+def dump_entries(ct):
+    count = 0
+    for entry in ct.dump_entries(tuple_orig=NFCTAttrTuple(dport=443)):
+        count += 1
+    return count
+
+
+def stream_entries(ct):
+    count = 0
+    for entry in ct.stream_entries(
+        tuple_orig=NFCTAttrTuple(proto=socket.IPPROTO_TCP, dport=443),
+        zone=ZONE,
+    ):
+        count += 1
+    return count
+
+
+def aggregate(ct):
+    ret = ct.aggregate(
+        key='saddr',
+        tuple_orig=NFCTAttrTuple(proto=socket.IPPROTO_TCP, dport=443),
+        zone=ZONE,
+    )
+    return sum(ret.values())
+
+
+def run(ct, func, count):
+    start = time.time()
+    assert func(ct) >= count
+    rate = count / (time.time() - start)
+    tracemalloc.start()
+    func(ct)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rate, peak
+
+
+def main(count):
+    with Conntrack() as ct:
+        for nfct_tuple in tuples(count):
+            ct.entry(
+                'add',
+                timeout=600,
+                zone=ZONE,
+                tuple_orig=nfct_tuple,
+                tuple_reply=nfct_tuple.reverse(),
+            )
+        try:
+            for name, func in (
+                ('dump_entries', dump_entries),
+                ('stream_entries', stream_entries),
+                ('aggregate', aggregate),
+            ):
+                rate, peak = run(ct, func, count)
+                print(
+                    '%-16s %8i entries/s   peak: %8i KiB'
+                    % (name, rate, peak / 1024)
+                )
+        finally:
+            for nfct_tuple in tuples(count):
+                ct.entry('del', zone=ZONE, tuple_orig=nfct_tuple)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,86 @@
+'''
+IPRoute flush benchmark
+
+Create a network namespace with a bridge and N routes in a table,
+then delete the routes:
+
+* put -- dump the routes and `put()` every decoded message back
+  as `RTM_DELROUTE`, the way the flush methods used to work
+* flush -- `IPRoute.flush_routes()`, the delete requests are built
+  from the raw dump and sent in batches, see
+  `pr2modules.iproute.flush`
+* flush/match -- the same, with a filter checked on the raw data
+
+The namespace is removed at the end. Linux only, requires root::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/flush.py [routes]
+'''
+import sys
+import time
+from pr2modules import netns
+from pr2modules.netlink import NLM_F_REQUEST
+from pr2modules.netlink.rtnl import RTM_DELROUTE
+from pr2modules.nslink.nslink import DirectNetNS
+
+NETNS = 'bmflush'
+TABLE = 100
+
+
+def setup(ns, routes):
+    for route in range(routes):
+        ns.route(
+            'add',
+            dst='10.%i.%i.%i/32'
+            % (route >> 16 & 0xFF, route >> 8 & 0xFF, route & 0xFF),
+            gateway='172.16.0.2',
+            table=TABLE,
+        )
+
+
+def put(ns):
+    count = 0
+    for route in ns.get_routes(table=TABLE):
+        ns.put(route, msg_type=RTM_DELROUTE, msg_flags=NLM_F_REQUEST)
+        count += 1
+    return count
+
+
+def flush(ns):
+    return ns.flush_routes(table=TABLE).deleted
+
+
+def flush_match(ns):
+    # RTPROT_STATIC, the default for `route('add')`
+    return ns.flush_routes(table=TABLE, proto=4).deleted
+
+
+def main(routes):
+    try:
+        with DirectNetNS(NETNS) as ns:
+            ns.link('add', ifname='bmbr0', kind='bridge')
+            (link,) = ns.link_lookup(ifname='bmbr0')
+            ns.link('set', index=link, state='up')
+            ns.addr('add', index=link, address='172.16.0.1', prefixlen=24)
+            for name, func in (
+                ('put', put),
+                ('flush', flush),
+                ('flush/match', flush_match),
+            ):
+                setup(ns, routes)
+                start = time.perf_counter()
+                deleted = func(ns)
+                delta = time.perf_counter() - start
+                left = len(ns.get_routes(table=TABLE))
+                print(
+                    '    %-12s %8.3f s  %10.0f routes/s  deleted: %i  left: %i'
+                    % (name, delta, deleted / delta, deleted, left)
+                )
+                if left:
+                    ns.flush_routes(table=TABLE)
+    finally:
+        netns.remove(NETNS)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
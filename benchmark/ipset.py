@@ -0,0 +1,67 @@
+'''
+ipset bulk load benchmark
+
+Load N entries into a temporary hash:ip set and delete them:
+
+* sequential -- one `IPSet.add()` / `IPSet.delete()` call per entry
+* bulk -- `IPSet.bulk_add()` / `IPSet.bulk_delete()`
+
+Print the rate for every mode. The sequential mode loads only the
+first 10000 entries, it is slow enough to get the rate. Linux only,
+requires root and ip_set::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/ipset.py [count]
+'''
+import sys
+import time
+from pr2modules.ipset import IPSet
+
+NAME = 'pr2bench'
+
+
+def entries(count):
+    return [
+        '10.%i.%i.%i' % (x >> 16 & 0xFF, x >> 8 & 0xFF, x & 0xFF)
+        for x in range(count)
+    ]
+
+
+def sequential(ips, command, ipaddr):
+    for entry in ipaddr[:10000]:
+        getattr(ips, command)(NAME, entry)
+    return min(len(ipaddr), 10000)
+
+
+def bulk(ips, command, ipaddr):
+    failed = getattr(ips, 'bulk_%s' % command)(NAME, ipaddr)
+    assert not failed, failed[0]
+    return len(ipaddr)
+
+
+def run(ips, ipaddr, func):
+    ret = []
+    ips.create(NAME, maxelem=max(len(ipaddr), 65536))
+    try:
+        for command in ('add', 'delete'):
+            start = time.time()
+            count = func(ips, command, ipaddr)
+            ret.append(count / (time.time() - start))
+    finally:
+        ips.destroy(NAME)
+    return ret
+
+
+def main(count):
+    ipaddr = entries(count)
+    with IPSet() as ips:
+        for name, func in (('sequential', sequential), ('bulk', bulk)):
+            add, delete = run(ips, ipaddr, func)
+            print(
+                '%-12s add: %8i entries/s   del: %8i entries/s'
+                % (name, add, delete)
+            )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
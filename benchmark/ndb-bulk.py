@@ -0,0 +1,89 @@
+'''
+NDB bulk transaction benchmark
+
+Create N VLAN interfaces on a bridge, add an IP address on every one
+of them, change MTU and remove the interfaces, first calling
+`commit()` for every object, then with one bulk transaction per step,
+see `NDB.begin(bulk=True)`:
+
+* create -- `ndb.interfaces.create(kind='vlan', ...)`
+* address -- `ndb.addresses.create(...)`
+* set -- `interface.set('mtu', ...)`
+* remove -- `interface.remove()`
+
+Print the time to get the objects and the commit time for every step.
+Linux only, requires root; the kind of the interfaces may be changed,
+e.g. to macvlan if the kernel doesn't support VLAN::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/ndb-bulk.py [count [kind]]
+'''
+import sys
+import time
+from pr2modules.ndb.main import NDB
+
+BRIDGE = 'bmbr0'
+
+
+def spec(kind, index):
+    ret = {'ifname': 'bmv%i' % index, 'kind': kind, 'link': BRIDGE}
+    if kind == 'vlan':
+        ret['vlan_id'] = index % 4094 + 1
+    return ret
+
+
+def address(index):
+    return '10.%i.%i.1' % (index >> 8 & 0xFF, index & 0xFF)
+
+
+def steps(ndb, kind):
+    return (
+        ('create', lambda index: ndb.interfaces.create(**spec(kind, index))),
+        (
+            'address',
+            lambda index: ndb.addresses.create(
+                index=ndb.interfaces['bmv%i' % index]['index'],
+                address=address(index),
+                prefixlen=24,
+            ),
+        ),
+        (
+            'set',
+            lambda index: ndb.interfaces['bmv%i' % index].set('mtu', 1280),
+        ),
+        ('remove', lambda index: ndb.interfaces['bmv%i' % index].remove()),
+    )
+
+
+def run(ndb, kind, count, bulk):
+    for name, factory in steps(ndb, kind):
+        start = time.time()
+        objects = [factory(index) for index in range(count)]
+        ready = time.time()
+        if bulk:
+            ndb.begin(bulk=True).push(*objects).commit()
+        else:
+            for obj in objects:
+                obj.commit()
+        print(
+            '    %-8s objects: %8.3f s   commit: %8.3f s'
+            % (name, ready - start, time.time() - ready)
+        )
+
+
+def main(count, kind):
+    with NDB() as ndb:
+        ndb.interfaces.create(ifname=BRIDGE, kind='bridge').commit()
+        try:
+            for bulk in (False, True):
+                print('bulk=%s' % bulk)
+                run(ndb, kind, count, bulk)
+        finally:
+            ndb.interfaces[BRIDGE].remove().commit()
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        sys.argv[2] if len(sys.argv) > 2 else 'vlan',
+    )
@@ -0,0 +1,118 @@
+'''
+NDB cluster transport benchmark
+
+Run N messenger nodes as local processes, all of them peers of each
+other, and send synthetic route events from the first node, the way
+the NDB main loop forwards them: raw netlink data per event, one
+frame per event queue item, see `Messenger.forward()` and `flush()`.
+
+Every node counts the received events, walking the netlink headers
+without parsing the messages, so the results show the transport
+cost, and stops when all of them are received. Print the events rate
+per node, first with the frames relayed to all the peers, then along
+a spanning tree with the fanout 2. All the nodes share the CPUs of
+one host, so the rate depends on the total work of the cluster. No
+root permissions are required, the nodes use local TCP ports::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    cd benchmark
+    python ndb-cluster.py [nodes [count]]
+'''
+import multiprocessing
+import struct
+import sys
+import time
+from codec import encode
+from codec import make_route
+from pr2modules.ndb.transport import Messenger
+from pr2modules.ndb.transport import Transport
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+
+PORT = 5780
+BATCH = 100
+TARGET = 'node0'
+
+
+def messenger(node, nodes, fanout):
+    ret = Messenger(node, Transport('127.0.0.1', PORT + node), fanout)
+    for peer in range(nodes):
+        if peer != node:
+            ret.add_peer(peer, '127.0.0.1', PORT + peer)
+    return ret
+
+
+def source(node, nodes, fanout, count, ready):
+    msngr = messenger(node, nodes, fanout)
+    data = bytes(encode(rtmsg, make_route, count))
+    ready.wait()
+    # all the messages are of the same size
+    length = len(data) // count
+    for offset in range(0, count, BATCH):
+        for index in range(offset, min(offset + BATCH, count)):
+            msngr.forward(TARGET, data[index * length : (index + 1) * length])
+        msngr.flush()
+    return msngr
+
+
+def events(data):
+    offset = 0
+    ret = 0
+    while offset < len(data):
+        offset += struct.unpack_from('I', data, offset)[0]
+        ret += 1
+    return ret
+
+
+def node(node, nodes, fanout, count, ready, results):
+    msngr = messenger(node, nodes, fanout)
+    ready.wait()
+    received = 0
+    start = None
+    for msg in msngr:
+        if msg['type'] != 'transport':
+            continue
+        if start is None:
+            start = time.time()
+        received += events(msg['data'])
+        if received >= count:
+            break
+    results.put((node, received / (time.time() - start)))
+    # keep relaying until the test ends
+    for msg in msngr:
+        pass
+
+
+def run(nodes, count, fanout):
+    ready = multiprocessing.Barrier(nodes)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=node, args=(x, nodes, fanout, count, ready, results)
+        )
+        for x in range(1, nodes)
+    ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    msngr = source(0, nodes, fanout, count, ready)
+    rates = sorted([results.get(timeout=60) for _ in workers])
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+    msngr.transport.close()
+    for index, rate in rates:
+        print('    node %-4i %10i events/s' % (index, rate))
+    print('    min       %10i events/s' % min([x[1] for x in rates]))
+
+
+def main(nodes, count):
+    for fanout in (None, 2):
+        print('fanout=%s' % fanout)
+        run(nodes, count, fanout)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+    )
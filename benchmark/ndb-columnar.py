@@ -0,0 +1,138 @@
+'''
+NDB columnar storage benchmark
+
+Load synthetic RTNL dumps -- links, addresses, routes and neighbours
+-- into the in-memory SQLite3 DB and into the columnar storage, see
+`NDB(db_provider='columnar')`, then run the queries:
+
+* interface -- an interface lookup by the key fields
+* ifname -- an interface lookup by name
+* route -- a route lookup by dst, that is not a key field
+* summary -- `ndb.routes.summary()`
+* dump -- all the records of the routes table
+
+Print the events loading rate for every dump and the queries rate.
+No root permissions are required, the dumps are generated in
+memory::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    cd benchmark
+    python ndb-columnar.py [count]
+'''
+import sys
+import time
+from codec import ip4addr
+from codec import make_address
+from codec import make_link
+from codec import make_neighbour
+from codec import make_route
+from suite import TARGET
+from suite import SchemaHost
+from suite import encode
+from pr2modules.ndb.objects.route import Route
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pr2modules.netlink.rtnl.ndmsg import ndmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+
+QUERIES = 1000
+REPORTS = 5
+
+
+class HostView(object):
+    # the minimal view for the SQL reports
+    chain = None
+
+    def __init__(self, host):
+        self.ndb = host
+
+
+def dumps(count):
+    return (
+        ('links', ifinfmsg, make_link, max(count // 10, 4)),
+        ('addresses', ifaddrmsg, make_address, count),
+        ('routes', rtmsg, make_route, count),
+        ('neighbours', ndmsg, make_neighbour, count),
+    )
+
+
+def queries(host, count):
+    links = max(count // 10, 4)
+    if host.mode == 'columnar':
+        summary = host.schema.summary
+        dump = host.schema.dump
+    else:
+        view = HostView(host)
+
+        def summary(table):
+            return Route.summary(view)
+
+        def dump(table):
+            # the main table only, like the columnar dump
+            return host.schema.fetch('SELECT * FROM %s' % table)
+
+    return (
+        (
+            'interface',
+            QUERIES,
+            lambda x: list(
+                host.schema.get(
+                    'interfaces',
+                    {'target': TARGET, 'tflags': 0, 'index': x % links},
+                )
+            ),
+        ),
+        (
+            'ifname',
+            QUERIES,
+            lambda x: list(
+                host.schema.get(
+                    'interfaces', {'IFLA_IFNAME': 'eth%i' % (x % links)}
+                )
+            ),
+        ),
+        (
+            'route',
+            QUERIES,
+            lambda x: list(
+                host.schema.get(
+                    'routes', {'RTA_DST': ip4addr(x * 7919 % count)}
+                )
+            ),
+        ),
+        ('summary', REPORTS, lambda x: list(summary('routes'))),
+        ('dump', REPORTS, lambda x: list(dump('routes'))),
+    )
+
+
+def run(mode, count):
+    host = SchemaHost(mode)
+    for name, msg_class, factory, number in dumps(count):
+        messages = MarshalRtnl().parse(
+            encode(msg_class, [factory(x) for x in range(number)])
+        )
+        start = time.perf_counter()
+        host.load(messages)
+        print(
+            '    load %-10s %10i msg/s'
+            % (name, number / (time.perf_counter() - start))
+        )
+    for name, number, func in queries(host, count):
+        start = time.perf_counter()
+        for x in range(number):
+            assert func(x), '%s: no records found' % name
+        print(
+            '    query %-9s %10.1f req/s'
+            % (name, number / (time.perf_counter() - start))
+        )
+
+
+def main(count):
+    for mode in ('sqlite3', 'columnar'):
+        print('db_provider=%s' % mode)
+        run(mode, count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
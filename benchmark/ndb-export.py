@@ -0,0 +1,124 @@
+'''
+NDB report export benchmark
+
+Load synthetic links and routes into the in-memory DB and write all
+the records of the routes table to /dev/null:
+
+* format json -- `RecordSet.format('json')`, a `Record` per row
+* format csv -- `RecordSet.format('csv')`, a `Record` per row
+* export jsonl -- `view.export(f, kind='jsonl')`
+* export csv -- `view.export(f, kind='csv')`
+* export columnar -- `view.export(f, kind='columnar')`
+
+Every case runs in a process forked after the DB is loaded. Print the
+rows rate and the peak RSS growth of the process during the export.
+Linux only, as it relies on fork() and the RSS accounting. No root
+permissions are required, the dumps are generated in memory::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    cd benchmark
+    python ndb-export.py [count]
+'''
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from codec import make_link
+from codec import make_route
+from suite import SchemaHost
+from suite import encode
+from pr2modules.ndb.report import Record
+from pr2modules.ndb.report import RecordSet
+from pr2modules.ndb.report import export
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+
+
+def report(host):
+    # the routes table as is, the SQL cost is the same for all the cases
+    spec = host.schema.compiled['routes']
+    yield spec['all_names']
+    for record in host.schema.fetch('SELECT %s FROM routes' % spec['fnames']):
+        yield record
+
+
+def format_report(kind):
+    def run(report, f):
+        fnames = next(report)
+        counter = [0]
+
+        def records():
+            for record in report:
+                counter[0] += 1
+                yield Record(fnames, record)
+
+        for line in RecordSet(records()).format(kind):
+            f.write(line.encode('utf-8'))
+            f.write(b'\n')
+        return counter[0]
+
+    return run
+
+
+def export_report(kind):
+    def run(report, f):
+        return export(report, f, kind)
+
+    return run
+
+
+cases = (
+    ('format json', format_report('json')),
+    ('format csv', format_report('csv')),
+    ('export jsonl', export_report('jsonl')),
+    ('export csv', export_report('csv')),
+    ('export columnar', export_report('columnar')),
+)
+
+
+def load(count):
+    host = SchemaHost()
+    for msg_class, factory, number in (
+        (ifinfmsg, make_link, max(count // 10, 4)),
+        (rtmsg, make_route, count),
+    ):
+        host.load(
+            MarshalRtnl().parse(
+                encode(msg_class, [factory(x) for x in range(number)])
+            ),
+            bulk=True,
+        )
+    return host
+
+
+def case(host, func, results):
+    # a forked process starts with the peak RSS = the current RSS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(os.devnull, 'wb') as f:
+        rows = func(report(host), f)
+    results.put(
+        (
+            rows / (time.perf_counter() - start),
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+        )
+    )
+
+
+def main(count):
+    host = load(count)
+    for name, func in cases:
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target=case, args=(host, func, results)
+        )
+        worker.start()
+        rate, rss = results.get()
+        worker.join()
+        print('    %-16s %10i rows/s %10i KiB peak RSS' % (name, rate, rss))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
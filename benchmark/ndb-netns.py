@@ -0,0 +1,78 @@
+'''
+NDB many sources startup benchmark
+
+Create N network namespaces with a bridge, an IP address and M routes
+in every one of them, and start NDB with all the namespaces as the
+sources, first loading the initial dumps in the main loop, then with
+a pool of ingest workers, see `NDB(ingest_workers=...)`.
+
+Print the time until NDB is ready, that is until all the sources are
+loaded, and the number of the loaded routes. Linux only, requires
+root::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/ndb-netns.py [netns [routes [workers]]]
+'''
+import sys
+import time
+from pr2modules import netns
+from pr2modules.ndb.main import NDB
+from pr2modules.nslink.nslink import NetNS
+
+PREFIX = 'bmns'
+
+
+def setup(count, routes):
+    for index in range(count):
+        with NetNS('%s%i' % (PREFIX, index)) as ns:
+            ns.link('add', ifname='bmbr0', kind='bridge')
+            (link,) = ns.link_lookup(ifname='bmbr0')
+            ns.link('set', index=link, state='up')
+            ns.addr('add', index=link, address='10.255.0.1', prefixlen=24)
+            for route in range(routes):
+                ns.route(
+                    'add',
+                    dst='10.%i.%i.0/24' % (route >> 8 & 0xFF, route & 0xFF),
+                    gateway='10.255.0.2',
+                )
+
+
+def cleanup(count):
+    for index in range(count):
+        try:
+            netns.remove('%s%i' % (PREFIX, index))
+        except OSError:
+            pass
+
+
+def run(count, workers):
+    start = time.time()
+    with NDB(
+        sources=[{'netns': '%s%i' % (PREFIX, x)} for x in range(count)],
+        ingest_workers=workers,
+    ) as ndb:
+        ready = time.time()
+        routes = ndb.routes.count()
+    print(
+        '    ingest_workers=%-4i ready: %8.3f s   routes: %i'
+        % (workers, ready - start, routes)
+    )
+
+
+def main(count, routes, workers):
+    try:
+        setup(count, routes)
+        # let the kernel finish with the IPv6 link local routes
+        time.sleep(2)
+        for number in (0, workers):
+            run(count, number)
+    finally:
+        cleanup(count)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 8,
+    )
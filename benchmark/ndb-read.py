@@ -0,0 +1,129 @@
+'''
+NDB read latency benchmark
+
+Run NDB reports while the main loop is busy with a sustained flow of
+synthetic route events -- N routes being added and removed in a loop
+at the given rate, events per second:
+
+* summary -- `ndb.routes.summary()`
+* dump -- `ndb.routes.dump()`
+* locate -- `ndb.interfaces['lo']`
+
+Print the median and the 99th percentile latency for every report,
+and the events rate during the test, first with all the queries going
+through the main loop (`db_readers=False`), then with the read-only
+DB connections (`db_readers=True`). The DB is a temporary SQLite3
+file in the WAL mode, on /dev/shm if available, so the results don't
+depend on the disk. Linux only, no root permissions required::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    cd benchmark
+    python ndb-read.py [count [rate]]
+'''
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from codec import encode
+from codec import make_route
+from pr2modules.ndb.main import NDB
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+from pr2modules.netlink.rtnl import RTM_NEWROUTE
+from pr2modules.netlink.rtnl import RTM_DELROUTE
+
+ROUNDS = 20
+BATCH = 100
+
+
+def flap(count):
+    # RTM_NEWROUTE + RTM_DELROUTE for every route
+    ret = []
+    for msg_type in (RTM_NEWROUTE, RTM_DELROUTE):
+
+        def factory(index):
+            msg = make_route(index)
+            msg['header']['type'] = msg_type
+            msg['attrs'][3] = ['RTA_OIF', 1]
+            return msg
+
+        for msg in MarshalRtnl().parse(encode(rtmsg, factory, count)):
+            msg['header']['target'] = 'localhost'
+            ret.append(msg)
+    return [tuple(ret[x : x + BATCH]) for x in range(0, len(ret), BATCH)]
+
+
+def feed(ndb, batches, rate, stop, counter):
+    start = time.time()
+    while not stop.is_set():
+        for batch in batches:
+            ndb._event_queue.put(batch, source='localhost')
+            counter[0] += len(batch)
+            delay = start + counter[0] / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def reports(ndb):
+    return (
+        ('summary', lambda: list(ndb.routes.summary())),
+        ('dump', lambda: list(ndb.routes.dump())),
+        ('locate', lambda: ndb.interfaces['lo']),
+    )
+
+
+def run(count, rate, db_spec, db_readers):
+    ndb = NDB(
+        sources=[{'target': 'localhost', 'kind': 'local'}],
+        db_spec=db_spec,
+        db_readers=db_readers,
+    )
+    stop = threading.Event()
+    counter = [0]
+    feeder = threading.Thread(
+        target=feed, args=(ndb, flap(count), rate, stop, counter)
+    )
+    feeder.start()
+    try:
+        start = time.time()
+        for name, func in reports(ndb):
+            timing = []
+            for _ in range(ROUNDS):
+                ts = time.time()
+                func()
+                timing.append(time.time() - ts)
+            timing.sort()
+            print(
+                '    %-8s median: %8.2f ms   p99: %8.2f ms'
+                % (
+                    name,
+                    timing[len(timing) // 2] * 1000,
+                    timing[len(timing) * 99 // 100] * 1000,
+                )
+            )
+        rate = counter[0] / (time.time() - start)
+        print('    events: %8i/s' % rate)
+    finally:
+        stop.set()
+        feeder.join()
+        ndb.close()
+
+
+def main(count, rate):
+    tmpdir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmpdir:
+        for db_readers in (False, True):
+            print('db_readers=%s' % db_readers)
+            db_spec = os.path.join(tmpdir, 'ndb-%s.db' % db_readers)
+            # the same journal mode for both runs
+            sqlite3.connect(db_spec).execute('PRAGMA journal_mode = WAL')
+            run(count, rate, db_spec, db_readers)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+    )
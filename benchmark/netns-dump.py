@@ -0,0 +1,146 @@
+'''
+NetNS vs DirectNetNS vs NetNSPool benchmark
+
+Create N network namespaces with a bridge, an IP address and M routes
+in every one of them, then for every implementation:
+
+* open -- connect to all the namespaces
+* sweep -- links + addresses + routes dumps of all the namespaces
+* dump -- the latency of one links + addresses + routes dump per
+  namespace, mean and 95th percentile; `NetNSPool` runs the dumps
+  of many namespaces at once, so only the sweep time makes sense
+* PSS -- the memory used by the process and its children, the
+  proportional set size, so the pages shared after fork() are not
+  counted twice
+
+`NetNS` forks a proxy process per namespace, `DirectNetNS` uses the
+netlink socket created in the namespace, see `pr2modules.nslink`,
+and `NetNSPool` serves such sockets of all the namespaces from one
+selector loop, see `pr2modules.nslink.nspool`.
+Every case runs in a separate process. Linux only, requires root::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/netns-dump.py [netns [routes]]
+'''
+import multiprocessing
+import sys
+import time
+from functools import partial
+from pr2modules import netns
+from pr2modules.nslink.nslink import DirectNetNS
+from pr2modules.nslink.nslink import NetNS
+from pr2modules.nslink.nspool import NetNSPool
+
+PREFIX = 'bmns'
+
+
+def setup(count, routes):
+    for index in range(count):
+        with DirectNetNS('%s%i' % (PREFIX, index)) as ns:
+            ns.link('add', ifname='bmbr0', kind='bridge')
+            (link,) = ns.link_lookup(ifname='bmbr0')
+            ns.link('set', index=link, state='up')
+            ns.addr('add', index=link, address='10.255.0.1', prefixlen=24)
+            for route in range(routes):
+                ns.route(
+                    'add',
+                    dst='10.%i.%i.0/24' % (route >> 8 & 0xFF, route & 0xFF),
+                    gateway='10.255.0.2',
+                )
+
+
+def cleanup(count):
+    for index in range(count):
+        try:
+            netns.remove('%s%i' % (PREFIX, index))
+        except OSError:
+            pass
+
+
+def pss(pid='self'):
+    with open('/proc/%s/smaps_rollup' % pid, 'r') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    return 0
+
+
+def objects(cls, count):
+    start = time.perf_counter()
+    sockets = [cls('%s%i' % (PREFIX, x)) for x in range(count)]
+    opened = time.perf_counter() - start
+    latency = []
+    msgs = 0
+    for ns in sockets:
+        start = time.perf_counter()
+        msgs += len(ns.get_links()) + len(ns.get_addr()) + len(ns.get_routes())
+        latency.append(time.perf_counter() - start)
+    latency.sort()
+    memory = pss()
+    for ns in sockets:
+        child = getattr(ns, 'child', None)
+        if child:
+            memory += pss(child)
+    for ns in sockets:
+        ns.close()
+    return (
+        opened,
+        sum(latency),
+        '%7.2f ms mean, %7.2f ms p95'
+        % (
+            sum(latency) / len(latency) * 1000,
+            latency[int(len(latency) * 0.95)] * 1000,
+        ),
+        memory,
+        msgs,
+    )
+
+
+def pool(count):
+    start = time.perf_counter()
+    pool = NetNSPool(['%s%i' % (PREFIX, x) for x in range(count)])
+    opened = time.perf_counter() - start
+    msgs = 0
+    start = time.perf_counter()
+    for method in (pool.get_links, pool.get_addr, pool.get_routes):
+        for msg in method():
+            msgs += 1
+    sweep = time.perf_counter() - start
+    memory = pss()
+    pool.close()
+    return (opened, sweep, '%29s' % '-', memory, msgs)
+
+
+def case(func, count, results):
+    results.put(func(count))
+
+
+def main(count, routes):
+    try:
+        setup(count, routes)
+        for name, func in (
+            ('NetNS', partial(objects, NetNS)),
+            ('DirectNetNS', partial(objects, DirectNetNS)),
+            ('NetNSPool', pool),
+        ):
+            results = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=case, args=(func, count, results)
+            )
+            worker.start()
+            opened, sweep, latency, memory, msgs = results.get()
+            worker.join()
+            print(
+                '    %-12s open: %7.3f s   sweep: %7.3f s   dump: %s   '
+                'PSS: %8i KiB   messages: %i'
+                % (name, opened, sweep, latency, memory, msgs)
+            )
+    finally:
+        cleanup(count)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+    )
@@ -0,0 +1,90 @@
+'''
+nftables ruleset load benchmark
+
+Load N rules into a temporary table with `NFTables.rule('add', ...)`:
+
+* transaction -- all the rules within one `begin()` / `commit()`
+* one-shot -- every rule in its own transaction
+
+For every mode print the rate of the whole load and of the commit
+stage, where the transaction is sent and the ACKs are collected.
+Linux only, requires root and nf_tables::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/nftables.py [count]
+'''
+import sys
+import time
+from pr2modules.nftables.main import NFTables
+from pr2modules.nftables.expressions import ipv4addr
+from pr2modules.nftables.expressions import verdict
+
+TABLE = 'pr2bench'
+CHAIN = 'input'
+
+
+def rule(nft, index):
+    return nft.rule(
+        'add',
+        table=TABLE,
+        chain=CHAIN,
+        expressions=(
+            ipv4addr(src='10.%i.%i.0/24' % (index >> 8 & 0xFF, index & 0xFF)),
+            verdict(code=1),
+        ),
+    )
+
+
+def transaction(nft, count):
+    nft.begin()
+    for index in range(count):
+        rule(nft, index)
+    start = time.time()
+    ret = nft.commit()
+    errors = [x for x in ret if isinstance(x, Exception)]
+    assert len(ret) == count
+    assert not errors, errors[0]
+    return time.time() - start
+
+
+def one_shot(nft, count):
+    for index in range(count):
+        rule(nft, index)
+    return None
+
+
+def run(nft, count, func):
+    nft.table('add', name=TABLE)
+    try:
+        nft.chain(
+            'add',
+            table=TABLE,
+            name=CHAIN,
+            hook='input',
+            type='filter',
+            policy=1,
+        )
+        start = time.time()
+        commit = func(nft, count)
+        total = time.time() - start
+        assert len(nft.get_rules()) == count
+    finally:
+        nft.table('del', name=TABLE)
+    return count / total, count / commit if commit else None
+
+
+def main(count):
+    with NFTables(nfgen_family=2) as nft:
+        for name, func in (
+            ('transaction', transaction),
+            ('one-shot', one_shot),
+        ):
+            load, commit = run(nft, count, func)
+            print(
+                '%-12s load: %8i rules/s   commit: %s'
+                % (name, load, '%8i rules/s' % commit if commit else '-')
+            )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
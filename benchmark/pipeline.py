@@ -0,0 +1,97 @@
+'''
+Bulk requests benchmark
+
+Add and delete routes on a temporary bridge:
+
+* sequential -- one `ipr.route()` call per route
+* pipeline/N -- `ipr.pipeline()` with the window N
+* batch -- routes compiled by `IPBatch` and sent with `submit()`
+
+Print the rate for every mode. Linux only, requires root::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    sudo -E python benchmark/pipeline.py [count]
+
+Please notice, that rtnetlink processes requests within the
+`sendmsg()` call, so with a local socket the pipeline saves only
+the per-request waiting overhead; the difference grows with the
+round trip time. The batch saves the syscalls and the per-request
+response wait as well.
+'''
+import sys
+import time
+from functools import partial
+from pr2modules.iproute.linux import IPBatch
+from pr2modules.iproute.linux import IPRoute
+
+IFNAME = 'pr2bench0'
+
+
+def destinations(count):
+    return ['10.%i.%i.0/24' % (x >> 8 & 0xFF, x & 0xFF) for x in range(count)]
+
+
+def sequential(ipr, command, index, dst):
+    for prefix in dst:
+        ipr.route(command, dst=prefix, oif=index)
+
+
+def pipelined(window, ipr, command, index, dst):
+    with ipr.pipeline(window=window) as pipe:
+        futures = [pipe.route(command, dst=x, oif=index) for x in dst]
+    errors = [x for x in futures if x.exception() is not None]
+    assert not errors, errors[0].exception()
+
+
+def batch(ipr, command, index, dst):
+    ipb = IPBatch()
+    for prefix in dst:
+        ipb.route(command, dst=prefix, oif=index)
+    errors = [x for x in ipb.submit(ipr) if isinstance(x, Exception)]
+    assert not errors, errors[0]
+    ipb.close()
+
+
+modes = (
+    ('sequential', sequential),
+    ('pipeline/1', partial(pipelined, 1)),
+    ('pipeline/8', partial(pipelined, 8)),
+    ('pipeline/64', partial(pipelined, 64)),
+    ('pipeline/256', partial(pipelined, 256)),
+    ('batch', batch),
+)
+
+
+def run(ipr, index, dst, func):
+    ret = []
+    for command in ('add', 'del'):
+        start = time.time()
+        func(ipr, command, index, dst)
+        ret.append(len(dst) / (time.time() - start))
+    return ret
+
+
+def main(count):
+    dst = destinations(count)
+    with IPRoute() as ipr:
+        ipr.link('add', ifname=IFNAME, kind='bridge')
+        try:
+            (index,) = ipr.link_lookup(ifname=IFNAME)
+            ipr.link('set', index=index, state='up')
+            # interleave the modes, not to depend on the system load drift
+            best = {}
+            for _ in range(3):
+                for name, func in modes:
+                    rate = run(ipr, index, dst, func)
+                    best[name] = max(best.get(name, rate), rate)
+            for name, _ in modes:
+                print(
+                    '%-16s add: %8i req/s   del: %8i req/s'
+                    % (name, best[name][0], best[name][1])
+                )
+        finally:
+            ipr.link('del', index=index)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,107 @@
+'''
+Receive path benchmark
+
+Feed synthetic RTNL dumps through a datagram socket pair into
+`IPRSocket.get()` and compare two receive paths:
+
+* alloc -- a new buffer for every datagram, like the async reader
+  used to do: `bytearray(64000)` + `recv_into()`
+* pool -- `recv_into()` pooled buffers, parsed as `memoryview`
+
+For every path print the parser rate, how many receive buffer
+bytes were allocated per message, and how much memory the parsed
+messages keep alive. Linux only, no root permissions required::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    python benchmark/recv.py [count]
+'''
+import sys
+import time
+import socket
+import tracemalloc
+from codec import encode
+from codec import samples
+from pr2modules.netlink.rtnl.iprsocket import IPRSocket
+
+DATAGRAM = 64000
+
+
+def datagrams(data):
+    # split the dump by message boundaries, like the kernel does
+    ret = []
+    offset = 0
+    while offset < len(data):
+        chunk = offset
+        while offset < len(data):
+            length = int.from_bytes(data[offset : offset + 4], sys.byteorder)
+            if offset + length - chunk > DATAGRAM:
+                break
+            offset += length
+        ret.append(bytes(data[chunk:offset]))
+    return ret
+
+
+class AllocRecv(object):
+    '''
+    The receive path with no buffer reuse.
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.allocated = 0
+
+    def __call__(self, bufsize, flags=0):
+        data = bytearray(bufsize)
+        self.allocated += bufsize
+        self.sock.recv_into(data, bufsize, flags)
+        return data
+
+
+def run(chunks, count, pool, trace=False):
+    nl = IPRSocket()
+    rx, tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    nl._sock.close()
+    nl._sock = rx
+    if not pool:
+        nl.recv_ft = AllocRecv(rx)
+    nl.buffer_pool.size = DATAGRAM
+    received = []
+    if trace:
+        tracemalloc.start()
+    start = time.time()
+    for chunk in chunks:
+        tx.send(chunk)
+        received.extend(nl.get(bufsize=DATAGRAM))
+    spent = time.time() - start
+    if trace:
+        kept = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        kept = 0
+    if pool:
+        allocated = nl.buffer_pool.allocated * nl.buffer_pool.size
+    else:
+        allocated = nl.recv_ft.allocated
+    assert len(received) == count
+    nl.close()
+    tx.close()
+    return count / spent, allocated / count, kept / count
+
+
+def main(count):
+    for name, msg_class, factory in samples:
+        chunks = datagrams(encode(msg_class, factory, count))
+        for pool in (False, True):
+            rate, allocated, _ = max(
+                run(chunks, count, pool) for _ in range(3)
+            )
+            _, _, kept = run(chunks, count, pool, trace=True)
+            print(
+                '%-10s %-5s %8i msg/s   buffers: %8.1f B/msg   '
+                'kept: %8.1f B/msg'
+                % (name, 'pool' if pool else 'alloc', rate, allocated, kept)
+            )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
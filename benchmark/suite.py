@@ -0,0 +1,522 @@
+'''
+Netlink benchmark suite
+
+Replay synthetic dumps through the library code paths. No root
+permissions and no network are required, the dumps are generated
+in memory:
+
+* parse/<dump> -- `Marshal.parse()` of a binary dump + NLA access
+* match/<dump> -- the same, filtered with a `match` dict like the
+  `IPRoute` dump methods do, see `pr2modules.netlink.match`
+* encode/<dump> -- `nlmsg_base.encode()` of the dump messages
+* request/<type> -- `IPRoute` API calls compiled with `IPBatch`,
+  that is `IPRequest` builders + encoding
+* ndb/<dump> -- NDB `load_netlink()` into an in-memory SQLite3 DB,
+  message by message
+* ndb-bulk/<dump> -- the same, as the NDB main loop loads the
+  initial dumps: in the bulk mode, `DBSchema.bulk_begin()`
+* ndb-columnar/<dump> -- the same, into the in-memory columnar
+  storage, `NDB(db_provider='columnar')`
+
+The dumps are: links, routes, addresses, neighbours, conntrack
+entries and nftables rules.
+
+For every case print the rate, the peak memory use of one run and
+the number of memory blocks the results keep per message::
+
+    export PYTHONPATH=`ls -d $(pwd)/pyroute2.* | tr '\\n' ':'`
+    python benchmark/suite.py [-c count] [-k 'parse/*'] [-j result.json]
+
+To compare commits, save the baseline results in JSON and run the
+suite with `--compare`. With `--threshold` the script exits with
+an error if some rate drops by more than the given fraction::
+
+    git worktree add /tmp/base master
+    PYTHONPATH=`ls -d /tmp/base/pyroute2.* | tr '\\n' ':'` \\
+        python benchmark/suite.py -j base.json
+    python benchmark/suite.py --compare base.json --threshold 0.1
+'''
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from codec import ip4addr
+from codec import make_address
+from codec import make_link
+from codec import make_neighbour
+from codec import make_route
+from pr2modules.iproute.linux import IPBatch
+from pr2modules.iproute.linux import RTNL_API
+from pr2modules.ndb import schema
+from pr2modules.ndb.main import Log
+from pr2modules.ndb.main import register_sqlite3_adapters
+from pr2modules.netlink.nfnetlink import NFNL_SUBSYS_NFTABLES
+from pr2modules.netlink.nfnetlink.nfctsocket import NFCTSocket
+from pr2modules.netlink.nfnetlink.nfctsocket import nfct_msg
+from pr2modules.netlink.nfnetlink.nftsocket import NFTSocket
+from pr2modules.netlink.nfnetlink.nftsocket import nft_rule_msg
+from pr2modules.netlink.nlsocket import Marshal
+from pr2modules.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.ndmsg import ndmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+from pr2modules.nftables.expressions import ipv4addr
+from pr2modules.nftables.expressions import verdict
+
+try:
+    from pr2modules.netlink.match import Match
+except ImportError:
+    # the trees before compiled match predicates
+    Match = None
+
+TARGET = 'localhost'
+
+
+def make_conntrack(index):
+    saddr = ip4addr(index)
+    sport = 1024 + (index & 0x7FFF)
+
+    def cta_tuple(saddr, daddr, sport, dport):
+        return {
+            'attrs': [
+                [
+                    'CTA_TUPLE_IP',
+                    {
+                        'attrs': [
+                            ['CTA_IP_V4_SRC', saddr],
+                            ['CTA_IP_V4_DST', daddr],
+                        ]
+                    },
+                ],
+                [
+                    'CTA_TUPLE_PROTO',
+                    {
+                        'attrs': [
+                            ['CTA_PROTO_NUM', 6],
+                            ['CTA_PROTO_SRC_PORT', sport],
+                            ['CTA_PROTO_DST_PORT', dport],
+                        ]
+                    },
+                ],
+            ]
+        }
+
+    def cta_counters(packets):
+        return {
+            'attrs': [
+                ['CTA_COUNTERS_PACKETS', packets],
+                ['CTA_COUNTERS_BYTES', packets * 1000],
+            ]
+        }
+
+    return {
+        'nfgen_family': 2,
+        'header': {'type': 0x100, 'flags': 2, 'sequence_number': 1},
+        'attrs': [
+            ['CTA_TUPLE_ORIG', cta_tuple(saddr, '192.168.0.1', sport, 443)],
+            ['CTA_TUPLE_REPLY', cta_tuple('192.168.0.1', saddr, 443, sport)],
+            ['CTA_STATUS', 0x18E],
+            ['CTA_COUNTERS_ORIG', cta_counters(index)],
+            ['CTA_COUNTERS_REPLY', cta_counters(index)],
+            ['CTA_TIMEOUT', 432000],
+            ['CTA_MARK', index & 0xFF],
+            ['CTA_USE', 1],
+            ['CTA_ID', index],
+        ],
+    }
+
+
+def make_nft_rule(index):
+    expressions = ipv4addr(
+        src='10.%i.%i.0/24' % (index >> 8 & 0xFF, index & 0xFF)
+    ) + verdict(code=1)
+    return {
+        'nfgen_family': 2,
+        'header': {
+            'type': 6 | (NFNL_SUBSYS_NFTABLES << 8),
+            'flags': 2,
+            'sequence_number': 1,
+        },
+        'attrs': [
+            ['NFTA_RULE_TABLE', 'filter'],
+            ['NFTA_RULE_CHAIN', 'input'],
+            ['NFTA_RULE_HANDLE', index + 1],
+            ['NFTA_RULE_EXPRESSIONS', expressions],
+        ],
+    }
+
+
+def nfct_marshal():
+    marshal = Marshal()
+    marshal.msg_map = dict(NFCTSocket.policy)
+    return marshal
+
+
+def nft_marshal():
+    marshal = Marshal()
+    marshal.msg_map = dict(
+        (x | (NFNL_SUBSYS_NFTABLES << 8), y)
+        for (x, y) in NFTSocket.policy.items()
+    )
+    return marshal
+
+
+# name, message class, factory, marshal, NLA to access, NDB table
+dumps = (
+    ('links', ifinfmsg, make_link, MarshalRtnl, 'IFLA_IFNAME', 'interfaces'),
+    ('routes', rtmsg, make_route, MarshalRtnl, 'RTA_DST', 'routes'),
+    (
+        'addresses',
+        ifaddrmsg,
+        make_address,
+        MarshalRtnl,
+        'IFA_ADDRESS',
+        'addresses',
+    ),
+    (
+        'neighbours',
+        ndmsg,
+        make_neighbour,
+        MarshalRtnl,
+        'NDA_DST',
+        'neighbours',
+    ),
+    (
+        'conntrack',
+        nfct_msg,
+        make_conntrack,
+        nfct_marshal,
+        'CTA_TUPLE_ORIG',
+        None,
+    ),
+    (
+        'nft-rules',
+        nft_rule_msg,
+        make_nft_rule,
+        nft_marshal,
+        'NFTA_RULE_EXPRESSIONS',
+        None,
+    ),
+)
+
+# name, message class, factory, match dict
+matches = (
+    ('links', ifinfmsg, make_link, {'ifname': 'eth7'}),
+    ('routes', rtmsg, make_route, {'table': 254, 'oif': 7}),
+    ('addresses', ifaddrmsg, make_address, {'address': ip4addr(7)}),
+    ('neighbours', ndmsg, make_neighbour, {'ifindex': 2, 'dst': ip4addr(7)}),
+)
+
+# name, IPBatch method, request factory
+requests = (
+    (
+        'link',
+        'link',
+        lambda x: {
+            'ifname': 'v%i' % x,
+            'kind': 'vlan',
+            'link': 2,
+            'vlan_id': x % 4094 + 1,
+            'mtu': 1500,
+            'address': '52:54:00:00:%02x:%02x' % divmod(x & 0xFFFF, 256),
+        },
+    ),
+    (
+        'route',
+        'route',
+        lambda x: {
+            'dst': '%s/32' % ip4addr(x),
+            'gateway': '192.168.0.1',
+            'oif': 2,
+            'priority': 100,
+        },
+    ),
+    (
+        'multipath',
+        'route',
+        lambda x: {
+            'dst': '%s/32' % ip4addr(x),
+            'multipath': [
+                {'gateway': '192.168.0.1', 'hops': 1},
+                {'gateway': '192.168.0.2', 'hops': 2},
+            ],
+        },
+    ),
+    (
+        'addr',
+        'addr',
+        lambda x: {'index': 2, 'address': ip4addr(x), 'prefixlen': 24},
+    ),
+    (
+        'neighbour',
+        'neigh',
+        lambda x: {
+            'ifindex': 2,
+            'dst': ip4addr(x),
+            'lladdr': '52:54:00:00:%02x:%02x' % divmod(x & 0xFFFF, 256),
+            'state': 2,
+        },
+    ),
+)
+
+
+def encode(msg_class, messages):
+    data = bytearray()
+    for message in messages:
+        msg = msg_class()
+        msg.setvalue(message)
+        msg.data = data
+        msg.offset = len(data)
+        msg.encode()
+    return data
+
+
+class SchemaHost(object):
+    '''
+    The minimal NDB environment to run `DBSchema` in the current
+    thread, without sources.
+    '''
+
+    def __init__(self, mode='sqlite3'):
+        self.log = Log()
+        self.mode = mode
+        self._event_map = {}
+        register_sqlite3_adapters()
+        self.schema = schema.init(
+            self,
+            sqlite3.connect(':memory:'),
+            mode,
+            False,
+            id(threading.current_thread()),
+        )
+        self.schema.execute(
+            'INSERT INTO sources (f_target, f_kind) VALUES (?, ?)',
+            (TARGET, 'local'),
+        )
+
+    def load(self, messages, bulk=False):
+        event_map = self.schema.event_map
+        if bulk:
+            self.schema.bulk_begin()
+        for msg in messages:
+            msg['header']['target'] = TARGET
+            for handler in event_map[type(msg)]:
+                handler(TARGET, msg)
+        if bulk:
+            self.schema.bulk_commit()
+
+    def count(self, table):
+        if self.mode == 'columnar':
+            return self.schema.count(table)
+        return self.schema.fetchone('SELECT count(*) FROM %s' % table)[0]
+
+
+def parse_case(msg_class, factory, marshal, nla, count):
+    data = bytes(encode(msg_class, [factory(x) for x in range(count)]))
+
+    def setup():
+        return marshal()
+
+    def run(marshal):
+        ret = marshal.parse(data)
+        for msg in ret:
+            msg.get_attr(nla)
+        return ret
+
+    return setup, run
+
+
+def match_case(msg_class, factory, spec, count):
+    data = bytes(encode(msg_class, [factory(x) for x in range(count)]))
+
+    def setup():
+        return MarshalRtnl()
+
+    def run(marshal):
+        # like RTNL_API dump methods
+        if Match is None:
+            return list(RTNL_API._match(None, spec, marshal.parse(data)))
+        match = Match(spec, msg_class)
+        msgs = marshal.parse(data, 1, match.callback)
+        return list(RTNL_API._match(None, match, msgs))
+
+    return setup, run
+
+
+def encode_case(msg_class, factory, marshal, nla, count):
+    def setup():
+        return [factory(x) for x in range(count)]
+
+    def run(messages):
+        return encode(msg_class, messages)
+
+    return setup, run
+
+
+def request_case(method, factory, count):
+    def setup():
+        return IPBatch(), [factory(x) for x in range(count)]
+
+    def run(state):
+        ipb, kwargs = state
+        call = getattr(ipb, method)
+        for spec in kwargs:
+            call('add', **spec)
+        ret = bytes(ipb.batch)
+        ipb.close()
+        return ret
+
+    return setup, run
+
+
+def ndb_case(msg_class, factory, table, bulk, count, mode='sqlite3'):
+    data = encode(msg_class, [factory(x) for x in range(count)])
+    # the objects to refer to, like interfaces for routes
+    links = encode(ifinfmsg, [make_link(x) for x in range(4)])
+
+    def setup():
+        host = SchemaHost(mode)
+        if table != 'interfaces':
+            host.load(MarshalRtnl().parse(links))
+        return host, MarshalRtnl().parse(data)
+
+    def run(state):
+        host, messages = state
+        host.load(messages, bulk)
+        loaded = host.count(table)
+        assert loaded >= count, '%s: %i of %i loaded' % (table, loaded, count)
+        return host
+
+    return setup, run
+
+
+def cases(count):
+    for name, msg_class, factory, marshal, nla, table in dumps:
+        spec = (msg_class, factory, marshal, nla, count)
+        yield 'parse/%s' % name, parse_case(*spec)
+        yield 'encode/%s' % name, encode_case(*spec)
+        if table is not None:
+            spec = (msg_class, factory, table)
+            yield 'ndb/%s' % name, ndb_case(*spec, False, count)
+            yield 'ndb-bulk/%s' % name, ndb_case(*spec, True, count)
+            yield 'ndb-columnar/%s' % name, ndb_case(
+                *spec, False, count, 'columnar'
+            )
+    for name, msg_class, factory, spec in matches:
+        yield 'match/%s' % name, match_case(msg_class, factory, spec, count)
+    for name, method, factory in requests:
+        yield 'request/%s' % name, request_case(method, factory, count)
+
+
+def measure(setup, run, count, rounds):
+    timing = []
+    for _ in range(rounds):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        timing.append(time.perf_counter() - start)
+        del state
+    # tracemalloc slows down the code, so use a separate run
+    state = setup()
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    ret = run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    del ret
+    return {
+        'count': count,
+        'time': min(timing),
+        'rate': count / min(timing),
+        'peak': peak,
+        'blocks': max(blocks, 0) / count,
+    }
+
+
+def commit():
+    path = os.path.dirname(os.path.abspath(schema.__file__))
+    try:
+        return (
+            subprocess.check_output(
+                ('git', 'describe', '--always', '--dirty'),
+                cwd=path,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode('utf-8')
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='netlink benchmark suite')
+    parser.add_argument('-c', '--count', type=int, default=10000)
+    parser.add_argument('-r', '--rounds', type=int, default=3)
+    parser.add_argument('-k', '--cases', default='*', help='fnmatch pattern')
+    parser.add_argument('-j', '--json', help='save results, - for stdout')
+    parser.add_argument('--compare', help='compare to saved results')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        help='fail if some rate drops by more than this fraction',
+    )
+    args = parser.parse_args()
+
+    base = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)['results']
+    output = sys.stderr if args.json == '-' else sys.stdout
+    results = {}
+    regressions = []
+    for name, (setup, run) in cases(args.count):
+        if not fnmatch.fnmatch(name, args.cases):
+            continue
+        ret = results[name] = measure(setup, run, args.count, args.rounds)
+        line = '%-20s %9i msg/s   peak: %9.1f KiB   blocks: %6.2f/msg' % (
+            name,
+            ret['rate'],
+            ret['peak'] / 1024,
+            ret['blocks'],
+        )
+        if name in base:
+            ratio = ret['rate'] / base[name]['rate']
+            line += '   x%.2f' % ratio
+            if args.threshold is not None and ratio < 1 - args.threshold:
+                regressions.append(name)
+        print(line, file=output)
+
+    if args.json:
+        report = {
+            'commit': commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'count': args.count,
+            'rounds': args.rounds,
+            'results': results,
+        }
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=4)
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=4)
+    if regressions:
+        print('regressions: %s' % ', '.join(regressions), file=output)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
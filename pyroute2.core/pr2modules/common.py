@@ -9,6 +9,7 @@ import time
 import sys
 import errno
 import types
+import heapq
 import struct
 import socket
 import logging
@@ -411,7 +412,9 @@ class AddrPool(object):
         self.allocated = 0
         if self.release and not isinstance(self.release, int):
             raise TypeError()
+        # banned addresses: a heap of (alloc round to free at, addr)
         self.ban = []
+        self.round = 0
         while mx:
             mx >>= 8
             self.cell_size += 1
@@ -427,12 +430,9 @@ class AddrPool(object):
     def alloc(self):
         with self.lock:
             # gc self.ban:
-            for item in tuple(self.ban):
-                if item['counter'] == 0:
-                    self.free(item['addr'])
-                    self.ban.remove(item)
-                else:
-                    item['counter'] -= 1
+            self.round += 1
+            while self.ban and self.ban[0][0] <= self.round:
+                self.free(heapq.heappop(self.ban)[1])
 
             # iterate through addr_map
             base = 0
@@ -498,7 +498,8 @@ class AddrPool(object):
     def free(self, addr, ban=0):
         with self.lock:
             if ban != 0:
-                self.ban.append({'addr': addr, 'counter': ban})
+                # free the address on the (ban + 1)th alloc() from now
+                heapq.heappush(self.ban, (self.round + ban + 1, addr))
             else:
                 base, bit, is_allocated = self.locate(addr)
                 if len(self.addr_map) <= base:
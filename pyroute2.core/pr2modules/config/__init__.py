@@ -13,7 +13,10 @@ async_qsize = 4096
 commit_barrier = 0
 gc_timeout = 60
 db_transaction_limit = 1
+db_bulk_limit = 10000
 cache_expire = 60
+genl_cache = True
+genl_cache_size = 16
 
 # save uname() on startup time: it is not so
 # highly possible that the kernel will be
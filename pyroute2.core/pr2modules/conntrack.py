@@ -1,4 +1,7 @@
 import socket
+import struct
+from collections import namedtuple
+from operator import itemgetter
 
 from pr2modules.netlink.nfnetlink.nfctsocket import IP_CT_TCP_FLAG_TO_NAME
 from pr2modules.netlink.nfnetlink.nfctsocket import IPSBIT_TO_NAME
@@ -6,6 +9,262 @@ from pr2modules.netlink.nfnetlink.nfctsocket import TCPF_TO_NAME
 from pr2modules.netlink.nfnetlink.nfctsocket import NFCTAttrTuple
 from pr2modules.netlink.nfnetlink.nfctsocket import NFCTSocket
 
+# NLA_F_NESTED and NLA_F_NET_BYTEORDER stripped
+NLA_TYPE_MASK = 0x3FFF
+nla_header = struct.Struct('HH')
+be16 = struct.Struct('>H')
+be32 = struct.Struct('>I')
+be64 = struct.Struct('>Q')
+
+ConntrackRecordFields = (
+    'family',
+    'proto',
+    'saddr',
+    'daddr',
+    'sport',
+    'dport',
+    'reply_saddr',
+    'reply_daddr',
+    'reply_sport',
+    'reply_dport',
+    'status',
+    'mark',
+    'zone',
+    'timeout',
+    'packets',
+    'bytes',
+    'reply_packets',
+    'reply_bytes',
+    'id',
+)
+ConntrackRecordIndex = {x: i for i, x in enumerate(ConntrackRecordFields)}
+
+
+class ConntrackRecord(namedtuple('ConntrackRecord', ConntrackRecordFields)):
+    '''
+    Compact conntrack entry, decoded directly from the dump
+    buffer. Addresses are strings, ports are `None` for the
+    protocols without ports, counters are `None` if the
+    accounting is disabled (`net.netfilter.nf_conntrack_acct`).
+    '''
+
+    __slots__ = ()
+
+    def tuple_orig(self):
+        return NFCTAttrTuple(
+            family=self.family,
+            saddr=self.saddr,
+            daddr=self.daddr,
+            proto=self.proto,
+            sport=self.sport,
+            dport=self.dport,
+        )
+
+    def status_name(self):
+        return ','.join(
+            [name for bit, name in IPSBIT_TO_NAME.items() if self.status & bit]
+        )
+
+
+def decode_tuple(data, offset, end):
+    '''
+    Decode CTA_TUPLE_* payload into (saddr, daddr, proto, sport, dport)
+    '''
+    saddr = daddr = sport = dport = None
+    proto = 0
+    while offset + 4 <= end:
+        length, nla_type = nla_header.unpack_from(data, offset)
+        if length < 4:
+            break
+        nla_type &= NLA_TYPE_MASK
+        stop = offset + length
+        pos = offset + 4
+        # CTA_TUPLE_IP
+        if nla_type == 1:
+            while pos + 4 <= stop:
+                a_length, a_type = nla_header.unpack_from(data, pos)
+                if a_length < 4:
+                    break
+                a_type &= NLA_TYPE_MASK
+                if a_type in (1, 2):
+                    addr = socket.inet_ntop(
+                        socket.AF_INET, data[pos + 4 : pos + 8]
+                    )
+                else:
+                    addr = socket.inet_ntop(
+                        socket.AF_INET6, data[pos + 4 : pos + 20]
+                    )
+                # CTA_IP_V4_SRC, CTA_IP_V6_SRC
+                if a_type & 1:
+                    saddr = addr
+                else:
+                    daddr = addr
+                pos += (a_length + 3) & ~3
+        # CTA_TUPLE_PROTO
+        elif nla_type == 2:
+            while pos + 4 <= stop:
+                a_length, a_type = nla_header.unpack_from(data, pos)
+                if a_length < 4:
+                    break
+                a_type &= NLA_TYPE_MASK
+                if a_type == 1:
+                    proto = data[pos + 4]
+                elif a_type == 2:
+                    (sport,) = be16.unpack_from(data, pos + 4)
+                elif a_type == 3:
+                    (dport,) = be16.unpack_from(data, pos + 4)
+                pos += (a_length + 3) & ~3
+        offset += (length + 3) & ~3
+    return saddr, daddr, proto, sport, dport
+
+
+def decode_counters(data, offset, end):
+    '''
+    Decode CTA_COUNTERS_* payload into (packets, bytes)
+    '''
+    packets = nbytes = None
+    while offset + 4 <= end:
+        length, nla_type = nla_header.unpack_from(data, offset)
+        if length < 4:
+            break
+        nla_type &= NLA_TYPE_MASK
+        if nla_type == 1:
+            (packets,) = be64.unpack_from(data, offset + 4)
+        elif nla_type == 2:
+            (nbytes,) = be64.unpack_from(data, offset + 4)
+        elif nla_type == 3:
+            (packets,) = be32.unpack_from(data, offset + 4)
+        elif nla_type == 4:
+            (nbytes,) = be32.unpack_from(data, offset + 4)
+        offset += (length + 3) & ~3
+    return packets, nbytes
+
+
+def decode_entry(data, offset, length):
+    '''
+    Decode IPCTNL_MSG_CT_NEW message into a plain tuple of
+    values in the `ConntrackRecordFields` order
+    '''
+    end = offset + length
+    family = data[offset + 16]
+    orig = reply = (None, None, 0, None, None)
+    status = mark = timeout = ct_id = None
+    counters = reply_counters = (None, None)
+    zone = 0
+    # nlmsghdr + nfgenmsg
+    offset += 20
+    while offset + 4 <= end:
+        nla_length, nla_type = nla_header.unpack_from(data, offset)
+        if nla_length < 4:
+            break
+        nla_type &= NLA_TYPE_MASK
+        if nla_type == 1:
+            orig = decode_tuple(data, offset + 4, offset + nla_length)
+        elif nla_type == 2:
+            reply = decode_tuple(data, offset + 4, offset + nla_length)
+        elif nla_type == 3:
+            (status,) = be32.unpack_from(data, offset + 4)
+        elif nla_type == 7:
+            (timeout,) = be32.unpack_from(data, offset + 4)
+        elif nla_type == 8:
+            (mark,) = be32.unpack_from(data, offset + 4)
+        elif nla_type == 9:
+            counters = decode_counters(data, offset + 4, offset + nla_length)
+        elif nla_type == 10:
+            reply_counters = decode_counters(
+                data, offset + 4, offset + nla_length
+            )
+        elif nla_type == 12:
+            (ct_id,) = be32.unpack_from(data, offset + 4)
+        elif nla_type == 18:
+            (zone,) = be16.unpack_from(data, offset + 4)
+        offset += (nla_length + 3) & ~3
+    return (
+        family,
+        orig[2],
+        orig[0],
+        orig[1],
+        orig[3],
+        orig[4],
+        reply[0],
+        reply[1],
+        reply[3],
+        reply[4],
+        status,
+        mark,
+        zone,
+        timeout,
+        counters[0],
+        counters[1],
+        reply_counters[0],
+        reply_counters[1],
+        ct_id,
+    )
+
+
+def compile_match(
+    mark=None,
+    mark_mask=0xFFFFFFFF,
+    tuple_orig=None,
+    tuple_reply=None,
+    zone=None,
+    status=None,
+    status_mask=None,
+):
+    '''
+    Return a function to check the decoded entry values against the
+    filters, or `None` if there are no filters. The kernels without
+    the filtering support ignore the filters, so the check is cheap
+    to run anyways.
+    '''
+    match = []
+    for prefix, nfct_tuple in (('', tuple_orig), ('reply_', tuple_reply)):
+        if nfct_tuple is None:
+            continue
+        for field in ('saddr', 'daddr', 'sport', 'dport'):
+            value = getattr(nfct_tuple, field)
+            if value is None:
+                continue
+            if field in ('saddr', 'daddr'):
+                # normalize the address text, e.g. IPv6 zeros
+                value = socket.inet_ntop(
+                    nfct_tuple.family,
+                    socket.inet_pton(nfct_tuple.family, value),
+                )
+            match.append((ConntrackRecordIndex[prefix + field], None, value))
+        if nfct_tuple.proto is not None:
+            match.append(
+                (ConntrackRecordIndex['proto'], None, nfct_tuple.proto)
+            )
+    if zone is not None:
+        match.append((ConntrackRecordIndex['zone'], None, zone))
+    if mark:
+        if mark_mask is None:
+            mark_mask = 0xFFFFFFFF
+        match.append(
+            (ConntrackRecordIndex['mark'], mark_mask, mark & mark_mask)
+        )
+    if status is not None:
+        if status_mask is None:
+            status_mask = 0xFFFFFFFF
+        match.append(
+            (ConntrackRecordIndex['status'], status_mask, status & status_mask)
+        )
+    if not match:
+        return None
+
+    def check(values):
+        for index, mask, value in match:
+            field = values[index]
+            if mask is not None:
+                if field is None or field & mask != value:
+                    return False
+            elif field != value:
+                return False
+        return True
+
+    return check
+
 
 class NFCTATcpProtoInfo(object):
 
@@ -227,3 +486,84 @@ class Conntrack(NFCTSocket):
                 ndmsg.get_attr('CTA_ID'),
                 ndmsg.get_attr('CTA_USE'),
             )
+
+    def stream_entries(
+        self,
+        mark=None,
+        mark_mask=0xFFFFFFFF,
+        tuple_orig=None,
+        tuple_reply=None,
+        zone=None,
+        status=None,
+        status_mask=None,
+    ):
+        """
+        Dump entries from conntrack table as `ConntrackRecord`
+
+        Unlike `dump_entries()`, no netlink message objects are
+        created: the records are decoded directly from the receive
+        buffer, and all the filters are sent to the kernel, see
+        `NFCTSocket.dump()`. The records are checked once again
+        in Python for the kernels that ignore the filters. The ICMP
+        id, type and code filters are not supported.
+
+        Examples::
+            # Established TCP connections to port 443 in the zone 1
+            for record in ct.stream_entries(
+                    tuple_orig=NFCTAttrTuple(proto=socket.IPPROTO_TCP,
+                                             dport=443),
+                    zone=1,
+                    status=IPS_ASSURED,
+                    status_mask=IPS_ASSURED):
+                print(record.saddr, record.sport, record.bytes)
+        """
+        check = compile_match(
+            mark, mark_mask, tuple_orig, tuple_reply, zone, status, status_mask
+        )
+        make = tuple.__new__
+        for values in self.dump_stream(
+            decode_entry,
+            mark=mark,
+            mark_mask=mark_mask,
+            tuple_orig=tuple_orig,
+            tuple_reply=tuple_reply,
+            zone=zone,
+            status=status,
+            status_mask=status_mask,
+        ):
+            if check is None or check(values):
+                yield make(ConntrackRecord, values)
+
+    def aggregate(self, key=('saddr', 'daddr', 'proto'), **kwargs):
+        """
+        Count conntrack entries grouped by the `key` fields, and
+        return a dictionary `{key values: count}`
+
+        The entries are not stored and no record objects are created,
+        so the memory use depends only on the number of the groups.
+        Accept the same filters as `stream_entries()`.
+
+        Examples::
+            # Connections per source address
+            {('10.0.0.1',): 1024, ('10.0.0.2',): 8}
+            ct.aggregate(key=('saddr', ))
+
+            # Connections per protocol in the zone 1
+            ct.aggregate(key=('proto', ), zone=1)
+        """
+        if isinstance(key, str):
+            key = (key,)
+        getter = itemgetter(*[ConntrackRecordIndex[x] for x in key])
+        if len(key) == 1:
+            fetch = getter
+
+            def getter(values):
+                return (fetch(values),)
+
+        check = compile_match(**kwargs)
+        ret = {}
+        for values in self.dump_stream(decode_entry, **kwargs):
+            if check is None or check(values):
+                group = getter(values)
+                ret[group] = ret.get(group, 0) + 1
+        return ret
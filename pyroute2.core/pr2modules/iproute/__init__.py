@@ -7,6 +7,7 @@ The RTNL API is provided by the class `RTNL_API`. It is a
 mixin class that works on top of any RTNL-compatible socket,
 so several classes with almost the same API are available:
     * `IPRoute` -- simple RTNL API
+    * `AsyncIPRoute` -- RTNL API for asyncio
     * `NetNS` -- RTNL API in a network namespace
     * `IPBatch` -- RTNL packet compiler
     * `RemoteIPRoute` -- run RTNL remotely (no deployment required)
@@ -150,6 +151,7 @@ elif config.uname[0][-3:] == 'BSD':
 else:
     from pr2modules.iproute.linux import IPRoute
     from pr2modules.iproute.linux import RawIPRoute
+    from pr2modules.iproute.linux import AsyncIPRoute  # noqa: F401
 
 classes = [RTNL_API, IPBatch, IPRoute, RawIPRoute]
 
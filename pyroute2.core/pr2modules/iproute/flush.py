@@ -0,0 +1,217 @@
+'''
+Flush
+-----
+
+`RTNL_API.flush_routes()`, `flush_addr()` and `flush_rules()`
+delete all the objects that match the filters, the same filters
+as `get_routes()`, `get_addr()` and `get_rules()` use::
+
+    with IPRoute() as ipr:
+        ipr.flush_routes(table=100)
+        ipr.flush_addr(index=2)
+        ipr.flush_rules(family=AF_INET, priority=lambda x: 5 < x < 32000)
+
+The delete requests are built right from the dump receive buffer:
+the message header and the key NLA only, e.g. `RTA_DST`,
+`RTA_TABLE`, `RTA_PRIORITY`, `RTA_OIF` and `RTA_GATEWAY` for
+routes, or the whole message for rules. When the filter can be
+checked on the raw data, see `pr2modules.netlink.match`, the dump
+messages are not decoded at all. The requests are sent in large
+datagrams while the dump is still being read.
+
+The requests are sent without `NLM_F_ACK`, so the kernel responds
+only with errors. The kernel processes the requests in order, so
+the flush ends with a `RTM_GETLINK` request for the loopback: by
+the time the response arrives all the errors are received.
+
+Deleting objects in the middle of a dump may make the kernel skip
+some of them, so like `ip route flush` the flush repeats the dump
+until nothing more can be deleted, up to 10 times.
+
+The methods return `FlushStats`::
+
+    stats = ipr.flush_routes(table=100)
+    stats.deleted  # -> the number of deleted objects
+    stats.failed   # -> the number of objects failed to delete
+    stats.errors   # -> {errno: count, ...}
+
+The objects already deleted by the time the request arrives, e.g.
+IPv4 secondary addresses deleted with the primary one, are counted
+neither as deleted nor as failed.
+
+`AsyncIPRoute` sends the decoded dump messages as delete requests
+with `NLM_F_ACK`, and counts the responses.
+'''
+
+import os
+import errno
+import struct
+import collections
+from pr2modules.netlink import NLA_F_NESTED
+from pr2modules.netlink import NLA_F_NET_BYTEORDER
+from pr2modules.netlink import NLMSG_DONE
+from pr2modules.netlink import NLMSG_ERROR
+from pr2modules.netlink import NLM_F_REQUEST
+from pr2modules.netlink import nla_header_struct
+from pr2modules.netlink.match import Match
+from pr2modules.netlink.match import get_plan
+from pr2modules.netlink.rtnl import RTM_GETLINK
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+
+FlushStats = collections.namedtuple(
+    'FlushStats', ('deleted', 'failed', 'errors')
+)
+
+# the object is already deleted
+GONE = (errno.ENOENT, errno.ESRCH, errno.EADDRNOTAVAIL)
+
+header_struct = struct.Struct('IHHII')
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+
+
+class Flush(object):
+    '''
+    One flush round: the dump request callback, that turns the
+    matching dump messages into delete requests.
+
+    * sock -- RTNL socket
+    * msg_class -- the dump message class
+    * msg_type -- the delete request type
+    * match -- match dict or predicate, or None to delete all
+    * keys -- NLA names to copy into the delete requests,
+      None to copy the whole message
+    * batch -- the datagram size to send
+    '''
+
+    def __init__(self, sock, msg_class, msg_type, match, keys, batch=32768):
+        self.sock = sock
+        self.msg_class = msg_class
+        self.msg_type = msg_type
+        self.batch_size = batch
+        self.buffer = bytearray()
+        self.requests = 0
+        self.deleted = 0
+        self.failed = 0
+        self.errors = collections.Counter()
+        plan = get_plan(msg_class)
+        self.nla_offset = plan.nla_offset
+        if keys is None:
+            self.nla_types = None
+        else:
+            self.nla_types = set(plan.nla(x)[0] for x in keys)
+        if isinstance(match, dict):
+            match = Match(match, msg_class) if match else None
+        self.match = match
+        # the raw data check is enough
+        self.exact = match is None or (
+            isinstance(match, Match) and len(match.raw) == len(match.keys)
+        )
+        self.pid = sock.epid or os.getpid()
+        # the kernel responds with errors only, see the module docs;
+        # register the backlog, otherwise the errors are dropped as
+        # orphaned messages
+        self.msg_seq = sock.addr_pool.alloc()
+        with sock.backlog_lock:
+            sock.backlog[self.msg_seq] = []
+
+    def __call__(self, msg):
+        # messages that could not be checked on the raw data
+        if msg['header']['type'] in (NLMSG_DONE, NLMSG_ERROR):
+            return False
+        if not isinstance(msg, self.msg_class):
+            return False
+        if self.match is None or self.match(msg):
+            self.delete(msg.data, msg.offset)
+        return True
+
+    def prefilter(self, msg_class, data, offset):
+        if msg_class is not self.msg_class:
+            return False
+        if isinstance(self.match, Match) and self.match.raw:
+            try:
+                if not self.match.check(data, offset):
+                    return True
+            except Exception:
+                # let the decoder deal with the broken data
+                return False
+        if not self.exact:
+            return False
+        self.delete(data, offset)
+        return True
+
+    def delete(self, data, offset):
+        '''
+        Add the delete request for the dump message at `offset`.
+        '''
+        buf = self.buffer
+        nla_types = self.nla_types
+        start = len(buf)
+        (length,) = struct.unpack_from('I', data, offset)
+        end = offset + length
+        if nla_types is None:
+            buf += data[offset:end]
+        else:
+            buf += data[offset : offset + self.nla_offset]
+            offset += self.nla_offset
+            while offset <= end - 4:
+                (length, nla_type) = nla_header_struct.unpack_from(
+                    data, offset
+                )
+                if length < 4:
+                    break
+                # the NLA are aligned, but the last one may be not padded
+                stop = offset + ((length + 4 - 1) & ~(4 - 1))
+                if (nla_type & NLA_TYPE_MASK) in nla_types:
+                    buf += data[offset : min(stop, end)]
+                offset = stop
+        buf += b'\0' * (-len(buf) % 4)
+        header_struct.pack_into(
+            buf,
+            start,
+            len(buf) - start,
+            self.msg_type,
+            NLM_F_REQUEST,
+            self.msg_seq,
+            self.pid,
+        )
+        self.requests += 1
+        if len(buf) >= self.batch_size:
+            self.send()
+
+    def send(self):
+        if self.buffer:
+            self.sock.sendto(bytes(self.buffer), (0, 0))
+            self.buffer = bytearray()
+
+    def commit(self):
+        '''
+        Send the rest of the requests and collect the errors.
+        '''
+        self.send()
+        if not self.requests:
+            return
+        msg = ifinfmsg()
+        msg['index'] = 1
+        for _ in self.sock.nlm_request(msg, RTM_GETLINK, NLM_F_REQUEST):
+            pass
+        gone = 0
+        with self.sock.backlog_lock:
+            msgs = self.sock.backlog.get(self.msg_seq, ())
+            self.sock.backlog[self.msg_seq] = []
+        for msg in msgs:
+            error = msg['header'].get('error', None)
+            if error is None:
+                continue
+            code = getattr(error, 'code', None)
+            if code in GONE:
+                gone += 1
+            else:
+                self.failed += 1
+                self.errors[code] += 1
+        self.deleted = self.requests - self.failed - gone
+
+    def release(self):
+        with self.sock.backlog_lock:
+            self.sock.backlog.pop(self.msg_seq, None)
+        # see NetlinkMixin.nlm_request() on msg_seq ban
+        self.sock.addr_pool.free(self.msg_seq, ban=0xFF)
@@ -73,11 +73,17 @@ from pr2modules.netlink.rtnl.ifstatsmsg import ifstatsmsg
 from pr2modules.netlink.rtnl.iprsocket import IPRSocket
 from pr2modules.netlink.rtnl.iprsocket import IPBatchSocket
 from pr2modules.netlink.rtnl.iprsocket import ChaoticIPRSocket
+from pr2modules.netlink.rtnl.iprsocket import AsyncIPRSocket
 from pr2modules.netlink.rtnl.riprsocket import RawIPRSocket
 from pr2modules.netlink.rtnl.nsidmsg import nsidmsg
 from pr2modules.netlink.rtnl.nsinfmsg import nsinfmsg
 from pr2modules.netlink.exceptions import SkipInode
 from pr2modules.netlink.exceptions import NetlinkError
+from pr2modules.netlink.nlsocket import NetlinkRequest
+from pr2modules.netlink.match import Match
+from pr2modules.iproute.flush import Flush
+from pr2modules.iproute.flush import FlushStats
+from pr2modules.iproute.flush import GONE
 
 from pr2modules.common import AF_MPLS
 from pr2modules.common import basestring
@@ -171,6 +177,38 @@ class RTNL_API(object):
                 if all(matches):
                     yield msg
 
+    def _compile_match(self, match, msg_class, callback=None):
+        #
+        # Compile a match dict into a predicate, see
+        # `pr2modules.netlink.match`. Return the predicate and
+        # the request callback that drops the not matching
+        # messages before decoding.
+        #
+        # With a custom callback the dict is used as is: the
+        # callback must see all the messages.
+        #
+        if isinstance(match, dict) and match and callback is None:
+            match = Match(match, msg_class)
+            callback = match.callback
+        return match, callback
+
+    def _dump_filter(self, match, keys):
+        #
+        # With `strict_check` the kernel filters dumps by some
+        # header fields and NLA. Return the integer `keys` of
+        # the match dict to add to the dump request.
+        #
+        # The kernel filter only reduces the dump, the results
+        # are matched with the whole dict anyway.
+        #
+        if not self.strict_check or not isinstance(match, dict):
+            return {}
+        return dict(
+            (key, value)
+            for key, value in match.items()
+            if key in keys and isinstance(value, int)
+        )
+
     # 8<---------------------------------------------------------------
     #
     def dump(self):
@@ -274,6 +312,11 @@ class RTNL_API(object):
 
             interfaces = [1, 2, 3]
             ip.get_links(*interfaces)
+
+        The `family` and `ext_mask` keywords are used in the
+        dump request, other keywords filter the results::
+
+            ip.get_links(ext_mask=1, ifname='eth0')
         '''
         result = []
         links = argv or [0]
@@ -285,6 +328,20 @@ class RTNL_API(object):
         else:
             cmd = 'get'
 
+        if cmd == 'dump':
+            # the request parameters are not the match keys
+            request = dict(
+                (x, kwarg.pop(x)) for x in ('family', 'ext_mask') if x in kwarg
+            )
+            match = kwarg.pop('match', None) or kwarg or None
+            if self.strict_check:
+                # strict dump requests may have only the filter NLA
+                request.update(self._dump_filter(match, ('master',)))
+            else:
+                request.update(kwarg)
+            request['match'] = match
+            kwarg = request
+
         for index in links:
             kwarg['index'] = index
             result.extend(self.link(cmd, **kwarg))
@@ -315,8 +372,17 @@ class RTNL_API(object):
 
             # and filter them by a function:
             ip.get_neighbours(AF_BRIDGE, match=lambda x: x['state'] == 2)
+
+        With `strict_check` the `ifindex` and `master` filters are
+        applied also by the kernel.
         '''
-        return self.neigh('dump', family=family, match=match or kwarg)
+        match = match or kwarg
+        return self.neigh(
+            'dump',
+            family=family,
+            match=match,
+            **self._dump_filter(match, ('ifindex', 'master'))
+        )
 
     def get_ntables(self, family=AF_UNSPEC):
         '''
@@ -326,7 +392,7 @@ class RTNL_API(object):
         msg['family'] = family
         return self.nlm_request(msg, RTM_GETNEIGHTBL)
 
-    def get_addr(self, family=AF_UNSPEC, match=None, **kwarg):
+    def get_addr(self, family=AF_UNSPEC, match=None, callback=None, **kwarg):
         '''
         Dump addresses.
 
@@ -352,10 +418,20 @@ class RTNL_API(object):
         A custom predicate can be used as a filter::
 
             ip.get_addr(match=lambda x: x['index'] == 1)
+
+        With `strict_check` the `index` filter is applied also
+        by the kernel.
         '''
-        return self.addr('dump', family=family, match=match or kwarg)
+        match = match or kwarg
+        return self.addr(
+            'dump',
+            family=family,
+            match=match,
+            callback=callback,
+            **self._dump_filter(match, ('index',))
+        )
 
-    def get_rules(self, family=AF_UNSPEC, match=None, **kwarg):
+    def get_rules(self, family=AF_UNSPEC, match=None, callback=None, **kwarg):
         '''
         Get all rules. By default return all rules. To explicitly
         request the IPv4 rules use `family=AF_INET`.
@@ -368,9 +444,10 @@ class RTNL_API(object):
             (RTM_GETRULE, NLM_F_REQUEST | NLM_F_ROOT | NLM_F_ATOMIC),
             family=family,
             match=match or kwarg,
+            callback=callback,
         )
 
-    def get_routes(self, family=255, match=None, **kwarg):
+    def get_routes(self, family=255, match=None, callback=None, **kwarg):
         '''
         Get all routes. You can specify the table. There
         are up to 4294967295 routing classes (tables), and the kernel
@@ -389,13 +466,28 @@ class RTNL_API(object):
         But it returns all the routes for all the families if one
         uses an invalid value here. Hack but true. And let's hope
         the kernel team will not fix this bug.
+
+        With `strict_check` the `table`, `oif` and `proto` filters
+        are applied also by the kernel, so e.g. the routes of other
+        tables are not even sent::
+
+            ipr = IPRoute(strict_check=True)
+            ipr.get_routes(table=100, oif=7)
         '''
         # get a particular route?
         if isinstance(kwarg.get('dst'), basestring):
             kwarg = {"dst": kwarg['dst'], "family": family}
-            return self.route('get', **kwarg)
+            return self.route('get', callback=callback, **kwarg)
         else:
-            return self.route('dump', family=family, match=match or kwarg)
+            match = match or kwarg
+            dump = self._dump_filter(match, ('table', 'oif', 'proto'))
+            if dump.get('table') == 252:
+                # RT_TABLE_COMPAT in the header matches all the
+                # tables > 255, don't filter it in the kernel
+                dump.pop('table')
+            return self.route(
+                'dump', family=family, match=match, callback=callback, **dump
+            )
 
     # 8<---------------------------------------------------------------
 
@@ -609,22 +701,65 @@ class RTNL_API(object):
     #
     # Shortcuts to flush RTNL objects
     #
-    def flush_routes(self, *argv, **kwarg):
+    def _flush(self, dump, msg_class, msg_type, match, keys, rounds=10):
+        #
+        # Run the `dump` with the `Flush` callback, see
+        # `pr2modules.iproute.flush`, until nothing more can
+        # be deleted.
+        #
+        deleted = 0
+        for _ in range(rounds):
+            flush = Flush(self, msg_class, msg_type, match, keys)
+            try:
+                for _ in dump(callback=flush):
+                    pass
+                flush.commit()
+            finally:
+                flush.release()
+            deleted += flush.deleted
+            if not flush.deleted:
+                break
+        return FlushStats(deleted, flush.failed, dict(flush.errors))
+
+    def flush_routes(self, family=255, match=None, **kwarg):
         '''
         Flush routes -- purge route records from a table.
-        Arguments are the same as for `get_routes()`
-        routine. Actually, this routine implements a pipe from
-        `get_routes()` to `nlm_request()`.
+        Arguments are the same as for `get_routes()` routine.
+        Return `FlushStats(deleted, failed, errors)`, see
+        `pr2modules.iproute.flush`::
+
+            # flush all the routes from the table 100
+            ipr.flush_routes(table=100)
         '''
-        ret = []
-        for route in self.get_routes(*argv, **kwarg):
-            self.put(route, msg_type=RTM_DELROUTE, msg_flags=NLM_F_REQUEST)
-            ret.append(route)
-        return ret
+        keys = (
+            'RTA_DST',
+            'RTA_SRC',
+            'RTA_OIF',
+            'RTA_GATEWAY',
+            'RTA_PRIORITY',
+            'RTA_MULTIPATH',
+            'RTA_TABLE',
+            'RTA_VIA',
+        )
+        if isinstance(kwarg.get('dst'), basestring):
+            # not a dump, but a route lookup: delete the result once
+            def lookup(callback):
+                return map(callback, self.get_routes(family, **kwarg))
+
+            return self._flush(lookup, rtmsg, RTM_DELROUTE, None, keys, 1)
+        return self._flush(
+            partial(self.get_routes, family, match, **kwarg),
+            rtmsg,
+            RTM_DELROUTE,
+            match or kwarg,
+            keys,
+        )
 
-    def flush_addr(self, *argv, **kwarg):
+    def flush_addr(self, family=AF_UNSPEC, match=None, **kwarg):
         '''
-        Flush IP addresses.
+        Flush IP addresses. Arguments are the same as for
+        `get_addr()` routine. Return `FlushStats(deleted, failed,
+        errors)`, see `pr2modules.iproute.flush`.
 
         Examples::
 
@@ -634,19 +769,21 @@ class RTNL_API(object):
             # flush all addresses with IFA_LABEL='eth0':
             ipr.flush_addr(label='eth0')
         '''
-        #flags = NLM_F_CREATE | NLM_F_EXCL | NLM_F_REQUEST
-        flags = NLM_F_CREATE | NLM_F_REQUEST
-        ret = []
-        for addr in self.get_addr(*argv, **kwarg):
-            self.put(addr, msg_type=RTM_DELADDR, msg_flags=flags)
-            ret.append(addr)
-        return ret
+        return self._flush(
+            partial(self.get_addr, family, match, **kwarg),
+            ifaddrmsg,
+            RTM_DELADDR,
+            match or kwarg,
+            ('IFA_ADDRESS', 'IFA_LOCAL'),
+        )
 
-    def flush_rules(self, *argv, **kwarg):
+    def flush_rules(self, family=AF_UNSPEC, match=None, **kwarg):
         '''
         Flush rules. Please keep in mind, that by default the function
         operates on **all** rules of **all** families. To work only on
         IPv4 rules, one should explicitly specify `family=AF_INET`.
+        Return `FlushStats(deleted, failed, errors)`, see
+        `pr2modules.iproute.flush`.
 
         Examples::
 
@@ -656,13 +793,14 @@ class RTNL_API(object):
             # flush all IPv6 rules that point to table 250:
             ipr.flush_rules(family=socket.AF_INET6, table=250)
         '''
-        #flags = NLM_F_CREATE | NLM_F_EXCL | NLM_F_REQUEST
-        flags = NLM_F_CREATE | NLM_F_REQUEST
-        ret = []
-        for rule in self.get_rules(*argv, **kwarg):
-            self.put(rule, msg_type=RTM_DELRULE, msg_flags=flags)
-            ret.append(rule)
-        return ret
+        # a rule is identified by all the attributes
+        return self._flush(
+            partial(self.get_rules, family, match, **kwarg),
+            fibmsg,
+            RTM_DELRULE,
+            match or kwarg,
+            None,
+        )
 
     # 8<---------------------------------------------------------------
 
@@ -1025,7 +1163,10 @@ class RTNL_API(object):
         # FIXME: move to req?
         if 'nud' in kwarg:
             kwarg['state'] = kwarg.pop('nud')
-        if 'state' not in kwarg:
+        if 'state' not in kwarg and not (
+            command == 'dump' and self.strict_check
+        ):
+            # strict dump requests must have no state in the header
             kwarg['state'] = 'permanent'
         if 'family' not in kwarg and 'dst' in kwarg:
             if '.' in kwarg['dst']:
@@ -1070,7 +1211,10 @@ class RTNL_API(object):
             if kwarg[key] is not None:
                 msg['attrs'].append([nla, kwarg[key]])
 
-        ret = self.nlm_request(msg, msg_type=command, msg_flags=flags)
+        match, callback = self._compile_match(match, ndmsg.ndmsg)
+        ret = self.nlm_request(
+            msg, msg_type=command, msg_flags=flags, callback=callback
+        )
         if match:
             ret = self._match(match, ret)
 
@@ -1500,7 +1644,10 @@ class RTNL_API(object):
             if kwarg[key] is not None:
                 msg['attrs'].append([nla, kwarg[key]])
 
-        ret = self.nlm_request(msg, msg_type=command, msg_flags=msg_flags)
+        match, callback = self._compile_match(match, ifinfmsg)
+        ret = self.nlm_request(
+            msg, msg_type=command, msg_flags=msg_flags, callback=callback
+        )
         if match is not None:
             ret = self._match(match, ret)
 
@@ -1570,6 +1717,7 @@ class RTNL_API(object):
         if command in ('get', 'set'):
             return
         lrq = kwarg.pop('kwarg_filter', IPAddrRequest)
+        callback = kwarg.pop('callback', None)
 
         flags_dump = NLM_F_REQUEST | NLM_F_DUMP
         flags_base = NLM_F_REQUEST | NLM_F_ACK
@@ -1639,11 +1787,13 @@ class RTNL_API(object):
             if kwarg[key] not in (None, ''):
                 msg['attrs'].append([nla, kwarg[key]])
 
+        match, callback = self._compile_match(match, ifaddrmsg, callback)
         ret = self.nlm_request(
             msg,
             msg_type=command,
             msg_flags=flags,
             terminate=lambda x: x['header']['type'] == NLMSG_ERROR,
+            callback=callback,
         )
         if match:
             ret = self._match(match, ret)
@@ -2117,6 +2267,7 @@ class RTNL_API(object):
                                 )
                                 break
 
+        match, callback = self._compile_match(match, rtmsg, callback)
         ret = self.nlm_request(
             msg, msg_type=command, msg_flags=flags, callback=callback
         )
@@ -2237,6 +2388,7 @@ class RTNL_API(object):
             ]
             kwarg.update(dict(zip(names, argv)))
 
+        callback = kwarg.pop('callback', None)
         kwarg = IPRuleRequest(kwarg)
         msg = fibmsg()
         table = kwarg.get('table', 0)
@@ -2253,7 +2405,9 @@ class RTNL_API(object):
             if kwarg[key] is not None:
                 msg['attrs'].append([nla, kwarg[key]])
 
-        ret = self.nlm_request(msg, msg_type=command, msg_flags=flags)
+        ret = self.nlm_request(
+            msg, msg_type=command, msg_flags=flags, callback=callback
+        )
 
         if 'match' in kwarg:
             ret = self._match(kwarg['match'], ret)
@@ -2318,6 +2472,14 @@ class IPBatch(RTNL_API, IPBatchSocket):
         # send the buffer
         IPRoute().sendto(data, (0, 0))
 
+    To send the batch and get the results per request, use
+    `submit()`::
+
+        with IPRoute() as ipr:
+            for ret in ipb.submit(ipr):
+                if isinstance(ret, Exception):
+                    ...
+
     '''
 
     pass
@@ -2346,3 +2508,152 @@ class ChaoticIPRoute(RTNL_API, ChaoticIPRSocket):
     '''
 
     pass
+
+
+def _submit(method):
+    def wrapper(self, *argv, **kwarg):
+        return self.submit(method, *argv, **kwarg)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class AsyncIPRoute(RTNL_API, AsyncIPRSocket):
+    '''
+    RTNL API for asyncio. The request methods return
+    `NetlinkRequest` objects, that can be awaited or iterated
+    with `async for`::
+
+        ipr = AsyncIPRoute()
+        lo = await ipr.link('get', index=1)
+        async for route in ipr.get_routes(table=254):
+            ...
+        ipr.close()
+
+    All the requests are sent at once, so there may be many
+    requests in flight::
+
+        await asyncio.gather(
+            *[ipr.link('get', index=x) for x in range(1, 100)]
+        )
+
+    No threads are used, the socket is read by the event loop.
+    The API methods that compile requests are the same as in
+    `IPRoute`. The shortcuts that process responses -- `link_lookup()`,
+    `flush_routes()` etc. -- are coroutines here, and `dump()` is an
+    async generator.
+    '''
+
+    def _match(self, match, msgs):
+        if isinstance(msgs, NetlinkRequest):
+            msgs.match = partial(RTNL_API._match, self, match)
+            return msgs
+        return RTNL_API._match(self, match, msgs)
+
+    link = _submit(RTNL_API.link)
+    addr = _submit(RTNL_API.addr)
+    route = _submit(RTNL_API.route)
+    rule = _submit(RTNL_API.rule)
+    neigh = _submit(RTNL_API.neigh)
+    fdb = _submit(RTNL_API.fdb)
+    brport = _submit(RTNL_API.brport)
+    vlan_filter = _submit(RTNL_API.vlan_filter)
+    tc = _submit(RTNL_API.tc)
+    stats = _submit(RTNL_API.stats)
+    get_links = _submit(RTNL_API.get_links)
+    get_addr = _submit(RTNL_API.get_addr)
+    get_routes = _submit(RTNL_API.get_routes)
+    get_rules = _submit(RTNL_API.get_rules)
+    get_neighbours = _submit(RTNL_API.get_neighbours)
+    get_vlans = _submit(RTNL_API.get_vlans)
+    get_ntables = _submit(RTNL_API.get_ntables)
+    get_filters = _submit(RTNL_API.get_filters)
+    get_classes = _submit(RTNL_API.get_classes)
+
+    def get_qdiscs(self, index=None):
+        ret = self.submit(RTNL_API.get_qdiscs)
+        if index is not None:
+            ret.match = partial(self._match, {'index': index})
+        return ret
+
+    get_qdiscs.__doc__ = RTNL_API.get_qdiscs.__doc__
+
+    async def dump(self):
+        for method in (
+            self.get_links,
+            self.get_addr,
+            self.get_neighbours,
+            self.get_routes,
+            self.get_vlans,
+            partial(self.fdb, 'dump'),
+            partial(self.get_rules, family=AF_INET),
+            partial(self.get_rules, family=AF_INET6),
+        ):
+            async for msg in method():
+                yield msg
+
+    dump.__doc__ = RTNL_API.dump.__doc__
+
+    async def get_default_routes(self, family=AF_UNSPEC, table=DEFAULT_TABLE):
+        return [
+            x
+            for x in await self.get_routes(family, table=table)
+            if (x.get_attr('RTA_DST', None) is None and x['dst_len'] == 0)
+        ]
+
+    get_default_routes.__doc__ = RTNL_API.get_default_routes.__doc__
+
+    async def link_lookup(self, match=None, **kwarg):
+        if set(kwarg) in ({'index'}, {'ifname'}, {'index', 'ifname'}):
+            try:
+                return [x['index'] for x in await self.link('get', **kwarg)]
+            except NetlinkError:
+                return []
+        return [x['index'] for x in await self.get_links(match=match or kwarg)]
+
+    link_lookup.__doc__ = RTNL_API.link_lookup.__doc__
+
+    async def _flush(self, dump, msg_type, rounds=10):
+        deleted = 0
+        for _ in range(rounds):
+            requests = []
+            async for msg in dump():
+                requests.append(
+                    self.nlm_request(msg, msg_type, NLM_F_REQUEST | NLM_F_ACK)
+                )
+            count = failed = 0
+            errors = {}
+            for request in requests:
+                try:
+                    await request
+                    count += 1
+                except NetlinkError as e:
+                    if e.code not in GONE:
+                        failed += 1
+                        errors[e.code] = errors.get(e.code, 0) + 1
+            deleted += count
+            if not count:
+                break
+        return FlushStats(deleted, failed, errors)
+
+    async def flush_routes(self, family=255, match=None, **kwarg):
+        return await self._flush(
+            partial(self.get_routes, family, match, **kwarg),
+            RTM_DELROUTE,
+            1 if isinstance(kwarg.get('dst'), basestring) else 10,
+        )
+
+    async def flush_addr(self, family=AF_UNSPEC, match=None, **kwarg):
+        return await self._flush(
+            partial(self.get_addr, family, match, **kwarg), RTM_DELADDR
+        )
+
+    async def flush_rules(self, family=AF_UNSPEC, match=None, **kwarg):
+        return await self._flush(
+            partial(self.get_rules, family, match, **kwarg), RTM_DELRULE
+        )
+
+    flush_routes.__doc__ = RTNL_API.flush_routes.__doc__
+    flush_addr.__doc__ = RTNL_API.flush_addr.__doc__
+    flush_rules.__doc__ = RTNL_API.flush_rules.__doc__
@@ -328,6 +328,21 @@ If the `fields` attribute is an empty list, the step 2 will be skipped.
 The step 3 will be skipped in the case of the empty `nla_map`. If both
 attributes are empty lists, only the header will be encoded/decoded.
 
+lazy decoding
+~~~~~~~~~~~~~
+
+Large dumps are often used only to look up a couple of NLA per
+message. With `lazy_decode=True` the socket decodes only headers and
+`fields`, and the step 3 just records NLA offsets::
+
+    with IPRoute(lazy_decode=True) as ipr:
+        names = [x.get_attr('IFLA_IFNAME') for x in ipr.get_links()]
+
+`get_attr()`, `get_attrs()` and `get_nested()` create NLA objects only
+for the requested types, while any access to the `attrs` list itself
+-- iteration, indexing, `repr()` etc. -- decodes the whole NLA chain,
+so the message looks the same as if decoded eagerly.
+
 create and send messages
 ~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -581,6 +596,105 @@ clean_cbs = threading.local()
 cache_fmt = {}
 cache_hdr = {}
 cache_jit = {}
+cache_plan = {}
+
+nla_header_struct = struct.Struct('HH')
+
+
+class nlmsg_plan(object):
+    '''
+    Compiled codec plan for a `fields` or `header` spec.
+
+    All the spec formats are merged into one `struct.Struct`, if
+    it is possible to do so without changing the binary layout:
+    the formats must share the byte order prefix, and the merged
+    format must not introduce any alignment padding. Otherwise
+    `self.struct` is None, and the codec falls back to field by
+    field processing.
+
+    Plans are compiled once per spec, see `compile_plan()`.
+    '''
+
+    __slots__ = (
+        'spec',
+        'names',
+        'fmts',
+        'sizes',
+        'counts',
+        'size',
+        'struct',
+        'packed',
+        'public',
+        'simple',
+        'variable',
+    )
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.names = tuple(x[0] for x in spec)
+        self.fmts = tuple(x[1] for x in spec)
+        self.sizes = tuple(struct.calcsize(x) for x in self.fmts)
+        self.counts = tuple(
+            len(struct.unpack(fmt, bytes(size)))
+            for fmt, size in zip(self.fmts, self.sizes)
+        )
+        self.size = sum(self.sizes)
+        self.public = tuple(x for x in self.names if x[0] != '_')
+        self.simple = all(x == 1 for x in self.counts)
+        # variable length strings are sized in runtime by the encoder
+        self.variable = 's' in self.fmts
+        self.struct = None
+        prefixes = set(x[0] if x[0] in '@=<>!' else '' for x in self.fmts)
+        if len(prefixes) == 1:
+            prefix = prefixes.pop()
+            merged = prefix + ''.join(x[len(prefix) :] for x in self.fmts)
+            if struct.calcsize(merged) == self.size:
+                self.struct = struct.Struct(merged)
+        # packed C struct layout, used by `nlmsg_decoder_struct`
+        # and to reserve space for headers
+        try:
+            self.packed = struct.Struct(''.join(self.fmts))
+        except struct.error:
+            self.packed = None
+
+    def unpack(self, data, offset):
+        '''
+        Return the list of (name, value) pairs decoded from the
+        buffer. Values of multi-item formats are returned as tuples.
+        '''
+        if self.struct is not None:
+            values = self.struct.unpack_from(data, offset)
+            if self.simple:
+                return zip(self.names, values)
+        else:
+            values = ()
+            for fmt, size in zip(self.fmts, self.sizes):
+                values += struct.unpack_from(fmt, data, offset)
+                offset += size
+        ret = []
+        position = 0
+        for name, count in zip(self.names, self.counts):
+            if count == 1:
+                ret.append((name, values[position]))
+            else:
+                ret.append((name, values[position : position + count]))
+            position += count
+        return ret
+
+
+def compile_plan(spec):
+    '''
+    Return the codec plan for a `fields` or `header` spec. The plan
+    is compiled on the first use and then cached.
+
+    Specs may be lists, so the cache is keyed by the object id; the
+    plan keeps a reference to the spec, thus the id can not be reused
+    while the plan is cached.
+    '''
+    plan = cache_plan.get(id(spec))
+    if plan is None or plan.spec is not spec:
+        plan = cache_plan[id(spec)] = nlmsg_plan(spec)
+    return plan
 
 
 class SQLSchema(object):
@@ -682,6 +796,8 @@ class nlmsg_base(dict):
     __compiled_ft = False
     __t_nla_map = None
     __r_nla_map = None
+    __t_nla_plan = None
+    __r_nla_plan = None
     # schema
     __schema = None
 
@@ -696,6 +812,7 @@ class nlmsg_base(dict):
         "_nla_init",
         "_nla_array",
         "_nla_flags",
+        "_nla_lazy",
         "value",
         "_r_value_map",
         "__weakref__",
@@ -726,6 +843,7 @@ class nlmsg_base(dict):
         self._nla_init = init
         self._nla_array = False
         self._nla_flags = self.nla_flags
+        self._nla_lazy = False
         self['attrs'] = []
         self['value'] = NotInitialized
         self.value = NotInitialized
@@ -984,21 +1102,15 @@ class nlmsg_base(dict):
             #
             # If the key exists, the statement after the first `or` is not
             # executed.
+            # The key is the unpacked (length, type) pair, so there
+            # is no need to slice the buffer.
             if self.is_nla:
-                key = tuple(self.data[offset : offset + 4])
+                key = nla_header_struct.unpack_from(self.data, offset)
                 self['header'] = (
                     cache_hdr.get(key, None)
                     or (
                         cache_hdr.__setitem__(
-                            key,
-                            dict(
-                                zip(
-                                    ('length', 'type'),
-                                    struct.unpack_from(
-                                        'HH', self.data, offset
-                                    ),
-                                )
-                            ),
+                            key, dict(zip(('length', 'type'), key))
                         )
                     )
                     or cache_hdr[key]
@@ -1006,12 +1118,11 @@ class nlmsg_base(dict):
                 ##
                 offset += 4
                 self.length = self['header']['length']
-            else:
-                for name, fmt in self.header:
-                    self['header'][name] = struct.unpack_from(
-                        fmt, self.data, offset
-                    )[0]
-                    offset += struct.calcsize(fmt)
+            elif self.header:
+                # e.g. inotify_msg has no header fields
+                plan = compile_plan(self.header)
+                self['header'].update(plan.unpack(self.data, offset))
+                offset += plan.size
                 # update length from header
                 # it can not be less than 4
                 if 'header' in self:
@@ -1054,8 +1165,9 @@ class nlmsg_base(dict):
         diff = 0
         # reserve space for the header
         if self.header is not None:
-            hsize = struct.calcsize(''.join([x[1] for x in self.header]))
-            self.data.extend([0] * hsize)
+            header_plan = compile_plan(self.header)
+            hsize = header_plan.packed.size
+            self.data.extend(bytes(hsize))
             offset += hsize
 
         # handle the array case
@@ -1084,12 +1196,20 @@ class nlmsg_base(dict):
             self.length = self['header']['length'] = (
                 offset - self.offset - diff
             )
-            offset = self.offset
-            for name, fmt in self.header:
-                struct.pack_into(
-                    fmt, self.data, offset, self['header'].get(name, 0)
+            header = self['header']
+            if header_plan.struct is not None and header_plan.simple:
+                header_plan.struct.pack_into(
+                    self.data,
+                    self.offset,
+                    *[header.get(name, 0) for name in header_plan.names]
                 )
-                offset += struct.calcsize(fmt)
+            else:
+                offset = self.offset
+                for name, fmt in self.header:
+                    struct.pack_into(
+                        fmt, self.data, offset, header.get(name, 0)
+                    )
+                    offset += struct.calcsize(fmt)
 
     def setvalue(self, value):
         if isinstance(value, dict):
@@ -1097,9 +1217,11 @@ class nlmsg_base(dict):
             if 'attrs' in value:
                 self['attrs'] = []
                 for nla_tuple in value['attrs']:
-                    nlv = nlmsg_base()
-                    nlv.setvalue(nla_tuple[1])
-                    self['attrs'].append([nla_tuple[0], nlv.getvalue()])
+                    nlv = nla_tuple[1]
+                    if type(nlv) is not nlmsg_base:
+                        # plain nlmsg_base values are already converted
+                        nlv = nlmsg_base().setvalue(nlv).getvalue()
+                    self['attrs'].append([nla_tuple[0], nlv])
         else:
             try:
                 if value in self.value_map.values():
@@ -1149,6 +1271,10 @@ class nlmsg_base(dict):
         '''
         Return attrs by name or an empty list
         '''
+        if self._nla_lazy:
+            attrs = self['attrs']
+            if isinstance(attrs, nla_lazy_list) and attrs.headers is not None:
+                return [i[1] for i in attrs.lookup(attr)]
         return [i[1] for i in self['attrs'] if i[0] == attr]
 
     def nla(self, attr=None, default=NotInitialized):
@@ -1256,6 +1382,8 @@ class nlmsg_base(dict):
         # clean up NLA mappings
         t_nla_map = {}
         r_nla_map = {}
+        t_nla_plan = {}
+        r_nla_plan = {}
 
         # fix nla flags
         nla_map = []
@@ -1309,9 +1437,23 @@ class nlmsg_base(dict):
                 'init': init,
             }
             t_nla_map[key] = r_nla_map[name] = prime
+            # the decoder jump table: type -> handler
+            is_function = isinstance(nla_class, types.FunctionType)
+            t_nla_plan[key] = (nla_class, is_function, name, init, nla_array)
+            # ... and the encoder one: name -> handler
+            r_nla_plan[name] = (
+                nla_class,
+                is_function,
+                key,
+                init,
+                nla_flags,
+                nla_array,
+            )
 
         self.__class__.__t_nla_map = t_nla_map
         self.__class__.__r_nla_map = r_nla_map
+        self.__class__.__t_nla_plan = t_nla_plan
+        self.__class__.__r_nla_plan = r_nla_plan
         self.__class__.__compiled_nla = True
 
     def encode_nlas(self, offset):
@@ -1319,38 +1461,39 @@ class nlmsg_base(dict):
         Encode the NLA chain. Should not be called manually, since
         it is called from `encode()` routine.
         '''
-        r_nla_map = self.__class__.__r_nla_map
-        for i in range(len(self['attrs'])):
-            cell = self['attrs'][i]
-            if cell[0] in r_nla_map:
-                prime = r_nla_map[cell[0]]
-                msg_class = prime['class']
+        r_nla_plan = self.__class__.__r_nla_plan
+        attrs = self['attrs']
+        for i in range(len(attrs)):
+            cell = attrs[i]
+            handler = r_nla_plan.get(cell[0])
+            if handler is not None:
+                (
+                    msg_class,
+                    is_function,
+                    msg_type,
+                    init,
+                    nla_flags,
+                    nla_array,
+                ) = handler
                 # is it a class or a function?
-                if isinstance(msg_class, types.FunctionType):
+                if is_function:
                     # if it is a function -- use it to get the class
                     msg_class = msg_class(self)
                 # encode NLA
                 nla_instance = msg_class(
-                    data=self.data,
-                    offset=offset,
-                    parent=self,
-                    init=prime['init'],
+                    data=self.data, offset=offset, parent=self, init=init
                 )
-                nla_instance._nla_flags |= prime['nla_flags']
+                nla_instance._nla_flags |= nla_flags
                 if isinstance(cell, tuple) and len(cell) > 2:
                     nla_instance._nla_flags |= cell[2]
-                nla_instance._nla_array = prime['nla_array']
+                nla_instance._nla_array = nla_array
                 nla_instance['header']['type'] = (
-                    prime['type'] | nla_instance._nla_flags
+                    msg_type | nla_instance._nla_flags
                 )
                 nla_instance.setvalue(cell[1])
-                try:
-                    nla_instance.encode()
-                except:
-                    raise
-                else:
-                    nla_instance.decoded = True
-                    self['attrs'][i] = nla_slot(prime['name'], nla_instance)
+                nla_instance.encode()
+                nla_instance.decoded = True
+                attrs[i] = nla_slot(cell[0], nla_instance)
                 offset += (nla_instance.length + 4 - 1) & ~(4 - 1)
         return offset
 
@@ -1359,49 +1502,117 @@ class nlmsg_base(dict):
         Decode the NLA chain. Should not be called manually, since
         it is called from `decode()` routine.
         '''
-        t_nla_map = self.__class__.__t_nla_map
-        while offset - self.offset <= self.length - 4:
-            nla_instance = None
+        if self._nla_lazy:
+            return self.index_nlas(offset)
+        t_nla_plan = self.__class__.__t_nla_plan
+        data = self.data
+        attrs = self['attrs']
+        unpack_header = nla_header_struct.unpack_from
+        end = self.offset + self.length
+        while offset <= end - 4:
             # pick the length and the type
-            (length, base_msg_type) = struct.unpack_from(
-                'HH', self.data, offset
-            )
+            (length, base_msg_type) = unpack_header(data, offset)
             # first two bits of msg_type are flags:
             msg_type = base_msg_type & ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
             # rewind to the beginning
-            length = min(max(length, 4), (self.length - offset + self.offset))
+            length = min(max(length, 4), end - offset)
             # we have a mapping for this NLA
-            if msg_type in t_nla_map:
-
-                prime = t_nla_map[msg_type]
-                # get the class
-                msg_class = t_nla_map[msg_type]['class']
+            handler = t_nla_plan.get(msg_type)
+            if handler is not None:
+                msg_class, is_function, name, init, nla_array = handler
                 # is it a class or a function?
-                if isinstance(msg_class, types.FunctionType):
+                if is_function:
                     # if it is a function -- use it to get the class
-                    msg_class = msg_class(self, data=self.data, offset=offset)
+                    msg_class = msg_class(self, data=data, offset=offset)
                 # decode NLA
                 nla_instance = msg_class(
-                    data=self.data,
+                    data=data,
                     offset=offset,
                     parent=self,
                     length=length,
-                    init=prime['init'],
+                    init=init,
                 )
-                nla_instance._nla_array = prime['nla_array']
+                nla_instance._nla_array = nla_array
                 nla_instance._nla_flags = base_msg_type & (
                     NLA_F_NESTED | NLA_F_NET_BYTEORDER
                 )
-                name = prime['name']
             else:
                 name = 'UNKNOWN'
                 nla_instance = nla_base(
-                    data=self.data, offset=offset, length=length
+                    data=data, offset=offset, length=length
                 )
 
-            self['attrs'].append(nla_slot(name, nla_instance))
+            attrs.append(nla_slot(name, nla_instance))
             offset += (length + 4 - 1) & ~(4 - 1)
 
+    def index_nlas(self, offset):
+        '''
+        Lazy NLA decoding: instead of creating NLA objects only
+        build the index of NLA headers, see `nla_lazy_list`.
+        '''
+        index = []
+        data = self.data
+        unpack_header = nla_header_struct.unpack_from
+        end = self.offset + self.length
+        while offset <= end - 4:
+            (length, base_msg_type) = unpack_header(data, offset)
+            length = min(max(length, 4), end - offset)
+            index.append([base_msg_type, offset, length, None])
+            offset += (length + 4 - 1) & ~(4 - 1)
+        self['attrs'] = nla_lazy_list(self, index)
+
+    def lazy_slot(self, entry):
+        '''
+        Create the NLA slot for a lazy index entry, or return
+        the already created one.
+        '''
+        if entry[3] is not None:
+            return entry[3]
+        base_msg_type, offset, length, _ = entry
+        msg_type = base_msg_type & ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+        handler = self.__class__.__t_nla_plan.get(msg_type)
+        if handler is not None:
+            msg_class, is_function, name, init, nla_array = handler
+            if is_function:
+                msg_class = msg_class(self, data=self.data, offset=offset)
+            nla_instance = msg_class(
+                data=self.data,
+                offset=offset,
+                parent=self,
+                length=length,
+                init=init,
+            )
+            nla_instance._nla_array = nla_array
+            nla_instance._nla_flags = base_msg_type & (
+                NLA_F_NESTED | NLA_F_NET_BYTEORDER
+            )
+        else:
+            name = 'UNKNOWN'
+            nla_instance = nla_base(
+                data=self.data, offset=offset, length=length
+            )
+        # nested NLA chains are decoded lazily as well
+        nla_instance._nla_lazy = True
+        entry[3] = nla_slot(name, nla_instance)
+        return entry[3]
+
+    def lazy_type(self, name):
+        '''
+        Return NLA type by name, or None
+        '''
+        handler = self.__class__.__r_nla_plan.get(name)
+        if handler is not None:
+            return handler[2]
+
+    def lazy_class(self, name):
+        '''
+        Return NLA class by name, or None if the class is
+        resolved in runtime or the NLA is an array
+        '''
+        handler = self.__class__.__r_nla_plan.get(name)
+        if handler is not None and not (handler[1] or handler[5]):
+            return handler[0]
+
 
 ##
 # 8<---------------------------------------------------------------------
@@ -1410,26 +1621,16 @@ class nlmsg_base(dict):
 #
 class nlmsg_decoder_generic(object):
     def ft_decode(self, offset):
-        global cache_fmt
-        for name, fmt in self.fields:
-            ##
-            # ~~ size = struct.calcsize(efmt)
-            #
-            # The use of the cache gives here a tiny performance
-            # improvement, but it is an improvement anyways
-            #
-            size = (
-                cache_fmt.get(fmt, None)
-                or cache_fmt.__setitem__(fmt, struct.calcsize(fmt))
-                or cache_fmt[fmt]
-            )
-            ##
-            value = struct.unpack_from(fmt, self.data, offset)
-            offset += size
-            if len(value) == 1:
-                self[name] = value[0]
-            else:
-                self[name] = value
+        ##
+        # ~~ for name, fmt in self.fields: self[name] = unpack(fmt, ...)
+        #
+        # Use the compiled plan: all the fields are usually decoded
+        # with one `unpack_from()` call, see `nlmsg_plan`.
+        #
+        if self.fields:
+            plan = compile_plan(self.fields)
+            self.update(plan.unpack(self.data, offset))
+            offset += plan.size
         # read NLA chain
         if self.nla_map:
             offset = (offset + 4 - 1) & ~(4 - 1)
@@ -1457,16 +1658,9 @@ class nlmsg_decoder_string(object):
 
 class nlmsg_decoder_struct(object):
     def ft_decode(self, offset):
-        names = []
-        fmt = ''
-        for field in self.fields:
-            names.append(field[0])
-            fmt += field[1]
-        value = struct.unpack_from(fmt, self.data, offset)
-        values = list(value)
-        for name in names:
-            if name[0] != '_':
-                self[name] = values.pop(0)
+        plan = compile_plan(self.fields)
+        values = plan.packed.unpack_from(self.data, offset)
+        self.update(zip(plan.public, values))
         # read NLA chain
         if self.nla_map:
             offset = (offset + 4 - 1) & ~(4 - 1)
@@ -1483,6 +1677,41 @@ class nlmsg_decoder_struct(object):
 
 class nlmsg_encoder_generic(object):
     def ft_encode(self, offset):
+        plan = compile_plan(self.fields)
+        if plan.struct is not None and not plan.variable:
+            ##
+            # ~~ for name, fmt in self.fields: pack_into(fmt, ...)
+            #
+            # Fixed size fields are encoded at once with the compiled
+            # plan; on any error fall back to the field by field loop
+            # below, it logs the failed field
+            values = []
+            for name, count in zip(plan.names, plan.counts):
+                if count == 0:
+                    # padding
+                    continue
+                value = self[name]
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                elif isinstance(value, float):
+                    value = int(value)
+                if type(value) in (list, tuple, set):
+                    values.extend(value)
+                else:
+                    values.append(value)
+            try:
+                packed = plan.struct.pack(*values)
+            except struct.error:
+                pass
+            else:
+                self.data.extend(bytes(plan.size))
+                self.data[offset : offset + plan.size] = packed
+                offset += plan.size
+                diff = ((offset + 4 - 1) & ~(4 - 1)) - offset
+                offset += diff
+                self.data.extend(bytes(diff))
+                return offset, diff
+
         for name, fmt in self.fields:
             value = self[name]
 
@@ -1594,6 +1823,94 @@ class nla_slot(object):
         return repr((self.cell[0], self.get_value()))
 
 
+def _materialize(method):
+    def wrapper(self, *argv, **kwarg):
+        if self.headers is not None:
+            self.materialize()
+        return method(self, *argv, **kwarg)
+
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class nla_lazy_list(list):
+    '''
+    The NLA chain of a lazily decoded message.
+
+    Holds only the list of NLA headers: [type, offset, length, slot].
+    `nlmsg_base.get_attr()` and friends create NLA slots only for
+    requested attributes, see `lookup()`, while any list operation
+    on the chain -- iteration, indexing, `len()`, `repr()` etc. --
+    creates all the slots, so the chain looks exactly as decoded
+    eagerly.
+    '''
+
+    __slots__ = ('msg', 'headers')
+
+    def __init__(self, msg, headers):
+        list.__init__(self)
+        self.msg = msg
+        self.headers = headers
+
+    def lookup(self, name):
+        '''
+        Return NLA slots by name, creating only the requested ones.
+        '''
+        if self.headers is None:
+            return [x for x in self if x[0] == name]
+        msg_type = self.msg.lazy_type(name)
+        if msg_type is None:
+            # not in the NLA map, so only UNKNOWN NLA may match
+            if name != 'UNKNOWN':
+                return []
+            return [x for x in self if x[0] == name]
+        mask = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+        return [
+            self.msg.lazy_slot(x)
+            for x in self.headers
+            if x[0] & mask == msg_type
+        ]
+
+    def materialize(self):
+        headers = self.headers
+        self.headers = None
+        list.extend(self, [self.msg.lazy_slot(x) for x in headers])
+        # drop the reference cycle
+        self.msg = None
+
+
+for _method in (
+    '__add__',
+    '__contains__',
+    '__delitem__',
+    '__eq__',
+    '__getitem__',
+    '__getslice__',
+    '__iadd__',
+    '__iter__',
+    '__len__',
+    '__ne__',
+    '__repr__',
+    '__reversed__',
+    '__setitem__',
+    'append',
+    'clear',
+    'copy',
+    'count',
+    'extend',
+    'index',
+    'insert',
+    'pop',
+    'remove',
+    'reverse',
+    'sort',
+):
+    # Python 2 lists have no clear() and copy()
+    if hasattr(list, _method):
+        setattr(nla_lazy_list, _method, _materialize(getattr(list, _method)))
+del _method
+
+
 ##
 # 8<---------------------------------------------------------------------
 #
@@ -4,6 +4,9 @@ import os
 class NetlinkError(Exception):
     '''
     Base netlink error
+
+    When received from the kernel, `errmsg` is the encapsulated
+    request that caused the error, if it could be decoded.
     '''
 
     def __init__(self, code, msg=None):
@@ -11,6 +14,7 @@ class NetlinkError(Exception):
         super(NetlinkError, self).__init__(code, msg)
         self.code = code
         self.extra_code = 0
+        self.errmsg = None
 
 
 class NetlinkDecodeError(Exception):
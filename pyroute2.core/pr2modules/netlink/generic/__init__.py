@@ -14,7 +14,9 @@ from pr2modules.netlink import SOL_NETLINK
 from pr2modules.netlink import NETLINK_ADD_MEMBERSHIP
 from pr2modules.netlink import NETLINK_DROP_MEMBERSHIP
 from pr2modules.netlink import ctrlmsg
+from pr2modules.netlink.exceptions import NetlinkError
 from pr2modules.netlink.nlsocket import NetlinkSocket
+from pr2modules.netlink.generic.cache import families
 
 
 class GenericNetlinkSocket(NetlinkSocket):
@@ -27,6 +29,8 @@ class GenericNetlinkSocket(NetlinkSocket):
     mcast_groups = {}
     module_err_message = None
     module_err_level = 'error'
+    # see pr2modules.netlink.generic.cache
+    family_cache = families
 
     def bind(self, proto, msg_class, groups=0, pid=None, **kwarg):
         '''
@@ -34,20 +38,21 @@ class GenericNetlinkSocket(NetlinkSocket):
         proto lookup. The `proto` parameter is a string,
         like "TASKSTATS", `msg_class` is a class to
         parse messages with.
+
+        The lookup results are cached, see
+        `pr2modules.netlink.generic.cache`.
         '''
         NetlinkSocket.bind(self, groups, pid, **kwarg)
         self.marshal.msg_map[GENL_ID_CTRL] = ctrlmsg
-        msg = self.discovery(proto)
-        self.prid = msg.get_attr('CTRL_ATTR_FAMILY_ID')
-        self.mcast_groups = dict(
-            [
-                (
-                    x.get_attr('CTRL_ATTR_MCAST_GRP_NAME'),
-                    x.get_attr('CTRL_ATTR_MCAST_GRP_ID'),
-                )
-                for x in msg.get_attr('CTRL_ATTR_MCAST_GROUPS', [])
-            ]
-        )
+        try:
+            family = self.family_cache.get(self, proto)
+        except KeyError:
+            # not found by an earlier discovery
+            err = NetlinkError(errno.ENOENT)
+            self.family_not_found(proto, err)
+            raise err
+        self.prid = family['id']
+        self.mcast_groups = dict(family['mcast_groups'])
         self.marshal.msg_map[self.prid] = msg_class
 
     def add_membership(self, group):
@@ -78,11 +83,14 @@ class GenericNetlinkSocket(NetlinkSocket):
         err = msg['header'].get('error', None)
         if err is not None:
             if hasattr(err, 'code') and err.code == errno.ENOENT:
-                err.extra_code = errno.ENOTSUP
-                logger = getattr(logging, self.module_err_level)
-                logger('Generic netlink protocol %s not found' % proto)
-                logger('Please check if the protocol module is loaded')
-                if self.module_err_message is not None:
-                    logger(self.module_err_message)
+                self.family_not_found(proto, err)
             raise err
         return msg
+
+    def family_not_found(self, proto, err):
+        err.extra_code = errno.ENOTSUP
+        logger = getattr(logging, self.module_err_level)
+        logger('Generic netlink protocol %s not found' % proto)
+        logger('Please check if the protocol module is loaded')
+        if self.module_err_message is not None:
+            logger(self.module_err_message)
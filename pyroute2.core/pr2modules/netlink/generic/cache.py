@@ -0,0 +1,289 @@
+'''
+Generic netlink family cache
+----------------------------
+
+Every generic netlink socket resolves its family name on `bind()`
+with a `CTRL_CMD_GETFAMILY` request. The results -- family ID,
+version, header size, ops and multicast groups -- are cached per
+process and per network namespace, so only the first socket of a
+family in a namespace sends the request::
+
+    from pr2modules.netlink.generic.wireguard import WireGuard
+
+    for _ in range(1000):
+        with WireGuard() as wg:  # one discovery round trip in total
+            ...
+
+The families that are not found are cached as well, and `bind()`
+raises the same `NetlinkError` for them.
+
+The generic netlink family IDs are allocated dynamically, so when a
+module is unloaded and loaded again the family gets another ID. The
+cache subscribes a socket per namespace to the `nlctrl` "notify"
+group, and before every lookup reads the pending notifications
+without blocking: the families that are registered or unregistered,
+or have their multicast groups changed, are dropped from the cache.
+If the notifications overflow the socket buffer, the whole namespace
+cache is dropped.
+
+The namespace is the one of the socket, and it is cached only if
+the calling thread is in the same namespace, since the notification
+socket is created there. The namespace is identified by the inode of
+`/proc/thread-self/ns/net`; with `CAP_NET_ADMIN` the namespace of
+the socket is checked with `SIOCGSKNS`. The notification socket
+holds a reference to the namespace, so only the last
+`config.genl_cache_size` namespaces are cached.
+
+The cache can be disabled with `config.genl_cache = False`.
+
+The cache is not persistent: the family IDs saved by one process
+can not be validated by another without the same discovery request,
+e.g. when a module was reloaded.
+'''
+
+import os
+import errno
+import fcntl
+import struct
+import logging
+import threading
+import collections
+from socket import SOCK_DGRAM
+from socket import MSG_DONTWAIT
+from pr2modules import config
+from pr2modules.config import AF_NETLINK
+from pr2modules.netlink import CTRL_CMD_NEWFAMILY
+from pr2modules.netlink import CTRL_CMD_DELFAMILY
+from pr2modules.netlink import CTRL_CMD_NEWMCAST_GRP
+from pr2modules.netlink import CTRL_CMD_DELMCAST_GRP
+from pr2modules.netlink import GENL_ID_CTRL
+from pr2modules.netlink import NETLINK_GENERIC
+from pr2modules.netlink import SOL_NETLINK
+from pr2modules.netlink import NETLINK_ADD_MEMBERSHIP
+from pr2modules.netlink import ctrlmsg
+from pr2modules.netlink.exceptions import NetlinkError
+
+log = logging.getLogger(__name__)
+
+# get the network namespace of a socket, linux/sockios.h
+SIOCGSKNS = 0x894C
+# the nlctrl "notify" group has the same ID as the family
+GENL_CTRL_NOTIFY = GENL_ID_CTRL
+
+
+def netns_id(path='/proc/thread-self/ns/net'):
+    '''
+    Return the network namespace ID of the calling thread.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        # Linux < 3.17
+        st = os.stat('/proc/self/ns/net')
+    return '%i:%i' % (st.st_dev, st.st_ino)
+
+
+def socket_netns_id(sock):
+    '''
+    Return the network namespace ID of the socket, or None if it
+    can not be checked.
+    '''
+    try:
+        fd = fcntl.ioctl(sock.fileno(), SIOCGSKNS)
+    except OSError:
+        return None
+    try:
+        st = os.fstat(fd)
+    finally:
+        os.close(fd)
+    return '%i:%i' % (st.st_dev, st.st_ino)
+
+
+def family_info(msg):
+    '''
+    Convert a `CTRL_CMD_GETFAMILY` response into a cache entry.
+    '''
+    return {
+        'id': msg.get_attr('CTRL_ATTR_FAMILY_ID'),
+        'version': msg.get_attr('CTRL_ATTR_VERSION'),
+        'hdrsize': msg.get_attr('CTRL_ATTR_HDRSIZE'),
+        'maxattr': msg.get_attr('CTRL_ATTR_MAXATTR'),
+        'ops': [
+            [x.get_attr('CTRL_ATTR_OP_ID'), x.get_attr('CTRL_ATTR_OP_FLAGS')]
+            for x in msg.get_attr('CTRL_ATTR_OPS', [])
+        ],
+        'mcast_groups': dict(
+            (
+                x.get_attr('CTRL_ATTR_MCAST_GRP_NAME'),
+                x.get_attr('CTRL_ATTR_MCAST_GRP_ID'),
+            )
+            for x in msg.get_attr('CTRL_ATTR_MCAST_GROUPS', [])
+        ),
+    }
+
+
+class Namespace(object):
+    '''
+    The cache of one network namespace.
+    '''
+
+    __slots__ = ('netns', 'pid', 'monitor', 'families')
+
+    def __init__(self, netns):
+        self.netns = netns
+        self.pid = os.getpid()
+        # family name -> entry, or None if not found
+        self.families = {}
+        self.monitor = config.SocketBase(
+            AF_NETLINK, SOCK_DGRAM, NETLINK_GENERIC
+        )
+        try:
+            self.monitor.bind((0, 0))
+            self.monitor.setsockopt(
+                SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, GENL_CTRL_NOTIFY
+            )
+        except Exception:
+            self.monitor.close()
+            raise
+
+    def poll(self):
+        '''
+        Read the pending notifications, drop the changed families.
+        Return True if something was dropped.
+        '''
+        changed = False
+        while True:
+            try:
+                data = self.monitor.recv(65536, MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return changed
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # lost notifications
+                self.families.clear()
+                changed = True
+                continue
+            offset = 0
+            while offset <= len(data) - 20:
+                length, msg_type = struct.unpack_from('IH', data, offset)
+                if length < 20:
+                    break
+                if msg_type == GENL_ID_CTRL and data[offset + 16] in (
+                    CTRL_CMD_NEWFAMILY,
+                    CTRL_CMD_DELFAMILY,
+                    CTRL_CMD_NEWMCAST_GRP,
+                    CTRL_CMD_DELMCAST_GRP,
+                ):
+                    msg = ctrlmsg(data[offset : offset + length])
+                    msg.decode()
+                    name = msg.get_attr('CTRL_ATTR_FAMILY_NAME')
+                    if self.families.pop(name, False) is not False:
+                        log.debug('genl family %s changed' % name)
+                        changed = True
+                offset += (length + 4 - 1) & ~(4 - 1)
+
+    def close(self):
+        self.monitor.close()
+
+
+class FamilyCache(object):
+    '''
+    Thread-safe generic netlink families cache. `GenericNetlinkSocket`
+    uses the process-wide instance `families`.
+    '''
+
+    def __init__(self, size=None):
+        self.size = size
+        self.lock = threading.Lock()
+        self.namespaces = collections.OrderedDict()
+
+    def namespace(self, sock):
+        #
+        # Return the cache of the socket namespace, or None if
+        # it can not be cached. Must be called with the lock.
+        #
+        netns = netns_id()
+        sock_netns = socket_netns_id(sock)
+        if sock_netns is None and getattr(sock, '_fileno', None) is not None:
+            # the socket may be created anywhere
+            return None
+        if sock_netns is not None and sock_netns != netns:
+            return None
+        ns = self.namespaces.pop(netns, None)
+        if ns is not None and ns.pid != os.getpid():
+            # forked: the notification socket is shared with the
+            # parent, so the notifications would be lost
+            ns.close()
+            ns = None
+        if ns is None:
+            try:
+                ns = Namespace(netns)
+            except OSError as e:
+                log.debug('genl cache is not available: %s' % e)
+                return None
+        self.namespaces[netns] = ns
+        size = self.size if self.size is not None else config.genl_cache_size
+        while len(self.namespaces) > max(size, 1):
+            self.namespaces.popitem(last=False)[1].close()
+        return ns
+
+    def get(self, sock, name):
+        '''
+        Return the family entry, run `sock.discovery(name)` on
+        cache miss. Raise `KeyError` if the family was not found
+        by an earlier discovery, and the discovery errors as is.
+        '''
+        if not config.genl_cache:
+            return family_info(sock.discovery(name))
+        with self.lock:
+            ns = self.namespace(sock)
+            if ns is not None:
+                ns.poll()
+                if name in ns.families:
+                    info = ns.families[name]
+                    if info is None:
+                        raise KeyError(name)
+                    return info
+        # the discovery runs without the lock; the notification
+        # socket is subscribed already, so the changes after the
+        # discovery are seen by the next lookup
+        error = None
+        try:
+            info = family_info(sock.discovery(name))
+        except NetlinkError as e:
+            if e.code != errno.ENOENT:
+                raise
+            info = None
+            error = e
+        if ns is not None:
+            with self.lock:
+                if self.namespaces.get(ns.netns) is ns:
+                    ns.families[name] = info
+        if error is not None:
+            raise error
+        return info
+
+    def invalidate(self, name=None):
+        '''
+        Drop the family `name` from the cache in all the namespaces,
+        or the whole cache if the name is None.
+        '''
+        with self.lock:
+            for ns in self.namespaces.values():
+                if name is None:
+                    ns.families.clear()
+                else:
+                    ns.families.pop(name, None)
+
+    def clear(self):
+        '''
+        Drop the cache and close the notification sockets.
+        '''
+        with self.lock:
+            for ns in self.namespaces.values():
+                ns.close()
+            self.namespaces.clear()
+
+
+families = FamilyCache()
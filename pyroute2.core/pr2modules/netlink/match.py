@@ -0,0 +1,309 @@
+'''
+Compiled match predicates
+-------------------------
+
+The RTNL API dump methods filter the results with `match` dicts::
+
+    ipr.get_routes(table=100, oif=7)
+
+With a plain dict every message has to be decoded, and then every
+key is checked with `name2nla()`, `get()` and `get_attr()`. `Match`
+compiles the dict once per request: the NLA names are resolved and
+the header fields and simple NLA types (integers, strings, IP
+addresses) are read directly from the receive buffer, so the
+messages that surely do not match are dropped by the marshal before
+they are decoded, see `Marshal.parse()`. The rest of the messages
+are checked as usual, with the same semantics as `RTNL_API._match()`.
+
+With `strict_check` the kernel can filter some dumps itself, so
+`get_routes()`, `get_addr()`, `get_neighbours()` and `get_links()`
+add the supported keys to the dump request:
+
+* routes -- `table`, `oif`, `proto`
+* addresses -- `index`
+* neighbours -- `ifindex`, `master`
+* links -- `master`
+
+The other keys are not sent to the kernel, since strict dump
+requests with unsupported attributes are rejected::
+
+    with IPRoute(strict_check=True) as ipr:
+        ipr.get_routes(table=100, oif=7)
+'''
+
+import types
+import struct
+from socket import AF_INET
+from socket import AF_INET6
+from socket import inet_ntop
+from pr2modules.netlink import NLA_F_NESTED
+from pr2modules.netlink import NLA_F_NET_BYTEORDER
+from pr2modules.netlink import nla
+from pr2modules.netlink import nla_header_struct
+from pr2modules.netlink import compile_plan
+
+# plans cache, msg_class -> MatchPlan
+plans = {}
+
+
+def decode_string(cls):
+    def decode(data, offset, length):
+        value = bytes(data[offset + 4 : offset + length])
+        if cls.zstring == 1:
+            value = value.strip(b'\0')
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value
+
+    return decode
+
+
+def decode_ipaddr(data, offset, length):
+    family = AF_INET6 if length > 8 else AF_INET
+    return inet_ntop(family, bytes(data[offset + 4 : offset + length]))
+
+
+def decode_ipxaddr(cls):
+    def decode(data, offset, length):
+        return inet_ntop(cls.family, bytes(data[offset + 4 : offset + length]))
+
+    return decode
+
+
+def decode_struct(cls):
+    unpack = struct.Struct(cls.fields[0][1]).unpack_from
+
+    def decode(data, offset, length):
+        return unpack(data, offset + 4)[0]
+
+    return decode
+
+
+# NLA class -> raw value decoder
+decoders = {
+    nla.string: decode_string(nla.string),
+    nla.asciiz: decode_string(nla.asciiz),
+    nla.ipaddr: decode_ipaddr,
+    nla.ip4addr: decode_ipxaddr(nla.ip4addr),
+    nla.ip6addr: decode_ipxaddr(nla.ip6addr),
+}
+for atom in (
+    nla.uint8,
+    nla.uint16,
+    nla.uint32,
+    nla.uint64,
+    nla.int8,
+    nla.int16,
+    nla.int32,
+    nla.int64,
+    nla.be8,
+    nla.be16,
+    nla.be32,
+    nla.be64,
+    nla.sbe8,
+    nla.sbe16,
+    nla.sbe32,
+    nla.sbe64,
+):
+    decoders[atom] = decode_struct(atom)
+
+
+class MatchPlan(object):
+    '''
+    Binary layout of a message class: header fields offsets,
+    NLA types and decoders.
+    '''
+
+    def __init__(self, msg_class):
+        self.msg_class = msg_class
+        # the prototype compiles the NLA plan of the class
+        self.proto = msg_class()
+        self.fields = {}
+        offset = compile_plan(msg_class.header).size
+        if msg_class.fields:
+            plan = compile_plan(msg_class.fields)
+            for name, fmt, size, count in zip(
+                plan.names, plan.fmts, plan.sizes, plan.counts
+            ):
+                if count == 1 and fmt[-1] not in 'sp':
+                    self.fields[name] = (
+                        struct.Struct(fmt).unpack_from,
+                        offset,
+                    )
+                offset += size
+        self.nla_offset = (offset + 4 - 1) & ~(4 - 1)
+        # some classes add keys in decode(), e.g. ifinfmsg['state'],
+        # and the marshal adds 'event'; such keys can not be checked
+        # on the raw data
+        try:
+            msg = msg_class()
+            msg.encode()
+            msg = msg_class(msg.data)
+            msg.decode()
+            self.extra = set(msg) - set(self.fields)
+            self.extra.add('event')
+        except Exception:
+            self.extra = None
+
+    def nla(self, name):
+        '''
+        Return (type, decoder) of the NLA, or None if the NLA is
+        not defined for the class, or (type, None) if it can not
+        be decoded from the raw data.
+        '''
+        nla_type = self.proto.lazy_type(name)
+        if nla_type is None:
+            return None
+        return (nla_type, decoders.get(self.proto.lazy_class(name)))
+
+    def raw(self, key):
+        '''
+        Is it possible to tell whether `msg.get(key)` is None
+        without decoding the message?
+        '''
+        if key in self.fields:
+            return True
+        return self.extra is not None and key not in self.extra
+
+
+def get_plan(msg_class):
+    plan = plans.get(msg_class)
+    if plan is None:
+        plan = plans[msg_class] = MatchPlan(msg_class)
+    return plan
+
+
+class Prefilter(object):
+    '''
+    The request callback that drops the messages rejected
+    by `Match.check()` before decoding.
+    '''
+
+    __slots__ = ('match',)
+
+    def __init__(self, match):
+        self.match = match
+
+    def __call__(self, msg):
+        # decoded messages are checked by the match predicate
+        return False
+
+    def prefilter(self, msg_class, data, offset):
+        '''
+        Return True to drop the message.
+        '''
+        if msg_class is not self.match.msg_class:
+            return False
+        try:
+            return not self.match.check(data, offset)
+        except Exception:
+            # let the decoder deal with the broken data
+            return False
+
+
+class Match(object):
+    '''
+    A `match` dict compiled for a message class. The object is
+    a predicate, `match(msg)` returns True if all the keys match.
+    '''
+
+    def __init__(self, spec, msg_class):
+        self.spec = spec
+        self.msg_class = msg_class
+        plan = get_plan(msg_class)
+        # [(key, NLA name, value, is function), ...]
+        self.keys = []
+        # [(field unpack, field offset, NLA type, NLA decoder,
+        #   value, is function), ...]
+        self.raw = []
+        for key, value in spec.items():
+            KEY = msg_class.name2nla(key)
+            function = isinstance(value, types.FunctionType)
+            self.keys.append((key, KEY, value, function))
+            if not plan.raw(key) or (value is None and not function):
+                continue
+            unpack, field_offset = plan.fields.get(key, (None, None))
+            nla_type, decoder = plan.nla(KEY) or (None, None)
+            if unpack is not None and function:
+                # fields are never None, so the NLA is not checked
+                nla_type = decoder = None
+            elif nla_type is not None and decoder is None:
+                # the NLA must be decoded to check the key
+                continue
+            self.raw.append(
+                (unpack, field_offset, nla_type, decoder, value, function)
+            )
+        self.nla_types = set(x[2] for x in self.raw if x[2] is not None)
+        self.nla_offset = plan.nla_offset
+        self.callback = Prefilter(self) if self.raw else None
+
+    def __call__(self, msg):
+        for key, KEY, value, function in self.keys:
+            if function:
+                if msg.get(key) is not None:
+                    if not value(msg.get(key)):
+                        return False
+                elif msg.get_attr(KEY) is not None:
+                    if not value(msg.get_attr(KEY)):
+                        return False
+                else:
+                    return False
+            elif not (msg.get(key) == value or msg.get_attr(KEY) == value):
+                return False
+        return True
+
+    def index(self, data, offset):
+        '''
+        Return {NLA type: (offset, length)} of the first NLA of
+        every type the match needs.
+        '''
+        ret = {}
+        (length,) = struct.unpack_from('I', data, offset)
+        end = offset + length
+        offset += self.nla_offset
+        while offset <= end - 4 and len(ret) < len(self.nla_types):
+            (length, nla_type) = nla_header_struct.unpack_from(data, offset)
+            nla_type &= ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+            length = min(max(length, 4), end - offset)
+            if nla_type in self.nla_types and nla_type not in ret:
+                ret[nla_type] = (offset, length)
+            offset += (length + 4 - 1) & ~(4 - 1)
+        return ret
+
+    def check(self, data, offset):
+        '''
+        Check the raw message at `offset`. Return False if it
+        surely does not match, True otherwise.
+        '''
+        attrs = None
+        for (
+            unpack,
+            field_offset,
+            nla_type,
+            decoder,
+            value,
+            function,
+        ) in self.raw:
+            if unpack is not None:
+                (field,) = unpack(data, offset + field_offset)
+                if function:
+                    if not value(field):
+                        return False
+                    continue
+                if field == value:
+                    continue
+            if nla_type is None:
+                # no such field or NLA
+                return False
+            if attrs is None:
+                attrs = self.index(data, offset)
+            if nla_type not in attrs:
+                return False
+            attr = decoder(data, *attrs[nla_type])
+            if function:
+                if not value(attr):
+                    return False
+            elif attr != value:
+                return False
+        return True
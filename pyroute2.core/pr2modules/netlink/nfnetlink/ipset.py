@@ -90,7 +90,7 @@ class ipset_msg(nfgen_msg):
         ('IPSET_ATTR_FLAGS', 'be32'),
         ('IPSET_ATTR_DATA', 'get_data_type'),
         ('IPSET_ATTR_ADT', 'attr_adt'),
-        ('IPSET_ATTR_LINENO', 'hex'),
+        ('IPSET_ATTR_LINENO', 'uint32'),
         ('IPSET_ATTR_PROTOCOL_MIN', 'uint8'),
         ('IPSET_ATTR_INDEX', 'be16'),
     )
@@ -120,7 +120,7 @@ class ipset_msg(nfgen_msg):
                 (6, 'IPSET_ATTR_TIMEOUT', 'be32', NLA_F_NET_BYTEORDER),
                 (7, 'IPSET_ATTR_PROTO', 'be8', NLA_F_NET_BYTEORDER),
                 (8, 'IPSET_ATTR_CADT_FLAGS', 'be32', NLA_F_NET_BYTEORDER),
-                (9, 'IPSET_ATTR_CADT_LINENO', 'be32'),
+                (9, 'IPSET_ATTR_CADT_LINENO', 'uint32'),
                 (10, 'IPSET_ATTR_MARK', 'be32', NLA_F_NET_BYTEORDER),
                 (11, 'IPSET_ATTR_MARKMASK', 'be32', NLA_F_NET_BYTEORDER),
                 (17, 'IPSET_ATTR_ETHER', 'l2addr'),
@@ -219,6 +219,7 @@ class nfct_msg(nfgen_msg):
         ('CTA_LABELS_MASK', 'cta_labels'),
         ('CTA_SYNPROXY', 'cta_synproxy'),
         ('CTA_FILTER', 'cta_filter'),
+        ('CTA_STATUS_MASK', 'be32'),
     )
 
     @classmethod
@@ -238,6 +239,7 @@ class nfct_msg(nfgen_msg):
             ('CTA_TUPLE_UNSPEC', 'none'),
             ('CTA_TUPLE_IP', 'cta_ip'),
             ('CTA_TUPLE_PROTO', 'cta_proto'),
+            ('CTA_TUPLE_ZONE', 'be16'),
         )
 
         class cta_ip(nla):
@@ -707,6 +709,9 @@ class NFCTSocket(NetlinkSocket):
         mark_mask=0xFFFFFFFF,
         tuple_orig=None,
         tuple_reply=None,
+        zone=None,
+        status=None,
+        status_mask=None,
     ):
         """Dump conntrack entries
 
@@ -714,6 +719,12 @@ class NFCTSocket(NetlinkSocket):
           * mark and mark_mask, for almost all kernel
           * tuple_orig and tuple_reply, since kernel 5.8 and newer.
             Warning: tuple_reply has a bug in kernel, fixed only recently.
+          * zone, since kernel 5.8 and newer
+          * status and status_mask, since kernel 6.1 and newer
+
+        Ports are filtered by the kernel only together with the
+        protocol number. Older kernels ignore unsupported filters
+        and dump all the entries.
 
         tuple_orig and tuple_reply are type NFCTAttrTuple.
         You can give only some attribute for filtering.
@@ -736,28 +747,84 @@ class NFCTSocket(NetlinkSocket):
            ct.dump_entries(tuple_orig=filter)
 
         """
+        return self.request(
+            self.dump_filter(
+                mark,
+                mark_mask,
+                tuple_orig,
+                tuple_reply,
+                zone,
+                status,
+                status_mask,
+            ),
+            IPCTNL_MSG_CT_GET,
+            msg_flags=NLM_F_REQUEST | NLM_F_DUMP,
+        )
+
+    def dump_filter(
+        self,
+        mark=None,
+        mark_mask=0xFFFFFFFF,
+        tuple_orig=None,
+        tuple_reply=None,
+        zone=None,
+        status=None,
+        status_mask=None,
+    ):
+        """Return the dump request with the kernel side filters
+
+        See :func:`dump` for the parameters.
+        """
+        msg = nfct_msg()
+        cta_filter = []
+        if zone is not None:
+            msg['attrs'].append(['CTA_ZONE', zone])
         if tuple_orig is not None:
-            tuple_orig.attrs()  # for creating flags
-            cta_filter = {
-                'attrs': [['CTA_FILTER_ORIG_FLAGS', tuple_orig.flags]]
-            }
-            msg = nfct_msg.create_from(
-                tuple_orig=tuple_orig, cta_filter=cta_filter
-            )
+            cta_tuple, flags = self._tuple_filter(tuple_orig)
+            msg['attrs'].append(['CTA_TUPLE_ORIG', {'attrs': cta_tuple}])
+            cta_filter.append(['CTA_FILTER_ORIG_FLAGS', flags])
         elif tuple_reply is not None:
-            tuple_reply.attrs()
-            cta_filter = {
-                'attrs': [['CTA_FILTER_REPLY_FLAGS', tuple_reply.flags]]
-            }
-            msg = nfct_msg.create_from(
-                tuple_reply=tuple_reply, cta_filter=cta_filter
-            )
-        elif mark:
-            msg = nfct_msg.create_from(mark=mark, mark_mask=mark_mask)
-        else:
-            msg = nfct_msg.create_from()
-        return self.request(
-            msg, IPCTNL_MSG_CT_GET, msg_flags=NLM_F_REQUEST | NLM_F_DUMP
+            cta_tuple, flags = self._tuple_filter(tuple_reply)
+            msg['attrs'].append(['CTA_TUPLE_REPLY', {'attrs': cta_tuple}])
+            cta_filter.append(['CTA_FILTER_REPLY_FLAGS', flags])
+        if cta_filter:
+            msg['attrs'].append(['CTA_FILTER', {'attrs': cta_filter}])
+        if mark:
+            if mark_mask is None:
+                mark_mask = 0xFFFFFFFF
+            msg['attrs'].append(['CTA_MARK', mark])
+            msg['attrs'].append(['CTA_MARK_MASK', mark_mask])
+        if status is not None:
+            if status_mask is None:
+                status_mask = 0xFFFFFFFF
+            msg['attrs'].append(['CTA_STATUS', status])
+            msg['attrs'].append(['CTA_STATUS_MASK', status_mask])
+        return msg
+
+    @staticmethod
+    def _tuple_filter(nfct_tuple):
+        cta_tuple = nfct_tuple.attrs()
+        flags = nfct_tuple.flags
+        if not flags & FILTER_FLAG_CTA_PROTO_NUM:
+            # the kernel rejects ports without the protocol number,
+            # so leave the ports to the caller
+            cta_tuple = [x for x in cta_tuple if x[0] != 'CTA_TUPLE_PROTO']
+            flags &= ~FILTER_FLAG_ALL_CTA_PROTO
+        return cta_tuple, flags
+
+    def dump_stream(self, parser, **kwargs):
+        """Dump conntrack entries without creating message objects
+
+        Accept the same filters as :func:`dump`, and yield
+        `parser(data, offset, length)` for every entry, see
+        `NetlinkMixin.nlm_stream()`.
+        """
+        msg = self.dump_filter(**kwargs)
+        msg['nfgen_family'] = self._nfgen_family
+        return self.nlm_stream(
+            msg,
+            IPCTNL_MSG_CT_GET | (NFNL_SUBSYS_CTNETLINK << 8),
+            parser=parser,
         )
 
     def stat(self):
@@ -4,11 +4,17 @@ NFTSocket -- low level nftables API
 See also: pr2modules.nftables
 """
 
+import struct
 import threading
+from socket import SOL_SOCKET
+from socket import SO_RCVBUF
+from socket import SO_SNDBUF
+from pr2modules.netlink import NLM_F_ACK
 from pr2modules.netlink import NLM_F_REQUEST
 from pr2modules.netlink import NLM_F_DUMP
 from pr2modules.netlink import NETLINK_NETFILTER
 from pr2modules.netlink import nla
+from pr2modules.netlink.exceptions import NetlinkError
 from pr2modules.netlink.nlsocket import NetlinkSocket
 from pr2modules.netlink.nfnetlink import nfgen_msg
 from pr2modules.netlink.nfnetlink import NFNL_SUBSYS_NFTABLES
@@ -38,6 +44,9 @@ NFT_MSG_GETOBJ_RESET = 21
 NFT_MSG_NEWFLOWTABLE = 22
 NFT_MSG_GETFLOWTABLE = 23
 NFT_MSG_DELFLOWTABLE = 24
+# <asm-generic/socket.h>
+SO_SNDBUFFORCE = 32
+SO_RCVBUFFORCE = 33
 
 
 class nft_map_uint8(nla):
@@ -989,6 +998,9 @@ class NFTSocket(NetlinkSocket):
     Implements API to the nftables functionality.
     '''
 
+    # the receive buffer space to reserve for one ACK
+    ack_size = 1024
+
     policy = {
         NFT_MSG_NEWTABLE: nft_table_msg,
         NFT_MSG_GETTABLE: nft_table_msg,
@@ -1028,39 +1040,137 @@ class NFTSocket(NetlinkSocket):
         self._write_lock = threading.RLock()
 
     def begin(self):
+        '''
+        Start a transaction: all the `request_put()` calls up to
+        `commit()` are encoded into one buffer and sent at once.
+        Return `False` if the transaction is already started.
+        '''
         with self._write_lock:
             if hasattr(self._ts, 'data'):
                 # transaction is already started
                 return False
 
-            self._ts.data = b''
-            self._ts.seqnum = (
-                self.addr_pool.alloc(),  # begin
-                self.addr_pool.alloc(),  # tx
-                self.addr_pool.alloc(),
-            )  # commit
-            msg = nfgen_msg()
-            msg['res_id'] = NFNL_SUBSYS_NFTABLES
-            msg['header']['type'] = 0x10
-            msg['header']['flags'] = NLM_F_REQUEST
-            msg['header']['sequence_number'] = self._ts.seqnum[0]
-            msg.encode()
-            self._ts.data += msg.data
+            self._ts.data = bytearray()
+            self._ts.count = 0
             return True
 
+    def batch_msg(self, msg_type, msg_seq):
+        msg = nfgen_msg()
+        msg['res_id'] = NFNL_SUBSYS_NFTABLES
+        msg['header']['type'] = msg_type
+        msg['header']['flags'] = NLM_F_REQUEST
+        msg['header']['sequence_number'] = msg_seq
+        msg.encode()
+        return msg.data
+
+    def setup_buffers(self, sndbuf, rcvbuf):
+        # like nft does, grow the socket buffers to fit the
+        # transaction, if possible; the kernel doubles the values
+        for option, force, size in (
+            (SO_SNDBUF, SO_SNDBUFFORCE, sndbuf),
+            (SO_RCVBUF, SO_RCVBUFFORCE, rcvbuf),
+        ):
+            if self.getsockopt(SOL_SOCKET, option) >= size:
+                continue
+            try:
+                self.setsockopt(SOL_SOCKET, force, size // 2 + 1)
+            except OSError:
+                self.setsockopt(SOL_SOCKET, option, size // 2 + 1)
+        return (
+            self.getsockopt(SOL_SOCKET, SO_SNDBUF),
+            self.getsockopt(SOL_SOCKET, SO_RCVBUF),
+        )
+
     def commit(self):
+        '''
+        Send the transaction and return the results, one per
+        `request_put()` call: the ACK message tuple or `NetlinkError`.
+
+        The transaction is atomic: if any message fails, the kernel
+        discards the whole transaction, and all the rest messages
+        get ACK as well, so check all the results.
+
+        The transaction is sent in one datagram, if the socket
+        buffers can be grown to fit it, like `nft` does. Otherwise
+        it is split into several transactions sent one by one; every
+        part is atomic, but not the whole.
+        '''
         with self._write_lock:
-            msg = nfgen_msg()
-            msg['res_id'] = NFNL_SUBSYS_NFTABLES
-            msg['header']['type'] = 0x11
-            msg['header']['flags'] = NLM_F_REQUEST
-            msg['header']['sequence_number'] = self._ts.seqnum[2]
-            msg.encode()
-            self._ts.data += msg.data
-            self.sendto(self._ts.data, (0, 0))
-            for seqnum in self._ts.seqnum:
-                self.addr_pool.free(seqnum, ban=10)
+            data = self._ts.data
+            count = self._ts.count
             del self._ts.data
+            del self._ts.count
+            # every reply takes ~1k of the receive buffer,
+            # errors include also the original messages
+            sndbuf, rcvbuf = self.setup_buffers(
+                len(data) + 64, count * self.ack_size + len(data)
+            )
+            view = memoryview(data)
+            ret = []
+            offset = 0
+            while offset < len(data):
+                # split by message boundaries
+                chunk = offset
+                seqs = []
+                while offset < len(data):
+                    (length,) = struct.unpack_from('I', data, offset)
+                    size = offset + length - chunk
+                    if seqs and (
+                        size + 64 > sndbuf - 32
+                        or (len(seqs) + 1) * self.ack_size + size > rcvbuf
+                    ):
+                        break
+                    msg_seq = self.addr_pool.alloc()
+                    self.backlog[msg_seq] = []
+                    struct.pack_into('I', data, offset + 8, msg_seq)
+                    seqs.append(msg_seq)
+                    offset += length
+                ret.extend(self.commit_chunk(view[chunk:offset], seqs))
+            view.release()
+            return ret
+
+    def commit_chunk(self, data, seqs):
+        msg_seq = self.addr_pool.alloc()
+        self.backlog[msg_seq] = []
+        ret = []
+        error = None
+        try:
+            self._sock.sendmsg(
+                [
+                    self.batch_msg(0x10, msg_seq),  # begin
+                    data,
+                    self.batch_msg(0x11, msg_seq),  # commit
+                ]
+            )
+        except Exception as e:
+            error = e
+        for seq in seqs + [msg_seq]:
+            try:
+                if seq == msg_seq:
+                    # the commit failure, if any, is reported to the
+                    # begin message before all the ACKs
+                    for msg in self.backlog.get(seq, ()):
+                        if msg['header'].get('error') is not None:
+                            raise msg['header']['error']
+                    continue
+                if error is not None:
+                    raise error
+                ret.append(tuple(self.get(msg_seq=seq)))
+            except NetlinkError as e:
+                if seq == msg_seq:
+                    ret = [e] * len(seqs)
+                else:
+                    ret.append(e)
+            except Exception as e:
+                # the socket failed, don't wait for the rest
+                ret.append(e)
+                error = e
+            finally:
+                with self.backlog_lock:
+                    self.backlog.pop(seq, None)
+                # see NetlinkMixin.nlm_request() on msg_seq ban
+                self.addr_pool.free(seq, ban=0xFF)
+        return ret
 
     def request_get(
         self,
@@ -1087,13 +1197,20 @@ class NFTSocket(NetlinkSocket):
         '''
         one_shot = self.begin()
         msg['header']['type'] = (NFNL_SUBSYS_NFTABLES << 8) | msg_type
-        msg['header']['flags'] = msg_flags
-        msg['header']['sequence_number'] = self._ts.seqnum[1]
+        # ACK every message to report errors per message; the
+        # sequence number is set on commit
+        msg['header']['flags'] = msg_flags | NLM_F_ACK
         msg['nfgen_family'] = self._nfgen_family
+        # encode directly into the transaction buffer
+        msg.data = self._ts.data
+        msg.offset = len(self._ts.data)
         msg.encode()
-        self._ts.data += msg.data
+        self._ts.count += 1
         if one_shot:
-            self.commit()
+            (ret,) = self.commit()
+            if isinstance(ret, Exception):
+                raise ret
+            return ret
 
     def _command(self, msg_class, commands, cmd, kwarg, flags=NLM_F_REQUEST):
         cmd = commands[cmd]
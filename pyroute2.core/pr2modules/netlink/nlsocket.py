@@ -62,6 +62,17 @@ broadcast storm will be over, and then the CPU will be
 100% loaded with the parser for some time, when it will
 process all the messages queued so far.
 
+receive buffers
+---------------
+
+The sockets don't allocate a new buffer for every datagram. The
+data is read with `recv_into()` into buffers taken from a small
+per-socket pool, see `BufferPool`, and `Marshal.parse()` walks the
+datagram as a `memoryview` window over the buffer. Only the messages
+returned by the parser are copied out, every one into its own
+`bytes` object, so the parsed messages don't keep the whole receive
+buffer alive, and the buffer returns to the pool right after parsing.
+
 when async I/O doesn't help
 ---------------------------
 
@@ -76,6 +87,66 @@ but it doesn't help much. So keep it in mind, and if you
 expect massive broadcast Netlink storms, perform stress
 testing prior to deploy a solution in the production.
 
+pipelining
+----------
+
+`nlm_request()` waits for the response before it returns, so every
+request costs a full round trip to the kernel. `pipeline()` returns
+a context manager that sends requests without waiting for responses.
+The API methods called via the pipeline return futures::
+
+    with ipr.pipeline(window=64) as pipe:
+        futures = [
+            pipe.route('add', dst='10.0.%i.0/24' % x, oif=idx)
+            for x in range(256)
+        ]
+
+    for future in futures:
+        if future.exception() is not None:
+            ...
+
+Up to `window` requests are in flight, every one with its own
+sequence number. The responses are collected in the order the
+requests were sent; a failed request sets only its own future
+exception. All the responses are collected on exit from the
+context, and `future.result()` may be called within the context.
+The future result is the tuple of response messages, so the methods
+that post-process responses, like `link_lookup()`, make no sense in
+a pipeline.
+
+streaming dumps
+---------------
+
+A big dump, like millions of conntrack entries, spends most of the
+time and memory to create message objects. `nlm_stream()` sends the
+request and calls a parser for every response message right on the
+receive buffer, so the parser may decode only the fields it needs::
+
+    def parse(data, offset, length):
+        return struct.unpack_from('I', data, offset + 20)[0]
+
+    for value in nl.nlm_stream(msg, msg_type, parser=parse):
+        ...
+
+asyncio
+-------
+
+`AsyncNetlinkSocket` is an event loop native socket. It doesn't
+use any threads or locks: the socket is read by the event loop with
+`loop.add_reader()`, and the responses are routed by the sequence
+number to pending requests. `nlm_request()` sends the request at
+once and returns `NetlinkRequest`, so many requests may be in flight
+simultaneously. The response may be awaited as a whole, or iterated
+as the messages arrive::
+
+    msgs = await nl.nlm_request(msg, msg_type)
+
+    async for msg in nl.nlm_request(msg, msg_type):
+        ...
+
+Messages that don't belong to any pending request -- broadcasts --
+are returned by `await nl.get()`.
+
 classes
 -------
 '''
@@ -85,13 +156,17 @@ import sys
 import time
 import errno
 import random
+import types
 import select
+import asyncio
 import struct
 import logging
 import traceback
 import threading
 import collections
 
+from functools import partial
+from concurrent.futures import Future
 from socket import SOCK_DGRAM
 from socket import MSG_PEEK
 from socket import SOL_SOCKET
@@ -113,6 +188,7 @@ from pr2modules.netlink import NETLINK_EXT_ACK
 from pr2modules.netlink import NETLINK_GENERIC
 from pr2modules.netlink import NETLINK_GET_STRICT_CHK
 from pr2modules.netlink import NETLINK_LISTEN_ALL_NSID
+from pr2modules.netlink import NLM_F_ACK
 from pr2modules.netlink import NLM_F_ACK_TLVS
 from pr2modules.netlink import NLM_F_DUMP
 from pr2modules.netlink import NLM_F_MULTI
@@ -134,6 +210,53 @@ log = logging.getLogger(__name__)
 Stats = collections.namedtuple('Stats', ('qsize', 'delta', 'delay'))
 
 
+class BufferPool(object):
+    '''
+    A pool of reusable receive buffers.
+
+    `get()` returns a `bytearray` of at least the requested size,
+    `release()` takes a `memoryview` over a buffer from the pool,
+    releases the view and returns the buffer back to the pool. Any
+    other objects passed to `release()` are ignored, so it is safe
+    to call it with the data returned by any `recv_ft()` variant.
+
+    The pool is used by two threads at most -- the async reader and
+    the parser, and `collections.deque` operations are atomic, so
+    no locks are required.
+    '''
+
+    def __init__(self, size=65536, depth=16):
+        self.size = size
+        self.depth = depth
+        self.pool = collections.deque()
+        # statistics
+        self.allocated = 0
+        self.reused = 0
+
+    def get(self, size=0):
+        try:
+            buf = self.pool.pop()
+            if len(buf) >= size:
+                self.reused += 1
+                return buf
+        except IndexError:
+            pass
+        self.allocated += 1
+        return bytearray(max(size, self.size))
+
+    def release(self, data):
+        if not isinstance(data, memoryview):
+            return
+        buf = getattr(data, 'obj', None)
+        if hasattr(data, 'release'):
+            data.release()
+        if isinstance(buf, bytearray) and len(self.pool) < self.depth:
+            self.pool.append(buf)
+
+    def view(self, buf, length):
+        return memoryview(buf)[:length]
+
+
 class Marshal(object):
     '''
     Generic marshalling class
@@ -144,6 +267,7 @@ class Marshal(object):
     type_format = 'H'
     error_type = NLMSG_ERROR
     debug = False
+    lazy_decode = False
 
     def __init__(self):
         self.lock = threading.Lock()
@@ -156,12 +280,24 @@ class Marshal(object):
         '''
         Parse string data.
 
+        The data may be a `memoryview` over a receive buffer that
+        will be reused after the call. In that case the headers are
+        read directly from the buffer, and every parsed message gets
+        a copy of its own bytes only.
+
         At this moment all transport, except of the native
         Netlink is deprecated in this library, so we should
         not support any defragmentation on that level
+
+        If the callback has the `prefilter(msg_class, data, offset)`
+        method, it is called for the messages of the request before
+        decoding, and the messages it returns True for are dropped,
+        see `pr2modules.netlink.match`.
         '''
         offset = 0
         result = []
+        view = isinstance(data, memoryview)
+        prefilter = getattr(callback, 'prefilter', None)
         # there must be at least one header in the buffer,
         # 'IHHII' == 16 bytes
         while offset <= len(data) - 16:
@@ -179,13 +315,31 @@ class Marshal(object):
                     error = NetlinkError(code)
 
             msg_class = self.msg_map.get(msg_type, nlmsg)
-            msg = msg_class(data, offset=offset)
+            if (
+                prefilter is not None
+                and msg_type not in (NLMSG_DONE, self.error_type)
+                and seq == struct.unpack_from('I', data, offset + 8)[0]
+                and prefilter(msg_class, data, offset)
+            ):
+                offset += length
+                continue
+
+            if view:
+                # the message escapes the receive buffer
+                msg_data = data[offset : offset + length].tobytes()
+                msg_offset = 0
+            else:
+                msg_data = data
+                msg_offset = offset
+            msg = msg_class(msg_data, offset=msg_offset)
+            if self.lazy_decode:
+                msg._nla_lazy = True
 
             if msg_type in (NLMSG_DONE, NLMSG_ERROR):
                 # get flags
                 flags = struct.unpack_from('H', data, offset + 6)[0]
                 if flags & NLM_F_ACK_TLVS:
-                    msg = nlmsgerr(data, offset=offset)
+                    msg = nlmsgerr(msg_data, offset=msg_offset)
             try:
                 msg.decode()
                 if isinstance(msg, nlmsgerr):
@@ -198,9 +352,10 @@ class Marshal(object):
                 if error is not None:
                     enc_type = struct.unpack_from('H', data, offset + 24)[0]
                     enc_class = self.msg_map.get(enc_type, nlmsg)
-                    enc = enc_class(data, offset=offset + 20)
+                    enc = enc_class(msg_data, offset=msg_offset + 20)
                     enc.decode()
                     msg['header']['errmsg'] = enc
+                    error.errmsg = enc
                 if callback and seq == msg['header']['sequence_number']:
                     if callback(msg):
                         offset += msg.length
@@ -310,6 +465,7 @@ class NetlinkMixin(object):
         target='localhost',
         ext_ack=False,
         strict_check=False,
+        lazy_decode=False,
     ):
         #
         # That's a trick. Python 2 is not able to construct
@@ -342,6 +498,7 @@ class NetlinkMixin(object):
             'nlm_generator': nlm_generator,
             'ext_ack': ext_ack,
             'strict_check': strict_check,
+            'lazy_decode': lazy_decode,
         }
         # 8<-----------------------------------------
         self.addr_pool = AddrPool(minaddr=0x000000FF, maxaddr=0x0000FFFF)
@@ -378,6 +535,7 @@ class NetlinkMixin(object):
             nlm_generator = config.nlm_generator
         self.nlm_generator = nlm_generator
         self.buffer_queue = Queue(maxsize=async_qsize)
+        self.buffer_pool = BufferPool()
         self.qsize = 0
         self.log = []
         self.get_timeout = 30
@@ -385,6 +543,7 @@ class NetlinkMixin(object):
         self.all_ns = all_ns
         self.ext_ack = ext_ack
         self.strict_check = strict_check
+        self.lazy_decode = lazy_decode
         if pid is None:
             self.pid = os.getpid() & 0x3FFFFF
             self.port = port
@@ -417,6 +576,18 @@ class NetlinkMixin(object):
     def post_init(self):
         pass
 
+    @property
+    def marshal(self):
+        return self._marshal
+
+    @marshal.setter
+    def marshal(self, marshal):
+        # the marshal is often replaced in the subclasses, so
+        # propagate the socket decoding options on assignment
+        if self.lazy_decode:
+            marshal.lazy_decode = True
+        self._marshal = marshal
+
     def clone(self):
         return type(self)(**self.config)
 
@@ -587,9 +758,11 @@ class NetlinkMixin(object):
             for (fd, event) in events:
                 if fd == sockfd:
                     try:
-                        data = bytearray(64000)
-                        self._sock.recv_into(data, 64000)
-                        self.buffer_queue.put_nowait(data)
+                        data = self.buffer_pool.get(64000)
+                        length = self._sock.recv_into(data, 64000)
+                        self.buffer_queue.put_nowait(
+                            self.buffer_pool.view(data, length)
+                        )
                     except Exception as e:
                         self.buffer_queue.put(e)
                         return
@@ -803,9 +976,12 @@ class NetlinkMixin(object):
                                 # locks, except the read lock must be released
                                 data = self.recv_ft(bufsize)
                                 # Parse data
-                                msgs = self.marshal.parse(
-                                    data, msg_seq, callback
-                                )
+                                try:
+                                    msgs = self.marshal.parse(
+                                        data, msg_seq, callback
+                                    )
+                                finally:
+                                    self.buffer_pool.release(data)
                                 # Reset ctime -- timeout should be measured
                                 # for every turn separately
                                 ctime = time.time()
@@ -946,6 +1122,87 @@ class NetlinkMixin(object):
             if defer is not None:
                 raise defer
 
+    def nlm_stream(
+        self, msg, msg_type, msg_flags=NLM_F_REQUEST | NLM_F_DUMP, parser=None
+    ):
+        '''
+        Send a request and iterate the response without creating
+        message objects: for every response message yield the
+        result of `parser(data, offset, length)`, where `data` is
+        the receive buffer and `offset` is the message offset in
+        it. The buffer is reused after the parser returns, so the
+        parser must not keep references to it.
+
+        Errors are raised like `nlm_request()` does, and messages
+        with other sequence numbers go to the backlog. The method
+        reads the socket directly, so the socket must not be read
+        by other threads until the iteration is over.
+        '''
+        msg_seq = self.addr_pool.alloc()
+        defer = None
+        try:
+            self.put(msg, msg_type, msg_flags, msg_seq=msg_seq)
+            while True:
+                data = self.recv_ft(DEFAULT_RCVBUF)
+                try:
+                    offset = 0
+                    while offset <= len(data) - 16:
+                        length, m_type, m_flags, m_seq = struct.unpack_from(
+                            'IHHI', data, offset
+                        )
+                        if length < 16:
+                            break
+                        if m_seq != msg_seq:
+                            self._stream_backlog(
+                                data[offset : offset + length]
+                            )
+                        elif m_type in (NLMSG_DONE, NLMSG_ERROR):
+                            code = 0
+                            if length >= 20:
+                                (code,) = struct.unpack_from(
+                                    'i', data, offset + 16
+                                )
+                            if code:
+                                raise NetlinkError(abs(code))
+                            if m_type == NLMSG_DONE or not (
+                                msg_flags & NLM_F_DUMP
+                            ):
+                                if defer is not None:
+                                    raise defer
+                                return
+                        else:
+                            if m_flags & NLM_F_DUMP_INTR and defer is None:
+                                defer = NetlinkDumpInterrupted()
+                            yield parser(data, offset, length)
+                            if not m_flags & NLM_F_MULTI:
+                                return
+                        offset += (length + 3) & ~3
+                finally:
+                    self.buffer_pool.release(data)
+        finally:
+            with self.backlog_lock:
+                if msg_seq in self.backlog:
+                    self.backlog[0].extend(self.backlog.pop(msg_seq))
+            # see nlm_request() on msg_seq ban
+            self.addr_pool.free(msg_seq, ban=0xFF)
+
+    def _stream_backlog(self, data):
+        with self.backlog_lock:
+            for msg in self.marshal.parse(data):
+                seq = msg['header']['sequence_number']
+                if seq not in self.backlog:
+                    if msg['header']['type'] == NLMSG_ERROR:
+                        continue
+                    seq = 0
+                self.backlog[seq].append(msg)
+
+    def pipeline(self, window=64):
+        '''
+        Return `NetlinkPipeline` to send requests without waiting
+        for responses, see "pipelining" above.
+        '''
+        return NetlinkPipeline(self, window)
+
 
 class BatchAddrPool(object):
     def alloc(self, *argv, **kwarg):
@@ -975,6 +1232,18 @@ class BatchBacklog(dict):
 
 
 class BatchSocket(NetlinkMixin):
+    '''
+    Netlink requests compiler: API calls encode requests into
+    `self.batch` buffer instead of sending them, and all the
+    requests get `sequence_number == 0`.
+
+    The compiled batch can be sent with `submit()`.
+    '''
+
+    # the replies to the requests submitted at once must fit into
+    # the receive buffer of the target socket
+    max_messages = 256
+
     def post_init(self):
 
         self.backlog = BatchBacklog()
@@ -1008,6 +1277,82 @@ class BatchSocket(NetlinkMixin):
     def get(self, *argv, **kwarg):
         pass
 
+    def submit(self, sock, max_messages=None):
+        '''
+        Send the compiled batch via a netlink socket `sock` and
+        return a list of results, one per message in the batch:
+        the response messages tuple, as `nlm_request()` returns, or
+        an exception for failed requests::
+
+            ipb = IPBatch()
+            for prefix in prefixes:
+                ipb.route('add', dst=prefix, gateway='10.0.0.1')
+            with IPRoute() as ipr:
+                for ret in ipb.submit(ipr):
+                    if isinstance(ret, Exception):
+                        ...
+            ipb.reset()
+
+        The batch is split into datagrams by message boundaries,
+        up to `SO_SNDBUF` of `sock` and up to `max_messages` messages
+        each, and every datagram is sent with one `sendto()` call.
+        Every message is sent with its own sequence number and
+        `NLM_F_ACK`, so the replies are collected per message. The
+        batch buffer itself is not changed.
+
+        The kernel runs only one dump per socket at a time, so if
+        there are dump requests in the batch, put them in separate
+        batches.
+        '''
+        if max_messages is None:
+            max_messages = self.max_messages
+        # see netlink_sendmsg(): len > sk->sk_sndbuf - 32 -> EMSGSIZE
+        limit = sock.getsockopt(SOL_SOCKET, SO_SNDBUF) - 32
+        data = bytearray(self.batch)
+        ret = []
+        offset = 0
+        while offset < len(data):
+            chunk = offset
+            seqs = []
+            while offset < len(data) and len(seqs) < max_messages:
+                (length,) = struct.unpack_from('I', data, offset)
+                if length < 16 or offset + length > len(data):
+                    raise ValueError('incorrect message at %i' % offset)
+                if seqs and offset + length - chunk > limit:
+                    break
+                msg_seq = sock.addr_pool.alloc()
+                with sock.backlog_lock:
+                    sock.backlog[msg_seq] = []
+                (flags,) = struct.unpack_from('H', data, offset + 6)
+                struct.pack_into(
+                    '=HI', data, offset + 6, flags | NLM_F_ACK, msg_seq
+                )
+                seqs.append(msg_seq)
+                offset += length
+            error = None
+            try:
+                sock.sendto(data[chunk:offset], (0, 0))
+            except Exception as e:
+                error = e
+            for msg_seq in seqs:
+                try:
+                    if error is not None:
+                        raise error
+                    ret.append(tuple(sock.get(msg_seq=msg_seq)))
+                except NetlinkError as e:
+                    ret.append(e)
+                except Exception as e:
+                    # the socket failed, don't wait for the rest
+                    ret.append(e)
+                    error = e
+                finally:
+                    with sock.backlog_lock:
+                        if msg_seq in sock.backlog:
+                            sock.backlog[0].extend(sock.backlog.pop(msg_seq))
+                    # see NetlinkMixin.nlm_request() on msg_seq ban
+                    sock.addr_pool.free(msg_seq, ban=0xFF)
+        return ret
+
 
 class NetlinkSocket(NetlinkMixin):
     def post_init(self):
@@ -1055,11 +1400,18 @@ class NetlinkSocket(NetlinkMixin):
             return getattr(self._sock, attr)
         elif attr in ('_sendto', '_recv', '_recv_into'):
             return getattr(self._sock, attr.lstrip("_"))
-        elif attr == "recv_ft":
-            return self._sock.recv
 
         raise AttributeError(attr)
 
+    def recv_ft(self, bufsize, flags=0):
+        '''
+        Receive a datagram into a pooled buffer; the caller must
+        return the buffer with `self.buffer_pool.release(data)`.
+        '''
+        data = self.buffer_pool.get(bufsize)
+        length = self._sock.recv_into(data, bufsize, flags)
+        return self.buffer_pool.view(data, length)
+
     def _gate(self, msg, addr):
         msg.reset()
         msg.encode()
@@ -1110,24 +1462,28 @@ class NetlinkSocket(NetlinkMixin):
         # all is OK till now, so start async recv, if we need
         if async_cache:
 
-            def recv_plugin(*argv, **kwarg):
+            def recv_ft_plugin(*argv, **kwarg):
                 data_in = self.buffer_queue.get()
                 if isinstance(data_in, Exception):
                     raise data_in
                 else:
                     return data_in
 
+            def recv_plugin(*argv, **kwarg):
+                data_in = recv_ft_plugin()
+                data = bytes(data_in)
+                self.buffer_pool.release(data_in)
+                return data
+
             def recv_into_plugin(data, *argv, **kwarg):
-                data_in = self.buffer_queue.get()
-                if isinstance(data_in, Exception):
-                    raise data_in
-                else:
-                    data[:] = data_in
-                    return len(data_in)
+                data_in = recv_ft_plugin()
+                data[:] = data_in
+                self.buffer_pool.release(data_in)
+                return len(data)
 
             self._recv = recv_plugin
             self._recv_into = recv_into_plugin
-            self.recv_ft = recv_plugin
+            self.recv_ft = recv_ft_plugin
             self.pthread = threading.Thread(
                 name="Netlink async cache", target=self.async_recv
             )
@@ -1166,3 +1522,573 @@ class ChaoticNetlinkSocket(NetlinkSocket):
         if random.random() > self.success_rate:
             raise ChaoticException()
         return super(ChaoticNetlinkSocket, self).get(*argv, **kwarg)
+
+
+class NetlinkPipelineRequest(object):
+    '''
+    A request compiled by `NetlinkPipeline`. While the API method
+    runs, the request is iterated as an empty sequence.
+    '''
+
+    __slots__ = (
+        'msg',
+        'msg_type',
+        'msg_flags',
+        'msg_seq',
+        'terminate',
+        'callback',
+        'match',
+        'future',
+        'last',
+        'dump',
+        'result',
+    )
+
+    def __init__(self, msg, msg_type, msg_flags, terminate, callback):
+        self.msg = msg
+        self.msg_type = msg_type
+        self.msg_flags = msg_flags
+        self.msg_seq = None
+        self.terminate = terminate
+        self.callback = callback
+        self.match = None
+        self.future = None
+        self.last = False
+        self.dump = msg_flags & NLM_F_DUMP == NLM_F_DUMP
+        self.result = ()
+
+    def __iter__(self):
+        return iter(())
+
+
+class NetlinkFuture(Future):
+    '''
+    The result of an API call run by `NetlinkPipeline`.
+
+    `result()` and `exception()` collect the responses in flight
+    up to this request, so they may be called within the pipeline
+    context as well.
+    '''
+
+    def __init__(self, pipeline):
+        super(NetlinkFuture, self).__init__()
+        self.pipeline = pipeline
+        self.parts = []
+
+    def result(self, timeout=None):
+        self.pipeline.wait(self)
+        return super(NetlinkFuture, self).result(timeout)
+
+    def exception(self, timeout=None):
+        self.pipeline.wait(self)
+        return super(NetlinkFuture, self).exception(timeout)
+
+
+class NetlinkPipeline(object):
+    '''
+    Send requests without waiting for responses, see "pipelining"
+    above. API calls made via the pipeline return `NetlinkFuture`.
+
+    Up to `window` requests are in flight; when the window is full,
+    the oldest response is collected before the next request is
+    sent. Every response is collected separately, so a failed
+    request sets its own future exception and doesn't affect the
+    rest. The socket must not be used by other threads while an
+    API call compiles requests.
+    '''
+
+    def __init__(self, sock, window=64):
+        self.sock = sock
+        self.window = max(1, window)
+        self.inflight = collections.deque()
+        self.dumps = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __getattr__(self, name):
+        method = getattr(self.sock, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        def submit(*argv, **kwarg):
+            return self.submit(method, *argv, **kwarg)
+
+        submit.__doc__ = method.__doc__
+        return submit
+
+    def capture(self, compiled, msg, msg_type, msg_flags=None, **kwarg):
+        if msg_flags is None:
+            msg_flags = NLM_F_REQUEST | NLM_F_DUMP
+        request = NetlinkPipelineRequest(
+            msg,
+            msg_type,
+            msg_flags,
+            kwarg.get('terminate'),
+            kwarg.get('callback'),
+        )
+        compiled.append(request)
+        return request
+
+    def submit(self, method, *argv, **kwarg):
+        '''
+        Run an API method bound to the socket, e.g. `ipr.route`,
+        send the requests it compiles and return `NetlinkFuture`.
+        '''
+        sock = self.sock
+        saved = {}
+        for key in ('nlm_request', '_match'):
+            if key in vars(sock):
+                saved[key] = vars(sock)[key]
+        compiled = []
+        sock.nlm_request = partial(self.capture, compiled)
+        match = getattr(sock, '_match', None)
+        if match is not None:
+
+            def capture_match(spec, msgs):
+                if isinstance(msgs, NetlinkPipelineRequest):
+                    msgs.match = partial(match, spec)
+                    return msgs
+                return match(spec, msgs)
+
+            sock._match = capture_match
+        try:
+            ret = method(*argv, **kwarg)
+            if isinstance(ret, types.GeneratorType):
+                # nlm_generator mode: run the method to the end
+                collections.deque(ret, maxlen=0)
+        finally:
+            for key in ('nlm_request', '_match'):
+                if key in saved:
+                    setattr(sock, key, saved[key])
+                else:
+                    vars(sock).pop(key, None)
+        future = NetlinkFuture(self)
+        if not compiled:
+            future.set_result(())
+            return future
+        compiled[-1].last = True
+        for request in compiled:
+            request.future = future
+            while len(self.inflight) >= self.window:
+                self.collect()
+            if request.dump:
+                # the kernel runs one dump per socket at a time, and
+                # replies EBUSY to the next one, so don't overlap them
+                while self.dumps:
+                    self.collect()
+                self.dumps += 1
+            request.msg_seq = sock.addr_pool.alloc()
+            self.inflight.append(request)
+            try:
+                sock.put(
+                    request.msg,
+                    request.msg_type,
+                    request.msg_flags,
+                    msg_seq=request.msg_seq,
+                )
+            except Exception as e:
+                self.inflight.pop()
+                self.release(request)
+                self.complete(request, e)
+        return future
+
+    def collect(self):
+        '''
+        Collect the response to the oldest request in flight.
+        '''
+        request = self.inflight.popleft()
+        sock = self.sock
+        exception = None
+        retry_count = 0
+        try:
+            while True:
+                try:
+                    request.result = tuple(
+                        sock.get(
+                            msg_seq=request.msg_seq,
+                            terminate=request.terminate,
+                            callback=request.callback,
+                        )
+                    )
+                    break
+                except NetlinkError as e:
+                    if e.code != 16 or retry_count >= 30:
+                        raise
+                    log.warning('Error 16, retry {}.'.format(retry_count))
+                    time.sleep(0.3)
+                    retry_count += 1
+                    sock.put(
+                        request.msg,
+                        request.msg_type,
+                        request.msg_flags,
+                        msg_seq=request.msg_seq,
+                    )
+            for msg in request.result:
+                if msg['header']['flags'] & NLM_F_DUMP_INTR:
+                    raise NetlinkDumpInterrupted()
+            if request.match is not None:
+                request.result = tuple(request.match(request.result))
+        except Exception as e:
+            exception = e
+        finally:
+            self.release(request)
+        self.complete(request, exception)
+
+    def release(self, request):
+        sock = self.sock
+        if request.dump:
+            self.dumps -= 1
+        with sock.backlog_lock:
+            if request.msg_seq in sock.backlog:
+                sock.backlog[0].extend(sock.backlog.pop(request.msg_seq))
+        # see NetlinkMixin.nlm_request() on msg_seq ban
+        sock.addr_pool.free(request.msg_seq, ban=0xFF)
+
+    def complete(self, request, exception=None):
+        future = request.future
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+            return
+        future.parts.append(request.result)
+        if request.last:
+            ret = []
+            for part in future.parts:
+                ret.extend(part)
+            future.parts = []
+            future.set_result(tuple(ret))
+
+    def wait(self, future):
+        '''
+        Collect responses until the future is done.
+        '''
+        while not future.done() and self.inflight:
+            self.collect()
+
+    def flush(self):
+        '''
+        Collect all the responses in flight.
+        '''
+        while self.inflight:
+            self.collect()
+
+
+class NetlinkRequest(object):
+    '''
+    A request sent by `AsyncNetlinkSocket`.
+
+    `await request` returns the list of response messages, and
+    `async for msg in request` yields messages as they arrive. The
+    errors are raised the same way as by `NetlinkMixin.get()`.
+
+    While `AsyncNetlinkSocket.submit()` runs a synchronous API
+    method to collect the requests it compiles, the requests are
+    iterated as empty sequences.
+    '''
+
+    def __init__(
+        self, sock, msg, msg_type, msg_flags, terminate=None, callback=None
+    ):
+        self.sock = sock
+        self.msg = msg
+        self.msg_type = msg_type
+        self.msg_flags = msg_flags
+        self.msg_seq = None
+        self.terminate = terminate
+        self.callback = callback
+        self.match = None
+        self.queue = collections.deque()
+        self.waiter = None
+        self.done = False
+        self.exception = None
+        self.defer = None
+        self.retry_count = 0
+
+    def send(self):
+        sock = self.sock
+        sock.setup_reader()
+        if len(sock.requests) >= sock.max_requests:
+            # wait for a free slot, see AsyncNetlinkSocket.max_requests
+            sock.deferred.append(self)
+            return self
+        self.msg_seq = sock.addr_pool.alloc()
+        sock.requests[self.msg_seq] = self
+        try:
+            self.put()
+        except Exception:
+            self.finish()
+            raise
+        return self
+
+    def put(self):
+        sock = self.sock
+        sock.put(self.msg, self.msg_type, self.msg_flags, msg_seq=self.msg_seq)
+        # a proxy may return the response without the kernel
+        for msg in sock.backlog.pop(self.msg_seq, ()):
+            self.feed(msg)
+
+    def feed(self, msg):
+        if self.done:
+            return
+        if self.callback is not None and self.callback(msg):
+            return
+        error = msg['header'].get('error', None)
+        if error is not None:
+            if getattr(error, 'code', None) == 16 and self.retry_count < 30:
+                log.warning('Error 16, retry {}.'.format(self.retry_count))
+                self.retry_count += 1
+                self.sock.loop.call_later(0.3, self.put)
+                return
+            return self.finish(error)
+        if self.defer is None and msg['header']['flags'] & NLM_F_DUMP_INTR:
+            self.defer = NetlinkDumpInterrupted()
+
+        tmsg = None
+        if self.terminate is not None:
+            tmsg = self.terminate(msg)
+            if isinstance(tmsg, nlmsg):
+                self.append(msg)
+        if (msg['header']['type'] == NLMSG_DONE) or tmsg:
+            return self.finish()
+        self.append(msg)
+        if not msg['header']['flags'] & NLM_F_MULTI:
+            self.finish()
+
+    def append(self, msg):
+        if self.match is not None:
+            for msg in self.match((msg,)):
+                break
+            else:
+                return
+        self.queue.append(msg)
+        self.wakeup()
+
+    def finish(self, exception=None):
+        if self.done:
+            return
+        self.done = True
+        self.exception = exception or self.defer
+        if self.sock.requests.get(self.msg_seq) is self:
+            del self.sock.requests[self.msg_seq]
+            # see NetlinkMixin.nlm_request() on msg_seq ban
+            self.sock.addr_pool.free(self.msg_seq, ban=0xFF)
+            self.sock.send_deferred()
+        self.wakeup()
+
+    def wakeup(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def __iter__(self):
+        if self.sock.compiled is not None:
+            return iter(())
+        raise TypeError('use "await" or "async for" to get the response')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.done:
+                if self.exception is not None:
+                    exception, self.exception = self.exception, None
+                    raise exception
+                raise StopAsyncIteration()
+            self.waiter = self.sock.loop.create_future()
+            await self.waiter
+            self.waiter = None
+        return self.queue.popleft()
+
+    async def collect(self):
+        return [msg async for msg in self]
+
+    def __await__(self):
+        return self.collect().__await__()
+
+
+class NetlinkRequestChain(NetlinkRequest):
+    '''
+    Several requests compiled by one API call, like
+    `get_links(1, 2, 3)`, returned as one response.
+    '''
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def __iter__(self):
+        raise TypeError('use "await" or "async for" to get the response')
+
+    def __aiter__(self):
+        return self.chain()
+
+    async def chain(self):
+        for request in self.requests:
+            async for msg in request:
+                yield msg
+
+
+class AsyncNetlinkSocket(NetlinkSocket):
+    '''
+    Netlink socket for asyncio, see "asyncio" above.
+
+    The socket is bound to the event loop of the first request.
+
+    The responses to all the requests in flight must fit into the
+    socket receive buffer, otherwise the kernel drops messages and
+    the socket fails with ENOBUFS. So only `max_requests` requests
+    are sent at once, and the rest wait in the `deferred` queue.
+    '''
+
+    max_requests = 64
+
+    def __init__(self, *argv, **kwarg):
+        # requests return NetlinkRequest, never tuples
+        kwarg['nlm_generator'] = True
+        super(AsyncNetlinkSocket, self).__init__(*argv, **kwarg)
+        self.loop = None
+        self.reader = None
+        self.requests = {}
+        self.deferred = collections.deque()
+        self.broadcast = None
+        self.compiled = None
+
+    def setup_reader(self):
+        fd = self._sock.fileno()
+        if self.reader == fd:
+            return
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        if self.reader is not None:
+            self.loop.remove_reader(self.reader)
+        self._sock.setblocking(False)
+        self.loop.add_reader(fd, self.read)
+        self.reader = fd
+
+    def read(self):
+        # limit the datagrams per loop iteration, not to
+        # starve other tasks under a broadcast storm
+        for _ in range(64):
+            data = self.buffer_pool.get(DEFAULT_RCVBUF)
+            try:
+                length = self._sock.recv_into(data, len(data))
+            except (BlockingIOError, InterruptedError):
+                self.buffer_pool.release(memoryview(data))
+                return
+            except OSError as e:
+                self.abort(e)
+                return
+            data = self.buffer_pool.view(data, length)
+            try:
+                msgs = self.marshal.parse(data)
+            finally:
+                self.buffer_pool.release(data)
+            for msg in msgs:
+                self.dispatch(msg)
+
+    def dispatch(self, msg):
+        msg['header']['target'] = self.target
+        msg['header']['stats'] = Stats(0, 0, 0)
+        request = self.requests.get(msg['header']['sequence_number'])
+        if request is not None:
+            return request.feed(msg)
+        if msg['header']['type'] == NLMSG_ERROR:
+            # drop orphaned NLMSG_ERROR messages
+            return
+        for cr in self.callbacks:
+            try:
+                if cr[0](msg):
+                    cr[1](msg, *cr[2])
+            except:
+                log.warning("Callback fail: %s" % (cr))
+                log.warning(traceback.format_exc())
+        self.backlog[0].append(msg)
+        if self.broadcast is not None and not self.broadcast.done():
+            self.broadcast.set_result(None)
+
+    def send_deferred(self):
+        while self.deferred and len(self.requests) < self.max_requests:
+            request = self.deferred.popleft()
+            try:
+                request.send()
+            except Exception as e:
+                request.finish(e)
+
+    def abort(self, exception):
+        deferred, self.deferred = self.deferred, collections.deque()
+        for request in tuple(self.requests.values()) + tuple(deferred):
+            request.finish(exception)
+        if self.broadcast is not None and not self.broadcast.done():
+            self.broadcast.set_exception(exception)
+
+    def nlm_request(
+        self,
+        msg,
+        msg_type,
+        msg_flags=NLM_F_REQUEST | NLM_F_DUMP,
+        terminate=None,
+        callback=None,
+    ):
+        request = NetlinkRequest(
+            self, msg, msg_type, msg_flags, terminate, callback
+        )
+        if self.compiled is not None:
+            self.compiled.append(request)
+            return request
+        return request.send()
+
+    def submit(self, method, *argv, **kwarg):
+        '''
+        Run a synchronous API method, e.g. `RTNL_API.link()`,
+        and send the requests it compiles. Return `NetlinkRequest`.
+        '''
+        if self.compiled is not None:
+            # nested API call, like get_links() -> link()
+            return method(self, *argv, **kwarg)
+        self.compiled = []
+        try:
+            method(self, *argv, **kwarg)
+            requests = self.compiled
+        finally:
+            self.compiled = None
+        for request in requests:
+            request.send()
+        if len(requests) == 1:
+            return requests[0]
+        return NetlinkRequestChain(requests)
+
+    async def get(self):
+        '''
+        Wait for broadcast messages and return them as a list.
+        '''
+        self.setup_reader()
+        while not self.backlog[0]:
+            self.broadcast = self.loop.create_future()
+            try:
+                await self.broadcast
+            finally:
+                self.broadcast = None
+        ret, self.backlog[0] = self.backlog[0], []
+        return ret
+
+    def bind(self, groups=0, pid=None, **kwarg):
+        # the async cache thread is not needed here
+        kwarg.pop('async_cache', None)
+        kwarg.pop('async', None)
+        super(AsyncNetlinkSocket, self).bind(groups, pid, **kwarg)
+        self.setup_reader()
+
+    def close(self, code=errno.ECONNRESET):
+        with self.sys_lock:
+            if self.closed:
+                return
+        if self.loop is not None and not self.loop.is_closed():
+            if self.reader is not None:
+                self.loop.remove_reader(self.reader)
+            self.abort(NetlinkError(code or errno.ECONNRESET))
+        self.reader = None
+        super(AsyncNetlinkSocket, self).close(code=0)
@@ -8,6 +8,7 @@ from pr2modules.common import DEFAULT_RCVBUF
 from pr2modules.proxy import NetlinkProxy
 from pr2modules.netlink import NETLINK_ROUTE
 from pr2modules.netlink.nlsocket import NetlinkSocket
+from pr2modules.netlink.nlsocket import AsyncNetlinkSocket
 from pr2modules.netlink.nlsocket import BatchSocket
 from pr2modules.netlink.nlsocket import ChaoticNetlinkSocket
 from pr2modules.netlink import rtnl
@@ -117,6 +118,10 @@ class ChaoticIPRSocket(IPRSocketMixin, ChaoticNetlinkSocket):
     pass
 
 
+class AsyncIPRSocket(IPRSocketMixin, AsyncNetlinkSocket):
+    pass
+
+
 class IPRSocket(IPRSocketMixin, NetlinkSocket):
     '''
     The simplest class, that connects together the netlink parser and
@@ -12,7 +12,7 @@ class MarshalUevent(Marshal):
     def parse(self, data, seq=None, callback=None):
         ret = ueventmsg()
         ret['header']['sequence_number'] = 0
-        data = data.split(b'\x00')
+        data = bytes(data).split(b'\x00')
         wtf = []
         ret['header']['message'] = data[0].decode('utf-8')
         ret['header']['unparsed'] = b''
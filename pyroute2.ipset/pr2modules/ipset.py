@@ -8,16 +8,23 @@ that this module is working with all available ipset modules.
 It supports almost all kernel commands (create, destroy, flush,
 rename, swap, test...)
 '''
+import os
 import errno
 import socket
+import struct
+from socket import inet_pton
+from socket import SOL_SOCKET
+from socket import SO_RCVBUF
 from pr2modules.common import basestring
 from pr2modules.netlink import NLMSG_ERROR
+from pr2modules.netlink import NLA_F_NET_BYTEORDER
 from pr2modules.netlink import NLM_F_REQUEST
 from pr2modules.netlink import NLM_F_DUMP
 from pr2modules.netlink import NLM_F_ACK
 from pr2modules.netlink import NLM_F_EXCL
 from pr2modules.netlink import NETLINK_NETFILTER
 from pr2modules.netlink.exceptions import NetlinkError, IPSetError
+from pr2modules.netlink.nlsocket import BatchSocket
 from pr2modules.netlink.nlsocket import NetlinkSocket
 from pr2modules.netlink.nfnetlink import NFNL_SUBSYS_IPSET
 from pr2modules.netlink.nfnetlink.ipset import IPSET_CMD_PROTOCOL
@@ -65,6 +72,42 @@ def _nlmsg_error(msg):
     return msg['header']['type'] == NLMSG_ERROR
 
 
+def _pack_nla(nla_type, payload):
+    length = 4 + len(payload)
+    return (
+        struct.pack('HH', length, nla_type) + payload + b'\0' * (-length % 4)
+    )
+
+
+# IPSET_ATTR_DATA attributes codec for IPSet._pack_data():
+# name -> (NLA type with flags, NLA class name)
+_adt_codec = {}
+for _nla in ipset_msg.ipset_generic.adt_data.nla_map:
+    _adt_codec[_nla[1]] = (
+        _nla[0]
+        | (_nla[3] if len(_nla) > 3 else 0)
+        | getattr(ipset_msg.ipset_generic.adt_data, _nla[2]).nla_flags,
+        _nla[2],
+    )
+_adt_codec['IPSET_ATTR_DATA'] = (
+    7 | ipset_msg.ipset_generic.adt_data.nla_flags,
+    'adt_data',
+)
+_adt_addr = {
+    'IPSET_ATTR_IPADDR_IPV4': (socket.AF_INET, 1 | NLA_F_NET_BYTEORDER),
+    'IPSET_ATTR_IPADDR_IPV6': (socket.AF_INET6, 2 | NLA_F_NET_BYTEORDER),
+}
+_adt_formats = {
+    'be8': '>B',
+    'be16': '>H',
+    'be32': '>I',
+    'be64': '>Q',
+    'uint32': 'I',
+    'skbmark': '>II',
+    'skbprio': '>HH',
+}
+
+
 class PortRange(object):
     """A simple container for port range with optional protocol
 
@@ -109,8 +152,16 @@ class IPSet(NetlinkSocket):
         IPSET_CMD_HEADER: ipset_msg,
         IPSET_CMD_GET_BYNAME: ipset_msg,
         IPSET_CMD_GET_BYINDEX: ipset_msg,
+        # to decode requests returned with errors
+        IPSET_CMD_ADD: ipset_msg,
+        IPSET_CMD_DEL: ipset_msg,
+        IPSET_CMD_TEST: ipset_msg,
     }
 
+    # max IPSET_ATTR_ADT payload in bulk requests, the NLA
+    # length is 16 bit
+    adt_size = 0xF000
+
     attr_map = {
         'iface': 'IPSET_ATTR_IFACE',
         'mark': 'IPSET_ATTR_MARK',
@@ -378,16 +429,13 @@ class IPSet(NetlinkSocket):
 
         return attrs
 
-    def _add_delete_test(
+    def _entry_data(
         self,
-        name,
         entry,
-        family,
-        cmd,
-        exclusive,
+        etype,
+        ip_version,
         comment=None,
         timeout=None,
-        etype="ip",
         packets=None,
         bytes=None,
         skbmark=None,
@@ -395,21 +443,19 @@ class IPSet(NetlinkSocket):
         skbqueue=None,
         wildcard=False,
         physdev=False,
+        lineno=0,
     ):
-        excl_flag = NLM_F_EXCL if exclusive else 0
         adt_flags = 0
         if wildcard:
             adt_flags |= IPSET_FLAG_IFACE_WILDCARD
         if physdev:
             adt_flags |= IPSET_FLAG_PHYSDEV
 
-        ip_version = self._family_to_version(family)
         data_attrs = self._entry_to_data_attrs(entry, etype, ip_version)
         if comment is not None:
-            data_attrs += [
-                ["IPSET_ATTR_COMMENT", comment],
-                ["IPSET_ATTR_CADT_LINENO", 0],
-            ]
+            data_attrs += [["IPSET_ATTR_COMMENT", comment]]
+        if comment is not None or lineno:
+            data_attrs += [["IPSET_ATTR_CADT_LINENO", lineno]]
         if timeout is not None:
             data_attrs += [["IPSET_ATTR_TIMEOUT", timeout]]
         if bytes is not None:
@@ -424,6 +470,14 @@ class IPSet(NetlinkSocket):
             data_attrs += [["IPSET_ATTR_SKBQUEUE", skbqueue]]
         if adt_flags:
             data_attrs += [["IPSET_ATTR_CADT_FLAGS", adt_flags]]
+        return data_attrs
+
+    def _add_delete_test(
+        self, name, entry, family, cmd, exclusive, etype="ip", **kwargs
+    ):
+        excl_flag = NLM_F_EXCL if exclusive else 0
+        ip_version = self._family_to_version(family)
+        data_attrs = self._entry_data(entry, etype, ip_version, **kwargs)
         msg = ipset_msg()
         msg['attrs'] = [
             ['IPSET_ATTR_PROTOCOL', self._proto_version],
@@ -438,6 +492,199 @@ class IPSet(NetlinkSocket):
             terminate=_nlmsg_error,
         )
 
+    def _pack_data(self, attrs):
+        #
+        # Encode IPSET_ATTR_DATA for multi-entry requests. The
+        # generic NLA encoder instantiates an object per attribute,
+        # that is too slow for big sets, so the simple attribute
+        # types are packed directly; the rest falls back to the
+        # generic encoder.
+        #
+        chain = []
+        try:
+            for name, value in attrs:
+                nla_type, kind = _adt_codec[name]
+                if kind == 'ipset_ip':
+                    ((version, addr),) = value['attrs']
+                    family, addr_type = _adt_addr[version]
+                    payload = _pack_nla(addr_type, inet_pton(family, addr))
+                elif kind == 'asciiz':
+                    payload = value.encode('utf-8') + b'\0'
+                elif kind == 'l2addr':
+                    payload = struct.pack(
+                        '6B', *[int(x, 16) for x in value.split(':')]
+                    )
+                elif isinstance(value, (tuple, list)):
+                    payload = struct.pack(_adt_formats[kind], *value)
+                else:
+                    payload = struct.pack(_adt_formats[kind], value)
+                chain.append(_pack_nla(nla_type, payload))
+        except KeyError:
+            adt = ipset_msg.attr_adt()
+            adt['attrs'] = [['IPSET_ATTR_DATA', {'attrs': attrs}]]
+            adt.encode()
+            return bytes(adt.data[4 : adt.length])
+        return _pack_nla(_adt_codec['IPSET_ATTR_DATA'][0], b''.join(chain))
+
+    def _bulk(self, name, entries, family, cmd, exclusive, etype, **kwargs):
+        #
+        # Every entry gets IPSET_ATTR_CADT_LINENO = its index + 1.
+        # The kernel stops on the first failed entry of a message
+        # and returns the request back with IPSET_ATTR_LINENO set to
+        # the lineno of that entry. The entries after it are not
+        # processed, so send them again with the next round.
+        #
+        entries = list(entries)
+        ip_version = self._family_to_version(family)
+        excl_flag = NLM_F_EXCL if exclusive else 0
+        # compile the request up to the empty IPSET_ATTR_ADT, the
+        # NLA header of IPSET_ATTR_ADT is the tail of the head
+        msg = ipset_msg()
+        msg['header']['type'] = cmd | (NFNL_SUBSYS_IPSET << 8)
+        msg['header']['flags'] = NLM_F_REQUEST | NLM_F_ACK | excl_flag
+        msg['header']['pid'] = self.epid or os.getpid()
+        msg['nfgen_family'] = self._nfgen_family
+        msg['attrs'] = [
+            ['IPSET_ATTR_PROTOCOL', self._proto_version],
+            ['IPSET_ATTR_SETNAME', name],
+            ['IPSET_ATTR_LINENO', 0],
+            ['IPSET_ATTR_ADT', {'attrs': []}],
+        ]
+        msg.encode()
+        head = bytes(msg.data[: msg.length])
+        # error replies carry the request back, they must fit
+        # into the receive buffer
+        max_messages = self.getsockopt(SOL_SOCKET, SO_RCVBUF) // (
+            2 * (len(head) + self.adt_size)
+        )
+        batch = BatchSocket()
+        packed = {}
+        failed = []
+        pending = [(0, len(entries))]
+        try:
+            while pending:
+                batch.reset()
+                sent = []
+                for begin, end in pending:
+                    data = []
+                    size = 0
+                    for index in range(begin, end):
+                        if index not in packed:
+                            entry = entries[index]
+                            spec = dict(kwargs)
+                            if isinstance(entry, dict):
+                                spec.update(entry)
+                                entry = spec.pop('entry')
+                            try:
+                                packed[index] = self._pack_data(
+                                    self._entry_data(
+                                        entry,
+                                        etype,
+                                        ip_version,
+                                        lineno=index + 1,
+                                        **spec
+                                    )
+                                )
+                            except Exception as e:
+                                packed[index] = None
+                                failed.append((index, e))
+                        if packed[index] is None:
+                            continue
+                        if data and size + len(packed[index]) > self.adt_size:
+                            sent.append((begin, index))
+                            self._bulk_compile(batch, head, data, size)
+                            begin = index
+                            data = []
+                            size = 0
+                        data.append(packed[index])
+                        size += len(packed[index])
+                    if data:
+                        sent.append((begin, end))
+                        self._bulk_compile(batch, head, data, size)
+                pending = []
+                results = batch.submit(self, max(1, max_messages))
+                for (begin, end), error in zip(sent, results):
+                    if not isinstance(error, Exception):
+                        continue
+                    if not isinstance(error, NetlinkError):
+                        raise error
+                    lineno = 0
+                    if isinstance(error.errmsg, ipset_msg):
+                        lineno = error.errmsg.get_attr('IPSET_ATTR_LINENO')
+                    error = _IPSetError(error.code, cmd=cmd)
+                    if begin < (lineno or 0) <= end:
+                        failed.append((lineno - 1, error))
+                        if lineno < end:
+                            pending.append((lineno, end))
+                    elif end - begin == 1:
+                        failed.append((begin, error))
+                    else:
+                        # no lineno reported: retry one by one
+                        pending.extend([(x, x + 1) for x in range(begin, end)])
+        finally:
+            batch.close()
+        failed.sort(key=lambda x: x[0])
+        return [(entries[x], y) for (x, y) in failed]
+
+    @staticmethod
+    def _bulk_compile(batch, head, data, size):
+        offset = len(batch.batch)
+        batch.batch += head
+        batch.batch += b''.join(data)
+        struct.pack_into('I', batch.batch, offset, len(head) + size)
+        struct.pack_into('H', batch.batch, offset + len(head) - 4, 4 + size)
+
+    def bulk_add(
+        self,
+        name,
+        entries,
+        family=socket.AF_INET,
+        exclusive=True,
+        etype="ip",
+        **kwargs
+    ):
+        '''
+        Add many members to the ipset.
+
+        Entries are packed into multi-entry `IPSET_CMD_ADD` messages,
+        and the messages are sent in batches, see `BatchSocket.submit()`.
+        An entry is a value like for :func:`add`, or a dict with the
+        value under the `entry` key and per-entry options::
+
+            ipset.bulk_add("foo", ["198.51.100.1", "198.51.100.2"])
+            ipset.bulk_add(
+                "bar",
+                [
+                    {"entry": "198.51.100.1", "comment": "first"},
+                    {"entry": "198.51.100.2", "timeout": 60},
+                ],
+                comment="default",
+            )
+
+        Other keyword arguments are default options for all the
+        entries, see :func:`add`.
+
+        A failed entry doesn't stop the rest. Return the list of
+        `(entry, IPSetError)` tuples for the failed entries, in the
+        order of `entries`; an empty list means that all the entries
+        are added.
+        '''
+        return self._bulk(
+            name, entries, family, IPSET_CMD_ADD, exclusive, etype, **kwargs
+        )
+
+    def bulk_delete(
+        self, name, entries, family=socket.AF_INET, exclusive=True, etype="ip"
+    ):
+        '''
+        Delete many members from the ipset.
+
+        See :func:`bulk_add` for the parameters and the return value.
+        '''
+        return self._bulk(
+            name, entries, family, IPSET_CMD_DEL, exclusive, etype
+        )
+
     def add(
         self,
         name,
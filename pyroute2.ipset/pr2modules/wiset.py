@@ -357,6 +357,12 @@ class WiSet(object):
         we add the element. Without this reset, kernel sometimes store old
         values and can add very strange behavior on counters.
         """
+        entry, kwargs = self._entry_kwargs(entry, kwargs)
+        add_ipset_entry(
+            self.name, entry, etype=self.entry_type, sock=self.sock, **kwargs
+        )
+
+    def _entry_kwargs(self, entry, kwargs):
         if isinstance(entry, dict):
             kwargs.update(entry)
             entry = kwargs.pop("entry")
@@ -372,9 +378,7 @@ class WiSet(object):
             except IndexError:
                 mask = int("0xffffffff", 16)
             kwargs["skbmark"] = (mark, mask)
-        add_ipset_entry(
-            self.name, entry, etype=self.entry_type, sock=self.sock, **kwargs
-        )
+        return entry, kwargs
 
     def delete(self, entry, **kwargs):
         """Delete/remove an entry in this ipset"""
@@ -418,9 +422,32 @@ class WiSet(object):
         return self._content
 
     def insert_list(self, entries):
-        """Just a small helper to reduce the number of loops in main code."""
+        """Add a list of entries with multi-entry requests.
+
+        A failed entry doesn't stop the rest, but the first error is
+        raised when all the list is processed.
+        """
+        bulk = []
         for entry in entries:
-            self.add(entry)
+            entry, kwargs = self._entry_kwargs(entry, {})
+            kwargs["entry"] = entry
+            bulk.append(kwargs)
+        failed = add_ipset_entries(
+            self.name, bulk, etype=self.entry_type, sock=self.sock
+        )
+        if failed:
+            raise failed[0][1]
+
+    def delete_list(self, entries):
+        """Delete a list of entries with multi-entry requests.
+
+        See :func:`insert_list` on errors.
+        """
+        failed = delete_ipset_entries(
+            self.name, entries, etype=self.entry_type, sock=self.sock
+        )
+        if failed:
+            raise failed[0][1]
 
     def replace_entries(self, new_list):
         """Replace the content of an ipset with a new list of entries.
@@ -438,9 +465,11 @@ class WiSet(object):
         temp.name = temp_name
         temp.sock = self.sock
         temp.create()
-        temp.insert_list(new_list)
-        swap_ipsets(self.name, temp_name, sock=self.sock)
-        temp.destroy()
+        try:
+            temp.insert_list(new_list)
+            swap_ipsets(self.name, temp_name, sock=self.sock)
+        finally:
+            temp.destroy()
 
 
 @need_ipset_socket
@@ -549,6 +578,18 @@ def delete_ipset_entry(name, entry, sock=None, **kwargs):
     sock.delete(name, entry, **kwargs)
 
 
+@need_ipset_socket
+def add_ipset_entries(name, entries, sock=None, **kwargs):
+    """Add a list of entries, return the failed ones"""
+    return sock.bulk_add(name, entries, **kwargs)
+
+
+@need_ipset_socket
+def delete_ipset_entries(name, entries, sock=None, **kwargs):
+    """Remove a list of entries, return the failed ones"""
+    return sock.bulk_delete(name, entries, **kwargs)
+
+
 @need_ipset_socket
 def test_ipset_exist(name, sock=None):
     """Test if the given ipset exist"""
@@ -15,6 +15,7 @@ def init(config):
     messenger = Messenger(
         config['local']['id'],
         Transport(config['local']['address'], config['local']['port']),
+        fanout=config['local'].get('fanout'),
     )
 
     for target in config['local'].get('targets', []):
@@ -0,0 +1,172 @@
+'''
+Event coalescing
+----------------
+
+A source may keep the RTNL events for a short time window before
+forwarding them to the DB, and forward only the latest state of every
+object changed within the window. E.g. the kernel may announce the
+same route several times in a burst -- add, change, delete, add --
+and the DB has to load only the last message::
+
+    ndb.sources.add(netns='test01', coalesce=0.05)
+
+The window is in seconds; no coalescing by default. The object key
+is the DB index of the table, see `DBSchema.indices`, with a few more
+fields. Deletes follow the same rule for routes, addresses and
+neighbours, the latest event wins. The interfaces are referred by
+other tables, so an interface delete is never merged: it is forwarded
+in the order it came, and the events after it make a new state.
+Other events, e.g. rules or netns, are forwarded as is.
+
+The counters::
+
+    >>> ndb.sources['test01'].coalescer.stats()
+    {'received': 1200, 'forwarded': 300, 'collapsed': 900,
+     'pending': 0, 'flushes': 4}
+'''
+import itertools
+import threading
+from collections import OrderedDict
+from pr2modules.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.ndmsg import ndmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+from .events import ShutdownException
+
+# message class: (table, the fields to add to the table index)
+keys = {
+    ifinfmsg: ('interfaces', ('family',)),
+    ifaddrmsg: ('addresses', ()),
+    rtmsg: ('routes', ('RTA_GATEWAY',)),
+    ndmsg: ('neighbours', ('family', 'NDA_DST')),
+}
+# the classes referred by other tables
+parents = (ifinfmsg,)
+
+
+class Coalescer(object):
+    '''
+    Collect the events with `push()`, forward them with the `put`
+    function `window` seconds after the first event of a batch.
+    '''
+
+    def __init__(self, put, indices, window, name='coalescer'):
+        self.put = put
+        self.window = window
+        self.name = name
+        self.fields = {}
+        for msg_class, (table, extra) in keys.items():
+            self.fields[msg_class] = tuple(indices[table]) + extra
+        self.pending = OrderedDict()
+        self.epochs = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.shutdown = threading.Event()
+        self.sequence = itertools.count()
+        self.received = 0
+        self.forwarded = 0
+        self.collapsed = 0
+        self.flushes = 0
+        self.th = None
+
+    def key(self, msg):
+        fields = self.fields.get(type(msg))
+        if fields is None or msg['header'].get('error'):
+            return None
+        key = [type(msg)]
+        for field in fields:
+            value = msg.get(field)
+            if value is None:
+                value = msg.get_attr(field)
+            key.append(value)
+        key = tuple(key)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def push(self, msgs):
+        with self.lock:
+            for msg in msgs:
+                self.received += 1
+                key = self.key(msg)
+                if key is None:
+                    # forward as is
+                    key = next(self.sequence)
+                elif type(msg) in parents:
+                    epoch = self.epochs.get(key, 0)
+                    if msg['header']['type'] % 2:
+                        # delete: forward in order, start a new state
+                        self.epochs[key] = epoch + 1
+                        key = next(self.sequence)
+                    else:
+                        # keep the position, update the state
+                        key += (epoch,)
+                        if key in self.pending:
+                            self.collapsed += 1
+                elif self.pending.pop(key, None) is not None:
+                    # the latest event wins
+                    self.collapsed += 1
+                self.pending[key] = msg
+            if self.pending and not self.ready.is_set():
+                self.ready.set()
+                if self.th is None or not self.th.is_alive():
+                    self.shutdown.clear()
+                    self.th = threading.Thread(
+                        target=self.run, name='NDB %s' % self.name
+                    )
+                    self.th.daemon = True
+                    self.th.start()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                msgs = tuple(self.pending.values())
+                self.pending = OrderedDict()
+                self.epochs = {}
+                self.ready.clear()
+                if msgs:
+                    self.forwarded += len(msgs)
+                    self.flushes += 1
+            if msgs:
+                self.put(msgs)
+
+    def run(self):
+        while not self.shutdown.is_set():
+            self.ready.wait()
+            if self.shutdown.wait(self.window):
+                break
+            try:
+                self.flush()
+            except ShutdownException:
+                break
+
+    def close(self, discard=False):
+        '''
+        Stop the thread and forward the pending events, or drop
+        them if `discard` is True.
+        '''
+        self.shutdown.set()
+        self.ready.set()
+        if self.th is not None:
+            self.th.join()
+            self.th = None
+        if discard:
+            with self.lock:
+                self.pending = OrderedDict()
+                self.epochs = {}
+                self.ready.clear()
+        else:
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'received': self.received,
+                'forwarded': self.forwarded,
+                'collapsed': self.collapsed,
+                'pending': len(self.pending),
+                'flushes': self.flushes,
+            }
@@ -0,0 +1,478 @@
+'''
+Columnar storage
+----------------
+
+For read-heavy monitoring, when the NDB objects are only looked up
+and reported, but never changed via NDB, there is an in-memory
+storage provider that doesn't use SQL for the RTNL records::
+
+    ndb = NDB(db_provider='columnar')
+
+    ndb.interfaces['eth0']             # a read-only record
+    ndb.routes.summary()
+    ndb.addresses.dump()
+
+Every table -- interfaces, addresses, routes, neighbours, rules and
+netns -- is kept as a set of columns, one list per field, with a
+hash index on the key fields of the table. The records are updated
+in place, so the events loading doesn't depend on the table size,
+and the lookups by the key fields take the same time for any number
+of records.
+
+Limitations:
+
+* the views return read-only records instead of RTNL objects, thus
+  `create()` raises `TypeError`, like the records on changes
+* only the main tables are loaded: no `ifinfo_*` tables with the
+  interface kind specific info, no multipath routes nexthops and
+  metrics, no bridge vlans and fdb records
+* the service tables, like `sources`, still use an in-memory SQLite3
+  DB
+'''
+import sys
+import threading
+from pr2modules.config import AF_BRIDGE
+from pr2modules.common import basestring
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pr2modules.netlink.rtnl.ndmsg import ndmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+from .schema import DBSchema
+from .schema import publish_exec
+
+if sys.version_info[0] > 2:
+    intern = sys.intern
+
+tables = ('interfaces', 'addresses', 'routes', 'neighbours', 'rules', 'netns')
+
+#
+# summary() specs: (header, fields, interface index field)
+#
+# None in the fields means the interface name, that is looked up
+# in the interfaces table by the index field value, like INNER JOIN
+# in the SQL summary() requests
+#
+summary_spec = {
+    'interfaces': (
+        ('target', 'tflags', 'index', 'ifname', 'address', 'flags', 'kind'),
+        (
+            'target',
+            'tflags',
+            'index',
+            'IFLA_IFNAME',
+            'IFLA_ADDRESS',
+            'flags',
+            'IFLA_INFO_KIND',
+        ),
+        None,
+    ),
+    'addresses': (
+        ('target', 'tflags', 'ifname', 'address', 'prefixlen'),
+        ('target', 'tflags', None, 'IFA_ADDRESS', 'prefixlen'),
+        'index',
+    ),
+    'routes': (
+        ('target', 'tflags', 'table', 'ifname', 'dst', 'dst_len', 'gateway'),
+        (
+            'target',
+            'tflags',
+            'RTA_TABLE',
+            None,
+            'RTA_DST',
+            'dst_len',
+            'RTA_GATEWAY',
+        ),
+        'RTA_OIF',
+    ),
+    'neighbours': (
+        ('target', 'tflags', 'ifname', 'lladdr', 'dst'),
+        ('target', 'tflags', None, 'NDA_LLADDR', 'NDA_DST'),
+        'ifindex',
+    ),
+    'rules': (
+        ('target', 'tflags', 'family', 'priority', 'action', 'table'),
+        ('target', 'tflags', 'family', 'FRA_PRIORITY', 'action', 'FRA_TABLE'),
+        None,
+    ),
+}
+
+
+class ColumnTable(object):
+    '''
+    One table: a list per field, the rows are the list positions.
+    The hash index maps record_key() of the index values to the row.
+    Deleted rows are reused, the target column of a free row is None.
+    '''
+
+    def __init__(self, names, norm_names, idx):
+        self.names = tuple(names)
+        self.norm_names = tuple(norm_names)
+        self.columns = [[] for _ in self.names]
+        self.keys = []
+        self.index = {}
+        self.free = []
+        # column positions by both the field and the normalized names
+        self.fields = {}
+        for pos, name in enumerate(self.norm_names):
+            self.fields[name] = pos
+        for pos, name in enumerate(self.names):
+            self.fields[name] = pos
+        self.key_fields = tuple([self.fields[x] for x in idx])
+
+    def __len__(self):
+        return len(self.index)
+
+    def upsert(self, values, ivalues):
+        key = DBSchema.record_key(ivalues)
+        row = self.index.get(key)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+                self.keys[row] = key
+            else:
+                row = len(self.keys)
+                self.keys.append(key)
+                for column in self.columns:
+                    column.append(None)
+            self.index[key] = row
+        for column, value in zip(self.columns, values):
+            if type(value) is str:
+                value = intern(value)
+            column[row] = value
+        return row
+
+    def row(self, row):
+        return tuple([column[row] for column in self.columns])
+
+    def drop(self, row):
+        #
+        # remove a row, return the record
+        #
+        ret = self.row(row)
+        self.index.pop(self.keys[row], None)
+        self.keys[row] = None
+        for column in self.columns:
+            column[row] = None
+        self.free.append(row)
+        return ret
+
+    def delete(self, key):
+        row = self.index.get(key)
+        if row is not None:
+            return self.drop(row)
+
+    def scan(self, spec):
+        #
+        # rows matching {column position: value}; list.index() runs
+        # the search on the first column in C, the rest of the spec
+        # is checked only for the found rows
+        #
+        if not spec:
+            return [x for x, key in enumerate(self.keys) if key is not None]
+        ret = []
+        items = list(spec.items())
+        pos, value = items.pop(0)
+        column = self.columns[pos]
+        idx = -1
+        while True:
+            try:
+                idx = column.index(value, idx + 1)
+            except ValueError:
+                break
+            for pos, value2 in items:
+                if self.columns[pos][idx] != value2:
+                    break
+            else:
+                if self.keys[idx] is not None:
+                    ret.append(idx)
+        return ret
+
+    def select(self, spec):
+        #
+        # try the hash index first, the key of the most of the
+        # records has tflags == 0
+        #
+        key = []
+        for pos in self.key_fields:
+            if pos == 1:
+                key.append(spec.get(pos, 0))
+            elif pos in spec:
+                key.append(spec[pos])
+            else:
+                break
+        else:
+            row = self.index.get(DBSchema.record_key(key))
+            if row is not None and all(
+                [self.columns[x][row] == y for x, y in spec.items()]
+            ):
+                return [row]
+        return self.scan(spec)
+
+    def delete_where(self, spec):
+        return [self.drop(row) for row in self.scan(spec)]
+
+    def flush(self, target):
+        return self.delete_where({0: target})
+
+    def retag(self, target, mark):
+        for row in self.scan({0: target}):
+            key = self.keys[row]
+            self.index.pop(key, None)
+            key = key[:1] + (mark,) + key[2:]
+            self.keys[row] = key
+            self.index[key] = row
+            self.columns[1][row] = mark
+
+    def dump(self):
+        return [x for x in zip(*self.columns) if x[0] is not None]
+
+
+class ColumnarSchema(DBSchema):
+    '''
+    DBSchema that keeps the RTNL tables in ColumnTable instances.
+    The updates run in the main loop as usual, the lookups may run
+    in any thread under `self.lock`.
+    '''
+
+    def __init__(self, ndb, connection, mode, rtnl_log, tid, readers=None):
+        # the service tables go to the SQLite3 DB
+        super(ColumnarSchema, self).__init__(
+            ndb, connection, 'sqlite3', rtnl_log, tid
+        )
+        self.lock = threading.Lock()
+        self.columns = {}
+        # integer fields, to convert the lookup values like SQL does
+        self.numeric = {}
+        for table in tables:
+            compiled = self.compiled[table]
+            self.columns[table] = ColumnTable(
+                compiled['all_names'], compiled['norm_names'], compiled['idx']
+            )
+            self.numeric[table] = set(
+                [x[-1] for x, y in self.spec[table].items() if 'INT' in y]
+            )
+        self.loaders = {
+            ifinfmsg: load_ifinfmsg,
+            ifaddrmsg: load_ifaddrmsg,
+            rtmsg: load_rtmsg,
+            ndmsg: load_ndmsg,
+        }
+
+    def mark(self, target, mark):
+        with self.lock:
+            for columns in self.columns.values():
+                columns.retag(target, mark)
+
+    @publish_exec
+    def flush(self, target):
+        with self.lock:
+            for columns in self.columns.values():
+                columns.flush(target)
+
+    def cascade(self, table, record):
+        #
+        # delete the dependent records, like ON DELETE CASCADE
+        #
+        parent = self.columns[table]
+        for child, fkey in self.dependents[table]:
+            columns = self.columns.get(child)
+            if columns is None:
+                continue
+            spec = {}
+            for field, pfield in zip(fkey['fields'], fkey['parent_fields']):
+                spec[columns.fields[field[2:]]] = record[
+                    parent.fields[pfield[2:]]
+                ]
+            for crecord in columns.delete_where(spec):
+                self.cascade(child, crecord)
+
+    def delete_where(self, table, target, **spec):
+        columns = self.columns[table]
+        spec = dict([(columns.fields[x], y) for x, y in spec.items()])
+        spec[0] = target
+        with self.lock:
+            for record in columns.delete_where(spec):
+                self.cascade(table, record)
+
+    def load_netlink(self, table, target, event, ctable=None, propagate=False):
+        #
+        if self.rtnl_log:
+            self.log_netlink(table, target, event, ctable)
+        #
+        if 'stats' in event['header']:
+            self.stats[target] = event['header']['stats']
+        #
+        columns = self.columns.get(table)
+        if columns is None:
+            return
+        if event['header'].get('type', 0) % 2:
+            ivalues = self.index_values(table, target, event)
+            key = self.record_key(ivalues)
+            with self.lock:
+                record = columns.delete(key)
+                if record is not None:
+                    self.cascade(table, record)
+            if table in self.watchers:
+                self._notify.append((table, key, None))
+        else:
+            values, ivalues = self.extract(table, target, event)
+            with self.lock:
+                columns.upsert(values, ivalues)
+            if table in self.watchers:
+                self._notify.append((table, self.record_key(ivalues), values))
+        if self._notify and self._bulk is None:
+            self.notify()
+
+    def rows(self, tables):
+        ret = []
+        with self.lock:
+            for table in tables:
+                if table in self.columns:
+                    rows = [list(x) for x in self.columns[table].dump()]
+                    if rows:
+                        ret.append((table, rows))
+        return ret
+
+    def load_rows(self, target, rows):
+        for table, records in rows:
+            columns = self.columns[table]
+            ipos = [
+                x
+                for x, name in enumerate(columns.names)
+                if name in self.compiled[table]['idx']
+            ]
+            with self.lock:
+                for values in records:
+                    values[0] = target
+                    ivalues = [values[x] for x in ipos]
+                    columns.upsert(values, ivalues)
+                    if table in self.watchers:
+                        self._notify.append(
+                            (table, self.record_key(ivalues), values)
+                        )
+        if self._notify and self._bulk is None:
+            self.notify()
+
+    def select(self, table, spec):
+        #
+        # Lookup records by a spec, where the keys are the field
+        # names, normalized or not, e.g. {'ifname': 'eth0'}
+        #
+        cls = self.classes[table]
+        columns = self.columns[table]
+        numeric = self.numeric[table]
+        cspec = {}
+        for key, value in spec.items():
+            if key not in columns.fields:
+                key = cls.name2nla(key)
+            if key not in columns.fields:
+                raise KeyError('field name not found')
+            pos = columns.fields[key]
+            if isinstance(value, basestring) and columns.names[pos] in numeric:
+                try:
+                    value = int(value)
+                except ValueError:
+                    pass
+            cspec[pos] = value
+        with self.lock:
+            return [columns.row(x) for x in columns.select(cspec)]
+
+    def get(self, table, spec):
+        names = self.columns[table].names
+        for record in self.select(table, spec):
+            yield dict(zip(names, record))
+
+    def count(self, table):
+        return len(self.columns[table])
+
+    def dump(self, table):
+        yield self.columns[table].norm_names
+        with self.lock:
+            records = self.columns[table].dump()
+        for record in records:
+            yield record
+
+    def summary(self, table):
+        columns = self.columns[table]
+        if table not in summary_spec:
+            header = self.compiled[table]['norm_idx']
+            fields = [columns.fields[x] for x in self.compiled[table]['idx']]
+            join = None
+        else:
+            header, fields, join = summary_spec[table]
+            fields = [None if x is None else columns.fields[x] for x in fields]
+        yield header
+        with self.lock:
+            records = columns.dump()
+            if join is not None:
+                interfaces = self.columns['interfaces']
+                join = columns.fields[join]
+                ifname = interfaces.fields['IFLA_IFNAME']
+                names = dict(
+                    [
+                        (
+                            (x[0], x[1], x[interfaces.fields['index']]),
+                            x[ifname],
+                        )
+                        for x in interfaces.dump()
+                    ]
+                )
+        for record in records:
+            if join is None:
+                yield tuple([record[x] for x in fields])
+                continue
+            name = names.get((record[0], record[1], record[join]))
+            if name is None:
+                continue
+            yield tuple([name if x is None else record[x] for x in fields])
+
+
+def flush_routes(schema, target, index):
+    schema.delete_where('routes', target, RTA_OIF=index)
+    schema.delete_where('routes', target, RTA_IIF=index)
+
+
+def load_ifinfmsg(schema, target, event):
+    #
+    # link goes down: flush all related routes
+    #
+    if not event['flags'] & 1:
+        flush_routes(schema, target, event['index'])
+    #
+    # ignore wireless updates and AF_BRIDGE events
+    #
+    if event.get_attr('IFLA_WIRELESS') or event['family'] == AF_BRIDGE:
+        return
+    schema.load_netlink('interfaces', target, event)
+
+
+def load_ifaddrmsg(schema, target, event):
+    schema.load_netlink('addresses', target, event)
+    #
+    # last IPv4 address removal should trigger routes flush
+    #
+    if event['header']['type'] % 2 and event.get('index'):
+        if not schema.select(
+            'addresses',
+            {'target': target, 'index': event['index'], 'family': 2},
+        ):
+            flush_routes(schema, target, event['index'])
+
+
+def load_rtmsg(schema, target, event):
+    if event.get_attr('RTA_TABLE', -1) == -1:
+        event['attrs'].append(['RTA_TABLE', 254])
+    if not event['header']['type'] % 2:
+        event['deps'] = 0
+    schema.load_netlink('routes', target, event)
+
+
+def load_ndmsg(schema, target, event):
+    #
+    # ignore events with ifindex == 0 and AF_BRIDGE events
+    #
+    if event['ifindex'] == 0 or event['family'] == AF_BRIDGE:
+        return
+    if event.get_attr('NDA_IFINDEX') is None:
+        event['attrs'].append(('NDA_IFINDEX', event['ifindex']))
+    schema.load_netlink('neighbours', target, event)
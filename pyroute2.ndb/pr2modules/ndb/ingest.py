@@ -0,0 +1,128 @@
+'''
+Parallel ingestion
+------------------
+
+By default the NDB main loop parses and loads the initial dumps of
+all the sources one after another. With many sources, e.g. hundreds
+of network namespaces, the startup time is the sum of all the dumps.
+
+With `ingest_workers` NDB starts a pool of worker processes. Every
+local or netns source sends its initial dump request to the pool,
+and a worker fetches the dump, parses the messages and runs the
+usual loaders into its own in-memory DB of the same provider. The
+resulting rows go back to the source, and the main loop only writes
+them into the DB in bulk, see `DBSchema.load_rows()`::
+
+    ndb = NDB(
+        sources=[{'netns': 'test%03i' % x} for x in range(300)],
+        ingest_workers=8,
+    )
+
+The source socket is bound before the dump request. The source
+thread doesn't wait for the worker, it keeps reading the events,
+and the events that come during the dump are loaded after the rows,
+as usual. The runtime events and the sources of other kinds are not
+affected. If the worker fails, the source loads the dump itself.
+
+The workers make sense only with spare CPU cores: spawning the
+workers and transferring the rows cost more than the parsing saves
+on a single core host.
+
+The workers are started with the `spawn` method, so the main module
+of the program must be safe to import, that is to be guarded with
+`if __name__ == '__main__'`.
+'''
+import sys
+import sqlite3
+import threading
+import traceback
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.iproute.linux import IPRoute
+from . import schema
+from .events import RescheduleException
+
+# the source kinds to load in the pool
+kinds = {'local': IPRoute}
+
+if sys.platform.startswith('linux'):
+    from pr2modules.nslink.nslink import NetNS
+
+    kinds['netns'] = NetNS
+
+
+def zero_if(target):
+    #
+    # the fake interface with index 0, see
+    # https://github.com/svinota/pyroute2/issues/737
+    #
+    msg = ifinfmsg()
+    msg['index'] = 0
+    msg['state'] = 'up'
+    msg['flags'] = 1
+    msg['header']['flags'] = 2
+    msg['header']['type'] = 16
+    msg['header']['target'] = target
+    msg['event'] = 'RTM_NEWLINK'
+    msg['attrs'] = [
+        ('IFLA_IFNAME', 'https://github.com/svinota/pyroute2/issues/737'),
+        ('IFLA_ADDRESS', '00:00:00:00:00:00'),
+    ]
+    msg.encode()
+    return msg
+
+
+class IngestHost(object):
+    '''
+    The minimal NDB environment to run `DBSchema` in a worker
+    '''
+
+    def __init__(self, target, kind, mode):
+        from .main import Log
+        from .main import register_sqlite3_adapters
+
+        self.log = Log()
+        self._event_map = {}
+        register_sqlite3_adapters()
+        if mode != 'columnar':
+            mode = 'sqlite3'
+        self.schema = schema.init(
+            self,
+            sqlite3.connect(':memory:'),
+            mode,
+            False,
+            id(threading.current_thread()),
+        )
+        self.schema.execute(
+            'INSERT INTO sources (f_target, f_kind) VALUES (?, ?)',
+            (target, kind),
+        )
+
+
+def ingest(target, kind, mode, spec):
+    '''
+    Fetch the initial dump of a source and return the DB rows,
+    see `DBSchema.rows()`. Runs in a worker process.
+    '''
+    host = IngestHost(target, kind, mode)
+    event_map = host.schema.event_map
+    with kinds[kind](**spec) as nl:
+        msgs = [zero_if(target)] + list(nl.dump())
+    host.schema.bulk_begin()
+    # like the main loop, give the messages that refer to the
+    # records not loaded yet a few more tries
+    for _ in range(4):
+        reschedule = []
+        for msg in msgs:
+            msg['header']['target'] = target
+            for handler in event_map.get(type(msg), ()):
+                try:
+                    handler(target, msg)
+                except RescheduleException:
+                    reschedule.append(msg)
+                except Exception:
+                    host.log.main.error('ingest: %s' % traceback.format_exc())
+        if not reschedule:
+            break
+        msgs = reschedule
+    host.schema.bulk_commit()
+    return host.schema.rows(host.schema.spec)
@@ -164,12 +164,15 @@ import threading
 import traceback
 import ctypes
 import ctypes.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from collections import OrderedDict
 from pr2modules import config
 from pr2modules import cli
 from pr2modules.common import basestring
 from pr2modules.netlink import nlmsg_base
+from pr2modules.netlink.exceptions import NetlinkError
 
 ##
 # NDB stuff
@@ -180,8 +183,9 @@ from .events import (
     InvalidateHandlerException,
     RescheduleException,
 )
-from .messages import cmsg, cmsg_event, cmsg_failed, cmsg_sstart
+from .messages import cmsg, cmsg_event, cmsg_failed, cmsg_rows, cmsg_sstart
 from .source import Source, SourceProxy
+from .transport import MarshalCluster
 from .auth_manager import check_auth
 from .auth_manager import AuthManager
 from .objects import RSLV_DELETE
@@ -193,6 +197,7 @@ from .objects.neighbour import Neighbour
 from .objects.rule import Rule
 from .objects.netns import NetNS
 from .report import RecordSet, Record
+from .report import EXPORT_BATCH, export
 
 try:
     from urlparse import urlparse
@@ -251,8 +256,11 @@ def regsiter_postgres_adapters():
 
 
 class Transaction(object):
-    def __init__(self, log):
+    def __init__(self, log, bulk=False, window=64):
         self.queue = []
+        self.bulk = bulk
+        self.window = window
+        self.failed = []
         self.event = threading.Event()
         self.event.clear()
         self.log = log.channel('transaction.%s' % id(self))
@@ -291,6 +299,8 @@ class Transaction(object):
         return self.event.is_set()
 
     def commit(self):
+        if self.bulk:
+            return self.commit_bulk()
         self.log.debug('commit')
         rollbacks = []
         for obj in self.queue:
@@ -307,6 +317,127 @@ class Transaction(object):
         self.event.set()
         return self
 
+    def commit_bulk(self):
+        #
+        # Apply the objects in waves: make the requests of all the
+        # objects of a wave, send them pipelined and then confirm
+        # them all. A wave ends with an object that can not be
+        # applied this way, or that can not make its request until
+        # the previous objects are applied, like an interface with
+        # a link being created in the same transaction.
+        #
+        # The failed objects are rolled back, the rest are not.
+        #
+        self.log.debug('commit bulk')
+        self.failed = []
+        wave = []
+        for obj in self.queue:
+            if obj.clean:
+                continue
+            save = dict(obj) if obj.state == 'invalid' else None
+            try:
+                if obj.chain:
+                    obj.chain.commit()
+                try:
+                    request = obj.bulk_request()
+                except KeyError:
+                    self.apply_wave(wave)
+                    wave = []
+                    request = obj.bulk_request()
+            except Exception as e:
+                self.fail(obj, save, e)
+                continue
+            if request is None:
+                self.apply_wave(wave)
+                wave = []
+                try:
+                    obj.commit()
+                except Exception as e:
+                    self.failed.append((obj, e))
+            else:
+                wave.append((obj, save, request))
+        self.apply_wave(wave)
+        self.event.set()
+        if self.failed:
+            self.log.debug('failed %i objects' % len(self.failed))
+            raise self.failed[0][1]
+        return self
+
+    def apply_wave(self, wave):
+        targets = OrderedDict()
+        for item in wave:
+            targets.setdefault(item[0]['target'], []).append(item)
+        applied = []
+        for target, items in targets.items():
+            source = items[0][0].sources[target]
+            results = source.api_pipeline(
+                [
+                    (obj.api, (method,), req)
+                    for obj, _, (_, method, req) in items
+                ],
+                self.window,
+            )
+            for (obj, save, request), result in zip(items, results):
+                _, method, req = request
+                try:
+                    if isinstance(result, NetlinkError):
+                        filters = obj.apply_fallback(result)
+                        if filters is not None:
+                            self.apply_fallback(obj, save, filters)
+                            continue
+                        obj.apply_error(method, req, result)
+                    elif isinstance(result, Exception):
+                        raise result
+                    else:
+                        obj.hook_apply(method, **req)
+                except Exception as e:
+                    self.fail(obj, save, e)
+                    continue
+                applied.append((obj, save, request))
+        # all the responses are collected by now, so most of the
+        # updates should be already loaded; retry the rest
+        for obj, save, (state, method, req) in applied:
+            try:
+                if not obj.apply_check(method):
+                    obj.apply_loop(method, req, start=1)
+                obj.apply_complete(state)
+            except Exception as e:
+                self.fail(obj, save, e)
+            finally:
+                if save is None and obj.last_save is not None:
+                    obj.last_save.state.set(obj.state.get())
+
+    def apply_fallback(self, obj, save, filters):
+        #
+        # The kernel rejected the request, but the object has a
+        # workaround: apply it one request per filter, the same way
+        # as RTNL_Object.commit() does
+        #
+        try:
+            for req_filter in filters:
+                obj.apply(req_filter=req_filter)
+        except Exception as e:
+            self.fail(obj, save, e)
+        finally:
+            if save is None and obj.last_save is not None:
+                obj.last_save.state.set(obj.state.get())
+
+    def fail(self, obj, save, e):
+        self.log.debug('fail %s: %s' % (obj, e))
+        self.failed.append((obj, e))
+        if save is not None:
+            # a new object: drop all the values and rollback to
+            # the initial state, like RTNL_Object.commit() does
+            for key in tuple(obj.keys()):
+                del obj[key]
+            for key in save:
+                dict.__setitem__(obj, key, save[key])
+            return
+        try:
+            obj.rollback()
+        except Exception as e_r:
+            self.log.warning('ignore rollback exception: %s' % e_r)
+
 
 class View(dict):
     '''
@@ -433,74 +564,59 @@ class View(dict):
         timeout = spec.pop('timeout', None)
         ctime = time.time()
 
-        # install a limited events queue -- for a possible immediate reaction
+        # install a limited records queue -- for a possible immediate
+        # reaction
         evq = queue.Queue(maxsize=100)
 
-        def handler(evq, target, event):
+        def handler(evq, table, key, record):
+            if record is None:
+                return
+            for name, value in spec.items():
+                if name in record and record[name] != value:
+                    return
             # ignore the "queue full" exception
             #
-            # if we miss some events here, nothing bad happens: we just
-            # load them from the DB after a timeout, falling back to
-            # the DB polling
-            #
-            # the most important here is not to allocate too much memory
+            # if we miss some records here, nothing bad happens: any
+            # of the queued records triggers the DB lookup
             try:
-                evq.put_nowait((target, event))
+                evq.put_nowait(record)
             except queue.Full:
                 pass
 
         #
         hdl = partial(handler, evq)
-        (self.ndb.register_handler(self.ndb.schema.classes[self.event], hdl))
+        self.ndb.schema.watch(self.table, None, hdl)
         #
         try:
-            ret = self.__getitem__(spec)
-            for key in spec:
-                if ret[key] != spec[key]:
-                    ret = None
-                    break
-        except KeyError:
-            ret = None
-
-        while ret is None:
-            if timeout is not None:
-                if ctime + timeout < time.time():
-                    break
-            try:
-                target, msg = evq.get(timeout=1)
-            except queue.Empty:
+            while ret is None:
                 try:
                     ret = self.__getitem__(spec)
                     for key in spec:
                         if ret[key] != spec[key]:
                             ret = None
-                            raise KeyError()
-                    break
+                            break
                 except KeyError:
-                    continue
-
-            #
-            for key, value in spec.items():
-                if key == 'target' and value != target:
-                    break
-                elif value not in (
-                    msg.get(key),
-                    msg.get_attr(msg.name2nla(key)),
-                ):
+                    ret = None
+                if ret is not None:
                     break
-            else:
-                while ret is None:
+                # the handler runs after the record is committed,
+                # so the next lookup will see it
+                if timeout is None:
+                    evq.get()
+                else:
+                    remains = ctime + timeout - time.time()
+                    if remains <= 0:
+                        break
                     try:
-                        ret = self.__getitem__(spec)
-                    except KeyError:
-                        time.sleep(0.1)
-
-        #
-        (self.ndb.unregister_handler(self.ndb.schema.classes[self.event], hdl))
+                        evq.get(timeout=remains)
+                    except queue.Empty:
+                        break
+                # drop the records queued meanwhile
+                while not evq.empty():
+                    evq.get_nowait()
+        finally:
+            self.ndb.schema.unwatch(self.table, None, hdl)
 
-        del evq
-        del hdl
-        gc.collect()
         if ret is None:
             raise TimeoutError()
         return ret
@@ -559,14 +675,17 @@ class View(dict):
             # cache del/add records in the logs
             if ckey == cache_key:
                 continue
-            # The number of referrers must be > 1, the first
-            # one is the cache itself
-            rcount = len(gc.get_referrers(self.cache[ckey]))
             # Remove only expired items
             expired = (rtime - self.cache[ckey].atime) > config.cache_expire
             # The number of changed rtnl_object fields must
             # be 0 which means that no transaction is started
-            if rcount == 1 and self.cache[ckey].clean and expired:
+            if not expired or not self.cache[ckey].clean:
+                continue
+            # The number of referrers must be > 1, the first
+            # one is the cache itself; it's expensive, so check
+            # it the last
+            rcount = len(gc.get_referrers(self.cache[ckey]))
+            if rcount == 1:
                 self.log.debug('cache del %s' % (ckey,))
                 self.cache.pop(ckey, None)
 
@@ -699,6 +818,99 @@ class View(dict):
         iclass = self.classes[self.table]
         return RecordSet(self._native(iclass.summary(self)))
 
+    def _report(self, summary):
+        iclass = self.classes[self.table]
+        return iclass.summary(self) if summary else iclass.dump(self)
+
+    @check_auth('obj:list')
+    def export(self, f, kind='jsonl', summary=False, batch=EXPORT_BATCH):
+        '''
+        Write the `dump()` or `summary()` report to a file name, a binary
+        file object or a socket, without creating `Record` objects::
+
+            ndb.routes.export('routes.jsonl')
+            ndb.routes.export(sock, kind='columnar', summary=True)
+
+        Formats: 'jsonl', 'csv', 'columnar'; see `pr2modules.ndb.report`.
+        Return the number of exported rows.
+        '''
+        return export(self._report(summary), f, kind, batch)
+
+
+class ColumnarView(View):
+    '''
+    The view for `db_provider='columnar'`: the lookups return
+    read-only records instead of RTNL objects::
+
+        ndb = NDB(db_provider='columnar')
+        ndb.interfaces['eth0']['index']
+    '''
+
+    @property
+    def columnar(self):
+        return self.table in self.ndb.schema.columns
+
+    def create(self, *argspec, **kwspec):
+        raise TypeError('read-only storage')
+
+    @check_auth('obj:read')
+    def __getitem__(self, key, table=None):
+        table = table or self.table
+        if table not in self.ndb.schema.columns:
+            return super(ColumnarView, self).__getitem__(key, table)
+        iclass = self.classes[table]
+        spec = (
+            iclass.new_spec(key, self.default_target)
+            .load_context(self.context)
+            .get_spec
+        )
+        iclass.resolve(
+            view=self,
+            spec=spec,
+            fields=iclass.resolve_fields,
+            policy=RSLV_DELETE,
+        )
+        spec = dict([x for x in spec.items() if x[1] is not None])
+        for record in self.ndb.schema.select(table, spec):
+            return Record(
+                self.ndb.schema.columns[table].norm_names, record, iclass
+            )
+        raise KeyError('object does not exist')
+
+    def exists(self, key, table=None):
+        try:
+            self.__getitem__(key, table)
+            return True
+        except KeyError:
+            return False
+
+    @cli.show_result
+    def count(self):
+        if not self.columnar:
+            return super(ColumnarView, self).count()
+        return self.ndb.schema.count(self.table)
+
+    @cli.show_result
+    @check_auth('obj:list')
+    def dump(self):
+        if not self.columnar:
+            return super(ColumnarView, self).dump()
+        return RecordSet(self._native(self.ndb.schema.dump(self.table)))
+
+    @cli.show_result
+    @check_auth('obj:list')
+    def summary(self):
+        if not self.columnar:
+            return super(ColumnarView, self).summary()
+        return RecordSet(self._native(self.ndb.schema.summary(self.table)))
+
+    def _report(self, summary):
+        if not self.columnar:
+            return super(ColumnarView, self)._report(summary)
+        if summary:
+            return self.ndb.schema.summary(self.table)
+        return self.ndb.schema.dump(self.table)
+
 
 class SourcesView(View):
     def __init__(self, ndb, auth_managers=None):
@@ -919,7 +1131,9 @@ class AuthProxy(object):
             'netns',
             'vlans',
         ):
-            view = View(self._ndb, spec, auth_managers=self._auth_managers)
+            view = self._ndb._view_class(
+                self._ndb, spec, auth_managers=self._auth_managers
+            )
             setattr(self, spec, view)
 
 
@@ -935,17 +1149,19 @@ class NDB(object):
         db_provider='sqlite3',
         db_spec=':memory:',
         db_cleanup=True,
+        db_readers=None,
         rtnl_debug=False,
         log=False,
         auto_netns=False,
         libc=None,
         messenger=None,
+        ingest_workers=0,
     ):
 
         if db_provider == 'postgres':
             db_provider = 'psycopg2'
 
-        if db_provider == 'sqlite3':
+        if db_provider in ('sqlite3', 'columnar'):
             register_sqlite3_adapters()
         elif db_provider == 'psycopg2':
             regsiter_postgres_adapters()
@@ -968,6 +1184,12 @@ class NDB(object):
         self._global_lock = threading.Lock()
         self._event_map = None
         self._event_queue = EventQueue(maxsize=100)
+        # the pool to load the initial dumps, see pr2modules.ndb.ingest
+        self._ingest_pool = None
+        if ingest_workers:
+            self._ingest_pool = ProcessPoolExecutor(
+                ingest_workers, mp_context=multiprocessing.get_context('spawn')
+            )
         self.messenger = messenger
         if messenger is not None:
             self._mm_thread = threading.Thread(
@@ -1009,7 +1231,12 @@ class NDB(object):
         self._call_registry = {}
         self._nl = sources
         self._db_provider = db_provider
+        self._view_class = ColumnarView if db_provider == 'columnar' else View
         self._db_spec = db_spec
+        if db_readers is None:
+            # SQLite3 readers change the DB file journal mode
+            db_readers = db_provider == 'psycopg2'
+        self._db_readers = db_readers
         self._db_rtnl_log = rtnl_debug
         atexit.register(self.close)
         self._dbm_ready.clear()
@@ -1035,12 +1262,12 @@ class NDB(object):
             'netns',
             'vlans',
         ):
-            view = View(self, spec, auth_managers=[am])
+            view = self._view_class(self, spec, auth_managers=[am])
             setattr(self, spec, view)
         # self.query = Query(self.schema)
 
     def _get_view(self, name, chain=None):
-        return View(self, name, chain)
+        return self._view_class(self, name, chain)
 
     def __enter__(self):
         return self
@@ -1048,8 +1275,26 @@ class NDB(object):
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-    def begin(self):
-        return Transaction(self.log)
+    def begin(self, bulk=False, window=64):
+        '''
+        Start a transaction. The objects pushed into the transaction
+        are applied on `commit()` one by one; if one fails, all the
+        applied objects are rolled back.
+
+        With `bulk=True` the requests of the objects are sent via
+        the source socket pipeline, up to `window` requests in
+        flight, and confirmed together. If some objects fail, only
+        these objects are rolled back; `commit()` raises the first
+        exception, and `transaction.failed` lists all the failed
+        objects as `(object, exception)`.
+
+        The objects rejected by the kernel but having a workaround,
+        like interfaces created with `master` on old kernels, are
+        applied then one by one, as with `bulk=False`. The changes
+        queued with `add_ip()`, `add_port()` etc. are also applied
+        one by one, after the object itself is confirmed.
+        '''
+        return Transaction(self.log, bulk, window)
 
     def auth_proxy(self, auth_manager):
         return AuthProxy(self, [auth_manager])
@@ -1082,6 +1327,8 @@ class NDB(object):
             self._event_queue.shutdown()
             self._event_queue.bypass((cmsg(None, ShutdownException()),))
             self._dbm_thread.join()
+            if self._ingest_pool is not None:
+                self._ingest_pool.shutdown()
             # shutdown the logger -- free the resources
             self.log.close()
 
@@ -1091,6 +1338,7 @@ class NDB(object):
                 source.restart()
 
     def __mm__(self):
+        marshal = MarshalCluster()
         # notify neighbours by sending hello
         for peer in self.messenger.transport.peers:
             peer.hello()
@@ -1101,10 +1349,10 @@ class NDB(object):
                     peer.last_exception_time = 0
                 self.reload(kinds=['local', 'netns', 'remote'])
             elif msg['type'] == 'transport':
-                message = msg['data'][0](data=msg['data'][1])
-                message.decode()
-                message['header']['target'] = msg['target']
-                self._event_queue.put((message,))
+                messages = tuple(marshal.parse(msg['data']))
+                for message in messages:
+                    message['header']['target'] = msg['target']
+                self._event_queue.put(messages)
             elif msg['type'] == 'response':
                 if msg['call_id'] in self._call_registry:
                     event = self._call_registry.pop(msg['call_id'])
@@ -1151,6 +1399,7 @@ class NDB(object):
         event_map = {
             cmsg_event: [lambda t, x: x.payload.set()],
             cmsg_failed: [lambda t, x: (self.schema.mark(t, 1))],
+            cmsg_rows: [lambda t, x: self.schema.load_rows(t, x.payload)],
             cmsg_sstart: [partial(check_sources_started, self, _locals)],
         }
         self._event_map = event_map
@@ -1161,6 +1410,8 @@ class NDB(object):
             with _sql_adapters_lock:
                 if self._db_provider == 'sqlite3':
                     self._db = sqlite3.connect(self._db_spec)
+                elif self._db_provider == 'columnar':
+                    self._db = sqlite3.connect(':memory:')
                 elif self._db_provider == 'psycopg2':
                     self._db = psycopg2.connect(**self._db_spec)
 
@@ -1170,6 +1421,7 @@ class NDB(object):
                 self._db_provider,
                 self._db_rtnl_log,
                 id(threading.current_thread()),
+                self._db_spec if self._db_readers else None,
             )
         except Exception as e:
             self._dbm_error = e
@@ -1191,6 +1443,9 @@ class NDB(object):
             source, events = event_queue.get()
             events = Events(events, reschedule)
             reschedule = []
+            # load the rows of one queue item, e.g. an initial dump
+            # of a source, in bulk; see DBSchema.bulk_begin()
+            self.schema.bulk_begin()
             try:
                 for event in events:
                     handlers = event_map.get(
@@ -1201,6 +1456,7 @@ class NDB(object):
                         in self.messenger.targets
                     ):
                         if isinstance(event, nlmsg_base):
+                            # forward the raw netlink data, if any
                             if event.data is not None:
                                 data = event.data[
                                     event.offset : event.offset + event.length
@@ -1209,14 +1465,8 @@ class NDB(object):
                                 event.reset()
                                 event.encode()
                                 data = event.data
-                            data = (type(event), data)
-                            tgt = event['header']['target']
-                            self.messenger.emit(
-                                {
-                                    'type': 'transport',
-                                    'target': tgt,
-                                    'data': data,
-                                }
+                            self.messenger.forward(
+                                event['header']['target'], data
                             )
 
                     for handler in tuple(handlers):
@@ -1262,6 +1512,11 @@ class NDB(object):
                 except KeyError:
                     self.log.debug(f'key error for {source}')
                     pass
+            finally:
+                self.schema.bulk_commit()
+                if self.messenger is not None:
+                    # one frame per target for the queue item
+                    self.messenger.flush()
 
         # release all the sources
         for target in tuple(self.sources.cache):
@@ -14,3 +14,7 @@ class cmsg_failed(cmsg):
 
 class cmsg_sstart(cmsg):
     pass
+
+
+class cmsg_rows(cmsg):
+    pass
@@ -94,6 +94,7 @@ import collections
 from functools import partial
 from pr2modules import cli
 from pr2modules.netlink.exceptions import NetlinkError
+from pr2modules.netlink.nlsocket import NetlinkMixin
 from ..report import Record
 from ..auth_manager import check_auth
 from ..auth_manager import AuthManager
@@ -193,7 +194,7 @@ class RTNL_Object(dict):
         Read-only property.
         '''
         if self.ctxid:
-            return '%s_%s' % (self.table, self.ctxid)
+            return self.schema.snapshot_table(self.table, self.ctxid)
         else:
             return self.table
 
@@ -308,6 +309,7 @@ class RTNL_Object(dict):
         self.snapshot_deps = []
         self.load_event = threading.Event()
         self.load_event.set()
+        self._watch = []
         self.load_debug = False
         self.lock = threading.Lock()
         self.kspec = self.schema.compiled[self.table]['idx']
@@ -383,8 +385,13 @@ class RTNL_Object(dict):
 
         return spec
 
-    def mark_tflags(self, mark):
-        pass
+    def snapshot_roots(self):
+        '''
+        Return the DB records to start the object snapshot from as
+        `(table, key)` pairs. The snapshot contains these records and
+        all the records that depend on them via foreign keys.
+        '''
+        return []
 
     def keys(self):
         return filter(lambda x: x not in self.hidden_fields, dict.keys(self))
@@ -507,28 +514,77 @@ class RTNL_Object(dict):
 
     def register(self):
         #
-        # Construct a weakref handler for events.
+        # Construct a weakref handler for the DB updates.
         #
         # If the referent doesn't exist, raise the
-        # exception to remove the handler from the
-        # chain.
+        # exception to remove the handler.
         #
-        def wr_handler(wr, fname, *argv):
-            try:
-                return getattr(wr(), fname)(*argv)
-            except Exception:
-                # check if the weakref became invalid
-                if wr() is None:
-                    raise InvalidateHandlerException()
-                raise
+        def wr_handler(wr, pattern, table, key, record):
+            obj = wr()
+            if obj is None:
+                raise InvalidateHandlerException()
+            if pattern is not None:
+                if record is None:
+                    return
+                for name, value in pattern.items():
+                    if record.get(name) != value:
+                        return
+            obj.load_record(table, record)
+            obj.load_event.set()
 
+        #
+        # Subscribe only to the records of the object, so the main
+        # loop doesn't run the handler for every event; the key may
+        # change, e.g. when the object is created, so re-subscribe
+        #
+        # With an incomplete key, None for the fields not known yet,
+        # match the records by the known key fields and the extra
+        # key fields, like ifname for interfaces
+        #
+        self.unregister()
         wr = weakref.ref(self)
-        for event, fname in self.event_map.items():
-            #
-            # Do not trust the implicit scope and pass the
-            # weakref explicitly via partial
-            #
-            (self.ndb.register_handler(event, partial(wr_handler, wr, fname)))
+        for table, key in self.record_keys():
+            if None in key:
+                pattern = self.record_pattern(table, key)
+                if pattern is None:
+                    continue
+                handler = partial(wr_handler, wr, pattern)
+                key = None
+            else:
+                handler = partial(wr_handler, wr, None)
+            self.schema.watch(table, key, handler)
+            self._watch.append((table, key, handler))
+
+    def record_pattern(self, table, key):
+        if table != self.table:
+            return None
+        pattern = {}
+        for name, value in zip(self.kspec[2:], key[2:]):
+            if value is not None:
+                pattern[self.iclass.nla2name(name)] = value
+        for name in self.key_extra_fields:
+            name = self.iclass.nla2name(name)
+            if self.get(name) is not None:
+                pattern[name] = self[name]
+        if not pattern:
+            # nothing to match the records against
+            return None
+        pattern['target'] = key[0]
+        return pattern
+
+    def unregister(self):
+        for table, key, handler in self._watch:
+            self.schema.unwatch(table, key, handler)
+        self._watch = []
+
+    def record_keys(self):
+        '''
+        Return the DB records of the object as `(table, key)` pairs,
+        see `DBSchema.watch()`. The key fields not known yet are None.
+        '''
+        key = [self.get(self.iclass.nla2name(x)) for x in self.kspec]
+        key[1] = 0  # tflags
+        return [(self.table, self.schema.record_key(key))]
 
     @check_auth('obj:modify')
     def snapshot(self, ctxid=None):
@@ -548,7 +604,7 @@ class RTNL_Object(dict):
         snp = type(self)(
             self.view, key, ctxid=ctxid, auth_managers=self.auth_managers
         )
-        self.ndb.schema.save_deps(ctxid, weakref.ref(snp), self.iclass)
+        self.ndb.schema.save_deps(ctxid, weakref.ref(snp))
         snp.changed = set(self.changed)
         return snp
 
@@ -717,7 +773,7 @@ class RTNL_Object(dict):
             self.state.set('remove')
             return self
 
-    def check(self):
+    def check(self, load=True):
         state_map = (
             ('invalid', 'system'),
             ('remove', 'invalid'),
@@ -726,7 +782,8 @@ class RTNL_Object(dict):
             ('replace', 'system'),
         )
 
-        self.load_sql()
+        if load:
+            self.load_sql()
         self.log.debug('check: %s' % str(self.state.events))
 
         if self.state.transition() not in state_map:
@@ -771,11 +828,10 @@ class RTNL_Object(dict):
     def hook_apply(self, method, **spec):
         pass
 
-    @check_auth('obj:modify')
-    def apply(self, rollback=False, req_filter=None):
+    def apply_request(self, rollback=False, req_filter=None):
         '''
-        Create a snapshot and apply pending changes. Do not revert
-        the changes in the case of an exception.
+        Create a snapshot and make the request to apply pending
+        changes. Return `(state, method, req)`.
         '''
 
         # Resolve the fields
@@ -849,68 +905,130 @@ class RTNL_Object(dict):
         if req_filter is not None:
             req = req_filter(req)
 
-        for itn in range(20):
+        # subscribe to the object records before the request,
+        # so no update will be lost
+        self.register()
+        return state, method, req
+
+    @check_auth('obj:modify')
+    def bulk_request(self):
+        '''
+        Make the request to apply pending changes within a bulk
+        transaction, see `NDB.begin()`. Return `(state, method, req)`,
+        or `None` if the object must be applied with `apply()`.
+        '''
+        if self.state in ('replace', 'setns'):
+            return None
+        source = self.sources[self['target']]
+        if not isinstance(source.nl, NetlinkMixin):
+            return None
+        return self.apply_request()
+
+    def apply_fallback(self, e):
+        '''
+        Return the request filters to apply the object with `apply()`,
+        one request per filter, if the request failed with the error
+        `e`, or None. See `Interface.apply_fallback()`.
+        '''
+        return None
+
+    def apply_error(self, method, req, e):
+        '''
+        Handle a netlink error of the request: run the fallback
+        request, if any, or re-raise the error.
+        '''
+        (self.log.debug('error: %s' % e))
+        ##
+        #
+        # FIXME: performance penalty
+        # required now only in some NDA corner cases
+        # must be moved to objects.neighbour
+        #
+        #
+        ##
+        if e.code in self.fallback_for[method]:
+            self.log.debug('ignore error %s for %s' % (e.code, self))
+            if self.fallback_for[method][e.code] is not None:
+                self.log.debug(
+                    'run fallback %s (%s)'
+                    % (self.fallback_for[method][e.code], req)
+                )
+                try:
+                    if isinstance(self.fallback_for[method][e.code], str):
+                        self.sources[self['target']].api(
+                            self.api, self.fallback_for[method][e.code], **req
+                        )
+                    else:
+                        self.fallback_for[method][e.code]()
+                except NetlinkError:
+                    pass
+        else:
+            raise e
+
+    def apply_check(self, method, itn=0):
+        '''
+        Wait for the object records being loaded after the request,
+        see `register()`. Return `True` if the changes are applied.
+        '''
+        wtime = self.wtime(itn)
+        mqsize = self.view.ndb._event_queue.qsize()
+        nq = self.schema.stats.get(self['target'])
+        if nq is not None:
+            nqsize = nq.qsize
+        else:
+            nqsize = 0
+        self.log.debug(
+            'stats: apply %s {'
+            'objid %s, wtime %s, '
+            'mqsize %s, nqsize %s'
+            '}' % (method, id(self), wtime, mqsize, nqsize)
+        )
+        deadline = time.time() + self.wtime(itn + 1)
+        while not self.check(load=False):
+            timeout = deadline - time.time()
+            if timeout <= 0 or not self.load_event.wait(timeout):
+                break
+            self.load_event.clear()
+        else:
+            self.log.debug('checked')
+            return True
+        # no matching update, e.g. the key is incomplete, or the
+        # object is not changed -- check the DB
+        if self.check():
+            self.log.debug('checked')
+            return True
+        self.log.debug('check failed')
+        return False
+
+    def apply_loop(self, method, req, start=0):
+        '''
+        Run the request until the changes are applied.
+        '''
+        for itn in range(start, 20):
+            self.load_event.clear()
             try:
                 self.log.debug('run %s (%s)' % (method, req))
                 (self.sources[self['target']].api(self.api, method, **req))
                 (self.hook_apply(method, **req))
             except NetlinkError as e:
-                (self.log.debug('error: %s' % e))
-                ##
-                #
-                # FIXME: performance penalty
-                # required now only in some NDA corner cases
-                # must be moved to objects.neighbour
-                #
-                #
-                ##
-                if e.code in self.fallback_for[method]:
-                    self.log.debug('ignore error %s for %s' % (e.code, self))
-                    if self.fallback_for[method][e.code] is not None:
-                        self.log.debug(
-                            'run fallback %s (%s)'
-                            % (self.fallback_for[method][e.code], req)
-                        )
-                        try:
-                            if isinstance(
-                                self.fallback_for[method][e.code], str
-                            ):
-                                self.sources[self['target']].api(
-                                    self.api,
-                                    self.fallback_for[method][e.code],
-                                    **req
-                                )
-                            else:
-                                self.fallback_for[method][e.code]()
-                        except NetlinkError:
-                            pass
-                else:
-                    raise e
-
-            wtime = self.wtime(itn)
-            mqsize = self.view.ndb._event_queue.qsize()
-            nq = self.schema.stats.get(self['target'])
-            if nq is not None:
-                nqsize = nq.qsize
-            else:
-                nqsize = 0
-            self.log.debug(
-                'stats: apply %s {'
-                'objid %s, wtime %s, '
-                'mqsize %s, nqsize %s'
-                '}' % (method, id(self), wtime, mqsize, nqsize)
-            )
-            if self.check():
-                self.log.debug('checked')
+                self.apply_error(method, req, e)
+            if self.apply_check(method, itn):
                 break
-            self.log.debug('check failed')
-            self.load_event.wait(wtime)
-            self.load_event.clear()
         else:
             self.log.debug('stats: %s apply %s fail' % (id(self), method))
             raise Exception('lost sync in apply()')
 
         self.log.debug('stats: %s pass' % (id(self)))
+
+    def apply_complete(self, state, rollback=False):
+        '''
+        Complete the applied request: remove the replaced object,
+        restore the dependent objects on rollback, or run the
+        apply script.
+        '''
+        # the key must be complete now, see register()
+        if any([x[1] is None for x in self._watch]):
+            self.register()
         #
         if state == 'replace':
             self._replace.remove()
@@ -926,11 +1044,11 @@ class RTNL_Object(dict):
                 # comprare the tables
                 diff = self.ndb.schema.fetch(
                     '''
-                    SELECT * FROM %s_%s
+                    SELECT * FROM %s
                       EXCEPT
                     SELECT * FROM %s
                     '''
-                    % (table, self.ctxid, table)
+                    % (self.schema.snapshot_table(table, self.ctxid), table)
                 )
                 for record in diff:
                     record = dict(
@@ -965,6 +1083,16 @@ class RTNL_Object(dict):
             self._apply_script = []
         return self
 
+    @check_auth('obj:modify')
+    def apply(self, rollback=False, req_filter=None):
+        '''
+        Create a snapshot and apply pending changes. Do not revert
+        the changes in the case of an exception.
+        '''
+        state, method, req = self.apply_request(rollback, req_filter)
+        self.apply_loop(method, req)
+        return self.apply_complete(state, rollback)
+
     def update(self, data):
         for key, value in data.items():
             self.load_value(key, value)
@@ -1000,7 +1128,7 @@ class RTNL_Object(dict):
             if ctxid is None:
                 table = self.etable
             else:
-                table = '%s_%s' % (self.table, ctxid)
+                table = self.schema.snapshot_table(self.table, ctxid)
         keys = []
         values = []
 
@@ -1026,6 +1154,23 @@ class RTNL_Object(dict):
                     self.state.set('system')
         return spec
 
+    def load_record(self, table, record):
+        '''
+        Load a DB record of the object just written by the main
+        loop, `None` if the record is deleted; see `register()`.
+        '''
+        if table != self.table:
+            return
+        with self.lock:
+            if record is None:
+                if self.state != 'invalid':
+                    # No such object (anymore)
+                    self.state.set('invalid')
+                    self.changed = set()
+            elif self.state not in ('remove', 'setns'):
+                self.update(record)
+                self.state.set('system')
+
     def load_rtnlmsg(self, target, event):
         '''
         Check if the RTNL event matches the object and load the
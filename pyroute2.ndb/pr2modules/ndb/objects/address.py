@@ -215,17 +215,10 @@ class Address(RTNL_Object):
         for record in view.ndb.schema.fetch(req + where, values):
             yield record
 
-    def mark_tflags(self, mark):
-        plch = (self.schema.plch,) * 3
-        self.schema.execute(
-            '''
-                            UPDATE interfaces SET
-                                f_tflags = %s
-                            WHERE f_index = %s AND f_target = %s
-                            '''
-            % plch,
-            (mark, self['index'], self['target']),
-        )
+    def snapshot_roots(self):
+        return [
+            ('interfaces', {'target': self['target'], 'index': self['index']})
+        ]
 
     def __init__(self, *argv, **kwarg):
         kwarg['iclass'] = ifaddrmsg
@@ -424,17 +424,10 @@ class Interface(RTNL_Object):
         for record in view.ndb.schema.fetch(req + where, values):
             yield record
 
-    def mark_tflags(self, mark):
-        plch = (self.schema.plch,) * 3
-        self.schema.execute(
-            '''
-                            UPDATE interfaces SET
-                                f_tflags = %s
-                            WHERE f_index = %s AND f_target = %s
-                            '''
-            % plch,
-            (mark, self['index'], self['target']),
-        )
+    def snapshot_roots(self):
+        return [
+            ('interfaces', {'target': self['target'], 'index': self['index']})
+        ]
 
     def __init__(self, *argv, **kwarg):
         kwarg['iclass'] = ifinfmsg
@@ -797,59 +790,71 @@ class Interface(RTNL_Object):
                         req[key] = self[key]
         return req
 
-    @check_auth('obj:modify')
-    def apply(self, rollback=False, req_filter=None):
+    def apply_request(self, *argv, **kwarg):
         # translate string link references into numbers
         for key in ('link', 'master'):
             if key in self and isinstance(self[key], basestring):
                 self[key] = self.ndb.interfaces[self[key]]['index']
+        return super(Interface, self).apply_request(*argv, **kwarg)
+
+    def bulk_request(self):
+        # tun interfaces are completed in hook_apply()
+        if self.get('kind') == 'tun':
+            return None
+        return super(Interface, self).bulk_request()
+
+    def apply_fallback(self, e):
+        #
+        # Return the request filters to apply the interface with,
+        # one request per filter, if the kernel rejects the request
+        # with the error `e`; None if there is no workaround. Used
+        # also by the bulk transactions, see Transaction.apply_wave()
+        #
+        if e.code != 95:
+            return None
+        if (
+            self.get('master') is not None
+            and self.get('master') > 0
+            and self.state == 'invalid'
+        ):
+            #
+            # on some old kernels it is impossible to create
+            # interfaces with master set; attempt to do it in
+            # two steps
+            def req_filter(req):
+                return dict(
+                    [x for x in req.items() if not x[0].startswith('master')]
+                )
+
+            return (req_filter, None)
+        if (
+            self.get('br_vlan_filtering') is not None
+            and self.get('br_vlan_filtering') == 0
+        ):
+            #
+            # if vlan filtering is not enabled, then the parameter
+            # is reported by netlink, but not accepted upon bridge
+            # creation, so simply strip it
+            def req_filter(req):
+                return dict(
+                    [x for x in req.items() if not x[0].startswith('br_vlan_')]
+                )
+
+            return (req_filter,)
+        return None
+
+    @check_auth('obj:modify')
+    def apply(self, rollback=False, req_filter=None):
         setns = self.state.get() == 'setns'
         try:
             super(Interface, self).apply(rollback, req_filter)
         except NetlinkError as e:
-            if (
-                e.code == 95
-                and self.get('master') is not None
-                and self.get('master') > 0
-                and self.state == 'invalid'
-            ):
-                #
-                # on some old kernels it is impossible to create
-                # interfaces with master set; attempt to do it in
-                # two steps
-                def req_filter(req):
-                    return dict(
-                        [
-                            x
-                            for x in req.items()
-                            if not x[0].startswith('master')
-                        ]
-                    )
-
-                self.apply(rollback, req_filter)
-                self.apply(rollback)
-
-            elif (
-                e.code == 95
-                and self.get('br_vlan_filtering') is not None
-                and self.get('br_vlan_filtering') == 0
-            ):
-                #
-                # if vlan filtering is not enabled, then the parameter
-                # is reported by netlink, but not accepted upon bridge
-                # creation, so simply strip it
-                def req_filter(req):
-                    return dict(
-                        [
-                            x
-                            for x in req.items()
-                            if not x[0].startswith('br_vlan_')
-                        ]
-                    )
-
-                self.apply(rollback, req_filter)
-            else:
+            # do not run the fallback for the fallback requests
+            filters = None if req_filter else self.apply_fallback(e)
+            if filters is None:
                 raise
+            for req_filter in filters:
+                self.apply(rollback, req_filter)
         if setns:
             self.load_value('target', self['net_ns_fd'])
             dict.__setitem__(self, 'net_ns_fd', None)
@@ -914,6 +919,19 @@ class Interface(RTNL_Object):
     def load_rtnlmsg(self, *argv, **kwarg):
         super(Interface, self).load_rtnlmsg(*argv, **kwarg)
 
+    def record_keys(self):
+        ret = super(Interface, self).record_keys()
+        tname = 'ifinfo_%s' % self.get('kind')
+        if tname in self.schema.compiled and self.get('index'):
+            ret.append((tname, (self['target'], 0, self['index'])))
+        return ret
+
+    def load_record(self, table, record):
+        if table == self.table:
+            super(Interface, self).load_record(table, record)
+        elif record is not None:
+            self.update(record)
+
     def key_repr(self):
         return '%s/%s' % (
             self.get('target', ''),
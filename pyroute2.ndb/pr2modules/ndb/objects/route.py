@@ -580,19 +580,12 @@ class Route(RTNL_Object):
         'via': _cmp_via,
     }
 
-    def mark_tflags(self, mark):
-        plch = (self.schema.plch,) * 4
-        self.schema.execute(
-            '''
-                            UPDATE interfaces SET
-                                f_tflags = %s
-                            WHERE
-                                (f_index = %s OR f_index = %s)
-                                AND f_target = %s
-                            '''
-            % plch,
-            (mark, self['iif'], self['oif'], self['target']),
-        )
+    def snapshot_roots(self):
+        return [
+            ('interfaces', {'target': self['target'], 'index': x})
+            for x in (self['iif'], self['oif'])
+            if x is not None
+        ]
 
     def __init__(self, *argv, **kwarg):
         kwarg['iclass'] = rtmsg
@@ -738,20 +731,38 @@ class Route(RTNL_Object):
         else:
             super(Route, self).__setitem__(key, value)
 
-    @check_auth('obj:modify')
-    def apply(self, rollback=False):
-        if (
+    def is_kernel_ipv6(self):
+        return (
             (self.get('table') == 255)
             and (self.get('family') == 10)
             and (self.get('proto') == 2)
-        ):
+        )
+
+    def apply_request(self, *argv, **kwarg):
+        if self.get('family', AF_INET) == AF_MPLS and not self.get('dst'):
+            dict.__setitem__(self, 'dst', [Target()])
+        return super(Route, self).apply_request(*argv, **kwarg)
+
+    def bulk_request(self):
+        if self.is_kernel_ipv6():
+            return None
+        return super(Route, self).bulk_request()
+
+    @check_auth('obj:modify')
+    def apply(self, rollback=False):
+        if self.is_kernel_ipv6():
             # skip automatic ipv6 routes with proto kernel
             return self
         else:
-            if self.get('family', AF_INET) == AF_MPLS and not self.get('dst'):
-                dict.__setitem__(self, 'dst', [Target()])
             return super(Route, self).apply(rollback)
 
+    def load_record(self, table, record):
+        # the route record is not complete w/o nh, metrics etc.
+        if record is None:
+            super(Route, self).load_record(table, record)
+        else:
+            self.load_sql()
+
     def load_sql(self, *argv, **kwarg):
         super(Route, self).load_sql(*argv, **kwarg)
         # transform MPLS
@@ -859,6 +870,9 @@ class RouteSub(object):
     def apply(self, *argv, **kwarg):
         return self.route.apply(*argv, **kwarg)
 
+    def bulk_request(self):
+        return None
+
     def commit(self, *argv, **kwarg):
         return self.route.commit(*argv, **kwarg)
 
@@ -869,19 +883,8 @@ class NextHop(RouteSub, RTNL_Object):
     table = 'nh'
     hidden_fields = ('route_id', 'target')
 
-    def mark_tflags(self, mark):
-        plch = (self.schema.plch,) * 4
-        self.schema.execute(
-            '''
-                            UPDATE interfaces SET
-                                f_tflags = %s
-                            WHERE
-                                (f_index = %s OR f_index = %s)
-                                AND f_target = %s
-                            '''
-            % plch,
-            (mark, self.route['iif'], self.route['oif'], self.route['target']),
-        )
+    def snapshot_roots(self):
+        return self.route.snapshot_roots()
 
     def __init__(self, route, *argv, **kwarg):
         self.route = route
@@ -896,19 +899,8 @@ class Metrics(RouteSub, RTNL_Object):
     table = 'metrics'
     hidden_fields = ('route_id', 'target')
 
-    def mark_tflags(self, mark):
-        plch = (self.schema.plch,) * 4
-        self.schema.execute(
-            '''
-                            UPDATE interfaces SET
-                                f_tflags = %s
-                            WHERE
-                                (f_index = %s OR f_index = %s)
-                                AND f_target = %s
-                            '''
-            % plch,
-            (mark, self.route['iif'], self.route['oif'], self.route['target']),
-        )
+    def snapshot_roots(self):
+        return self.route.snapshot_roots()
 
     def __init__(self, route, *argv, **kwarg):
         self.route = route
@@ -64,6 +64,13 @@ class Rule(RTNL_Object):
         self.event_map = {fibmsg: "load_rtnlmsg"}
         super(Rule, self).__init__(*argv, **kwarg)
 
+    def load_record(self, table, record):
+        # see load_sql() below
+        if record is None:
+            super(Rule, self).load_record(table, record)
+        else:
+            self.load_sql()
+
     def load_sql(self, *argv, **kwarg):
         spec = super(Rule, self).load_sql(*argv, **kwarg)
         if spec is None:
@@ -26,14 +26,64 @@ Filtering examples::
     '10.255.145.0','10.255.152.254',42881,'prdc51e6d5','4a6a.60b1.8448'
     ...
 
-
+Exporting large reports
+-----------------------
+
+`RecordSet` creates a `Record` object for every row, that is fine for
+the CLI and filters, but too expensive to export big tables. To write
+a report to a file or a socket use `view.export()`: it reads the DB
+cursor in batches and writes every batch as one chunk, so the memory
+usage doesn't depend on the number of rows::
+
+    # JSON Lines, one JSON object per row
+    ndb.routes.export('routes.jsonl')
+
+    # CSV with a header line, RFC 4180 quoting
+    with open('routes.csv', 'wb') as f:
+        ndb.routes.export(f, kind='csv')
+
+    # the binary columnar format, see below; summary() instead of dump()
+    ndb.routes.export(sock, kind='columnar', summary=True)
+
+The method returns the number of exported rows. The binary columnar
+format, all the numbers in network byte order::
+
+    header:   b'NDBC', uint16 version, uint16 fields,
+              and the field names, uint16 length + UTF-8 each
+    batch:    uint32 rows, then one block per field:
+              uint8 type, null bitmap -- (rows + 7) / 8 bytes,
+              and the values:
+                  b'i' -- int64 per row
+                  b'd' -- float64 per row
+                  b's' -- uint32 length per row + UTF-8 strings
+                  b'j' -- the same as b's', but JSON values
+    trailer:  uint32 0
+
+Use `read_columnar()` to load the data back::
+
+    with open('routes.bin', 'rb') as f:
+        dump = read_columnar(f)
+        fnames = next(dump)
+        for row in dump:
+            ...
 '''
+import io
+import csv
 import json
-from itertools import chain
+import socket
+import struct
+from functools import partial
+from itertools import chain, islice
 from pr2modules import cli
 from pr2modules.common import basestring
 
 MAX_REPORT_LINES = 10000
+# rows per exported chunk
+EXPORT_BATCH = 1024
+COLUMNAR_MAGIC = b'NDBC'
+COLUMNAR_VERSION = 1
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
 
 
 def format_json(dump, headless=False):
@@ -86,6 +136,187 @@ def format_csv(dump, headless=False):
         yield ','.join(dump_record(record))
 
 
+def export_jsonl(fnames, batches):
+    for rows in batches:
+        yield ''.join(
+            [
+                '%s\n' % json.dumps(dict(zip(fnames, row)), default=str)
+                for row in rows
+            ]
+        ).encode('utf-8')
+
+
+def export_csv(fnames, batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(fnames)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+
+
+def _column(values):
+    #
+    # Encode one column of a batch: type, null bitmap, values
+    #
+    count = len(values)
+    nulls = bytearray((count + 7) // 8)
+    types = set()
+    for idx, value in enumerate(values):
+        if value is None:
+            nulls[idx // 8] |= 1 << (idx % 8)
+        else:
+            types.add(type(value))
+    if types <= set((int,)) and all(
+        INT64_MIN <= x <= INT64_MAX for x in values if x is not None
+    ):
+        return (
+            b'i'
+            + nulls
+            + struct.pack(
+                '!%iq' % count, *[0 if x is None else x for x in values]
+            )
+        )
+    if types == set((float,)):
+        return (
+            b'd'
+            + nulls
+            + struct.pack(
+                '!%id' % count, *[0.0 if x is None else x for x in values]
+            )
+        )
+    if types == set((str,)):
+        kind, encode = b's', str
+    else:
+        kind, encode = b'j', partial(json.dumps, default=str)
+    data = [b'' if x is None else encode(x).encode('utf-8') for x in values]
+    return (
+        kind
+        + nulls
+        + struct.pack('!%iI' % count, *[len(x) for x in data])
+        + b''.join(data)
+    )
+
+
+def export_columnar(fnames, batches):
+    header = [
+        COLUMNAR_MAGIC,
+        struct.pack('!HH', COLUMNAR_VERSION, len(fnames)),
+    ]
+    for name in fnames:
+        name = name.encode('utf-8')
+        header.append(struct.pack('!H', len(name)) + name)
+    yield b''.join(header)
+    for rows in batches:
+        yield b''.join(
+            [struct.pack('!I', len(rows))]
+            + [_column(values) for values in zip(*rows)]
+        )
+    yield struct.pack('!I', 0)
+
+
+exporters = {
+    'jsonl': export_jsonl,
+    'csv': export_csv,
+    'columnar': export_columnar,
+}
+
+
+def export(dump, f, kind='jsonl', batch=EXPORT_BATCH):
+    '''
+    Write a raw report -- the field names and then the rows, as the
+    `dump()` and `summary()` class methods of NDB objects yield them
+    -- to a file name, a binary file object or a socket. Return the
+    number of rows.
+    '''
+    if kind not in exporters:
+        raise ValueError('unknown export format: %s' % kind)
+    close = False
+    if isinstance(f, basestring):
+        f = open(f, 'wb')
+        close = True
+    if isinstance(f, socket.socket):
+        write = f.sendall
+    elif isinstance(f, io.TextIOBase):
+        raise TypeError('binary file object required')
+    else:
+        write = f.write
+    counter = [0]
+
+    def batches():
+        while True:
+            rows = list(islice(dump, batch))
+            if not rows:
+                return
+            counter[0] += len(rows)
+            yield rows
+
+    try:
+        for chunk in exporters[kind](tuple(next(dump)), batches()):
+            write(chunk)
+    finally:
+        if close:
+            f.close()
+    return counter[0]
+
+
+def read_columnar(f):
+    '''
+    Read the binary columnar export from a file object. Yield the
+    field names first, then the rows, like the raw reports do.
+    '''
+
+    def read(size):
+        ret = f.read(size)
+        if len(ret) != size:
+            raise ValueError('unexpected end of data')
+        return ret
+
+    magic, version, count = struct.unpack('!4sHH', read(8))
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError('unsupported data format')
+    fnames = []
+    for _ in range(count):
+        (length,) = struct.unpack('!H', read(2))
+        fnames.append(read(length).decode('utf-8'))
+    yield tuple(fnames)
+    decode = {b's': lambda x: x.decode('utf-8'), b'j': json.loads}
+    while True:
+        (rows,) = struct.unpack('!I', read(4))
+        if rows == 0:
+            return
+        columns = []
+        for _ in range(count):
+            kind = read(1)
+            nulls = read((rows + 7) // 8)
+            if kind == b'i':
+                values = struct.unpack('!%iq' % rows, read(rows * 8))
+            elif kind == b'd':
+                values = struct.unpack('!%id' % rows, read(rows * 8))
+            elif kind in decode:
+                lengths = struct.unpack('!%iI' % rows, read(rows * 4))
+                data = read(sum(lengths))
+                values = []
+                offset = 0
+                for length in lengths:
+                    values.append(data[offset : offset + length])
+                    offset += length
+            else:
+                raise ValueError('unknown column type: %r' % kind)
+            column = []
+            for idx, value in enumerate(values):
+                if nulls[idx // 8] & (1 << (idx % 8)):
+                    value = None
+                elif kind in decode:
+                    value = decode[kind](value)
+                column.append(value)
+            columns.append(column)
+        for row in zip(*columns):
+            yield row
+
+
 class Record(object):
     def __init__(self, names, values, ref_class=None):
         if len(names) != len(values):
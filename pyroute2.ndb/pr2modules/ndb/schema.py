@@ -24,6 +24,32 @@ module::
               db_spec={'dbname': 'test',
                        'host': 'db1.example.com'})
 
+See also the in-memory columnar storage for read-only monitoring,
+`db_provider='columnar'`, in the `pr2modules.ndb.columnar` module.
+
+Concurrent reads
+----------------
+
+All the DB updates run in the NDB main loop thread. With a file
+based SQLite3 DB or PostgreSQL the queries from other threads, like
+`ndb.routes.dump()` or `ndb.interfaces['eth0']`, don't go through
+the main loop, but use a small pool of read-only connections. So
+the reports don't wait for the events being loaded, and the events
+loading doesn't wait for the reports. Every query sees a consistent
+DB snapshot. When all the connections are busy, the query goes
+through the main loop.
+
+This is the default for PostgreSQL. A SQLite3 DB file must be
+switched to the WAL mode for that, so it is enabled only on
+request; the previous journal mode is restored on close::
+
+    ndb = NDB(db_provider='sqlite3',
+              db_spec='test.db',
+              db_readers=True)
+
+The in-memory SQLite3 DB, the default, can not be shared between
+connections, so all the queries go through the main loop.
+
 SQL schema
 ----------
 
@@ -90,16 +116,16 @@ There are also some useful views, that join `ifinfo` tables with
 '''
 import io
 import sys
+import json
 import time
-import random
 import sqlite3
 import threading
 import traceback
 from functools import partial
 from collections import OrderedDict
 from pr2modules import config
-from pr2modules.common import uuid32
 from pr2modules.common import basestring
+from .events import InvalidateHandlerException
 from .objects import address
 from .objects import interface
 from .objects import neighbour
@@ -115,6 +141,11 @@ try:
 except ImportError:
     import Queue as queue
 
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
 #
 # the order is important
 #
@@ -182,11 +213,11 @@ def publish_exec(method):
     #
     def _do_local(self, target, request):
         try:
-            (
-                request.response.put(
-                    method(self, *request.argv, **request.kwarg)
-                )
-            )
+            ret = method(self, *request.argv, **request.kwarg)
+            if self.readers is not None:
+                # make the changes visible for the reader threads
+                self.connection.commit()
+            request.response.put(ret)
         except Exception as e:
             (request.response.put(e))
 
@@ -226,13 +257,101 @@ def publish_exec(method):
     return _do_dispatch
 
 
+class ReaderPool(object):
+    '''
+    Read-only DB connections. A query borrows a connection for the
+    time of the fetch, so the number of connections doesn't depend
+    on the number of the reader threads.
+    '''
+
+    def __init__(self, mode, spec, size=8):
+        self.mode = mode
+        self.spec = spec
+        self.size = size
+        self.lock = threading.Lock()
+        self.connections = []
+        self.idle = []
+
+    def connect(self):
+        if self.mode == 'sqlite3':
+            # a connection may be used by different threads, one
+            # at a time
+            connection = sqlite3.connect(self.spec, check_same_thread=False)
+            connection.execute('PRAGMA query_only = ON')
+        elif self.mode == 'psycopg2':
+            connection = psycopg2.connect(**self.spec)
+            connection.set_session(readonly=True, autocommit=True)
+        return connection
+
+    def acquire(self):
+        '''
+        Borrow a connection, or return None if all the `size`
+        connections are busy.
+        '''
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if len(self.connections) >= self.size:
+                return None
+            # reserve the slot before connecting
+            self.connections.append(None)
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.lock:
+                self.connections.remove(None)
+            raise
+        with self.lock:
+            self.connections[self.connections.index(None)] = connection
+        return connection
+
+    def release(self, connection):
+        with self.lock:
+            if connection in self.connections:
+                self.idle.append(connection)
+                return
+        # the pool is closed
+        connection.close()
+
+    def fetch(self, connection, *argv, **kwarg):
+        try:
+            cursor = connection.cursor()
+            try:
+                # one statement -- one read transaction, so the rows
+                # are of the same DB snapshot
+                cursor.execute(*argv, **kwarg)
+                while True:
+                    row_set = cursor.fetchmany()
+                    if not row_set:
+                        return
+                    for row in row_set:
+                        yield row
+            finally:
+                cursor.close()
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self.lock:
+            connections = [x for x in self.connections if x is not None]
+            self.connections = []
+            self.idle = []
+        # the borrowed connections are closed as well, the running
+        # queries fail
+        for connection in connections:
+            connection.close()
+
+
 class DBSchema(object):
 
     connection = None
+    readers = None
     thread = None
     event_map = None
     key_defaults = None
-    snapshots = None  # <table_name>: <obj_weakref>
+    snapshots = None  # <ctxid>: <obj_weakref>
+    dependents = None  # <table_name>: [(<child_table>, <fk_spec>), ...]
+    watchers = None  # <table_name>: {<record_key>: (<handler>, ...)}
 
     spec = OrderedDict()
     classes = {}
@@ -244,7 +363,7 @@ class DBSchema(object):
     indices = {}
     foreign_keys = {}
 
-    def __init__(self, ndb, connection, mode, rtnl_log, tid):
+    def __init__(self, ndb, connection, mode, rtnl_log, tid, readers=None):
         self.ndb = ndb
         # collect all the dispatched methods and publish them
         for name in dir(self):
@@ -260,10 +379,17 @@ class DBSchema(object):
         self.rtnl_log = rtnl_log
         self.log = ndb.log.channel('schema')
         self.snapshots = {}
+        self.dependents = {}
+        self.watchers = {}
         self.key_defaults = {}
         self.event_map = {}
         self._cursor = None
+        self._journal = None
         self._counter = 0
+        self._bulk = None
+        self._bulk_rows = 0
+        self._notify = []
+        self._watch_lock = threading.Lock()
         self._allow_read = threading.Event()
         self._allow_read.set()
         self._allow_write = threading.Event()
@@ -273,9 +399,26 @@ class DBSchema(object):
             # SQLite3
             self.connection.execute('PRAGMA foreign_keys = ON')
             self.plch = '?'
+            if readers is not None:
+                # concurrent reads require WAL, that is not
+                # supported by in-memory DB; the journal mode is
+                # persistent, so it is restored on close
+                (self._journal,) = self.connection.execute(
+                    'PRAGMA journal_mode'
+                ).fetchone()
+                (journal,) = self.connection.execute(
+                    'PRAGMA journal_mode = WAL'
+                ).fetchone()
+                if journal == 'wal':
+                    self.connection.execute('PRAGMA synchronous = NORMAL')
+                    self.readers = ReaderPool(mode, readers)
+                else:
+                    self.log.debug('%s: no concurrent reads' % journal)
         elif self.mode == 'psycopg2':
             # PostgreSQL
             self.plch = '%s'
+            if readers is not None:
+                self.readers = ReaderPool(mode, readers)
         else:
             raise NotImplementedError('database provider not supported')
         self.gctime = self.ctime = time.time()
@@ -289,6 +432,16 @@ class DBSchema(object):
             )
             self.create_table(table)
 
+        #
+        # the foreign keys graph, used to collect the snapshots
+        #
+        for table in self.spec.keys():
+            self.dependents[table] = []
+        for table in self.spec.keys():
+            for key in self.foreign_keys.get(table, []):
+                if key['parent'] in self.dependents:
+                    self.dependents[key['parent']].append((table, key))
+
         #
         # service tables
         #
@@ -415,6 +568,41 @@ class DBSchema(object):
         # the same issue with the placeholders
         #
         f_idx_match = ['%s.%s = %s' % (table, x, self.plch) for x in f_idx]
+        #
+        # the plan to fetch the values from netlink messages:
+        # (sub-NLA path, field name, is the field in the index)
+        #
+        # e.g.: ((), 'index', True),
+        #       (('IFLA_LINKINFO', 'IFLA_INFO_DATA'), 'IFLA_VLAN_ID', False)
+        #
+        extract = [(tuple(x[:-1]), x[-1], x[-1] in idx) for x in schema_names]
+        #
+        # the bulk upsert, see bulk_flush()
+        #
+        if self.mode == 'psycopg2':
+            upsert = (
+                'INSERT INTO %s (%s) VALUES (%s) '
+                'ON CONFLICT (%s) DO UPDATE SET %s WHERE %s'
+                % (
+                    table,
+                    ','.join(f_names),
+                    ','.join(plchs),
+                    ','.join(f_idx),
+                    ','.join(f_set),
+                    ' AND '.join(f_idx_match),
+                )
+            )
+        elif sqlite3.sqlite_version_info >= (3, 24, 0):
+            upsert = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) ' % (
+                table,
+                ','.join(f_names),
+                ','.join(plchs),
+                ','.join(f_idx),
+            ) + 'DO UPDATE SET %s' % (
+                ','.join(['%s = excluded.%s' % (x, x) for x in f_names])
+            )
+        else:
+            upsert = None
 
         return {
             'names': names,
@@ -427,10 +615,15 @@ class DBSchema(object):
             'fset': ','.join(f_set),
             'knames': ','.join(f_idx),
             'fidx': ' AND '.join(f_idx_match),
+            'extract': extract,
+            'upsert': upsert,
         }
 
     @publish_exec
     def execute(self, *argv, **kwarg):
+        if self._bulk:
+            # keep the order of the statements
+            self.bulk_flush()
         if self._cursor:
             cursor = self._cursor
         else:
@@ -515,8 +708,32 @@ class DBSchema(object):
         else:
             self._allow_write.clear()
 
-    @publish
     def fetch(self, *argv, **kwarg):
+        if self.readers is not None and self.thread != id(
+            threading.current_thread()
+        ):
+            # another thread, use a read-only connection
+            self._allow_read.wait()
+            return self._read(*argv, **kwarg)
+        return self._fetch(*argv, **kwarg)
+
+    def _read(self, *argv, **kwarg):
+        #
+        # the connection is borrowed on the first iteration, so
+        # a generator dropped before that doesn't hold it
+        #
+        readers = self.readers
+        connection = readers.acquire() if readers is not None else None
+        if connection is None:
+            # all the connections are busy, use the main loop
+            rows = self._fetch(*argv, **kwarg)
+        else:
+            rows = readers.fetch(connection, *argv, **kwarg)
+        for row in rows:
+            yield row
+
+    @publish
+    def _fetch(self, *argv, **kwarg):
         cursor = self.execute(*argv, **kwarg)
         while True:
             row_set = cursor.fetchmany()
@@ -555,12 +772,25 @@ class DBSchema(object):
 
     @publish_exec
     def close(self):
+        readers = self.readers
+        if readers is not None:
+            self.readers = None
+            readers.close()
         self.purge_snapshots()
         self.connection.commit()
+        if self.mode == 'sqlite3' and readers is not None:
+            try:
+                self.connection.execute(
+                    'PRAGMA journal_mode = %s' % self._journal
+                )
+            except sqlite3.Error as e:
+                self.log.warning('journal mode not restored: %s' % e)
         self.connection.close()
 
     @publish_exec
     def commit(self):
+        if self._bulk:
+            self.bulk_flush()
         self.connection.commit()
 
     def create_table(self, table):
@@ -624,6 +854,38 @@ class DBSchema(object):
         )
         self.execute(req)
 
+        #
+        # index the foreign keys to look up the dependent records,
+        # both for the snapshots and for ON UPDATE / ON DELETE
+        #
+        for fk_idx, key in enumerate(self.foreign_keys.get(table, [])):
+            self.execute(
+                'CREATE INDEX IF NOT EXISTS %s_fk%i ON %s (%s)'
+                % (table, fk_idx, table, ','.join(key['fields']))
+            )
+
+        #
+        # the snapshots table: records of all the snapshots, the
+        # same fields w/o constraints plus the snapshot ctxid
+        #
+        req = [
+            'f_ctxid BIGINT NOT NULL',
+            'f_target TEXT NOT NULL',
+            'f_tflags BIGINT NOT NULL DEFAULT 0',
+        ]
+        for field in fields:
+            req.append(' '.join(field.split()[:2]))
+        self.execute(
+            'CREATE TABLE IF NOT EXISTS %s_snapshots (%s)'
+            % (table, ','.join(req))
+        )
+        self.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS %s_snapshots_idx '
+            'ON %s_snapshots (f_ctxid,%s)' % (table, table, index)
+        )
+        # drop the snapshots left by the previous runs, if any
+        self.execute('DELETE FROM %s_snapshots' % table)
+
         #
         # create table for the transaction buffer: there go the system
         # updates while the transaction is not committed.
@@ -671,110 +933,173 @@ class DBSchema(object):
                 (target,),
             )
 
-    @publish_exec
-    def save_deps(self, ctxid, weak_ref, iclass):
-        uuid = uuid32()
-        obj = weak_ref()
-        obj_k = obj.key
-        idx = self.indices[obj.table]
-        conditions = []
-        values = []
-        for key in idx:
-            conditions.append('f_%s = %s' % (key, self.plch))
-            if key in obj_k:
-                values.append(obj_k[key])
+    @staticmethod
+    def record_key(values):
+        #
+        # Make a hashable record key from the index values, compatible
+        # with the SQL adapters -- see main.register_sqlite3_adapters()
+        #
+        return tuple(
+            [
+                json.dumps(x) if isinstance(x, (list, dict)) else x
+                for x in values
+            ]
+        )
+
+    def watch(self, table, key, handler):
+        #
+        # Run handler(table, key, record) in the main loop every time
+        # a record with the key is written to the table, as soon as
+        # the change is committed. The record is a dict of normalized
+        # field names, or None if the record is deleted. Use key None
+        # to watch all the records of the table.
+        #
+        # The key is the record_key() of the table index values,
+        # starting with target and tflags. Raise
+        # InvalidateHandlerException in the handler to remove it.
+        #
+        with self._watch_lock:
+            watchers = dict(self.watchers.get(table, {}))
+            watchers[key] = watchers.get(key, ()) + (handler,)
+            self.watchers[table] = watchers
+
+    def unwatch(self, table, key, handler):
+        with self._watch_lock:
+            watchers = dict(self.watchers.get(table, {}))
+            handlers = tuple(
+                [x for x in watchers.get(key, ()) if x is not handler]
+            )
+            if handlers:
+                watchers[key] = handlers
+            else:
+                watchers.pop(key, None)
+            if watchers:
+                self.watchers[table] = watchers
             else:
-                values.append(obj.get(iclass.nla2name(key)))
+                self.watchers.pop(table, None)
+
+    def notify(self):
+        notify, self._notify = self._notify, []
+        for table, key, values in notify:
+            watchers = self.watchers.get(table, {})
+            for wkey in (key, None):
+                handlers = watchers.get(wkey)
+                if not handlers:
+                    continue
+                record = None
+                if values is not None:
+                    record = dict(
+                        zip(self.compiled[table]['norm_names'], values)
+                    )
+                for handler in handlers:
+                    try:
+                        handler(table, key, record)
+                    except InvalidateHandlerException:
+                        self.unwatch(table, wkey, handler)
+                    except Exception:
+                        self.log.error(
+                            'watch handler error: %s' % traceback.format_exc()
+                        )
+
+    def snapshot_table(self, table, ctxid):
         #
-        # save the old f_tflags value
+        # An SQL expression to use the records of the snapshot
+        # `ctxid` instead of the table, named `<table>_<ctxid>`:
         #
-        tflags = self.execute(
-            '''
-                           SELECT f_tflags FROM %s
-                           WHERE %s
-                           '''
-            % (obj.table, ' AND '.join(conditions)),
-            values,
-        ).fetchone()[0]
+        # SELECT * FROM %s WHERE ... % snapshot_table('routes', ctxid)
         #
-        # mark tflags for obj
+        return '(SELECT %s FROM %s_snapshots WHERE f_ctxid = %i) AS %s_%s' % (
+            self.compiled[table]['fnames'],
+            table,
+            ctxid,
+            table,
+            ctxid,
+        )
+
+    def save_snapshot(self, ctxid, table, join, conditions, values):
         #
-        obj.mark_tflags(uuid)
+        # copy the records to the snapshots table, ignore records
+        # that are already in the snapshot; return the number of
+        # records copied
+        #
+        fnames = ','.join(
+            ['main.%s' % x for x in self.compiled[table]['fnames'].split(',')]
+        )
+        req = 'INTO %s_snapshots SELECT %s,%s FROM %s AS main %s WHERE %s' % (
+            table,
+            self.plch,
+            fnames,
+            table,
+            join,
+            ' AND '.join(conditions),
+        )
+        if self.mode == 'sqlite3':
+            req = 'INSERT OR IGNORE %s' % req
+        else:
+            req = 'INSERT %s ON CONFLICT DO NOTHING' % req
+        return self.execute(req, [ctxid] + values).rowcount
 
+    @publish_exec
+    def save_deps(self, ctxid, weak_ref):
+        obj = weak_ref()
+        wref = self.snapshots.get(ctxid)
+        if wref is not None and wref() is None:
+            # the ctxid is reused, drop the old records
+            self.drop_snapshots([ctxid])
         #
-        # f_tflags is used in foreign keys ON UPDATE CASCADE, so all
-        # related records will be marked
+        # 1. copy the records the object depends on
         #
-        for table in self.spec:
-            self.log.debug('create snapshot %s_%s' % (table, ctxid))
-            #
-            # create the snapshot table
-            #
-            self.execute(
-                '''
-                         CREATE TABLE IF NOT EXISTS %s_%s
-                         AS SELECT * FROM %s
-                         WHERE
-                             f_tflags IS NULL
-                         '''
-                % (table, ctxid, table)
-            )
-            #
-            # copy the data -- is it possible to do it in one step?
-            #
-            self.execute(
-                '''
-                         INSERT INTO %s_%s
-                         SELECT * FROM %s
-                         WHERE
-                             f_tflags = %s
-                         '''
-                % (table, ctxid, table, self.plch),
-                [uuid],
-            )
+        queue = []
+        for table, key in obj.snapshot_roots():
+            conditions = []
+            values = []
+            for name, value in key.items():
+                conditions.append('main.f_%s = %s' % (name, self.plch))
+                values.append(value)
+            if self.save_snapshot(ctxid, table, '', conditions, values):
+                queue.append(table)
         #
-        # unmark all the data
+        # 2. walk the foreign keys graph and copy only the dependent
+        # records, so the snapshot cost depends on the number of
+        # the dependencies, not on the DB size
         #
-        obj.mark_tflags(tflags)
+        while queue:
+            parent = queue.pop(0)
+            for table, key in self.dependents[parent]:
+                join = ' '.join(
+                    [
+                        'INNER JOIN %s_snapshots AS parent ON' % parent,
+                        ' AND '.join(
+                            [
+                                'main.%s = parent.%s' % x
+                                for x in zip(
+                                    key['fields'], key['parent_fields']
+                                )
+                            ]
+                        ),
+                    ]
+                )
+                conditions = ['parent.f_ctxid = %s' % self.plch]
+                if self.save_snapshot(ctxid, table, join, conditions, [ctxid]):
+                    queue.append(table)
+        self.snapshots[ctxid] = weak_ref
 
+    def drop_snapshots(self, ctxids):
         for table in self.spec:
             self.execute(
-                '''
-                         UPDATE %s_%s SET f_tflags = %s
-                         '''
-                % (table, ctxid, self.plch),
-                [tflags],
+                'DELETE FROM %s_snapshots WHERE f_ctxid IN (%s)'
+                % (table, ','.join([self.plch] * len(ctxids))),
+                ctxids,
             )
-            self.snapshots['%s_%s' % (table, ctxid)] = weak_ref
+        for ctxid in ctxids:
+            self.snapshots.pop(ctxid, None)
 
     def purge_snapshots(self):
-        for table in tuple(self.snapshots):
-            for _ in range(MAX_ATTEMPTS):
-                try:
-                    if table.startswith('ifinfo_'):
-                        try:
-                            self.execute('DROP VIEW %s' % table[7:])
-                            self.connection.commit()
-                        except Exception:
-                            # GC collision?
-                            pass
-                    if self.mode == 'sqlite3':
-                        self.execute('DROP TABLE %s' % table)
-                    elif self.mode == 'psycopg2':
-                        self.execute('DROP TABLE %s CASCADE' % table)
-                    self.connection.commit()
-                    del self.snapshots[table]
-                    break
-                except sqlite3.OperationalError:
-                    #
-                    # Retry on:
-                    # -- OperationalError: database table is locked
-                    #
-                    time.sleep(random.random())
-            else:
-                raise Exception('DB snapshot error')
+        for table in self.spec:
+            self.execute('DELETE FROM %s_snapshots' % table)
+        self.connection.commit()
+        self.snapshots = {}
 
-    @publish
     def get(self, table, spec):
         #
         # Retrieve info from the DB
@@ -836,22 +1161,9 @@ class DBSchema(object):
             self.gctime = time.time()
 
             # clean dead snapshots after GC timeout
-            for name, wref in tuple(self.snapshots.items()):
-                if wref() is None:
-                    del self.snapshots[name]
-                    if name.startswith('ifinfo_'):
-                        try:
-                            self.execute('DROP VIEW %s' % name[7:])
-                        except Exception as e:
-                            self.log.debug(
-                                'failed to remove view %s: %s' % (name[7:], e)
-                            )
-                    try:
-                        self.execute('DROP TABLE %s' % name)
-                    except Exception as e:
-                        self.log.debug(
-                            'failed to remove table %s: %s' % (name, e)
-                        )
+            dead = [x for x, y in self.snapshots.items() if y() is None]
+            if dead:
+                self.drop_snapshots(dead)
 
             # clean marked routes
             self.execute(
@@ -865,120 +1177,43 @@ class DBSchema(object):
             #
             # Delete an object
             #
+            ivalues = self.index_values(table, target, event)
             conditions = ['f_target = %s' % self.plch]
-            values = [target]
             for key in self.indices[table]:
                 conditions.append('f_%s = %s' % (key, self.plch))
-                value = event.get(key) or event.get_attr(key)
-                if value is None:
-                    value = self.key_defaults[table][key]
-                values.append(value)
             self.execute(
                 'DELETE FROM %s WHERE'
                 ' %s' % (table, ' AND '.join(conditions)),
-                values,
+                ivalues[:1] + ivalues[2:],
             )
+            if table in self.watchers:
+                self._notify.append((table, self.record_key(ivalues), None))
+                if self._bulk is None:
+                    self.notify()
         else:
             #
             # Create or set an object
             #
-            # field values
-            values = [target, 0]
-            # index values
-            ivalues = [target, 0]
-            compiled = self.compiled[table]
-            # a map of sub-NLAs
-            nodes = {}
-
-            # fetch values (exc. the first two columns)
-            for fname, ftype in self.spec[table].items():
-                node = event
-
-                # if the field is located in a sub-NLA
-                if len(fname) > 1:
-                    # see if we tried to get it already
-                    if fname[:-1] not in nodes:
-                        # descend
-                        for steg in fname[:-1]:
-                            node = node.get_attr(steg)
-                            if node is None:
-                                break
-                        nodes[fname[:-1]] = node
-                    # lookup the sub-NLA in the map
-                    node = nodes[fname[:-1]]
-                    # the event has no such sub-NLA
-                    if node is None:
-                        values.append(None)
-                        continue
-
-                # NLA have priority
-                value = node.get_attr(fname[-1])
-                if value is None:
-                    value = node.get(fname[-1])
-                if value is None and fname[-1] in self.compiled[table]['idx']:
-                    value = self.key_defaults[table][fname[-1]]
-                if fname[-1] in compiled['idx']:
-                    ivalues.append(value)
-                values.append(value)
-
-            try:
-                if self.mode == 'psycopg2':
-                    #
-                    # run UPSERT -- the DB provider must support it
-                    #
-                    (
-                        self.execute(
-                            'INSERT INTO %s (%s) VALUES (%s) '
-                            'ON CONFLICT (%s) '
-                            'DO UPDATE SET %s WHERE %s'
-                            % (
-                                table,
-                                compiled['fnames'],
-                                compiled['plchs'],
-                                compiled['knames'],
-                                compiled['fset'],
-                                compiled['fidx'],
-                            ),
-                            (values + values + ivalues),
-                        )
-                    )
-                    #
-                elif self.mode == 'sqlite3':
-                    #
-                    # SQLite3 >= 3.24 actually has UPSERT, but ...
-                    #
-                    # We can not use here INSERT OR REPLACE as well, since
-                    # it drops (almost always) records with foreign key
-                    # dependencies. Maybe a bug in SQLite3, who knows.
-                    #
-                    count = (
-                        self.execute(
-                            '''
-                                      SELECT count(*) FROM %s WHERE %s
-                                      '''
-                            % (table, compiled['fidx']),
-                            ivalues,
-                        ).fetchone()
-                    )[0]
-                    if count == 0:
-                        self.execute(
-                            '''
-                                     INSERT INTO %s (%s) VALUES (%s)
-                                     '''
-                            % (table, compiled['fnames'], compiled['plchs']),
-                            values,
-                        )
-                    else:
-                        self.execute(
-                            '''
-                                     UPDATE %s SET %s WHERE %s
-                                     '''
-                            % (table, compiled['fset'], compiled['fidx']),
-                            (values + ivalues),
-                        )
-                else:
-                    raise NotImplementedError()
+            values, ivalues = self.extract(table, target, event)
+            if table in self.watchers:
+                # the handlers run after the record is written, see
+                # notify() calls
+                self._notify.append((table, self.record_key(ivalues), values))
+            if self._bulk is not None and not propagate:
                 #
+                # bulk mode: group the rows by table, keeping the
+                # order of the tables, see bulk_flush()
+                #
+                if self._bulk and self._bulk[-1][0] == table:
+                    self._bulk[-1][1].append((values, ivalues))
+                else:
+                    self._bulk.append((table, [(values, ivalues)]))
+                self._bulk_rows += 1
+                if self._bulk_rows >= config.db_bulk_limit:
+                    self.bulk_flush()
+                return
+            try:
+                self.upsert(table, values, ivalues)
             except Exception as e:
                 #
                 if propagate:
@@ -989,9 +1224,236 @@ class DBSchema(object):
                     'load_netlink: %s %s %s' % (table, target, event)
                 )
                 self.log.error('load_netlink: %s' % traceback.format_exc())
+            if self._notify:
+                self.notify()
+
+    def index_values(self, table, target, event):
+        #
+        # Fetch the index values for the table from a netlink
+        # message, starting with target and tflags
+        #
+        values = [target, 0]
+        key_defaults = self.key_defaults[table]
+        for key in self.indices[table]:
+            value = event.get(key) or event.get_attr(key)
+            if value is None:
+                value = key_defaults[key]
+            values.append(value)
+        return values
 
+    def extract(self, table, target, event):
+        #
+        # Fetch the field values and the index values for the table
+        # from a netlink message, using the plan from compile_spec()
+        #
+        # field values
+        values = [target, 0]
+        # index values
+        ivalues = [target, 0]
+        key_defaults = self.key_defaults[table]
+        # a map of sub-NLAs: path -> (sub-NLA, {NLA name: the first NLA})
+        nodes = {}
+
+        # fetch values (exc. the first two columns)
+        for path, name, is_index in self.compiled[table]['extract']:
+            # see if we tried to get the sub-NLA already
+            if path in nodes:
+                node, nla_map = nodes[path]
+            else:
+                # descend
+                node = event
+                for steg in path:
+                    node = node.get_attr(steg)
+                    if node is None:
+                        break
+                # scan the NLA chain once instead of get_attr()
+                # for every field
+                nla_map = {}
+                if node is not None:
+                    for cell in node.get('attrs') or ():
+                        nla_map.setdefault(cell[0], cell)
+                nodes[path] = (node, nla_map)
+            # the event has no such sub-NLA
+            if node is None:
+                values.append(None)
+                continue
+
+            # NLA have priority
+            cell = nla_map.get(name)
+            value = None if cell is None else cell[1]
+            if value is None:
+                value = node.get(name)
+            if is_index:
+                if value is None:
+                    value = key_defaults[name]
+                ivalues.append(value)
+            values.append(value)
+        return values, ivalues
 
-def init(ndb, connection, mode, rtnl_log, tid):
+    def upsert(self, table, values, ivalues):
+        compiled = self.compiled[table]
+        if self.mode == 'psycopg2':
+            #
+            # run UPSERT -- the DB provider must support it
+            #
+            self.execute(compiled['upsert'], (values + values + ivalues))
+            #
+        elif self.mode == 'sqlite3':
+            #
+            # SQLite3 >= 3.24 actually has UPSERT, but ...
+            #
+            # We can not use here INSERT OR REPLACE as well, since
+            # it drops (almost always) records with foreign key
+            # dependencies. Maybe a bug in SQLite3, who knows.
+            #
+            count = (
+                self.execute(
+                    '''
+                              SELECT count(*) FROM %s WHERE %s
+                              '''
+                    % (table, compiled['fidx']),
+                    ivalues,
+                ).fetchone()
+            )[0]
+            if count == 0:
+                self.execute(
+                    '''
+                             INSERT INTO %s (%s) VALUES (%s)
+                             '''
+                    % (table, compiled['fnames'], compiled['plchs']),
+                    values,
+                )
+            else:
+                self.execute(
+                    '''
+                             UPDATE %s SET %s WHERE %s
+                             '''
+                    % (table, compiled['fset'], compiled['fidx']),
+                    (values + ivalues),
+                )
+        else:
+            raise NotImplementedError()
+
+    def bulk_begin(self):
+        #
+        # Start the bulk mode: load_netlink() collects the rows,
+        # and they go to the DB with one executemany() per table
+        # in one transaction. The rows are flushed on any other
+        # SQL statement, when config.db_bulk_limit is reached,
+        # and by bulk_commit()
+        #
+        if self._bulk is None:
+            self._bulk = []
+            self._bulk_rows = 0
+
+    def bulk_commit(self):
+        if self._bulk is not None:
+            if self._bulk:
+                self.bulk_flush()
+            self._bulk = None
+        if self.readers is not None:
+            self.connection.commit()
+        if self._notify:
+            self.notify()
+
+    def bulk_flush(self):
+        bulk = self._bulk
+        self._bulk = []
+        self._bulk_rows = 0
+        cursor = self._cursor or self.connection.cursor()
+        for table, rows in bulk:
+            upsert = self.compiled[table]['upsert']
+            if upsert is not None:
+                if self.mode == 'psycopg2':
+                    batch = [x + x + y for (x, y) in rows]
+                else:
+                    batch = [x for (x, _) in rows]
+                try:
+                    self.bulk_guard(cursor, cursor.executemany, upsert, batch)
+                    continue
+                except Exception as e:
+                    self.log.debug('bulk_flush: %s: %s' % (table, e))
+            #
+            # no UPSERT in SQLite3 < 3.24, or the batch failed: the
+            # upsert is idempotent, so simply run it row by row, to
+            # load the rest and to log the errors
+            #
+            for values, ivalues in rows:
+                try:
+                    self.bulk_guard(
+                        cursor, self.upsert, table, values, ivalues
+                    )
+                except Exception:
+                    self.log.debug('load_netlink: %s %s' % (table, values))
+                    self.log.error('load_netlink: %s' % traceback.format_exc())
+        self.connection.commit()
+        self._counter = 0
+
+    def bulk_guard(self, cursor, func, *argv):
+        #
+        # An error aborts the whole PostgreSQL transaction, so the
+        # statements run within a savepoint, and on error only they
+        # are rolled back, not the statements before the bulk flush
+        #
+        if self.mode != 'psycopg2':
+            return func(*argv)
+        cursor.execute('SAVEPOINT bulk_flush')
+        try:
+            ret = func(*argv)
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT bulk_flush')
+            raise
+        cursor.execute('RELEASE SAVEPOINT bulk_flush')
+        return ret
+
+    def rows(self, tables):
+        #
+        # Export the records: [(table, [row, ...]), ...], the rows
+        # in the compiled all_names order, see load_rows()
+        #
+        ret = []
+        for table in tables:
+            rows = self.fetch(
+                'SELECT %s FROM %s' % (self.compiled[table]['fnames'], table)
+            )
+            rows = [list(x) for x in rows]
+            if rows:
+                ret.append((table, rows))
+        return ret
+
+    def load_rows(self, target, rows):
+        #
+        # Load the records exported by rows() in the bulk mode,
+        # see pr2modules.ndb.ingest
+        #
+        bulk = self._bulk is None
+        if bulk:
+            self.bulk_begin()
+        for table, records in rows:
+            compiled = self.compiled[table]
+            ipos = [
+                x
+                for x, name in enumerate(compiled['all_names'])
+                if name in compiled['idx']
+            ]
+            batch = []
+            for values in records:
+                values[0] = target
+                ivalues = [values[x] for x in ipos]
+                if table in self.watchers:
+                    self._notify.append(
+                        (table, self.record_key(ivalues), values)
+                    )
+                batch.append((values, ivalues))
+            self._bulk.append((table, batch))
+            self._bulk_rows += len(batch)
+            if self._bulk_rows >= config.db_bulk_limit:
+                self.bulk_flush()
+        if bulk:
+            self.bulk_commit()
+
+
+def init(ndb, connection, mode, rtnl_log, tid, readers=None):
     #
     # first prepare the schema and init the DB
     #
@@ -1009,7 +1471,12 @@ def init(ndb, connection, mode, rtnl_log, tid):
         for name, cls in plugin.init['classes']:
             DBSchema.classes[name] = cls
 
-    ret = DBSchema(ndb, connection, mode, rtnl_log, tid)
+    if mode == 'columnar':
+        from .columnar import ColumnarSchema
+
+        ret = ColumnarSchema(ndb, connection, mode, rtnl_log, tid)
+    else:
+        ret = DBSchema(ndb, connection, mode, rtnl_log, tid, readers)
 
     #
     # init the event mapping
@@ -1027,4 +1494,10 @@ def init(ndb, connection, mode, rtnl_log, tid):
                     handlers.append(partial(h, ret))
             ret.event_map[etype] = handlers
 
+    #
+    # storage specific loaders, if any
+    #
+    for etype, handler in getattr(ret, 'loaders', {}).items():
+        ret.event_map[etype] = [partial(handler, ret)]
+
     return ret
@@ -67,6 +67,28 @@ In some more extended form::
                        'check_host_keys': False})
 
 See also: :ref:`remote`
+
+Event bursts
+------------
+
+Any source may merge the RTNL events that change the same object
+within a time window, seconds, so the DB loads only the latest
+state of the object::
+
+    ndb.sources.add(netns='test01', coalesce=0.05)
+
+See also: `pr2modules.ndb.coalesce`
+
+Many sources
+------------
+
+The initial dumps of the local and netns sources may be loaded in
+parallel by a pool of worker processes::
+
+    ndb = NDB(sources=[{'netns': 'test%02i' % x} for x in range(300)],
+              ingest_workers=8)
+
+See also: `pr2modules.ndb.ingest`
 '''
 import sys
 import time
@@ -82,9 +104,11 @@ from pr2modules.iproute.linux import IPRoute
 from pr2modules.remote import RemoteIPRoute
 from pr2modules.netlink.nlsocket import NetlinkMixin
 from pr2modules.netlink.exceptions import NetlinkError
-from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from . import ingest
+from .coalesce import Coalescer
 from .events import ShutdownException, State
-from .messages import cmsg_event, cmsg_failed, cmsg_sstart
+from .ingest import zero_if
+from .messages import cmsg_event, cmsg_failed, cmsg_rows, cmsg_sstart
 
 if sys.platform.startswith('linux'):
     from pr2modules import netns
@@ -158,6 +182,16 @@ class Source(dict):
         self.kind = spec.pop('kind', 'local')
         self.persistent = spec.pop('persistent', True)
         self.event = spec.pop('event')
+        # merge the RTNL events within the time window, seconds
+        coalesce = spec.pop('coalesce', None)
+        self.coalescer = None
+        if coalesce:
+            self.coalescer = Coalescer(
+                self.forward,
+                self.ndb.schema.indices,
+                coalesce,
+                'event coalescer: %s' % self.target,
+            )
         # RTNL API
         self.nl_prime = self.get_prime(self.kind)
         self.nl_kwarg = spec
@@ -169,6 +203,10 @@ class Source(dict):
         self.started = threading.Event()
         self.lock = threading.RLock()
         self.shutdown_lock = threading.RLock()
+        # the events received while a worker loads the initial
+        # dump, see load_rows()
+        self.backlog = None
+        self.backlog_lock = threading.Lock()
         self.started.clear()
         self.log = ndb.log.channel('sources.%s' % self.target)
         self.state = State(log=self.log)
@@ -297,22 +335,41 @@ class Source(dict):
                     time.sleep(1)
         raise RuntimeError('api call failed')
 
+    def api_pipeline(self, calls, window=64):
+        '''
+        Run API calls `[(name, argv, kwarg), ...]` without waiting
+        for the responses, see `NetlinkMixin.pipeline()`. Return the
+        results in the same order, the exceptions are returned as
+        the results of the failed calls.
+        '''
+        with self.lock:
+            if not isinstance(self.nl, NetlinkMixin):
+                ret = []
+                for name, argv, kwarg in calls:
+                    try:
+                        ret.append(getattr(self.nl, name)(*argv, **kwarg))
+                    except Exception as e:
+                        ret.append(e)
+                return ret
+            futures = []
+            with self.nl.pipeline(window) as pipe:
+                for name, argv, kwarg in calls:
+                    try:
+                        futures.append(getattr(pipe, name)(*argv, **kwarg))
+                    except Exception as e:
+                        futures.append(e)
+        ret = []
+        for future in futures:
+            if isinstance(future, Exception):
+                ret.append(future)
+            elif future.exception() is not None:
+                ret.append(future.exception())
+            else:
+                ret.append(future.result())
+        return ret
+
     def fake_zero_if(self):
-        url = 'https://github.com/svinota/pyroute2/issues/737'
-        zero_if = ifinfmsg()
-        zero_if['index'] = 0
-        zero_if['state'] = 'up'
-        zero_if['flags'] = 1
-        zero_if['header']['flags'] = 2
-        zero_if['header']['type'] = 16
-        zero_if['header']['target'] = self.target
-        zero_if['event'] = 'RTM_NEWLINK'
-        zero_if['attrs'] = [
-            ('IFLA_IFNAME', url),
-            ('IFLA_ADDRESS', '00:00:00:00:00:00'),
-        ]
-        zero_if.encode()
-        self.evq.put([zero_if], source=self.target)
+        self.evq.put([zero_if(self.target)], source=self.target)
 
     def receiver(self):
         #
@@ -326,6 +383,10 @@ class Source(dict):
                 if self.shutdown.is_set():
                     break
 
+                if self.coalescer is not None:
+                    # the events of the previous connection go first
+                    self.coalescer.flush()
+
                 if self.nl is not None:
                     try:
                         self.nl.close(code=0)
@@ -347,14 +408,31 @@ class Source(dict):
                     #
                     # Initial load -- enqueue the data
                     #
-                    self.ndb.schema.allow_read(False)
-                    try:
-                        self.ndb.schema.flush(self.target)
-                        if self.kind in ('local', 'netns', 'remote'):
-                            self.fake_zero_if()
-                        self.evq.put(self.nl.dump(), source=self.target)
-                    finally:
-                        self.ndb.schema.allow_read(True)
+                    pool = self.ndb._ingest_pool
+                    if (
+                        pool is not None
+                        and self.kind in ingest.kinds
+                        and self.ndb.messenger is None
+                    ):
+                        # fetch, parse and load the dump in a worker,
+                        # the main loop has only to write the rows;
+                        # the receiver keeps reading the events
+                        future = pool.submit(
+                            ingest.ingest,
+                            self.target,
+                            self.kind,
+                            self.ndb._db_provider,
+                            self.nl_kwarg,
+                        )
+                        with self.backlog_lock:
+                            self.backlog = backlog = []
+                        threading.Thread(
+                            target=self.load_rows,
+                            args=(future, backlog),
+                            name='NDB ingest: %s' % (self.target),
+                        ).start()
+                    else:
+                        self.load(self.nl.dump())
                 except Exception as e:
                     self.started.set()
                     self.state.set('failed')
@@ -380,19 +458,10 @@ class Source(dict):
                     continue
 
             with self.lock:
-                if self.state.get() == 'loading':
-                    if self.event is not None:
-                        self.evq.put(
-                            (cmsg_event(self.target, self.event),),
-                            source=self.target,
-                        )
-                    else:
-                        self.evq.put(
-                            (cmsg_sstart(self.target),), source=self.target
-                        )
-                    self.started.set()
-                    self.shutdown.clear()
-                    self.state.set('running')
+                with self.backlog_lock:
+                    # with a worker, the loader thread does that
+                    if self.state.get() == 'loading' and self.backlog is None:
+                        self.running()
 
             while self.state.get() not in ('stop', 'restart'):
                 try:
@@ -414,13 +483,20 @@ class Source(dict):
                     self.state.set('stop')
                     break
 
-                self.ndb.schema._allow_write.wait()
                 try:
-                    self.evq.put(msg, source=self.target)
+                    with self.backlog_lock:
+                        if self.backlog is not None:
+                            # the initial dump is not loaded yet
+                            self.backlog.append(msg)
+                            continue
+                    self.push(msg)
                 except ShutdownException:
                     self.state.set('stop')
                     break
 
+        with self.backlog_lock:
+            # the loader thread, if any, must drop the rows
+            self.backlog = None
         # thus we make sure that all the events from
         # this source are consumed by the main loop
         # in __dbm__() routine
@@ -433,8 +509,93 @@ class Source(dict):
             pass
         self.state.set('stopped')
 
+    def load(self, dump=None, rows=None):
+        #
+        # Enqueue the initial dump, or the rows loaded by a worker
+        #
+        self.ndb.schema.allow_read(False)
+        try:
+            self.ndb.schema.flush(self.target)
+            if dump is None:
+                self.evq.put(
+                    (cmsg_rows(self.target, rows),), source=self.target
+                )
+            else:
+                if self.kind in ('local', 'netns', 'remote'):
+                    self.fake_zero_if()
+                self.evq.put(dump, source=self.target)
+        finally:
+            self.ndb.schema.allow_read(True)
+
+    def load_rows(self, future, backlog):
+        #
+        # The loader thread routine -- wait for the worker, enqueue
+        # the rows and then the events received meanwhile
+        #
+        try:
+            try:
+                rows = future.result()
+                dump = None
+            except Exception as e:
+                self.log.warning('ingest worker: %s %s' % (type(e), e))
+                rows = None
+                dump = self.nl.dump()
+            with self.backlog_lock:
+                if self.backlog is not backlog:
+                    # the source is restarted or stopped
+                    return
+                self.load(dump, rows)
+                self.backlog = None
+                for msg in backlog:
+                    self.push(msg)
+                self.running()
+        except ShutdownException:
+            return
+        except Exception as e:
+            if self.shutdown.is_set():
+                return
+            self.started.set()
+            self.state.set('failed')
+            self.log.error('source error: %s %s' % (type(e), e))
+            try:
+                self.evq.put((cmsg_failed(self.target),), source=self.target)
+            except ShutdownException:
+                return
+            if self.persistent:
+                self.shutdown.wait(SOURCE_FAIL_PAUSE)
+                if not self.shutdown.is_set():
+                    self.restart('initial load failed')
+            else:
+                self.close(sync=False)
+                if self.event is not None:
+                    self.event.set()
+
+    def running(self):
+        if self.event is not None:
+            self.evq.put(
+                (cmsg_event(self.target, self.event),), source=self.target
+            )
+        else:
+            self.evq.put((cmsg_sstart(self.target),), source=self.target)
+        self.started.set()
+        self.shutdown.clear()
+        self.state.set('running')
+
+    def push(self, msg):
+        if self.coalescer is not None:
+            self.coalescer.push(msg)
+        else:
+            self.forward(msg)
+
+    def forward(self, msg):
+        self.ndb.schema._allow_write.wait()
+        self.evq.put(msg, source=self.target)
+
     def sync(self):
         self.log.debug('sync')
+        if self.coalescer is not None:
+            # the source is closed: the DB records are to be flushed
+            self.coalescer.close(discard=self.shutdown.is_set())
         sync = threading.Event()
         self.evq.put((cmsg_event(self.target, sync),), source=self.target)
         sync.wait()
@@ -467,6 +628,10 @@ class Source(dict):
                     self.nl.close(code=code)
                 except Exception as e:
                     self.log.error('source close: %s' % e)
+            if self.coalescer is not None:
+                # the pending events must not bring the records
+                # back after the DB flush
+                self.coalescer.close(discard=True)
         if sync:
             if self.th is not None:
                 self.th.join()
@@ -1,34 +1,114 @@
-import time
-import uuid
-import socket
+'''
+Cluster transport
+-----------------
+
+NDB nodes exchange frames over TCP. Every frame starts with a fixed
+header, network byte order::
+
+    struct {
+        uint32 length;     // the payload length
+        uint16 version;    // the protocol version, see VERSION
+        uint16 kind;       // KIND_HELLO, KIND_EVENTS or KIND_PICKLE
+        uint32 sender;     // the node that sent the frame
+        uint32 origin;     // the node that created the frame
+        uint64 sequence;   // the frame id of the origin
+    };
+
+KIND_EVENTS payload is the target name, uint16 length + UTF-8, and
+the raw netlink messages of this target, as they came from the
+source, one or more per frame. The API calls and responses, that
+carry arbitrary Python objects, use pickle, KIND_PICKLE.
+
+The nodes relay frames as is, only updating the sender. Duplicates
+are dropped by `(origin, sequence)` before the payload is parsed.
+By default every frame is relayed to all the peers but the sender
+and the origin, that works with any topology. If all the nodes are
+peers of each other, a spanning tree may be used instead: with
+`fanout=k` the frames go along a k-ary tree rooted at the origin,
+so every node gets every frame only once::
+
+    messenger = Messenger(local_id, transport, fanout=2)
+
+or in the cluster config, see `pr2modules.ndb.cluster`::
+
+    {"local": {"id": 1, "address": "0.0.0.0", "port": 5680, "fanout": 2},
+     "peers": [[2, "192.168.12.1", 5680], [3, "192.168.12.5", 5680]]}
+'''
+import itertools
 import pickle
 import select
+import socket
 import struct
+import threading
+import time
+from pr2modules.netlink.rtnl import RTM_NEWNETNS
+from pr2modules.netlink.rtnl import RTM_DELNETNS
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from pr2modules.netlink.rtnl.nsinfmsg import nsinfmsg
+
+HEADER = struct.Struct('!IHHIIQ')
+TARGET = struct.Struct('!H')
+VERSION = 1
+KIND_HELLO = 1
+KIND_EVENTS = 2
+KIND_PICKLE = 3
+# flush the pending events when the batch grows over this size
+BATCH_SIZE = 65536
+# the initial read buffer size per connection
+BUFFER_SIZE = 262144
+
+
+def frame(kind, sender, origin, sequence, payload=b''):
+    return (
+        HEADER.pack(len(payload), VERSION, kind, sender, origin, sequence)
+        + payload
+    )
+
+
+class MarshalCluster(MarshalRtnl):
+    '''
+    Parse KIND_EVENTS payload: RTNL messages + NDB netns info
+    '''
 
+    msg_map = dict(MarshalRtnl.msg_map)
+    msg_map[RTM_NEWNETNS] = nsinfmsg
+    msg_map[RTM_DELNETNS] = nsinfmsg
 
-class IdCache(dict):
-    def invalidate(self):
-        current_time = time.time()
-        collect_time = current_time - 60
-        for mid, meta in tuple(self.items()):
-            if meta < collect_time:
-                self.pop(mid)
 
-    def __setitem__(self, key, value):
-        if len(self) > 100:
-            self.invalidate()
-        dict.__setitem__(self, key, value)
+class SequenceCache(object):
+    '''
+    Seen frames. The frames of one origin may come out of order via
+    different paths, so keep a window of the recent sequence numbers
+    per origin; the older frames are considered seen.
+    '''
+
+    window = 4096
+
+    def __init__(self):
+        self.origins = {}
+
+    def seen(self, origin, sequence):
+        top, recent = self.origins.get(origin, (0, set()))
+        if sequence <= top - self.window or sequence in recent:
+            return True
+        recent.add(sequence)
+        if sequence > top:
+            top = sequence
+        if len(recent) > self.window * 2:
+            recent = set([x for x in recent if x > top - self.window])
+        self.origins[origin] = (top, recent)
+        return False
 
 
 class Peer(object):
-    def __init__(self, remote_id, local_id, address, port, cache):
+    def __init__(self, remote_id, local_id, address, port, sequence):
         self.address = address
         self.port = port
         self.socket = None
         self.remote_id = remote_id
         self.local_id = local_id
-        self.cache = cache
-        self.version = 0
+        self.sequence = sequence
+        self.lock = threading.Lock()
         self.last_exception_time = 0
 
     @property
@@ -37,9 +117,9 @@ class Peer(object):
 
     def __repr__(self):
         if self.connected:
-            connected = 'not connected'
-        else:
             connected = 'connected'
+        else:
+            connected = 'not connected'
         return '[%s-%s] %s:%s [%s]' % (
             self.local_id,
             self.remote_id,
@@ -49,41 +129,97 @@ class Peer(object):
         )
 
     def hello(self):
-        while True:
-            message_id = str(uuid.uuid4().hex)
-            if message_id not in self.cache:
-                self.cache[message_id] = time.time()
-                break
-        data = pickle.dumps(
-            {'type': 'system', 'id': message_id, 'data': 'HELLO'}
-        )
-        self.send(data)
+        self.send(None)
 
     def send(self, data):
-        length = len(data)
-        data = struct.pack('III', length, self.version, self.local_id) + data
-        if self.socket is None:
-            if time.time() - self.last_exception_time < 5:
+        #
+        # Send a frame, connect if required. A new connection starts
+        # with HELLO; data None means only HELLO.
+        #
+        with self.lock:
+            if self.socket is None:
+                if time.time() - self.last_exception_time < 5:
+                    return
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+                )
+                try:
+                    self.socket.connect((self.address, self.port))
+                except Exception:
+                    self.last_exception_time = time.time()
+                    self.socket = None
+                    return
+                hello = frame(
+                    KIND_HELLO,
+                    self.local_id,
+                    self.local_id,
+                    next(self.sequence),
+                )
+                data = hello if data is None else hello + data
+            if data is None:
                 return
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             try:
-                self.socket.connect((self.address, self.port))
-                self.hello()
+                self.socket.sendall(data)
             except Exception:
-                self.last_exception_time = time.time()
+                try:
+                    self.socket.close()
+                except Exception:
+                    pass
                 self.socket = None
-                return
-        try:
-            self.socket.send(data)
-        except Exception:
-            try:
-                self.socket.close()
-            except Exception:
-                pass
-            self.socket = None
 
     def close(self):
-        self.socket.close()
+        with self.lock:
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
+
+
+class Stream(object):
+    '''
+    An incoming connection. Read the data into a preallocated buffer
+    and cut it into frames.
+    '''
+
+    def __init__(self, sock, size=BUFFER_SIZE):
+        self.socket = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+
+    def grow(self, size):
+        self.view.release()
+        self.buffer.extend(bytearray(size - len(self.buffer)))
+        self.view = memoryview(self.buffer)
+
+    def read(self):
+        #
+        # Return the list of complete frames, None on EOF
+        #
+        length = self.socket.recv_into(self.view[self.filled :])
+        if length == 0:
+            return None
+        self.filled += length
+        ret = []
+        offset = 0
+        while self.filled - offset >= HEADER.size:
+            length, version = HEADER.unpack_from(self.buffer, offset)[:2]
+            end = offset + HEADER.size + length
+            if end > self.filled:
+                break
+            if version == VERSION:
+                ret.append(self.buffer[offset:end])
+            offset = end
+        if offset:
+            rest = self.filled - offset
+            self.view[:rest] = self.view[offset : self.filled]
+            self.filled = rest
+        # a frame that doesn't fit the buffer
+        if self.filled >= HEADER.size:
+            length = HEADER.unpack_from(self.buffer)[0] + HEADER.size
+            if length > len(self.buffer):
+                self.grow(length)
+        return ret
 
 
 class Transport(object):
@@ -91,13 +227,13 @@ class Transport(object):
         self.peers = []
         self.address = address
         self.port = port
-        self.version = 0
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1048576)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.address, self.port))
         self.socket.listen(16)
-        self.stream_endpoints = []
+        self.streams = {}
+        self.frames = []
 
     def add_peer(self, peer):
         self.peers.append(peer)
@@ -110,48 +246,64 @@ class Transport(object):
                 ret.append(peer.send(data))
         return ret
 
+    def poll(self):
+        fds = [self.socket] + list(self.streams)
+        rlist, _, xlist = select.select(fds, [], fds)
+        for fd in xlist:
+            self.streams.pop(fd, None)
+        for fd in rlist:
+            if fd == self.socket:
+                new_fd, raddr = self.socket.accept()
+                self.streams[new_fd] = Stream(new_fd)
+                continue
+            stream = self.streams.get(fd)
+            if stream is None:
+                continue
+            try:
+                frames = stream.read()
+            except OSError:
+                frames = None
+            if frames is None:
+                self.streams.pop(fd).socket.close()
+                continue
+            self.frames.extend(frames)
+
     def get(self):
-        while True:
-            fds = [self.socket] + self.stream_endpoints
-            [rlist, wlist, xlist] = select.select(fds, [], fds)
-            for fd in xlist:
-                if fd in self.stream_endpoints:
-                    (
-                        self.stream_endpoints.pop(
-                            self.stream_endpoints.index(fd)
-                        )
-                    )
-            for fd in rlist:
-                if fd == self.socket:
-                    new_fd, raddr = self.socket.accept()
-                    self.stream_endpoints.append(new_fd)
-                else:
-                    data = fd.recv(8)
-                    if len(data) == 0:
-                        (
-                            self.stream_endpoints.pop(
-                                self.stream_endpoints.index(fd)
-                            )
-                        )
-                        continue
-                    length, version, remote_id = struct.unpack('III', data)
-                    if version != self.version:
-                        continue
-                    data = b''
-                    while len(data) < length:
-                        data += fd.recv(length - len(data))
-                    return data, remote_id
+        #
+        # Return the next frame as a bytearray
+        #
+        while not self.frames:
+            try:
+                self.poll()
+            except (OSError, ValueError):
+                if self.socket.fileno() < 0:
+                    # closed, stop the messenger iteration
+                    raise StopIteration()
+                raise
+            self.frames.reverse()
+        return self.frames.pop()
 
     def close(self):
+        for peer in self.peers:
+            peer.close()
+        for stream in tuple(self.streams.values()):
+            stream.socket.close()
         self.socket.close()
 
 
 class Messenger(object):
-    def __init__(self, local_id, transport=None):
+    def __init__(self, local_id, transport=None, fanout=None):
         self.local_id = local_id
         self.transport = transport or Transport('0.0.0.0', 5680)
         self.targets = set()
-        self.id_cache = IdCache()
+        self.fanout = fanout
+        self.cache = SequenceCache()
+        # time based, so the numbers keep growing after restart
+        self.sequence = itertools.count(int(time.time() * 1000000))
+        self.pending = {}
+        self.pending_size = 0
+        self.lock = threading.Lock()
+        self._tree = (None, None)
 
     def __iter__(self):
         return self
@@ -162,49 +314,106 @@ class Messenger(object):
             if msg is not None:
                 return msg
 
-    def handle(self):
-        data, remote_id = self.transport.get()
-        message = pickle.loads(data)
+    next = __next__
 
-        if message['id'] in self.id_cache:
-            # discard message
-            return None
+    def route(self, origin, sender):
+        #
+        # Choose the peers to send a frame to
+        #
+        peers = self.transport.peers
+        if self.fanout:
+            count, members = self._tree
+            if count != len(peers):
+                members = sorted(
+                    set([self.local_id] + [x.remote_id for x in peers])
+                )
+                self._tree = (len(peers), members)
+            if origin in members:
+                # the k-ary tree, rooted at the origin
+                position = members.index(origin)
+                ring = members[position:] + members[:position]
+                index = ring.index(self.local_id) * self.fanout
+                children = ring[index + 1 : index + self.fanout + 1]
+                return [x for x in peers if x.remote_id in children]
+        return [x for x in peers if x.remote_id not in (sender, origin)]
 
-        if message['type'] == 'system':
-            # forward system messages
-            self.transport.send(data, exclude=[remote_id])
-            return message
+    def send(self, kind, payload):
+        data = frame(
+            kind, self.local_id, self.local_id, next(self.sequence), payload
+        )
+        return [x.send(data) for x in self.route(self.local_id, None)]
 
-        self.id_cache[message['id']] = time.time()
+    def handle(self):
+        data = self.transport.get()
+        length, version, kind, sender, origin, sequence = HEADER.unpack_from(
+            data
+        )
+        if origin == self.local_id or self.cache.seen(origin, sequence):
+            # discard message
+            return None
 
-        if (
-            message['type'] == 'transport'
-            and message['target'] in self.targets
-        ):
-            # ignore DB updates with the same target
-            message = None
-        elif (
-            message['type'] == 'api' and message['target'] not in self.targets
-        ):
-            # ignore API messages with other targets
-            message = None
+        # relay the frame
+        peers = self.route(origin, sender)
+        if peers:
+            HEADER.pack_into(
+                data, 0, length, version, kind, self.local_id, origin, sequence
+            )
+            for peer in peers:
+                peer.send(data)
 
-        self.transport.send(data, exclude=[remote_id])
-        return message
+        if kind == KIND_HELLO:
+            return {'type': 'system', 'data': 'HELLO', 'origin': origin}
+        elif kind == KIND_EVENTS:
+            offset = HEADER.size + TARGET.size
+            (tlen,) = TARGET.unpack_from(data, HEADER.size)
+            target = bytes(data[offset : offset + tlen]).decode('utf-8')
+            if target in self.targets:
+                # ignore DB updates with the same target
+                return None
+            return {
+                'type': 'transport',
+                'target': target,
+                'data': data[offset + tlen :],
+            }
+        elif kind == KIND_PICKLE:
+            message = pickle.loads(data[HEADER.size :])
+            if (
+                message['type'] == 'api'
+                and message['target'] not in self.targets
+            ):
+                # ignore API messages with other targets
+                return None
+            return message
 
     def emit(self, message):
-        while True:
-            message_id = '%s-%s' % (
-                message.get('target', '-'),
-                uuid.uuid4().hex,
-            )
-            if message_id not in self.id_cache:
-                self.id_cache[message_id] = time.time()
-                break
+        return self.send(KIND_PICKLE, pickle.dumps(message))
+
+    def forward(self, target, data):
+        #
+        # Queue raw netlink messages of the target, see flush()
+        #
+        with self.lock:
+            if target not in self.pending:
+                target_data = target.encode('utf-8')
+                self.pending[target] = bytearray(
+                    TARGET.pack(len(target_data)) + target_data
+                )
+            self.pending[target] += data
+            self.pending_size += len(data)
+            if self.pending_size < BATCH_SIZE:
+                return
+        self.flush()
 
-        message['id'] = message_id
-        return self.transport.send(pickle.dumps(message))
+    def flush(self):
+        #
+        # Send the queued netlink messages, one frame per target
+        #
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.pending_size = 0
+        for payload in pending.values():
+            self.send(KIND_EVENTS, bytes(payload))
 
     def add_peer(self, remote_id, address, port):
-        peer = Peer(remote_id, self.local_id, address, port, self.id_cache)
+        peer = Peer(remote_id, self.local_id, address, port, self.sequence)
         self.transport.add_peer(peer)
@@ -62,6 +62,27 @@ To remove a network namespace::
 One should stop it first with `close()`, and only after that
 run `remove()`.
 
+DirectNetNS objects
+===================
+
+A netlink socket stays in the network namespace where it was
+created, so there is no need to proxy the requests via another
+process. `DirectNetNS` creates the socket in a short-lived helper
+thread, that joins the namespace with `setns()`, and then works with
+the socket in the calling thread, as `IPRoute` does. No child process
+per namespace, no pickle round trips::
+
+    from pr2modules.nslink.nslink import DirectNetNS
+
+    with DirectNetNS('test') as ns:
+        ns.link('add', ifname='br0', kind='bridge')
+        ns.get_links()
+
+The arguments are the same as for `NetNS`. The netlink proxy hooks,
+e.g. creating tuntap or team interfaces, also run in the namespace.
+Other code that relies on the current namespace of the process, like
+`/sys/class/net` lookups, sees the original namespace.
+
 '''
 
 import os
@@ -69,7 +90,9 @@ import errno
 import signal
 import atexit
 import logging
+import threading
 from functools import partial
+from pr2modules.netlink.rtnl.iprsocket import IPRSocket
 from pr2modules.netlink.rtnl.iprsocket import MarshalRtnl
 from pr2modules.iproute import RTNL_API
 from pr2modules.netns import setns
@@ -81,6 +104,32 @@ from ..remote.transport import RemoteSocket
 log = logging.getLogger(__name__)
 
 
+def in_netns(netns, func, *argv, **kwarg):
+    '''
+    Run `func` in a helper thread in the namespace, return the result
+    or raise the exception. `setns()` affects only the calling thread,
+    so the rest of the process stays where it is. The `flags` and
+    `libc` keywords are passed to `setns()`.
+    '''
+    flags = kwarg.pop('flags', os.O_CREAT)
+    libc = kwarg.pop('libc', None)
+    ret = {}
+
+    def run():
+        try:
+            setns(netns, flags, libc=libc)
+            ret['value'] = func(*argv, **kwarg)
+        except Exception as e:
+            ret['error'] = e
+
+    th = threading.Thread(target=run, name='netns %s' % netns)
+    th.start()
+    th.join()
+    if 'error' in ret:
+        raise ret['error']
+    return ret['value']
+
+
 class FD(object):
     def __init__(self, fd):
         self.fd = fd
@@ -226,3 +275,47 @@ class NetNS(RTNL_API, RemoteSocket):
         Try to remove this network namespace from the system.
         '''
         remove(self.netns)
+
+
+class DirectNetNS(RTNL_API, IPRSocket):
+    '''
+    The IPRoute API over a netlink socket created in the network
+    namespace. See the module docs.
+    '''
+
+    def __init__(
+        self, netns, flags=os.O_CREAT, target=None, libc=None, **kwarg
+    ):
+        self.netns = netns
+        self.flags = flags
+        self.libc = libc
+        kwarg['target'] = target or netns
+        super(DirectNetNS, self).__init__(**kwarg)
+
+    def in_netns(self, func, *argv, **kwarg):
+        return in_netns(
+            self.netns, func, *argv, flags=self.flags, libc=self.libc, **kwarg
+        )
+
+    def post_init(self):
+        # (re)create the socket, see NetlinkSocket.post_init()
+        return self.in_netns(super(DirectNetNS, self).post_init)
+
+    def _gate_linux(self, msg, addr):
+        # the proxy hooks may create interfaces with ioctl() etc.
+        if msg['header']['type'] in self._sproxy.pmap:
+            return self.in_netns(
+                super(DirectNetNS, self)._gate_linux, msg, addr
+            )
+        return super(DirectNetNS, self)._gate_linux(msg, addr)
+
+    def clone(self):
+        kwarg = dict(self.config)
+        kwarg.pop('family')
+        return type(self)(self.netns, self.flags, libc=self.libc, **kwarg)
+
+    def remove(self):
+        '''
+        Try to remove this network namespace from the system.
+        '''
+        remove(self.netns)
@@ -0,0 +1,285 @@
+'''
+NetNSPool
+=========
+
+With hundreds of network namespaces one `NetNS` object per namespace
+means hundreds of proxy processes, pipes and threads. `NetNSPool`
+keeps only a netlink socket per namespace, created in the namespace,
+see `DirectNetNS`, and serves all the sockets from one `selectors`
+loop in the calling thread.
+
+The IPRoute API calls are compiled once with `IPBatch` and sent to
+all or some of the namespaces. The responses are yielded as they
+arrive, every message tagged with the namespace name in
+`msg['header']['target']`::
+
+    from pr2modules.nslink.nspool import NetNSPool
+
+    with NetNSPool(['test01', 'test02', 'test03']) as pool:
+        for msg in pool.get_links():
+            print(msg['header']['target'], msg.get_attr('IFLA_IFNAME'))
+
+        # only some namespaces
+        for msg in pool.route('dump', targets=['test01', 'test03']):
+            ...
+
+        pool.add('test04')
+        pool.discard('test01')
+
+Up to `window` namespaces have requests in flight at any moment. The
+namespaces are not created or removed by the pool, but `add()` uses
+the same `flags` as `NetNS`, so by default a missing namespace is
+created.
+
+The responses are not post-processed like in `IPRoute`: the API
+methods that filter or match the dump results on the client side
+return here the whole dump. The error responses are yielded as well,
+with the exception in `msg['header']['error']`, so one failed
+namespace doesn't stop the rest.
+
+All the requests are sent with `NLM_F_ACK`, so every request gets
+a response: the requests that don't return data yield the ACK, with
+`msg['header']['error']` set to None. If no response arrives within
+`timeout` seconds, the iteration raises `TimeoutError`, and the
+namespaces that didn't respond are not waited for anymore.
+
+The pool is not thread safe, use one pool per thread.
+'''
+
+import os
+import errno
+import struct
+import selectors
+import collections
+from socket import SOL_SOCKET
+from socket import SO_RCVBUF
+from socket import SO_SNDBUF
+from socket import SOCK_DGRAM
+from pr2modules import config
+from pr2modules.common import DEFAULT_RCVBUF
+from pr2modules.config import AF_NETLINK
+from pr2modules.iproute.linux import IPBatch
+from pr2modules.netlink import NETLINK_ROUTE
+from pr2modules.netlink import NLMSG_DONE
+from pr2modules.netlink import NLMSG_ERROR
+from pr2modules.netlink import NLM_F_ACK
+from pr2modules.netlink.rtnl.marshal import MarshalRtnl
+from .nslink import in_netns
+
+
+class Member(object):
+    '''
+    A namespace socket and its request state
+    '''
+
+    __slots__ = ('name', 'sock', 'seq', 'pending')
+
+    def __init__(self, name, sock):
+        self.name = name
+        self.sock = sock
+        self.seq = 0
+        # the responses to wait for
+        self.pending = 0
+
+
+class NetNSPool(object):
+    def __init__(
+        self,
+        netns=(),
+        flags=os.O_CREAT,
+        libc=None,
+        window=64,
+        sndbuf=1048576,
+        rcvbuf=1048576,
+        timeout=30,
+    ):
+        self.flags = flags
+        self.libc = libc
+        self.window = max(1, window)
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.timeout = timeout
+        self.members = collections.OrderedDict()
+        self.selector = selectors.DefaultSelector()
+        self.marshal = MarshalRtnl()
+        self.buffer = bytearray(DEFAULT_RCVBUF)
+        self.compiler = IPBatch()
+        for name in netns:
+            self.add(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(tuple(self.members))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self.compiler, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        def fanout(*argv, **kwarg):
+            targets = kwarg.pop('targets', None)
+            return self.fanout(self.compile(method, *argv, **kwarg), targets)
+
+        fanout.__doc__ = method.__doc__
+        return fanout
+
+    def socket(self):
+        sock = config.SocketBase(AF_NETLINK, SOCK_DGRAM, NETLINK_ROUTE)
+        sock.setsockopt(SOL_SOCKET, SO_SNDBUF, self.sndbuf)
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, self.rcvbuf)
+        sock.bind((0, 0))
+        return sock
+
+    def add(self, name):
+        '''
+        Open a socket in the namespace `name`.
+        '''
+        if name in self.members:
+            return
+        sock = in_netns(name, self.socket, flags=self.flags, libc=self.libc)
+        sock.setblocking(False)
+        member = Member(name, sock)
+        self.members[name] = member
+        self.selector.register(sock, selectors.EVENT_READ, member)
+
+    def discard(self, name):
+        '''
+        Close the socket of the namespace `name`, if any.
+        '''
+        member = self.members.pop(name, None)
+        if member is not None:
+            self.selector.unregister(member.sock)
+            member.sock.close()
+
+    def close(self):
+        for name in tuple(self.members):
+            self.discard(name)
+        self.selector.close()
+        self.compiler.close()
+
+    def compile(self, method, *argv, **kwarg):
+        '''
+        Run an `IPBatch` method, return the compiled requests.
+        '''
+        self.compiler.reset()
+        method(*argv, **kwarg)
+        return bytes(self.compiler.batch)
+
+    def fanout(self, data, targets=None):
+        '''
+        Send the compiled requests `data` to the namespaces, all by
+        default, and yield the response messages as they arrive.
+        '''
+        if targets is None:
+            targets = tuple(self.members)
+        queue = collections.deque(targets)
+        data = bytearray(data)
+        offsets = []
+        offset = 0
+        while offset < len(data):
+            offsets.append(offset)
+            # every request must get a response, see recv()
+            (flags,) = struct.unpack_from('H', data, offset + 6)
+            struct.pack_into('H', data, offset + 6, flags | NLM_F_ACK)
+            offset += struct.unpack_from('I', data, offset)[0]
+        inflight = 0
+        try:
+            while queue or inflight:
+                while queue and inflight < self.window:
+                    inflight += self.send(queue.popleft(), data, offsets)
+                if not inflight:
+                    break
+                events = self.selector.select(self.timeout)
+                if not events:
+                    names = self.abandon()
+                    raise TimeoutError('no response from %s' % names)
+                for key, _ in events:
+                    member = key.data
+                    if not member.pending:
+                        # no request in flight: drop the stale data
+                        self.recv(member)
+                        continue
+                    for msg in self.recv(member):
+                        yield msg
+                    if not member.pending:
+                        inflight -= 1
+        finally:
+            # the consumer stopped early: drain the responses, so
+            # the sockets are ready for the next request
+            while any(x.pending for x in self.members.values()):
+                events = self.selector.select(self.timeout)
+                if not events:
+                    self.abandon()
+                    break
+                for key, _ in events:
+                    self.recv(key.data)
+
+    def abandon(self):
+        '''
+        Stop waiting for the requests in flight, return the names
+        of the namespaces. The late responses are dropped by
+        sequence number.
+        '''
+        ret = []
+        for member in self.members.values():
+            if member.pending:
+                member.pending = 0
+                ret.append(member.name)
+        return ret
+
+    def send(self, name, data, offsets):
+        member = self.members.get(name)
+        if member is None:
+            raise KeyError('netns %s is not in the pool' % name)
+        data = bytearray(data)
+        member.seq = (member.seq + 1) & 0xFFFFFFFF or 1
+        for offset in offsets:
+            struct.pack_into('I', data, offset + 8, member.seq)
+        member.sock.send(data)
+        member.pending = len(offsets)
+        return 1 if offsets else 0
+
+    def recv(self, member):
+        '''
+        Read one datagram of the namespace, return the messages of
+        the current request.
+        '''
+        try:
+            length = member.sock.recv_into(self.buffer)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        ret = []
+        view = memoryview(self.buffer)[:length]
+        try:
+            msgs = self.marshal.parse(view)
+        finally:
+            view.release()
+        for msg in msgs:
+            header = msg['header']
+            if header['sequence_number'] != member.seq or not member.pending:
+                continue
+            # a dump ends with NLMSG_DONE, other requests with
+            # NLMSG_ERROR: an error or the ACK
+            if header['type'] == NLMSG_DONE:
+                member.pending -= 1
+                continue
+            if header['type'] == NLMSG_ERROR:
+                member.pending -= 1
+            header['target'] = member.name
+            ret.append(msg)
+        return ret
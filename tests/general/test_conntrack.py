@@ -150,6 +150,39 @@ class TestDumpEntries(object):
 
         assert count_found == self.COUNT_CT
 
+    def test_stream_entries(self):
+        tuple_match = NFCTAttrTuple(saddr='192.168.122.1',
+                                    daddr='192.168.122.67')
+
+        records = list(self.ct.stream_entries(tuple_orig=tuple_match))
+        assert len(records) == self.COUNT_CT
+        assert set(x.sport for x in records) == \
+            set(x.sport for x in self.tuples)
+        for record in records:
+            assert record.proto == socket.IPPROTO_TCP
+            assert record.dport == 5599
+            assert record.reply_sport == 5599
+            assert record.reply_dport == record.sport
+            assert record.tuple_orig() == NFCTAttrTuple(
+                saddr='192.168.122.1', daddr='192.168.122.67',
+                proto=socket.IPPROTO_TCP, sport=record.sport, dport=5599)
+
+        tuple_filter = NFCTAttrTuple(proto=socket.IPPROTO_TCP, sport=20001)
+        records = list(self.ct.stream_entries(tuple_orig=tuple_filter))
+        assert [x.sport for x in records] == [20001]
+
+    def test_aggregate(self):
+        tuple_match = NFCTAttrTuple(saddr='192.168.122.1',
+                                    daddr='192.168.122.67')
+
+        ret = self.ct.aggregate(tuple_orig=tuple_match)
+        assert ret == {('192.168.122.1',
+                        '192.168.122.67',
+                        socket.IPPROTO_TCP): self.COUNT_CT}
+
+        ret = self.ct.aggregate(key='dport', tuple_orig=tuple_match)
+        assert ret == {(5599, ): self.COUNT_CT}
+
     def teardown(self):
         for tuple_orig in self.tuples:
             self.ct.entry('del', tuple_orig=tuple_orig)
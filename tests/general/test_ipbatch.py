@@ -1,6 +1,7 @@
 from pyroute2 import IPBatch
 from pyroute2 import IPRoute
 from pyroute2.common import uifname
+from pyroute2.netlink.exceptions import NetlinkError
 from utils import require_user
 from utils import allocate_network
 from utils import free_network
@@ -33,3 +34,25 @@ class TestIPBatch(object):
         idx = ipr.link_lookup(ifname=ifname)[0]
         ipr.link('del', index=idx)
         ipr.close()
+
+    def test_submit(self):
+        require_user('root')
+
+        ifname = uifname()
+        ipb = IPBatch()
+        ipb.link('add', ifname=ifname, kind='dummy')
+        ipb.link('add', ifname=ifname, kind='dummy')
+        data = bytes(ipb.batch)
+
+        ipr = IPRoute()
+        ret = ipb.submit(ipr)
+        assert len(ret) == 2
+        assert ret[0][0]['header']['error'] is None
+        assert isinstance(ret[1], NetlinkError)
+        assert ret[1].code == 17
+        # the batch buffer remains the same
+        assert ipb.batch == data
+
+        idx = ipr.link_lookup(ifname=ifname)[0]
+        ipr.link('del', index=idx)
+        ipr.close()
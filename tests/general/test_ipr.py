@@ -287,8 +287,9 @@ class TestIPRoute(object):
         assert len(self.ip.get_rules(priority=lambda x: 100 < x < 500)) == 4
         assert len(self.ip.get_rules(src=ifaddr1)) == 1
         assert len(self.ip.get_rules(dst=ifaddr2)) == 1
-        self.ip.flush_rules(family=socket.AF_INET,
-                            priority=lambda x: 100 < x < 500)
+        stats = self.ip.flush_rules(family=socket.AF_INET,
+                                    priority=lambda x: 100 < x < 500)
+        assert stats == (4, 0, {})
         assert len(self.ip.get_rules(priority=lambda x: 100 < x < 500)) == 0
         assert len(self.ip.get_rules(src=ifaddr1)) == 0
         assert len(self.ip.get_rules(dst=ifaddr2)) == 0
@@ -1153,14 +1154,17 @@ class TestIPRoute(object):
         assert grep('ip route show table 100',
                     pattern='%s/24.*%s' % (naddr2, ifaddr2))
 
-        self.ip.flush_routes(table=100, family=socket.AF_INET6)
+        assert self.ip.flush_routes(table=100,
+                                    family=socket.AF_INET6).deleted == 0
 
         assert grep('ip route show table 100',
                     pattern='%s/24.*%s' % (naddr1, ifaddr2))
         assert grep('ip route show table 100',
                     pattern='%s/24.*%s' % (naddr2, ifaddr2))
 
-        self.ip.flush_routes(table=100, family=socket.AF_INET)
+        stats = self.ip.flush_routes(table=100, family=socket.AF_INET)
+        assert stats.deleted == 2
+        assert stats.failed == 0
 
         assert not grep('ip route show table 100',
                         pattern='%s/24.*%s' % (naddr1, ifaddr2))
@@ -5,6 +5,7 @@ from pyroute2.ipset import IPSet, PortRange, PortEntry
 from pyroute2.netlink.exceptions import NetlinkError
 from pyroute2.netlink.nfnetlink.ipset import IPSET_FLAG_WITH_FORCEADD
 from pyroute2.netlink.nfnetlink.ipset import IPSET_ERR_TYPE_SPECIFIC
+from pyroute2.netlink.nfnetlink.ipset import IPSET_ERR_EXIST
 from utils import require_user
 from uuid import uuid4
 
@@ -151,6 +152,26 @@ class TestIPSet(object):
         self.ip.destroy(name)
         assert not self.get_ipset(name)
 
+    def test_bulk_add_delete(self):
+        name = str(uuid4())[:16]
+        entries = ['10.10.%i.%i' % (x >> 8, x & 0xff) for x in range(5000)]
+        self.ip.create(name, comment=True)
+        # a duplicate and an invalid entry in the middle of a message
+        failed = self.ip.bulk_add(name,
+                                  entries[:2000]
+                                  + [entries[10], '10.10.300.1']
+                                  + entries[2000:]
+                                  + [{'entry': '10.20.0.1', 'comment': 'foo'}])
+        assert [x[0] for x in failed] == [entries[10], '10.10.300.1']
+        assert failed[0][1].code == IPSET_ERR_EXIST
+        content = self.list_ipset(name)
+        assert set(entries) | set(['10.20.0.1']) == set(content)
+        assert content['10.20.0.1'][2] == 'foo'
+        failed = self.ip.bulk_delete(name, entries[:100] + ['10.30.0.1'])
+        assert [x[0] for x in failed] == ['10.30.0.1']
+        assert len(self.list_ipset(name)) == 4901
+        self.ip.destroy(name)
+
     def test_swap(self):
         name_a = str(uuid4())[:16]
         name_b = str(uuid4())[:16]
@@ -1,4 +1,5 @@
 import os
+import errno
 import time
 import fcntl
 import signal
@@ -10,6 +11,8 @@ from threading import Thread
 from pyroute2 import IPDB
 from pyroute2 import IPRoute
 from pyroute2 import NetNS
+from pyroute2 import DirectNetNS
+from pyroute2 import NetNSPool
 from pyroute2 import NSPopen
 from pyroute2.common import uifname
 from pyroute2.netns.process.proxy import NSPopen as NSPopenDirect
@@ -190,6 +193,59 @@ class TestNetNS(object):
             netnsmod.remove(foo)
             netnsmod.remove(bar)
 
+    def test_direct(self):
+        require_user('root')
+        foo = str(uuid4())
+        tap = uifname()
+        fd = open('/proc/self/ns/net', 'r')
+        inode = os.fstat(fd.fileno()).st_ino
+        try:
+            with DirectNetNS(foo) as ns:
+                # the tuntap proxy hook runs in the netns as well
+                ns.link('add', ifname=tap, kind='tuntap', mode='tap')
+                links = set([x.get_attr('IFLA_IFNAME')
+                             for x in ns.get_links()])
+            # the process stays in the original netns
+            assert os.stat('/proc/self/ns/net').st_ino == inode
+            with NetNS(foo) as ns:
+                assert links == set([x.get_attr('IFLA_IFNAME')
+                                     for x in ns.get_links()])
+            assert tap in links
+            with IPRoute() as ip:
+                assert not ip.link_lookup(ifname=tap)
+        finally:
+            fd.close()
+            netnsmod.remove(foo)
+
+    def test_pool(self):
+        require_user('root')
+        names = [str(uuid4()) for _ in range(3)]
+        try:
+            with NetNSPool(names, window=2) as pool:
+                links = {}
+                for msg in pool.get_links():
+                    links.setdefault(msg['header']['target'], []).append(
+                        msg.get_attr('IFLA_IFNAME'))
+                assert links == dict([(x, ['lo']) for x in names])
+                # a subset; errors don't stop the rest
+                ret = list(pool.link('del', index=0xffff,
+                                     targets=names[:2]))
+                assert [x['header']['target'] for x in ret] == names[:2]
+                assert all([x['header']['error'].code == errno.ENODEV
+                            for x in ret])
+                # no data: the ACK is yielded
+                ret = list(pool.link('set', index=1, state='up'))
+                assert len(ret) == len(names)
+                assert all([x['header']['error'] is None for x in ret])
+                # stop early, the next request must work
+                next(pool.get_links())
+                pool.discard(names[0])
+                assert names[0] not in pool
+                assert len(list(pool.get_links())) == 2
+        finally:
+            for name in names:
+                netnsmod.remove(name)
+
     def test_there_and_back(self):
         require_user('root')
         # wait until the previous test's side effects are gone
@@ -6,6 +6,7 @@ from nose.plugins.skip import SkipTest
 from pyroute2 import netns
 from pyroute2.nftables.main import NFTables
 from pyroute2.nftables.rule import NFTRule
+from pyroute2.netlink.exceptions import NetlinkError
 
 from utils import require_user
 
@@ -48,3 +49,22 @@ class NFTables_test(object):
         for r in NFTables(nfgen_family=0).get_rules():
             my_res.append(NFTRule.from_netlink(r).to_dict())
         assert my_res == nft_res
+
+    def test_commit_results(self):
+        nft = NFTables(nfgen_family=2)
+        nft.table('add', name='pr2test')
+        try:
+            nft.begin()
+            nft.chain('add', table='pr2test', name='c0',
+                      hook='input', type='filter', policy=1)
+            nft.chain('add', table='pr2test_none', name='c0',
+                      hook='input', type='filter', policy=1)
+            ret = nft.commit()
+            assert len(ret) == 2
+            assert ret[0][0]['header']['error'] is None
+            assert isinstance(ret[1], NetlinkError)
+            # the transaction is atomic
+            assert not nft.get_chains()
+        finally:
+            nft.table('del', name='pr2test')
+            nft.close()
@@ -1,6 +1,15 @@
+import struct
 from pyroute2.common import load_dump
+from pyroute2.netlink import nla
 from pyroute2.netlink import nlmsg
+from pyroute2.netlink import compile_plan
+from pyroute2.netlink import nla_lazy_list
+from pyroute2.netlink.match import Match
+from pyroute2.inotify.inotify_msg import inotify_msg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
 from pyroute2.netlink.rtnl.iprsocket import MarshalRtnl
+from pyroute2.iproute.linux import RTNL_API
 from pyroute2.netlink.nl80211 import MarshalNl80211
 
 
@@ -33,6 +42,170 @@ class TestAttrs(object):
         assert self.msg.get_nested('C', 'D', 'E') is None
 
 
+class TestPlan(object):
+
+    class msg(nlmsg):
+        fields = (
+            ('family', 'B'),
+            ('__pad', '3x'),
+            ('index', 'I'),
+            ('pair', 'HH'),
+        )
+        nla_map = (('NLA_UNSPEC', 'none'), ('NLA_VALUE', 'nla_value'))
+
+        class nla_value(nla):
+            fields = (('first', 'B'), ('second', '>I'))
+
+    def test_merged(self):
+        plan = compile_plan(self.msg.fields)
+        assert plan.struct is not None
+        assert plan.struct.format == 'B3xIHH'
+        assert plan.size == 12
+        assert plan.counts == (1, 0, 1, 2)
+        assert compile_plan(self.msg.fields) is plan
+
+    def test_fallback(self):
+        # mixed byte order can not be merged
+        plan = compile_plan(self.msg.nla_value.fields)
+        assert plan.struct is None
+        assert plan.size == 5
+        # merge must not introduce alignment padding
+        plan = compile_plan((('a', 'B'), ('b', 'I')))
+        assert plan.struct is None
+        assert plan.size == 5
+
+    def test_codec(self):
+        prime = {
+            'family': 2,
+            'index': 10,
+            'pair': (1, 2),
+            'attrs': [['NLA_VALUE', {'first': 1, 'second': 0x01020304}]],
+        }
+        msg = self.msg()
+        msg.setvalue(prime)
+        msg.encode()
+        assert msg.data[16:28] == b'\x02\0\0\0\x0a\0\0\0\x01\0\x02\0'
+        assert msg.data[32:37] == b'\x01\x01\x02\x03\x04'
+        ret = self.msg(msg.data)
+        ret.decode()
+        assert ret['family'] == 2
+        assert ret['index'] == 10
+        assert ret['pair'] == (1, 2)
+        assert ret['__pad'] == ()
+        value = ret.get_attr('NLA_VALUE')
+        assert value['first'] == 1
+        assert value['second'] == 0x01020304
+
+    def test_no_header(self):
+        # e.g. inotify events
+        data = struct.pack('iIII8s', 1, 0x100, 0, 8, b'test')
+        msg = inotify_msg(data)
+        msg.decode()
+        assert 'header' not in msg
+        assert msg['wd'] == 1
+        assert msg['name'] == 'test'
+
+
+class TestLazy(object):
+
+    def load(self, lazy_decode):
+        marshal = MarshalRtnl()
+        marshal.lazy_decode = lazy_decode
+        with open('decoder/addrmsg_ipv4', 'r') as f:
+            return marshal.parse(load_dump(f))
+
+    def test_get_attr(self):
+        for eager, lazy in zip(self.load(False), self.load(True)):
+            attrs = dict.__getitem__(lazy, 'attrs')
+            assert isinstance(attrs, nla_lazy_list)
+            assert lazy.get_attr('IFA_LABEL') == eager.get_attr('IFA_LABEL')
+            assert lazy.get_attr('RTA_DST') is None
+            # get_attr() must not decode the whole NLA chain
+            assert attrs.headers is not None
+
+    def test_materialize(self):
+        for eager, lazy in zip(self.load(False), self.load(True)):
+            assert len(lazy['attrs']) == len(eager['attrs'])
+            assert lazy['attrs'].headers is None
+            assert lazy == eager
+            assert lazy.dump() == eager.dump()
+
+
+class TestView(object):
+
+    def test_parse(self):
+        with open('decoder/addrmsg_ipv4', 'r') as f:
+            data = load_dump(f)
+        buf = bytearray(data)
+        view = memoryview(buf)
+        msgs = MarshalRtnl().parse(view)
+        view.release()
+        # the buffer may be reused right after parsing
+        buf[:] = bytearray(len(buf))
+        for msg, prime in zip(msgs, MarshalRtnl().parse(data)):
+            assert isinstance(msg.data, bytes)
+            assert msg == prime
+            assert msg.get_attr('IFA_LABEL') == prime.get_attr('IFA_LABEL')
+
+
+class TestMatch(object):
+
+    def dump(self, msg_class, values):
+        data = bytearray()
+        for value in values:
+            msg = msg_class()
+            msg.setvalue(value)
+            msg['header']['type'] = 24 if msg_class is rtmsg else 16
+            msg['header']['flags'] = 2
+            msg['header']['sequence_number'] = 1
+            msg.data = data
+            msg.offset = len(data)
+            msg.encode()
+        return bytes(data)
+
+    def check(self, msg_class, data, spec):
+        parsed = MarshalRtnl().parse(data)
+        reference = list(RTNL_API._match(None, spec, parsed))
+        match = Match(spec, msg_class)
+        msgs = MarshalRtnl().parse(data, 1, match.callback)
+        assert len(msgs) <= len(MarshalRtnl().parse(data))
+        assert list(RTNL_API._match(None, match, msgs)) == reference
+        return len(reference), len(msgs)
+
+    def test_routes(self):
+        data = self.dump(rtmsg, [{'family': 2,
+                                  'dst_len': 24,
+                                  'table': 252 if x % 3 else 254,
+                                  'proto': 4 if x % 2 else 3,
+                                  'attrs': [['RTA_TABLE',
+                                             1000 if x % 3 else 254],
+                                            ['RTA_DST', '10.0.%i.0' % x],
+                                            ['RTA_OIF', x % 4],
+                                            ['RTA_PRIORITY', x]]}
+                                 for x in range(16)])
+        # only the matching messages are decoded
+        assert self.check(rtmsg, data, {'table': 1000, 'oif': 1}) == (3, 3)
+        assert self.check(rtmsg, data, {'table': 254, 'proto': 3}) == (3, 3)
+        assert self.check(rtmsg, data, {'priority': 7}) == (1, 1)
+        assert self.check(rtmsg, data, {'proto': lambda x: x > 3}) == (8, 8)
+        assert self.check(rtmsg, data, {'nonsense': 5}) == (0, 0)
+        # RTA_METRICS, RTA_DST are not decoded on the raw data
+        assert self.check(rtmsg, data, {'metrics': 5}) == (0, 16)
+        assert self.check(rtmsg, data, {'oif': 2, 'dst': '10.0.6.0'}) == (1, 4)
+        assert self.check(rtmsg, data, {'gateway': None}) == (16, 16)
+
+    def test_links(self):
+        data = self.dump(ifinfmsg, [{'index': x,
+                                     'flags': x % 2,
+                                     'attrs': [['IFLA_IFNAME', 'eth%i' % x],
+                                               ['IFLA_MTU', 1500 + x % 2]]}
+                                    for x in range(8)])
+        assert self.check(ifinfmsg, data, {'ifname': 'eth3'}) == (1, 1)
+        assert self.check(ifinfmsg, data, {'mtu': 1501, 'index': 5}) == (1, 1)
+        # ifinfmsg['state'] is set in decode()
+        assert self.check(ifinfmsg, data, {'state': 'up'}) == (4, 8)
+
+
 class TestNL(object):
 
     marshal = None
@@ -127,6 +127,24 @@ class WiSet_test(object):
             assert ip not in myset.content
             myset.destroy()
 
+    def test_insert_delete_list(self, sock=None):
+        entries = ["10.10.%d.%d" % (x >> 8, x & 0xff) for x in range(3000)]
+
+        with WiSet(name=self.name, sock=sock, counters=True) as myset:
+            myset.create()
+            myset.insert_list(entries)
+            assert len(myset.content) == len(entries)
+            try:
+                myset.insert_list(["10.20.0.1", entries[0], "10.20.0.2"])
+                raise Exception("the duplicate must fail")
+            except IPSetError:
+                pass
+            myset.delete_list(entries[:1000])
+            myset.update_content()
+            assert set(myset.content) == (set(entries[1000:])
+                                          | set(["10.20.0.1", "10.20.0.2"]))
+            myset.destroy()
+
     def test_flush(self, sock=None):
         ip_list = ["1.2.3.4", "1.1.1.1", "7.7.7.7"]
 
@@ -0,0 +1,71 @@
+import os
+import socket
+import pytest
+from pr2modules.netlink import CTRL_CMD_DELFAMILY
+from pr2modules.netlink import GENL_ID_CTRL
+from pr2modules.netlink import NETLINK_GENERIC
+from pr2modules.netlink import ctrlmsg
+from pr2modules.netlink.exceptions import NetlinkError
+from pr2modules.netlink.generic import GenericNetlinkSocket
+from pr2modules.netlink.generic.cache import FamilyCache
+
+
+class CountingSocket(GenericNetlinkSocket):
+    discovered = []
+
+    def discovery(self, proto):
+        self.discovered.append(proto)
+        return GenericNetlinkSocket.discovery(self, proto)
+
+
+@pytest.fixture
+def genl():
+    class Socket(CountingSocket):
+        discovered = []
+        family_cache = FamilyCache()
+
+    yield Socket
+    Socket.family_cache.clear()
+
+
+def bind(cls, proto):
+    with cls() as sock:
+        sock.bind(proto, ctrlmsg)
+        return sock.prid, sock.mcast_groups
+
+
+def test_cache_hit(genl):
+    ret = bind(genl, 'nlctrl')
+    assert ret == (GENL_ID_CTRL, {'notify': GENL_ID_CTRL})
+    for _ in range(3):
+        assert bind(genl, 'nlctrl') == ret
+    assert genl.discovered == ['nlctrl']
+
+
+def test_cache_not_found(genl):
+    for _ in range(2):
+        with pytest.raises(NetlinkError) as e:
+            bind(genl, 'pr2_no_family')
+        assert e.value.code == 2
+    assert genl.discovered == ['pr2_no_family']
+
+
+def test_cache_invalidate(genl):
+    if os.getuid() != 0:
+        pytest.skip('root required to send nlctrl notifications')
+    bind(genl, 'nlctrl')
+    # a fake notification, the cache can not tell it from the kernel
+    msg = ctrlmsg()
+    msg['cmd'] = CTRL_CMD_DELFAMILY
+    msg['version'] = 1
+    msg['attrs'] = [('CTRL_ATTR_FAMILY_NAME', 'nlctrl')]
+    msg['header']['type'] = GENL_ID_CTRL
+    msg.encode()
+    with socket.socket(
+        socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_GENERIC
+    ) as sock:
+        sock.bind((0, 0))
+        sock.sendto(msg.data, (0, 1 << (GENL_ID_CTRL - 1)))
+    bind(genl, 'nlctrl')
+    bind(genl, 'nlctrl')
+    assert genl.discovered == ['nlctrl', 'nlctrl']
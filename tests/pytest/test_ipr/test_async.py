@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from pr2modules.iproute.linux import AsyncIPRoute
+from pr2modules.netlink.exceptions import NetlinkError
+from pr2test.context_manager import make_test_matrix
+from pr2test.context_manager import skip_if_not_supported
+
+wait_timeout = 30
+test_matrix = make_test_matrix(targets=['local'])
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_link_get(context):
+    index, ifname = context.default_interface
+
+    async def main():
+        ipr = AsyncIPRoute()
+        try:
+            (link,) = await ipr.link('get', index=index)
+            return link.get_attr('IFLA_IFNAME')
+        finally:
+            ipr.close()
+
+    assert run(main()) == ifname
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_dump_iterator(context):
+    index, ifname = context.default_interface
+
+    async def main():
+        ipr = AsyncIPRoute()
+        try:
+            return [x['index'] async for x in ipr.get_links()]
+        finally:
+            ipr.close()
+
+    assert index in run(main())
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_concurrent(context):
+    index, ifname = context.default_interface
+    count = AsyncIPRoute.max_requests * 4
+
+    async def main():
+        ipr = AsyncIPRoute()
+        try:
+            return await asyncio.gather(
+                *[ipr.link('get', index=index) for _ in range(count)],
+                ipr.get_addr(),
+                ipr.link_lookup(ifname=ifname),
+            )
+        finally:
+            ipr.close()
+
+    ret = run(main())
+    assert len(ret) == count + 2
+    assert all(x[0]['index'] == index for x in ret[:count])
+    assert ret[-1] == [index]
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_addr_add(context):
+    index, ifname = context.default_interface
+    ipaddr = context.new_ipaddr
+
+    async def main():
+        ipr = AsyncIPRoute()
+        try:
+            await ipr.addr('add', index=index, address=ipaddr, prefixlen=24)
+            return await ipr.get_addr(index=index, address=ipaddr)
+        finally:
+            ipr.close()
+
+    assert len(run(main())) == 1
+    context.ndb.addresses.wait(
+        index=index, address=ipaddr, timeout=wait_timeout
+    )
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_error(context):
+    ifname = context.new_ifname
+
+    async def main():
+        ipr = AsyncIPRoute()
+        try:
+            with pytest.raises(NetlinkError):
+                await ipr.link('get', ifname=ifname)
+            return await ipr.link_lookup(ifname=ifname)
+        finally:
+            ipr.close()
+
+    assert run(main()) == []
@@ -0,0 +1,60 @@
+import pytest
+from socket import AF_INET
+from pr2modules.iproute.flush import Flush
+from pr2modules.netlink.rtnl import RTM_DELROUTE
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+from pr2test.context_manager import make_test_matrix
+from pr2test.context_manager import skip_if_not_supported
+
+test_matrix = make_test_matrix(targets=['local', 'netns'])
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_flush_routes(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+    ipaddr = context.new_ipaddr
+    gateway = context.new_ipaddr
+    ipr.link('set', index=index, state='up')
+    ipr.addr('add', index=index, address=ipaddr, prefixlen=24)
+    for table in (100, 101):
+        for x in range(1024):
+            ipr.route(
+                'add',
+                dst='10.%i.%i.0/24' % (x >> 8, x & 0xFF),
+                gateway=gateway,
+                table=table,
+            )
+
+    stats = ipr.flush_routes(table=100, dst=lambda x: x.startswith('10.1.'))
+    assert stats == (256, 0, {})
+    assert len(ipr.get_routes(table=100)) == 768
+    assert ipr.flush_routes(table=100) == (768, 0, {})
+    assert len(ipr.get_routes(table=100)) == 0
+    assert len(ipr.get_routes(table=101)) == 1024
+    assert ipr.flush_routes(table=100) == (0, 0, {})
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_flush_errors(context):
+    ipr = context.ipr
+    flush = Flush(ipr, rtmsg, RTM_DELROUTE, None, ('RTA_DST', 'RTA_TABLE'))
+    try:
+        for dst_len in (33, 24):
+            msg = rtmsg()
+            msg['family'] = AF_INET
+            msg['dst_len'] = dst_len
+            msg['table'] = 100
+            msg['attrs'] = [('RTA_DST', '10.0.0.0'), ('RTA_PRIORITY', 5)]
+            msg.encode()
+            flush.delete(msg.data, 0)
+        flush.commit()
+    finally:
+        flush.release()
+    # EINVAL for the invalid prefix, ESRCH for the missing route
+    assert flush.requests == 2
+    assert flush.deleted == 0
+    assert flush.failed == 1
+    assert flush.errors == {22: 1}
@@ -0,0 +1,57 @@
+import pytest
+from pr2modules.netlink.exceptions import NetlinkError
+from pr2test.context_manager import make_test_matrix
+from pr2test.context_manager import skip_if_not_supported
+
+test_matrix = make_test_matrix(targets=['local'])
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_route_add(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+    ipr.link('set', index=index, state='up')
+    dst = [context.new_ipaddr for _ in range(16)]
+
+    with ipr.pipeline(window=4) as pipe:
+        futures = [
+            pipe.route('add', dst=x, dst_len=32, oif=index) for x in dst
+        ]
+        # the same route again must fail alone
+        failed = pipe.route('add', dst=dst[0], dst_len=32, oif=index)
+        link = pipe.link('get', index=index)
+
+    assert all(x.exception() is None for x in futures)
+    assert isinstance(failed.exception(), NetlinkError)
+    assert link.result()[0].get_attr('IFLA_IFNAME') == ifname
+    routes = ipr.get_routes(oif=index, family=2)
+    assert set(dst) <= set(x.get_attr('RTA_DST') for x in routes)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_result_in_context(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+
+    with ipr.pipeline(window=64) as pipe:
+        futures = [pipe.link('get', index=index) for _ in range(8)]
+        assert futures[0].result()[0]['index'] == index
+    assert all(x.result()[0]['index'] == index for x in futures)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_dump(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+
+    with ipr.pipeline() as pipe:
+        links = pipe.get_links()
+        match = pipe.get_links(match={'index': index})
+        addr = pipe.get_addr()
+
+    assert index in [x['index'] for x in links.result()]
+    assert [x['index'] for x in match.result()] == [index]
+    assert addr.exception() is None
@@ -0,0 +1,65 @@
+import pytest
+from pr2modules.iproute.linux import IPRoute
+from pr2test.context_manager import make_test_matrix
+from pr2test.context_manager import skip_if_not_supported
+
+test_matrix = make_test_matrix(targets=['local'])
+
+
+def dump(msgs, *attrs):
+    # stable keys only, no stats and timers
+    return sorted(
+        (x['family'], tuple(x.get_attr(y) for y in attrs)) for x in msgs
+    )
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_strict_dump_filter(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+    ipr.link('set', index=index, state='up')
+    ipaddr = context.new_ipaddr
+    gateway = context.new_ipaddr
+    ipr.addr('add', index=index, address=ipaddr, prefixlen=24)
+    ipr.neigh('add', dst=gateway, lladdr='00:11:22:33:44:55', ifindex=index)
+    for table in (100, 1000):
+        for x in range(4):
+            ipr.route(
+                'add',
+                dst='10.%i.%i.0/24' % (table % 256, x),
+                oif=index,
+                table=table,
+            )
+
+    with IPRoute(strict_check=True) as strict:
+        for method, spec, attrs in (
+            ('get_routes', {'table': 1000, 'oif': index}, ('RTA_DST',)),
+            ('get_routes', {'table': 100, 'proto': 4}, ('RTA_DST',)),
+            ('get_addr', {'index': index}, ('IFA_ADDRESS',)),
+            ('get_addr', {'label': ifname}, ('IFA_ADDRESS',)),
+            ('get_neighbours', {'ifindex': index}, ('NDA_DST',)),
+            ('get_neighbours', {'dst': gateway}, ('NDA_DST',)),
+            ('get_links', {'ifname': ifname}, ('IFLA_IFNAME',)),
+        ):
+            filtered = getattr(strict, method)(**spec)
+            assert len(filtered) > 0
+            assert dump(filtered, *attrs) == dump(
+                getattr(ipr, method)(**spec), *attrs
+            )
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+@skip_if_not_supported
+def test_strict_ext_mask(context):
+    index, ifname = context.default_interface
+    ipr = context.ipr
+    links = dump(ipr.get_links(), 'IFLA_IFNAME')
+
+    with IPRoute(strict_check=True) as strict:
+        # ext_mask is a request parameter, not a match key
+        assert dump(strict.get_links(ext_mask=1), 'IFLA_IFNAME') == links
+        assert dump(ipr.get_links(ext_mask=1), 'IFLA_IFNAME') == links
+        assert [
+            x['index'] for x in strict.get_links(ext_mask=1, ifname=ifname)
+        ] == [index]
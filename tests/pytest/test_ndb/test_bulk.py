@@ -0,0 +1,104 @@
+import pytest
+from pr2modules import config
+from pr2modules.ndb.ingest import IngestHost
+from pr2modules.netlink.rtnl import RTM_NEWLINK
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+
+
+class CountingCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.executemany_calls = 0
+
+    def executemany(self, *argv, **kwarg):
+        self.executemany_calls += 1
+        return self.cursor.executemany(*argv, **kwarg)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def link(index, ifname):
+    msg = ifinfmsg()
+    msg['header']['type'] = RTM_NEWLINK
+    msg['index'] = index
+    msg['attrs'] = [('IFLA_IFNAME', ifname)]
+    return msg
+
+
+@pytest.fixture
+def host():
+    host = IngestHost('localhost', 'local', 'sqlite3')
+    host.schema._cursor = CountingCursor(host.schema._cursor)
+    yield host
+    host.schema.connection.close()
+
+
+def load(host, links):
+    for index, ifname in links:
+        host.schema.load_netlink(
+            'interfaces', 'localhost', link(index, ifname)
+        )
+
+
+def interfaces(host):
+    return dict(
+        (x[0], x[1])
+        for x in host.schema.fetch(
+            'SELECT f_index, f_IFLA_IFNAME FROM interfaces'
+        )
+    )
+
+
+def test_bulk_upsert(host):
+    if host.schema.compiled['interfaces']['upsert'] is None:
+        pytest.skip('SQLite3 < 3.24, no UPSERT')
+    host.schema.bulk_begin()
+    load(host, [(x, 'eth%i' % x) for x in range(1, 101)])
+    # update in the same batch
+    load(host, [(x, 'br%i' % x) for x in range(1, 11)])
+    host.schema.bulk_commit()
+    assert host.schema._cursor.executemany_calls == 1
+    ret = interfaces(host)
+    assert len(ret) == 100
+    assert ret[1] == 'br1'
+    assert ret[50] == 'eth50'
+
+
+def test_bulk_limit(host, monkeypatch):
+    if host.schema.compiled['interfaces']['upsert'] is None:
+        pytest.skip('SQLite3 < 3.24, no UPSERT')
+    monkeypatch.setattr(config, 'db_bulk_limit', 10)
+    host.schema.bulk_begin()
+    load(host, [(x, 'eth%i' % x) for x in range(1, 26)])
+    # flushed on the limit
+    assert host.schema._cursor.executemany_calls == 2
+    host.schema.bulk_commit()
+    assert host.schema._cursor.executemany_calls == 3
+    assert len(interfaces(host)) == 25
+
+
+def test_bulk_fallback(host):
+    host.schema.bulk_begin()
+    load(host, [(x, 'eth%i' % x) for x in range(1, 11)])
+    # the value can not be bound to the statement
+    load(host, [(11, object())])
+    load(host, [(x, 'eth%i' % x) for x in range(12, 21)])
+    host.schema.bulk_commit()
+    # the rest of the batch is loaded row by row
+    ret = interfaces(host)
+    assert len(ret) == 19
+    assert 11 not in ret
+
+
+def test_bulk_no_upsert(host, monkeypatch):
+    # SQLite3 < 3.24: row by row
+    monkeypatch.setitem(host.schema.compiled['interfaces'], 'upsert', None)
+    host.schema.bulk_begin()
+    load(host, [(x, 'eth%i' % x) for x in range(1, 11)])
+    load(host, [(1, 'br1')])
+    host.schema.bulk_commit()
+    assert host.schema._cursor.executemany_calls == 0
+    ret = interfaces(host)
+    assert len(ret) == 10
+    assert ret[1] == 'br1'
@@ -0,0 +1,42 @@
+import time
+import pytest
+from pyroute2 import NDB
+from pr2modules.ndb.transport import Messenger
+from pr2modules.ndb.transport import Transport
+
+
+@pytest.mark.parametrize('fanout', (None, 2))
+def test_two_nodes(spec, fanout):
+
+    ports = {1: 5791, 2: 5792} if fanout is None else {1: 5793, 2: 5794}
+    nodes = []
+    try:
+        for node, peer in ((1, 2), (2, 1)):
+            messenger = Messenger(
+                node, Transport('127.0.0.1', ports[node]), fanout=fanout
+            )
+            messenger.add_peer(peer, '127.0.0.1', ports[peer])
+            target = 'node%i' % node
+            nodes.append(
+                NDB(
+                    sources=[{'target': target, 'kind': 'local'}],
+                    localhost=target,
+                    messenger=messenger,
+                    log=spec.log_spec,
+                )
+            )
+        # every node gets the records of the other one
+        for _ in range(30):
+            targets = [
+                set([x.target for x in ndb.interfaces.summary()])
+                for ndb in nodes
+            ]
+            if all([x == {'node1', 'node2'} for x in targets]):
+                break
+            time.sleep(0.1)
+        else:
+            raise AssertionError('records not synced: %s' % targets)
+    finally:
+        for ndb in nodes:
+            ndb.close()
+            ndb.messenger.transport.close()
@@ -0,0 +1,134 @@
+import time
+from pr2modules.ndb import schema
+from pr2modules.ndb.coalesce import Coalescer
+from pr2modules.netlink.rtnl import RTM_DELLINK
+from pr2modules.netlink.rtnl import RTM_DELROUTE
+from pr2modules.netlink.rtnl import RTM_NEWLINK
+from pr2modules.netlink.rtnl import RTM_NEWROUTE
+from pr2modules.netlink.rtnl.fibmsg import fibmsg
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+from pr2modules.netlink.rtnl.rtmsg import rtmsg
+
+indices = {}
+for plugin in schema.plugins:
+    for name, spec in plugin.init['specs']:
+        indices[name] = spec.index
+
+
+def route(event, dst, gateway='10.0.0.1'):
+    msg = rtmsg()
+    msg['header']['type'] = event
+    msg['family'] = 2
+    msg['dst_len'] = 24
+    msg['attrs'] = [
+        ('RTA_DST', dst),
+        ('RTA_GATEWAY', gateway),
+        ('RTA_TABLE', 254),
+    ]
+    return msg
+
+
+def link(event, index):
+    msg = ifinfmsg()
+    msg['header']['type'] = event
+    msg['index'] = index
+    msg['attrs'] = []
+    return msg
+
+
+def rule(event):
+    msg = fibmsg()
+    msg['header']['type'] = event
+    return msg
+
+
+def flat(batches):
+    return [
+        (type(x).__name__, x['header']['type'], x.get_attr('RTA_GATEWAY'))
+        for batch in batches
+        for x in batch
+    ]
+
+
+def test_routes():
+    batches = []
+    coalescer = Coalescer(batches.append, indices, 3600)
+    coalescer.push(
+        (
+            route(RTM_NEWROUTE, '10.1.0.0'),
+            route(RTM_NEWROUTE, '10.2.0.0'),
+            route(RTM_DELROUTE, '10.1.0.0'),
+            route(RTM_NEWROUTE, '10.1.0.0'),
+            # ECMP: the same key, another gateway
+            route(RTM_NEWROUTE, '10.2.0.0', '10.0.0.2'),
+            route(RTM_DELROUTE, '10.2.0.0'),
+        )
+    )
+    assert batches == []
+    coalescer.close()
+    assert flat(batches) == [
+        ('rtmsg', RTM_NEWROUTE, '10.0.0.1'),
+        ('rtmsg', RTM_NEWROUTE, '10.0.0.2'),
+        ('rtmsg', RTM_DELROUTE, '10.0.0.1'),
+    ]
+    assert coalescer.stats() == {
+        'received': 6,
+        'forwarded': 3,
+        'collapsed': 3,
+        'pending': 0,
+        'flushes': 1,
+    }
+
+
+def test_links():
+    batches = []
+    coalescer = Coalescer(batches.append, indices, 3600)
+    coalescer.push(
+        (
+            link(RTM_NEWLINK, 5),
+            route(RTM_NEWROUTE, '10.1.0.0'),
+            rule(RTM_NEWROUTE),
+            link(RTM_NEWLINK, 5),
+            link(RTM_DELLINK, 5),
+            rule(RTM_NEWROUTE),
+            link(RTM_NEWLINK, 5),
+            link(RTM_NEWLINK, 5),
+        )
+    )
+    coalescer.close()
+    # the interface delete is a barrier, the rules are not merged
+    assert flat(batches) == [
+        ('ifinfmsg', RTM_NEWLINK, None),
+        ('rtmsg', RTM_NEWROUTE, '10.0.0.1'),
+        ('fibmsg', RTM_NEWROUTE, None),
+        ('ifinfmsg', RTM_DELLINK, None),
+        ('fibmsg', RTM_NEWROUTE, None),
+        ('ifinfmsg', RTM_NEWLINK, None),
+    ]
+    assert coalescer.stats()['collapsed'] == 2
+
+
+def test_window():
+    batches = []
+    coalescer = Coalescer(batches.append, indices, 0.1)
+    coalescer.push((route(RTM_NEWROUTE, '10.1.0.0'),))
+    coalescer.push((route(RTM_NEWROUTE, '10.1.0.0'),))
+    for _ in range(50):
+        if batches:
+            break
+        time.sleep(0.1)
+    assert len(flat(batches)) == 1
+    coalescer.push((route(RTM_NEWROUTE, '10.1.0.0'),))
+    coalescer.close()
+    assert len(batches) == 2
+
+
+def test_close_discard():
+    batches = []
+    coalescer = Coalescer(batches.append, indices, 0.1)
+    coalescer.push((route(RTM_NEWROUTE, '10.1.0.0'),))
+    coalescer.close(discard=True)
+    time.sleep(0.3)
+    assert batches == []
+    assert coalescer.stats()['pending'] == 0
+    assert coalescer.th is None
@@ -1,6 +1,12 @@
+import io
+import csv
+import json
 import sqlite3
+import threading
+import pytest
 import psycopg2
 from pyroute2 import NDB
+from pr2modules.ndb.report import read_columnar
 
 
 def test_no_cleanup(spec):
@@ -25,6 +31,124 @@ def test_no_cleanup(spec):
     assert set([x[0] for x in interfaces]) == set(('localhost',))
 
 
+def test_readers(spec):
+
+    with NDB(
+        db_provider='sqlite3', db_spec=spec.db_spec, log=spec.log_spec
+    ) as ndb:
+        # SQLite3 readers are enabled only on request
+        assert ndb.schema.readers is None
+
+    with NDB(
+        db_provider='sqlite3',
+        db_spec=spec.db_spec,
+        db_readers=True,
+        log=spec.log_spec,
+    ) as ndb:
+        # file DB: the reports use read-only connections
+        assert ndb.schema.readers is not None
+        assert ndb.interfaces['lo']['index'] == 1
+        assert ndb.interfaces.count() > 1
+        # the connections are reused by the queries
+        assert len(ndb.schema.readers.connections) == 1
+        threads = [
+            threading.Thread(target=ndb.interfaces.count) for _ in range(16)
+        ]
+        [x.start() for x in threads]
+        [x.join() for x in threads]
+        readers = ndb.schema.readers
+        assert 1 <= len(readers.connections) <= readers.size
+        assert len(readers.idle) == len(readers.connections)
+        # the read-only connections must fail to change the DB
+        connection = readers.acquire()
+        with pytest.raises(sqlite3.OperationalError):
+            tuple(readers.fetch(connection, 'DELETE FROM interfaces'))
+
+    # the journal mode is restored
+    db = sqlite3.connect(spec.db_spec)
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    db.close()
+
+    with NDB(
+        db_provider='sqlite3',
+        db_spec=':memory:',
+        db_readers=True,
+        log=spec.log_spec,
+    ) as ndb:
+        # in-memory DB: all the queries go through the main loop
+        assert ndb.schema.readers is None
+        assert ndb.interfaces['lo']['index'] == 1
+
+
+def test_columnar(spec):
+
+    with NDB(db_provider='columnar', log=spec.log_spec) as ndb:
+        # no SQL for the RTNL records
+        assert ndb.schema.fetchone('SELECT count(*) FROM interfaces')[0] == 0
+        assert ndb.interfaces.count() > 1
+        # the lookups return read-only records
+        lo = ndb.interfaces['lo']
+        assert lo['index'] == 1
+        assert ndb.interfaces[{'index': 1}]['ifname'] == 'lo'
+        assert ndb.interfaces.exists('lo')
+        assert not ndb.interfaces.exists('not-existing-if')
+        assert ndb.addresses['127.0.0.1/8']['index'] == 1
+        with pytest.raises(TypeError):
+            lo['mtu'] = 1280
+        with pytest.raises(TypeError):
+            ndb.interfaces.create(ifname='test', kind='dummy')
+        # the same reports as with SQL
+        assert ndb.addresses.summary().filter(address='127.0.0.1').count() == 1
+        assert ndb.interfaces.dump().filter(ifname='lo').count() == 1
+
+
+@pytest.mark.parametrize('db_provider', ('sqlite3', 'columnar'))
+def test_export(spec, db_provider):
+
+    with NDB(db_provider=db_provider, log=spec.log_spec) as ndb:
+        dump = [tuple(x) for x in ndb.addresses.dump()]
+        fnames = ndb.addresses.dump()[0]._names
+        # JSON Lines
+        f = io.BytesIO()
+        assert ndb.addresses.export(f, batch=2) == len(dump)
+        rows = [json.loads(x) for x in f.getvalue().decode().splitlines()]
+        assert [tuple(x[y] for y in fnames) for x in rows] == dump
+        # CSV, the header line + rows
+        f = io.BytesIO()
+        assert ndb.addresses.export(f, kind='csv') == len(dump)
+        rows = list(csv.reader(io.StringIO(f.getvalue().decode())))
+        assert tuple(rows[0]) == fnames
+        assert len(rows) == len(dump) + 1
+        # binary columnar, the same types after the round trip
+        f = io.BytesIO()
+        assert ndb.addresses.export(f, kind='columnar', batch=2) == len(dump)
+        f.seek(0)
+        data = read_columnar(f)
+        assert next(data) == fnames
+        assert list(data) == dump
+        # summary
+        f = io.BytesIO()
+        count = ndb.addresses.export(f, kind='columnar', summary=True)
+        assert count == ndb.addresses.summary().count()
+        with pytest.raises(ValueError):
+            ndb.addresses.export(io.BytesIO(), kind='xml')
+
+
+@pytest.mark.parametrize('db_provider', ('sqlite3', 'columnar'))
+def test_ingest_workers(spec, db_provider):
+
+    tables = ('interfaces', 'addresses', 'routes')
+    with NDB(db_provider=db_provider, log=spec.log_spec) as ndb:
+        reference = [set(map(tuple, getattr(ndb, x).dump())) for x in tables]
+    # the initial dump loaded by a worker process
+    with NDB(
+        db_provider=db_provider, log=spec.log_spec, ingest_workers=1
+    ) as ndb:
+        assert ndb.interfaces['lo']['index'] == 1
+        loaded = [set(map(tuple, getattr(ndb, x).dump())) for x in tables]
+    assert loaded == reference
+
+
 def test_postgres_fail(spec):
 
     try:
@@ -204,3 +204,40 @@ def test_vlan_deps(context):
     assert address_exists(context.netns, ifname=if_vlan, address=ifaddr1)
     assert address_exists(context.netns, ifname=if_vlan, address=ifaddr2)
     assert route_exists(context.netns, dst=dst, gateway=router)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_snapshot_scope(context):
+
+    ifname1 = context.new_ifname
+    ifname2 = context.new_ifname
+    ipaddr1 = context.new_ipaddr
+    ipaddr2 = context.new_ipaddr
+
+    for ifname, ipaddr in ((ifname1, ipaddr1), (ifname2, ipaddr2)):
+        (
+            context.ndb.interfaces.create(ifname=ifname, kind='dummy')
+            .set('state', 'up')
+            .add_ip(address=ipaddr, prefixlen=24)
+            .commit()
+        )
+
+    iface = context.ndb.interfaces[ifname1]
+    snapshot = iface.snapshot()
+
+    def fetch(table, field):
+        return set(
+            x[0]
+            for x in context.ndb.schema.fetch(
+                'SELECT f_%s FROM %s'
+                % (
+                    field,
+                    context.ndb.schema.snapshot_table(table, snapshot.ctxid),
+                )
+            )
+        )
+
+    # only the interface and the dependent records must be saved
+    assert fetch('interfaces', 'index') == set((iface['index'],))
+    assert fetch('addresses', 'IFA_ADDRESS') == set((ipaddr1,))
+    assert fetch('routes', 'RTA_OIF') == set((iface['index'],))
@@ -1,8 +1,10 @@
+import time
 import pytest
 from utils import require_user
 from pr2test.tools import interface_exists
 from pr2test.context_manager import make_test_matrix
 from pyroute2 import NDB
+from pyroute2 import NetNS
 
 
 test_matrix = make_test_matrix(
@@ -147,6 +149,26 @@ def test_source_netns_restart(context):
     # as interfaces inside the netns
 
 
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_source_remove_coalesced(context):
+    '''
+    The events pending in the coalescer must not get into the DB
+    after the source is removed
+    '''
+    require_user('root')
+    nsname = context.new_nsname
+    ifname = context.register(netns=nsname)
+    ndb = context.ndb
+    ndb.sources.add(netns=nsname, coalesce=0.5)
+    assert count_interfaces(ndb, nsname) > 0
+    with NetNS(nsname) as ns:
+        ns.link('add', ifname=ifname, kind='dummy')
+        ns.link('set', index=1, state='down')
+    ndb.sources.remove(nsname)
+    time.sleep(1)
+    assert count_interfaces(ndb, nsname) == 0
+
+
 def count_interfaces(ndb, target):
     return (
         ndb.schema.fetchone(
@@ -1,4 +1,6 @@
 import pytest
+from pr2modules.ndb.source import Source
+from pr2modules.netlink.exceptions import NetlinkError
 from pr2test.tools import interface_exists
 from pr2test.tools import address_exists
 from pr2test.context_manager import make_test_matrix
@@ -40,3 +42,95 @@ def test_multiple_interfaces(context):
     )
     assert address_exists(context.netns, ifname=ifname1, address=ipaddr1)
     assert address_exists(context.netns, ifname=ifname2, address=ipaddr2)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_bulk_interfaces(context):
+
+    ifname = context.new_ifname
+    vlans = [context.new_ifname for _ in range(8)]
+    ipaddrs = [context.new_ipaddr for _ in range(8)]
+
+    # the parent is created in the same transaction
+    tx = context.ndb.begin(bulk=True)
+    tx.push(context.ndb.interfaces.create(ifname=ifname, kind='dummy'))
+    for vlan_id, vlan in enumerate(vlans):
+        tx.push(
+            context.ndb.interfaces.create(
+                ifname=vlan, kind='vlan', link=ifname, vlan_id=vlan_id + 1
+            )
+        )
+    tx.commit()
+
+    tx = context.ndb.begin(bulk=True)
+    for vlan, ipaddr in zip(vlans, ipaddrs):
+        tx.push(
+            context.ndb.interfaces[vlan]
+            .set(state='up')
+            .add_ip(address=ipaddr, prefixlen=24)
+        )
+    tx.commit()
+
+    for vlan, ipaddr in zip(vlans, ipaddrs):
+        assert interface_exists(context.netns, ifname=vlan, state='up')
+        assert address_exists(context.netns, ifname=vlan, address=ipaddr)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_bulk_partial_failure(context):
+
+    ifname1 = context.new_ifname
+    ifname2 = context.new_ifname
+    ifname3 = context.new_ifname
+
+    tx = context.ndb.begin(bulk=True)
+    tx.push(
+        context.ndb.interfaces.create(ifname=ifname1, kind='dummy'),
+        # no such link
+        context.ndb.interfaces.create(
+            ifname=ifname2, kind='vlan', link=0x7FFFFFF0, vlan_id=101
+        ),
+        context.ndb.interfaces.create(ifname=ifname3, kind='dummy'),
+    )
+    with pytest.raises(Exception):
+        tx.commit()
+
+    # only the failed object is rolled back
+    assert [x[0]['ifname'] for x in tx.failed] == [ifname2]
+    assert interface_exists(context.netns, ifname=ifname1)
+    assert interface_exists(context.netns, ifname=ifname3)
+    assert not interface_exists(context.netns, ifname=ifname2)
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_bulk_fallback(context, monkeypatch):
+
+    ifname1 = context.new_ifname
+    ifname2 = context.new_ifname
+
+    # emulate an old kernel: br_vlan_filtering is not accepted
+    # upon bridge creation
+    api_pipeline = Source.api_pipeline
+
+    def old_kernel(self, calls, window=64):
+        ret = []
+        for name, argv, kwarg in calls:
+            if argv == ('add',) and 'br_vlan_filtering' in kwarg:
+                ret.append(NetlinkError(95))
+            else:
+                ret.extend(api_pipeline(self, [(name, argv, kwarg)], window))
+        return ret
+
+    monkeypatch.setattr(Source, 'api_pipeline', old_kernel)
+    tx = context.ndb.begin(bulk=True)
+    tx.push(
+        context.ndb.interfaces.create(
+            ifname=ifname1, kind='bridge', br_vlan_filtering=0
+        ),
+        context.ndb.interfaces.create(ifname=ifname2, kind='dummy'),
+    )
+    tx.commit()
+
+    assert not tx.failed
+    assert interface_exists(context.netns, ifname=ifname1)
+    assert interface_exists(context.netns, ifname=ifname2)
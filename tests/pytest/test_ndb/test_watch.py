@@ -0,0 +1,166 @@
+import gc
+import pytest
+from pyroute2 import NDB
+from pr2modules.ndb.events import InvalidateHandlerException
+from pr2modules.ndb.ingest import IngestHost
+from pr2modules.netlink.rtnl import RTM_NEWLINK
+from pr2modules.netlink.rtnl import RTM_DELLINK
+from pr2modules.netlink.rtnl.ifinfmsg import ifinfmsg
+
+
+def link(index, ifname, event=RTM_NEWLINK):
+    msg = ifinfmsg()
+    msg['header']['type'] = event
+    msg['header']['target'] = 'localhost'
+    msg['index'] = index
+    msg['attrs'] = [('IFLA_IFNAME', ifname)]
+    return msg
+
+
+class Watcher(object):
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, table, key, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def host():
+    host = IngestHost('localhost', 'local', 'sqlite3')
+    yield host
+    host.schema.connection.close()
+
+
+def load(host, msg):
+    host.schema.load_netlink('interfaces', 'localhost', msg)
+
+
+def key(host, index):
+    # target, tflags, index
+    return host.schema.record_key(('localhost', 0, index))
+
+
+def test_watch_key(host):
+    watcher = Watcher()
+    host.schema.watch('interfaces', key(host, 10), watcher)
+    load(host, link(10, 'eth10'))
+    load(host, link(10, 'br10'))
+    load(host, link(10, 'br10', RTM_DELLINK))
+    assert [x and x['ifname'] for x in watcher.records] == [
+        'eth10',
+        'br10',
+        None,
+    ]
+
+
+def test_watch_other_keys(host):
+    watcher = Watcher()
+    host.schema.watch('interfaces', key(host, 10), watcher)
+    load(host, link(11, 'eth11'))
+    load(host, link(11, 'eth11', RTM_DELLINK))
+    assert watcher.records == []
+
+
+def test_watch_table(host):
+    watcher = Watcher()
+    host.schema.watch('interfaces', None, watcher)
+    load(host, link(10, 'eth10'))
+    load(host, link(11, 'eth11'))
+    assert [x['index'] for x in watcher.records] == [10, 11]
+
+
+def test_watch_bulk(host):
+    watcher = Watcher()
+    host.schema.watch('interfaces', key(host, 10), watcher)
+    host.schema.bulk_begin()
+    load(host, link(10, 'eth10'))
+    # the handlers run only after the records are committed
+    assert watcher.records == []
+    host.schema.bulk_commit()
+    assert [x['ifname'] for x in watcher.records] == ['eth10']
+
+
+def test_unwatch(host):
+    watcher = Watcher()
+    host.schema.watch('interfaces', key(host, 10), watcher)
+    host.schema.watch('interfaces', None, watcher)
+    host.schema.unwatch('interfaces', key(host, 10), watcher)
+    host.schema.unwatch('interfaces', None, watcher)
+    assert host.schema.watchers == {}
+    load(host, link(10, 'eth10'))
+    assert watcher.records == []
+
+
+def test_invalidate(host):
+    def handler(table, key, record):
+        raise InvalidateHandlerException()
+
+    host.schema.watch('interfaces', key(host, 10), handler)
+    load(host, link(10, 'eth10'))
+    assert host.schema.watchers == {}
+
+
+@pytest.fixture
+def ndb():
+    with NDB() as ndb:
+        yield ndb
+
+
+def inject(ndb, *msgs):
+    ndb._event_queue.put(msgs, source='localhost')
+
+
+def handlers(ndb):
+    watchers = ndb.schema.watchers.get('interfaces', {})
+    return sum([len(x) for x in watchers.values()])
+
+
+def table_handlers(ndb):
+    # the handlers watching all the records of the table
+    return len(ndb.schema.watchers.get('interfaces', {}).get(None, ()))
+
+
+def test_register(ndb):
+    ifname = 'pr2w%i' % id(ndb)
+    obj = ndb.interfaces.create(ifname=ifname, kind='dummy')
+    assert obj._watch
+    obj.load_event.clear()
+    # other records do not wake the object up
+    inject(ndb, link(0x7FFFFFF0, '%s-x' % ifname))
+    ndb.interfaces.wait(ifname='%s-x' % ifname, timeout=5)
+    assert not obj.load_event.is_set()
+    inject(ndb, link(0x7FFFFFF1, ifname))
+    assert obj.load_event.wait(5)
+    assert obj['index'] == 0x7FFFFFF1
+    watched = len(obj._watch)
+    count = handlers(ndb)
+    obj.unregister()
+    assert obj._watch == []
+    assert handlers(ndb) == count - watched
+
+
+def test_register_gc(ndb):
+    ifname = 'pr2w%i' % id(ndb)
+    obj = ndb.interfaces.create(ifname=ifname, kind='dummy')
+    # the key is not complete yet, so the table is watched
+    assert table_handlers(ndb) == 1
+    del obj
+    gc.collect()
+    # the handler of the collected object is removed on the next
+    # matching record
+    inject(ndb, link(0x7FFFFFF0, ifname))
+    ndb.interfaces.wait(ifname=ifname, timeout=5)
+    assert table_handlers(ndb) == 0
+
+
+def test_view_wait(ndb):
+    ifname = 'pr2w%i' % id(ndb)
+    with pytest.raises(TimeoutError):
+        ndb.interfaces.wait(ifname=ifname, timeout=0.5)
+    assert table_handlers(ndb) == 0
+    inject(ndb, link(0x7FFFFFF0, ifname))
+    assert ndb.interfaces.wait(ifname=ifname, timeout=5)['index'] == (
+        0x7FFFFFF0
+    )
+    assert table_handlers(ndb) == 0